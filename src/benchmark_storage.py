@@ -0,0 +1,148 @@
+#!/home/cclin/.local/python311/bin/python3
+"""
+儲存層效能比較
+以合成的多百萬筆價格歷史，比較視覺化分析查詢在 SQLite 與 DuckDB 上的執行時間
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from tesla_storage import SQLiteStorage, DuckDBStorage, HAS_DUCKDB, QUERIES
+
+MODELS = ['MODEL3', 'MODELY', 'MODELS', 'MODELX']
+BASE_PRICES = [1800000, 2200000, 3500000, 4000000]
+TRIMS = ['Long Range', 'Performance', 'Standard Range']
+COLORS = ['珍珠白', '純黑', '午夜銀', '深藍', '紅色']
+LOCATIONS = ['台北', '新北', '桃園', '台中', '高雄']
+
+
+def synthetic_history(rows: int, days: int = 730, seed: int = 42) -> tuple:
+    """
+    產生合成價格歷史
+
+    Args:
+        rows: 觀測筆數
+        days: 涵蓋天數
+        seed: 亂數種子
+
+    Returns:
+        tuple: (vehicle_prices DataFrame, price_trends DataFrame)
+    """
+    rng = np.random.default_rng(seed)
+
+    model_idx = rng.integers(0, len(MODELS), rows)
+    start = np.datetime64(datetime.now().strftime('%Y-%m-%d')) - np.timedelta64(days, 'D')
+    seconds = np.sort(rng.integers(0, days * 86400, rows))
+
+    df_vehicles = pd.DataFrame({
+        'id': np.arange(1, rows + 1),
+        'vin': np.char.add('5YJ', rng.integers(0, rows // 20 + 1, rows).astype(str)),
+        'model': np.array(MODELS)[model_idx],
+        'year': rng.integers(2018, 2026, rows),
+        'trim': np.array(TRIMS)[rng.integers(0, len(TRIMS), rows)],
+        'price': np.array(BASE_PRICES)[model_idx] + rng.integers(-300000, 300000, rows),
+        'mileage': rng.integers(0, 120000, rows),
+        'location': np.array(LOCATIONS)[rng.integers(0, len(LOCATIONS), rows)],
+        'exterior_color': np.array(COLORS)[rng.integers(0, len(COLORS), rows)],
+        'scrape_datetime': (start + seconds.astype('timedelta64[s]')),
+    })
+
+    trend_rows = max(rows // 10, 1)
+    trend_model = rng.integers(0, len(MODELS), trend_rows)
+    df_trends = pd.DataFrame({
+        'id': np.arange(1, trend_rows + 1),
+        'vin': np.char.add('5YJ', np.arange(trend_rows).astype(str)),
+        'model': np.array(MODELS)[trend_model],
+        'price': np.array(BASE_PRICES)[trend_model] + rng.integers(-300000, 300000, trend_rows),
+        'price_change': rng.integers(-50000, 50000, trend_rows),
+        'change_percentage': rng.uniform(-5, 5, trend_rows),
+        'date_recorded': (start + rng.integers(0, days, trend_rows).astype('timedelta64[D]')),
+    })
+    return df_vehicles, df_trends
+
+
+def load_sqlite(path: str, df_vehicles: pd.DataFrame, df_trends: pd.DataFrame) -> SQLiteStorage:
+    """建立 SQLite 測試資料庫"""
+    storage = SQLiteStorage(path)
+    storage.init_schema()
+
+    df = df_vehicles.copy()
+    df['scrape_datetime'] = df['scrape_datetime'].dt.strftime('%Y-%m-%d %H:%M:%S')
+    df.to_sql('vehicle_prices', storage.conn, if_exists='append', index=False, chunksize=50000)
+
+    df = df_trends.copy()
+    df['date_recorded'] = df['date_recorded'].dt.strftime('%Y-%m-%d')
+    df.to_sql('price_trends', storage.conn, if_exists='append', index=False, chunksize=50000)
+    storage.conn.commit()
+    return storage
+
+
+def load_duckdb(path: str, df_vehicles: pd.DataFrame, df_trends: pd.DataFrame) -> DuckDBStorage:
+    """建立 DuckDB 測試資料庫"""
+    storage = DuckDBStorage(path)
+    storage.init_schema()
+    storage.write_frame('vehicle_prices', df_vehicles)
+    storage.write_frame('price_trends', df_trends)
+    return storage
+
+
+def time_queries(storage, repeat: int) -> dict:
+    """執行所有分析查詢並記錄最佳時間（秒）"""
+    results = {}
+    for name in QUERIES:
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            storage.run_query(name)
+            best = min(best, time.perf_counter() - start)
+        results[name] = best
+    return results
+
+
+def main():
+    """主程式"""
+    parser = argparse.ArgumentParser(description='儲存層查詢效能比較')
+    parser.add_argument('--rows', type=int, default=2000000, help='合成觀測筆數')
+    parser.add_argument('--repeat', type=int, default=3, help='每個查詢重複次數')
+    args = parser.parse_args()
+
+    if not HAS_DUCKDB:
+        print("❌ 需要 duckdb: pip install duckdb")
+        sys.exit(1)
+
+    print(f"產生 {args.rows:,} 筆合成資料...")
+    df_vehicles, df_trends = synthetic_history(args.rows)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        sqlite_storage = load_sqlite(os.path.join(tmp, 'bench.db'), df_vehicles, df_trends)
+        print(f"SQLite 載入: {time.perf_counter() - start:.1f} 秒")
+
+        start = time.perf_counter()
+        duck_storage = load_duckdb(os.path.join(tmp, 'bench.duckdb'), df_vehicles, df_trends)
+        print(f"DuckDB 載入: {time.perf_counter() - start:.1f} 秒")
+
+        sqlite_times = time_queries(sqlite_storage, args.repeat)
+        duck_times = time_queries(duck_storage, args.repeat)
+
+        sqlite_storage.close()
+        duck_storage.close()
+
+    print("\n" + "="*60)
+    print(f"{'查詢':<18}{'SQLite (秒)':>12}{'DuckDB (秒)':>12}{'加速':>10}")
+    print("-"*60)
+    for name in QUERIES:
+        speedup = sqlite_times[name] / duck_times[name] if duck_times[name] else float('inf')
+        print(f"{name:<18}{sqlite_times[name]:>12.3f}{duck_times[name]:>12.3f}{speedup:>9.1f}x")
+    print("="*60)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,6 @@ Tesla 認證中古車價格追蹤系統 - 主程式
 
 import os
 import sys
-import sqlite3
 import argparse
 from datetime import datetime
 import time
@@ -43,24 +42,18 @@ def check_database(db_path="tesla_prices.db"):
         print(f"❌ 資料庫不存在: {db_path}")
         return False, 0
 
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    from tesla_storage import SQLiteStorage
+    storage = SQLiteStorage(db_path)
 
     # 檢查表格是否存在
-    cursor.execute("""
-        SELECT name FROM sqlite_master
-        WHERE type='table' AND name='vehicle_prices'
-    """)
-
-    if not cursor.fetchone():
-        conn.close()
+    if not storage.has_table('vehicle_prices'):
+        storage.close()
         print("❌ 資料庫表格不存在")
         return False, 0
 
     # 檢查資料筆數
-    cursor.execute("SELECT COUNT(*) FROM vehicle_prices")
-    count = cursor.fetchone()[0]
-    conn.close()
+    count = storage.count_observations()
+    storage.close()
 
     return True, count
 
@@ -103,47 +96,13 @@ def run_simple_scraper():
     """執行簡化版爬蟲（用於測試）"""
     print("\n🔄 執行簡化版爬蟲...")
 
-    import sqlite3
-    import requests
     from datetime import datetime
     import random
+    from tesla_storage import SQLiteStorage
 
     # 建立資料庫
-    conn = sqlite3.connect("tesla_prices.db")
-    cursor = conn.cursor()
-
-    # 創建表格
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS vehicle_prices (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            vin TEXT,
-            model TEXT,
-            year INTEGER,
-            trim TEXT,
-            price INTEGER,
-            mileage INTEGER,
-            location TEXT,
-            exterior_color TEXT,
-            interior_color TEXT,
-            autopilot_type TEXT,
-            scrape_datetime DATETIME,
-            listing_url TEXT,
-            UNIQUE(vin, scrape_datetime)
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS price_trends (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            vin TEXT,
-            model TEXT,
-            price INTEGER,
-            price_change INTEGER,
-            change_percentage REAL,
-            date_recorded DATE,
-            UNIQUE(vin, date_recorded)
-        )
-    ''')
+    storage = SQLiteStorage("tesla_prices.db")
+    storage.init_schema()
 
     # 插入測試資料（模擬爬取的資料）
     print("插入模擬資料用於測試...")
@@ -162,59 +121,55 @@ def run_simple_scraper():
             'MODELX': 4000000
         }[model]
 
-        vehicle = (
-            f"5YJ3{model[5]}{random.randint(10000, 99999)}",  # VIN
-            model,
-            random.choice([2021, 2022, 2023, 2024]),  # year
-            'Long Range' if random.random() > 0.5 else 'Performance',  # trim
-            base_price + random.randint(-200000, 300000),  # price
-            random.randint(5000, 50000),  # mileage
-            random.choice(locations),
-            random.choice(colors),
-            random.choice(['Black', 'White', 'Cream']),
-            'Enhanced Autopilot',
-            datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            f"https://www.tesla.com/inventory/{model.lower()}/demo"
-        )
+        vehicle = {
+            'vin': f"5YJ3{model[5]}{random.randint(10000, 99999)}",
+            'model': model,
+            'year': random.choice([2021, 2022, 2023, 2024]),
+            'trim': 'Long Range' if random.random() > 0.5 else 'Performance',
+            'price': base_price + random.randint(-200000, 300000),
+            'mileage': random.randint(5000, 50000),
+            'location': random.choice(locations),
+            'exterior_color': random.choice(colors),
+            'interior_color': random.choice(['Black', 'White', 'Cream']),
+            'autopilot_type': 'Enhanced Autopilot',
+            'scrape_datetime': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'listing_url': f"https://www.tesla.com/inventory/{model.lower()}/demo"
+        }
         test_data.append(vehicle)
 
     # 插入資料
-    cursor.executemany('''
-        INSERT OR IGNORE INTO vehicle_prices
-        (vin, model, year, trim, price, mileage, location,
-         exterior_color, interior_color, autopilot_type,
-         scrape_datetime, listing_url)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', test_data)
+    storage.write_observations(test_data)
 
     # 插入價格趨勢資料
-    for vehicle in test_data:
-        cursor.execute('''
-            INSERT OR IGNORE INTO price_trends
-            (vin, model, price, price_change, change_percentage, date_recorded)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (
-            vehicle[0],  # vin
-            vehicle[1],  # model
-            vehicle[4],  # price
+    storage.write_trends(
+        (
+            vehicle['vin'],
+            vehicle['model'],
+            vehicle['price'],
             random.randint(-50000, 50000),  # price_change
             random.uniform(-5, 5),  # change_percentage
             datetime.now().date()
-        ))
+        )
+        for vehicle in test_data
+    )
 
-    conn.commit()
-    conn.close()
+    storage.close()
 
     print(f"✅ 成功插入 {len(test_data)} 筆測試資料")
     return True
 
-def run_full_scraper():
-    """執行完整爬蟲"""
+def run_full_scraper(keep_raw=True):
+    """
+    執行完整爬蟲
+
+    Args:
+        keep_raw: 是否保存原始卡片文字（停用後無法重新解析這一輪的資料）
+    """
     print("\n🔄 執行完整爬蟲...")
 
     try:
         from tesla_price_scraper import TeslaPriceScraper
-        scraper = TeslaPriceScraper()
+        scraper = TeslaPriceScraper(keep_raw=keep_raw)
         scraper.run()
         return True
     except ImportError:
@@ -226,14 +181,46 @@ def run_full_scraper():
         print("改用簡化版爬蟲...")
         return run_simple_scraper()
 
-def run_visualization():
-    """執行視覺化分析"""
+def run_visualization(backend='sqlite', batch=False, dpi=300, fmt='png', workers=None,
+                      force=False, heatmap_days=None, full_rebuild=False):
+    """
+    執行視覺化分析
+
+    Args:
+        backend: 儲存實作
+        batch: 批次模式（Agg 後端、平行繪製、不顯示視窗）
+        dpi: 圖表輸出解析度
+        fmt: 圖表輸出格式（html 輸出單一互動儀表板）
+        workers: 批次模式的程序數
+        force: 忽略圖表快取，全部重新繪製
+        heatmap_days: 價格變動熱力圖只取最近 N 天
+        full_rebuild: 捨棄增量分析狀態從頭重新計算
+    """
     print("\n📊 執行視覺化分析...")
 
+    if batch or fmt == 'html':
+        # 在載入 pyplot 之前強制使用非互動後端（html 儀表板不需要繪圖視窗）
+        os.environ['MPLBACKEND'] = 'Agg'
+        import matplotlib
+        matplotlib.use('Agg', force=True)
+
     try:
         from tesla_visualizer import TeslaPriceVisualizer
-        visualizer = TeslaPriceVisualizer()
-        visualizer.run_analysis()
+
+        if backend == 'duckdb':
+            # 分析前先將 SQLite 新資料同步到 DuckDB
+            from tesla_storage import DuckDBStorage
+            storage = DuckDBStorage()
+            storage.init_schema()
+            storage.sync_from_sqlite()
+            storage.close()
+
+        visualizer = TeslaPriceVisualizer(backend=backend, output_dpi=dpi,
+                                          output_format=fmt, interactive=not batch and fmt != 'html',
+                                          heatmap_window_days=heatmap_days)
+        visualizer.run_analysis(batch=batch, workers=workers,
+                                use_cache=False if force else None,
+                                full_rebuild=full_rebuild)
         return True
     except ImportError:
         print("❌ 找不到 tesla_visualizer.py")
@@ -243,19 +230,80 @@ def run_visualization():
         print(f"❌ 視覺化執行失敗: {e}")
         return False
 
-def run_simple_analysis():
-    """執行簡化版分析"""
-    import pandas as pd
-    import sqlite3
+def run_archive_export():
+    """增量匯出 Parquet 封存"""
+    print("\n📦 匯出 Parquet 封存...")
 
-    conn = sqlite3.connect("tesla_prices.db")
+    try:
+        from tesla_archive import ParquetArchiveExporter
+        exporter = ParquetArchiveExporter()
+        exported = exporter.export()
+        for table, count in exported.items():
+            print(f"  {table}: 新增 {count} 筆")
+        print(f"✅ 封存已更新: {exporter.archive_dir}")
+        return True
+    except ImportError as e:
+        print(f"❌ {e}")
+        return False
 
-    # 讀取資料
-    df = pd.read_sql_query("SELECT * FROM vehicle_prices", conn)
+def run_retention(keep_days):
+    """執行資料保留策略"""
+    print(f"\n🧹 執行資料保留策略（保留 {keep_days} 天原始資料）...")
 
-    if df.empty:
+    from tesla_retention import RetentionJob
+    result = RetentionJob(keep_days=keep_days).run()
+    print(f"  截止日期: {result['cutoff']}")
+    print(f"  彙整並刪除: {result['deleted']} 筆")
+    print(f"  清除原始文字: {result['raw_texts_deleted']} 筆")
+    return True
+
+def run_reparse(workers=None, restart=False):
+    """
+    以目前的解析規則重新解析已保存的原始文字（中斷後再次執行會從水位繼續）
+
+    Args:
+        workers: 程序數
+        restart: 捨棄未完成的水位，從頭開始
+    """
+    from tesla_storage import SQLiteStorage
+    from tesla_reparse import Reparser
+
+    print("\n🔁 重新解析歷史原始文字...")
+    storage = SQLiteStorage("tesla_prices.db")
+    storage.init_schema()
+    start = time.time()
+    result = Reparser(storage, workers=workers).run(restart)
+    storage.close()
+
+    print(f"  解析規則版本: {result['parser_version']}")
+    print(f"  處理: {result['scanned']} 筆 / 更新: {result['updated']} 筆（{len(result['dates'])} 個日期）")
+    print(f"  耗時: {time.time() - start:.1f} 秒")
+    if not result['scanned']:
+        print("  沒有保存原始文字的資料列（以 --no-raw 爬取的資料不會保存）")
+    return True
+
+def run_simple_analysis(full_rebuild=False):
+    """
+    執行簡化版分析（增量：只納入上次分析後新增的資料）
+
+    Args:
+        full_rebuild: 捨棄分析狀態並重新產生完整報告
+    """
+    from tesla_storage import SQLiteStorage
+    from tesla_analysis_state import AnalysisState, stats_from_state
+
+    storage = SQLiteStorage("tesla_prices.db")
+    storage.init_schema()
+
+    # 統計數字由增量分析狀態取得
+    state = AnalysisState(storage)
+    state.update(full_rebuild)
+    stats = stats_from_state(state)
+    overall = stats.overall
+
+    if not overall['count']:
         print("❌ 沒有資料可供分析")
-        conn.close()
+        storage.close()
         return False
 
     # 基本統計
@@ -264,26 +312,307 @@ def run_simple_analysis():
     print("="*60)
 
     print(f"\n📊 基本統計:")
-    print(f"  總車輛數: {len(df)}")
-    print(f"  平均價格: NT${df['price'].mean():,.0f}")
-    print(f"  最低價格: NT${df['price'].min():,.0f}")
-    print(f"  最高價格: NT${df['price'].max():,.0f}")
+    print(f"  總車輛數: {overall['count']}")
+    print(f"  平均價格: NT${overall['price_mean']:,.0f}")
+    p10, median, p90 = storage.sketches.quantiles().values()
+    if median is not None:
+        print(f"  中位數價格: NT${median:,.0f} (P10 NT${p10:,.0f} / P90 NT${p90:,.0f})")
+    print(f"  最低價格: NT${overall['price_min']:,.0f}")
+    print(f"  最高價格: NT${overall['price_max']:,.0f}")
 
     print(f"\n🚗 各車型統計:")
-    for model in df['model'].unique():
-        model_df = df[df['model'] == model]
+    for model, model_stats in stats.per_model.iterrows():
         print(f"\n  {model}:")
-        print(f"    數量: {len(model_df)}")
-        print(f"    平均價格: NT${model_df['price'].mean():,.0f}")
-        print(f"    價格範圍: NT${model_df['price'].min():,.0f} - NT${model_df['price'].max():,.0f}")
+        print(f"    數量: {model_stats['count']:.0f}")
+        print(f"    平均價格: NT${model_stats['price_mean']:,.0f}")
+        print(f"    價格範圍: NT${model_stats['price_min']:,.0f} - NT${model_stats['price_max']:,.0f}")
+
+    # 儲存報告：既有報告只附加新資料列
+    report_path = 'tesla_inventory_report.csv'
+    csv_watermark = state.get_marker('report_watermark', 0)
+    append = not full_rebuild and csv_watermark > 0 and os.path.exists(report_path)
+    if append:
+        # 資料表新增欄位後既有報告的欄位不一致，改為重新輸出
+        with open(report_path, encoding='utf-8-sig') as f:
+            append = f.readline().strip().split(',') == storage.table_columns('vehicle_prices')
+    report_max = state.state['watermark']['vehicle_prices']
+    df = storage.read_frame("SELECT * FROM vehicle_prices WHERE id > ? AND id <= ? ORDER BY id",
+                            (csv_watermark if append else 0, report_max))
+    if append:
+        df.to_csv(report_path, mode='a', header=False, index=False, encoding='utf-8')
+        print(f"\n✅ 已附加 {len(df)} 筆新資料至 {report_path}")
+    else:
+        df.to_csv(report_path, index=False, encoding='utf-8-sig')
+        print(f"\n✅ 報告已儲存至 {report_path}")
+    state.set_marker('report_watermark', report_max)
+
+    storage.close()
+    return True
+
+def run_fair_prices(top=10):
+    """以折舊模型估計每輛車的合理價格並列出低於合理價格最多的車輛"""
+    from tesla_storage import SQLiteStorage
+    from tesla_depreciation import DepreciationModel
+
+    storage = SQLiteStorage("tesla_prices.db")
+    model = DepreciationModel(storage)
+    model.fit()
+    df = model.fair_prices()
+    storage.close()
+
+    if df.empty:
+        print("❌ 沒有可估計的車輛（需要價格、里程與年份）")
+        return False
+
+    report_path = 'tesla_fair_prices.csv'
+    df.to_csv(report_path, index=False, encoding='utf-8-sig')
+
+    print(f"\n💰 低於合理價格最多的 {min(top, len(df))} 輛車:")
+    for row in df.head(top).itertuples():
+        print(f"  {row.vin} {row.model} {row.trim or ''} {row.year} {row.mileage:,} km: "
+              f"NT${row.price:,.0f} (合理 NT${row.fair_price:,.0f}, {row.residual:+,.0f})")
+    print(f"\n✅ 合理價格已儲存至 {report_path}")
+    return True
+
+def run_comparables(spec, k=10):
+    """以 VIN 或規格（車型 車款 年份 里程 [顏色]）找出相似車輛並估計合理價格"""
+    from tesla_storage import SQLiteStorage
+    from tesla_comparables import ComparablesIndex
+
+    storage = SQLiteStorage("tesla_prices.db")
+    storage.init_schema()
+    index = ComparablesIndex(storage.conn)
+    index.refresh()
+    if len(spec) == 1:
+        result = index.query_vin(spec[0], k)
+        if result is None:
+            print(f"❌ 找不到 VIN {spec[0]}（或缺少年份 / 里程）")
+            storage.close()
+            return False
+        vehicle = result['vehicle']
+        print(f"\n🚗 {vehicle['vin']} {vehicle['model']} {vehicle['trim'] or ''} {vehicle['year']} "
+              f"{vehicle['mileage']:,} km {vehicle['colour'] or ''}: NT${vehicle['price']:,}")
+    elif len(spec) in (4, 5):
+        model, trim, year, mileage = spec[:4]
+        result = index.query(model, trim if trim != '*' else None, int(year), int(mileage),
+                             spec[4] if len(spec) == 5 else None, k)
+    else:
+        print("❌ 請指定 VIN，或 車型 車款 年份 里程 [顏色]")
+        storage.close()
+        return False
+    storage.close()
+
+    if not result['comparables']:
+        print("❌ 沒有可比較的車輛")
+        return False
+
+    partition = result['partition']
+    print(f"\n🔎 最相近的 {len(result['comparables'])} 輛車（{partition['model']} {partition['trim']}）:")
+    for item in result['comparables']:
+        status = f"售出 {item['sold_at'][:10]}" if item['status'] == 'sold' else '在架'
+        print(f"  {item['vin']} {item['year']} {item['mileage']:,} km {item['colour'] or '-'}: "
+              f"NT${item['price']:,} ({status}, 距離 {item['distance']:.2f})")
+    print(f"\n💰 估計合理價格: NT${result['fair_price']:,}")
+    return True
+
+def run_price_events(limit=20):
+    """列出最近的降價 / 漲價事件"""
+    from tesla_storage import SQLiteStorage
+
+    storage = SQLiteStorage("tesla_prices.db")
+    storage.events.init_schema()
+    storage.conn.commit()
+    events = storage.events.recent(limit)
+    storage.close()
+
+    if not events:
+        print("ℹ️ 目前沒有價格變動事件")
+        return True
+
+    print(f"\n🔔 最近 {len(events)} 筆價格變動事件:")
+    for event in events:
+        icon = '📉' if event['event_type'] == 'price_cut' else '📈'
+        print(f"  {icon} {event['seen_at']} {event['vin']} {event['model']}: "
+              f"NT${event['old_price']:,} → NT${event['new_price']:,} "
+              f"({event['price_change']:+,}, {event['change_percentage']:+.2f}%)")
+    return True
+
+def run_watchlist(add=None, remove=None, model=None, trim=None, min_price=None,
+                  max_price=None, max_mileage=None):
+    """新增 / 刪除追蹤規則，並列出所有規則與最近的符合車輛"""
+    from tesla_storage import SQLiteStorage
+
+    storage = SQLiteStorage("tesla_prices.db")
+    storage.watchlist.init_schema()
+    storage.conn.commit()
+    watchlist = storage.watchlist
+
+    if add:
+        rule_id = watchlist.add_rule(add, model, trim, min_price, max_price, max_mileage)
+        print(f"✅ 已新增追蹤規則 #{rule_id}: {add}")
+    if remove is not None:
+        if not watchlist.remove_rule(remove):
+            print(f"❌ 找不到追蹤規則 #{remove}")
+            storage.close()
+            return False
+        print(f"✅ 已刪除追蹤規則 #{remove}")
+
+    rules = watchlist.rules()
+    matches = watchlist.recent()
+    storage.close()
+
+    print(f"\n👀 追蹤規則 ({len(rules)} 條):")
+    for rule in rules:
+        conditions = [rule['model'] or '任何車型']
+        if rule['trim']:
+            conditions.append(rule['trim'])
+        if rule['min_price'] is not None:
+            conditions.append(f"≥ NT${rule['min_price']:,}")
+        if rule['max_price'] is not None:
+            conditions.append(f"≤ NT${rule['max_price']:,}")
+        if rule['max_mileage'] is not None:
+            conditions.append(f"≤ {rule['max_mileage']:,} km")
+        print(f"  #{rule['id']} {rule['name']}: {', '.join(conditions)}")
+
+    if matches:
+        print(f"\n🔔 最近 {len(matches)} 筆符合車輛:")
+        for match in matches:
+            print(f"  {match['seen_at']} [{match['rule_name']}] {match['vin']} {match['model']} "
+                  f"{match['trim'] or ''} NT${match['price']:,}")
+    return True
+
+def run_price_quantiles(start_date=None, end_date=None):
+    """由分位數草圖列出日期區間內的全市場與各車型價格分位數"""
+    from tesla_storage import SQLiteStorage
+
+    storage = SQLiteStorage("tesla_prices.db")
+    storage.sketches.init_schema()
+    storage.conn.commit()
+    overall = storage.sketches.quantiles((0.1, 0.25, 0.5, 0.75, 0.9), start_date, end_date)
+    per_model = storage.sketches.quantiles_by_model(start_date=start_date, end_date=end_date)
+    storage.close()
+
+    if overall[0.5] is None:
+        print("❌ 指定區間沒有價格資料")
+        return False
+
+    print(f"\n📐 價格分位數 ({start_date or '最早'} 至 {end_date or '最新'}):")
+    print("  全市場: " + " / ".join(f"P{q * 100:.0f} NT${value:,.0f}" for q, value in overall.items()))
+    for model, row in per_model.iterrows():
+        print(f"  {model} ({row['count']:,.0f} 筆): P10 NT${row['p10']:,.0f} / "
+              f"P50 NT${row['p50']:,.0f} / P90 NT${row['p90']:,.0f}")
+    return True
+
+def run_turnover(start_date=None, end_date=None):
+    """由上架生命週期表列出各車型的上架、售出與在架天數"""
+    from tesla_storage import SQLiteStorage
+
+    storage = SQLiteStorage("tesla_prices.db")
+    storage.init_schema()
+    report = storage.listings.turnover(start_date, end_date)
+    storage.close()
+
+    if not report:
+        print("❌ 沒有上架紀錄")
+        return False
+
+    print(f"\n🔄 庫存周轉 ({start_date or '最早'} 至 {end_date or '最新'}):")
+    for row in report:
+        line = f"  {row['model']}: 新上架 {row['listed']} / 售出 {row['sold']} / 在架 {row['active']}"
+        if row['sold']:
+            line += (f" / 平均在架 {row['avg_days_on_market']:.1f} 天"
+                     f" / 平均售價 NT${row['avg_sale_price']:,.0f}")
+        print(line)
+    return True
+
+def run_sweep_diff(sweep_ids, as_json=False):
+    """比較兩輪爬取（預設為最新一輪與前一輪）的新增 / 移除車輛與價格、里程、地點變動"""
+    import json
+    from tesla_storage import SQLiteStorage
+    from tesla_diff import diff_sweeps, format_diff
+
+    storage = SQLiteStorage("tesla_prices.db")
+    storage.init_schema()
+    old_id, new_id = ([int(sweep_id) for sweep_id in sweep_ids] + [None, None])[:2]
+    try:
+        diff = diff_sweeps(storage.conn, old_id, new_id)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return False
+    finally:
+        storage.close()
 
-    # 儲存報告
-    df.to_csv('tesla_inventory_report.csv', index=False, encoding='utf-8-sig')
-    print(f"\n✅ 報告已儲存至 tesla_inventory_report.csv")
+    if as_json:
+        print(json.dumps(diff, ensure_ascii=False, indent=2))
+    else:
+        print(f"\n🔍 {format_diff(diff)}")
+    return True
 
-    conn.close()
+def run_api_server(port=None):
+    """啟動本機唯讀價格查詢 API（Ctrl+C 結束）"""
+    from tesla_storage import SQLiteStorage
+    from tesla_api import PriceApiServer, PriceQueryService, API_HOST, API_PORT
+
+    # 先以讀寫連線建立查詢需要的表格與索引，服務本身只開唯讀連線
+    storage = SQLiteStorage("tesla_prices.db")
+    storage.init_schema()
+    storage.close()
+
+    server = PriceApiServer(PriceQueryService("tesla_prices.db"), API_HOST,
+                            API_PORT if port is None else port)
+    host, port = server.server_address[:2]
+    print(f"\n🌐 價格查詢 API: http://{host}:{port}/")
+    print("  /health  /inventory[/<model>]  /vins/<vin>/history")
+    print("  /daily?start=&end=&model=  /quantiles?start=&end=&model=&q=  /events?since=&type=&limit=")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n已停止 API 服務")
+    finally:
+        server.server_close()
     return True
 
+def run_aggregate_check():
+    """比對彙總表與原始資料的完整重新計算"""
+    from tesla_storage import SQLiteStorage
+
+    from tesla_analysis_state import AnalysisState
+
+    storage = SQLiteStorage("tesla_prices.db")
+    storage.aggregates.init_schema()
+    mismatches = storage.aggregates.check_consistency()
+    storage.sketches.init_schema()
+    sketch_mismatches = storage.sketches.check_consistency()
+
+    # 增量分析狀態：先納入新資料，再與完整重新計算比對
+    state = AnalysisState(storage)
+    state.update()
+    state_mismatches = state.verify()
+    storage.close()
+
+    if not mismatches:
+        print("✅ 彙總表與原始資料一致")
+    else:
+        print(f"❌ 發現 {len(mismatches)} 項不一致:")
+        for date, model, band, field, actual, expected in mismatches[:20]:
+            print(f"  {date} {model} 區間{band} {field}: 彙總={actual} 重新計算={expected}")
+
+    if not sketch_mismatches:
+        print("✅ 分位數草圖筆數與原始資料一致")
+    else:
+        print(f"❌ 分位數草圖發現 {len(sketch_mismatches)} 項筆數不一致:")
+        for date, model, actual, expected in sketch_mismatches[:20]:
+            print(f"  {date} {model}: 草圖={actual} 原始資料={expected}")
+
+    if not state_mismatches:
+        print("✅ 增量分析狀態與完整重新計算一致")
+    else:
+        print(f"❌ 增量分析狀態發現 {len(state_mismatches)} 項不一致（可使用 --full-rebuild 重建）:")
+        for line in state_mismatches[:20]:
+            print(f"  {line}")
+
+    return not mismatches and not sketch_mismatches and not state_mismatches
+
 def show_menu():
     """顯示主選單"""
     print("\n" + "="*60)
@@ -315,6 +644,52 @@ def main():
     parser.add_argument('--analyze', action='store_true', help='執行分析')
     parser.add_argument('--test', action='store_true', help='使用測試資料')
     parser.add_argument('--auto', action='store_true', help='自動執行所有功能')
+    parser.add_argument('--export-archive', action='store_true', help='增量匯出 Parquet 封存')
+    parser.add_argument('--backend', choices=['sqlite', 'duckdb'], default='sqlite',
+                        help='分析使用的儲存實作')
+    parser.add_argument('--check-aggregates', action='store_true', help='檢查彙總表一致性')
+    parser.add_argument('--retain-days', type=int, metavar='N',
+                        help='彙整並刪除 N 天以前的原始資料')
+    parser.add_argument('--batch', action='store_true',
+                        help='批次繪圖：Agg 後端平行輸出圖表，不開啟視窗')
+    parser.add_argument('--dpi', type=int, default=300, help='圖表輸出解析度')
+    parser.add_argument('--format', dest='fmt', default='png', help='圖表輸出格式 (png/svg/pdf/html)')
+    parser.add_argument('--workers', type=int, help='批次繪圖 / 重新解析的程序數')
+    parser.add_argument('--force-render', action='store_true',
+                        help='忽略圖表快取，全部重新繪製')
+    parser.add_argument('--heatmap-days', type=int, metavar='N',
+                        help='價格變動熱力圖只取最近 N 天')
+    parser.add_argument('--fair-prices', action='store_true',
+                        help='以折舊模型估計每輛車的合理價格')
+    parser.add_argument('--full-rebuild', action='store_true',
+                        help='捨棄增量分析狀態，從第一筆資料重新計算（搭配 --reparse 時捨棄未完成的進度）')
+    parser.add_argument('--events', action='store_true',
+                        help='列出最近的降價 / 漲價事件')
+    parser.add_argument('--serve', action='store_true', help='啟動本機唯讀價格查詢 API')
+    parser.add_argument('--port', type=int, help='查詢 API 的連接埠（預設 8765）')
+    parser.add_argument('--quantiles', nargs='*', metavar='DATE',
+                        help='列出價格分位數（可指定起始與結束日期 YYYY-MM-DD）')
+    parser.add_argument('--diff', nargs='*', metavar='SWEEP_ID',
+                        help='比較兩輪爬取（預設為最新一輪與前一輪）')
+    parser.add_argument('--json', action='store_true', help='以 JSON 輸出（搭配 --diff）')
+    parser.add_argument('--comparables', nargs='+', metavar='SPEC',
+                        help='以 VIN 或「車型 車款 年份 里程 [顏色]」找出相似車輛並估計合理價格（車款 * 表示不限）')
+    parser.add_argument('--neighbors', type=int, default=10, help='相似車輛數量（預設 10）')
+    parser.add_argument('--watchlist', action='store_true', help='列出追蹤規則與最近的符合車輛')
+    parser.add_argument('--watch-add', metavar='NAME',
+                        help='新增追蹤規則（搭配 --watch-model / --watch-trim / --min-price / --max-price / --max-mileage）')
+    parser.add_argument('--watch-remove', type=int, metavar='ID', help='刪除追蹤規則')
+    parser.add_argument('--watch-model', help='追蹤規則的車型，例如 MODELY')
+    parser.add_argument('--watch-trim', help='追蹤規則的車款，例如 "Long Range"')
+    parser.add_argument('--min-price', type=int, help='追蹤規則的最低價格')
+    parser.add_argument('--max-price', type=int, help='追蹤規則的最高價格')
+    parser.add_argument('--max-mileage', type=int, help='追蹤規則的最高里程')
+    parser.add_argument('--no-raw', action='store_true',
+                        help='爬蟲不保存原始卡片文字（之後無法重新解析這些資料）')
+    parser.add_argument('--reparse', action='store_true',
+                        help='以目前的解析規則重新解析已保存的原始文字並更新歷史資料')
+    parser.add_argument('--turnover', nargs='*', metavar='DATE',
+                        help='列出各車型上架 / 售出數量與在架天數（可指定起始與結束日期 YYYY-MM-DD）')
 
     args = parser.parse_args()
 
@@ -328,7 +703,7 @@ def main():
         print("🤖 自動模式啟動...")
         if not check_database()[0]:
             run_simple_scraper()
-        run_simple_analysis()
+        run_simple_analysis(args.full_rebuild)
         sys.exit(0)
 
     if args.test:
@@ -336,14 +711,89 @@ def main():
         sys.exit(0)
 
     if args.scrape:
-        run_full_scraper()
+        run_full_scraper(keep_raw=not args.no_raw)
+        sys.exit(0)
+
+    if args.export_archive:
+        if not check_database()[0]:
+            print("請先執行爬蟲或使用測試資料")
+            sys.exit(1)
+        sys.exit(0 if run_archive_export() else 1)
+
+    if args.check_aggregates:
+        if not check_database()[0]:
+            print("請先執行爬蟲或使用測試資料")
+            sys.exit(1)
+        sys.exit(0 if run_aggregate_check() else 1)
+
+    if args.fair_prices:
+        if not check_database()[0]:
+            print("請先執行爬蟲或使用測試資料")
+            sys.exit(1)
+        sys.exit(0 if run_fair_prices() else 1)
+
+    if args.events:
+        if not check_database()[0]:
+            print("請先執行爬蟲或使用測試資料")
+            sys.exit(1)
+        sys.exit(0 if run_price_events() else 1)
+
+    if args.serve:
+        if not check_database()[0]:
+            print("請先執行爬蟲或使用測試資料")
+            sys.exit(1)
+        sys.exit(0 if run_api_server(args.port) else 1)
+
+    if args.quantiles is not None:
+        if not check_database()[0]:
+            print("請先執行爬蟲或使用測試資料")
+            sys.exit(1)
+        start_date, end_date = (args.quantiles + [None, None])[:2]
+        sys.exit(0 if run_price_quantiles(start_date, end_date) else 1)
+
+    if args.comparables:
+        if not check_database()[0]:
+            print("請先執行爬蟲或使用測試資料")
+            sys.exit(1)
+        sys.exit(0 if run_comparables(args.comparables, args.neighbors) else 1)
+
+    if args.watchlist or args.watch_add or args.watch_remove is not None:
+        sys.exit(0 if run_watchlist(args.watch_add, args.watch_remove, args.watch_model,
+                                    args.watch_trim, args.min_price, args.max_price,
+                                    args.max_mileage) else 1)
+
+    if args.diff is not None:
+        if not check_database()[0]:
+            print("請先執行爬蟲或使用測試資料")
+            sys.exit(1)
+        sys.exit(0 if run_sweep_diff(args.diff, args.json) else 1)
+
+    if args.turnover is not None:
+        if not check_database()[0]:
+            print("請先執行爬蟲或使用測試資料")
+            sys.exit(1)
+        start_date, end_date = (args.turnover + [None, None])[:2]
+        sys.exit(0 if run_turnover(start_date, end_date) else 1)
+
+    if args.reparse:
+        if not check_database()[0]:
+            print("請先執行爬蟲或使用測試資料")
+            sys.exit(1)
+        sys.exit(0 if run_reparse(args.workers, args.full_rebuild) else 1)
+
+    if args.retain_days is not None:
+        if not check_database()[0]:
+            print("請先執行爬蟲或使用測試資料")
+            sys.exit(1)
+        run_retention(args.retain_days)
         sys.exit(0)
 
     if args.analyze:
         if not check_database()[0]:
             print("請先執行爬蟲或使用測試資料")
             sys.exit(1)
-        run_visualization()
+        run_visualization(args.backend, args.batch, args.dpi, args.fmt, args.workers,
+                          args.force_render, args.heatmap_days, args.full_rebuild)
         sys.exit(0)
 
     # 互動式選單
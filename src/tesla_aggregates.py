@@ -0,0 +1,282 @@
+#!/home/cclin/.local/python311/bin/python3
+"""
+Tesla 價格彙總表
+寫入時增量維護每日 / 車型 / 價格區間統計，報表只需讀取 O(分組數) 的資料
+"""
+
+import bisect
+import sqlite3
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 價格區間（單位：萬元），與市場洞察圖表一致
+PRICE_BANDS = [
+    (0, 150, '150萬以下'),
+    (150, 200, '150-200萬'),
+    (200, 250, '200-250萬'),
+    (250, 300, '250-300萬'),
+    (300, float('inf'), '300萬以上')
+]
+
+_BAND_EDGES = [low * 10000 for low, _, _ in PRICE_BANDS[1:]]
+
+# 彙總欄位：(次數, 價格總和, 價格平方和, 最低價, 最高價, 里程總和, 里程筆數)
+_FIELDS = ['observations', 'price_sum', 'price_sq_sum', 'price_min', 'price_max',
+           'mileage_sum', 'mileage_count']
+
+
+def price_band(price: int) -> int:
+    """回傳價格所屬的區間索引"""
+    return bisect.bisect_right(_BAND_EDGES, price)
+
+
+def price_band_sql(column: str = 'price') -> str:
+    """產生計算價格區間索引的 SQL 運算式"""
+    cases = ' '.join(f"WHEN {column} < {edge} THEN {i}" for i, edge in enumerate(_BAND_EDGES))
+    return f"CASE {cases} ELSE {len(_BAND_EDGES)} END"
+
+
+class AggregateStore:
+    """每日 × 車型 × 價格區間的增量彙總"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        """
+        初始化彙總表
+
+        Args:
+            conn: 資料庫連線
+        """
+        self.conn = conn
+
+    def init_schema(self):
+        """建立彙總表格與檢視；既有資料庫第一次建立時由原始資料回填"""
+        cursor = self.conn.cursor()
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS agg_daily_model_band (
+                date DATE NOT NULL,
+                model TEXT NOT NULL,
+                band INTEGER NOT NULL,
+                observations INTEGER NOT NULL,
+                price_sum INTEGER NOT NULL,
+                price_sq_sum REAL NOT NULL,
+                price_min INTEGER,
+                price_max INTEGER,
+                mileage_sum INTEGER NOT NULL,
+                mileage_count INTEGER NOT NULL,
+                PRIMARY KEY (date, model, band)
+            ) WITHOUT ROWID
+        ''')
+
+        # 各維度的檢視，皆從最細粒度彙總再次加總
+        for view, key in (('agg_by_day', 'date'), ('agg_by_model', 'model'), ('agg_by_band', 'band')):
+            cursor.execute(f'''
+                CREATE VIEW IF NOT EXISTS {view} AS
+                SELECT {key},
+                       SUM(observations) AS observations,
+                       SUM(price_sum) AS price_sum,
+                       SUM(price_sq_sum) AS price_sq_sum,
+                       MIN(price_min) AS price_min,
+                       MAX(price_max) AS price_max,
+                       SUM(mileage_sum) AS mileage_sum,
+                       SUM(mileage_count) AS mileage_count
+                FROM agg_daily_model_band
+                GROUP BY {key}
+            ''')
+
+        has_aggregates = cursor.execute(
+            "SELECT 1 FROM agg_daily_model_band LIMIT 1").fetchone()
+        has_raw = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='vehicle_prices'").fetchone()
+        if not has_aggregates and has_raw:
+            if cursor.execute("SELECT 1 FROM vehicle_prices LIMIT 1").fetchone():
+                logger.info("回填彙總表...")
+                self.rebuild()
+
+    def add(self, rows: Iterable[Tuple]):
+        """
+        將新寫入的觀測加入彙總（同一批先在記憶體合併再寫入）
+
+        Args:
+            rows: (scrape_datetime, model, price, mileage) 的序列
+        """
+        batch: Dict[Tuple, List] = {}
+        for scrape_datetime, model, price, mileage in rows:
+            if price is None or not scrape_datetime:
+                continue
+            key = (str(scrape_datetime)[:10], model or 'UNKNOWN', price_band(price))
+            acc = batch.get(key)
+            if acc is None:
+                acc = batch[key] = [0, 0, 0.0, price, price, 0, 0]
+            acc[0] += 1
+            acc[1] += price
+            acc[2] += float(price) * price
+            acc[3] = min(acc[3], price)
+            acc[4] = max(acc[4], price)
+            if mileage is not None:
+                acc[5] += mileage
+                acc[6] += 1
+
+        if not batch:
+            return
+
+        self.conn.executemany('''
+            INSERT INTO agg_daily_model_band
+                (date, model, band, observations, price_sum, price_sq_sum,
+                 price_min, price_max, mileage_sum, mileage_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(date, model, band) DO UPDATE SET
+                observations = observations + excluded.observations,
+                price_sum = price_sum + excluded.price_sum,
+                price_sq_sum = price_sq_sum + excluded.price_sq_sum,
+                price_min = MIN(price_min, excluded.price_min),
+                price_max = MAX(price_max, excluded.price_max),
+                mileage_sum = mileage_sum + excluded.mileage_sum,
+                mileage_count = mileage_count + excluded.mileage_count
+        ''', [key + tuple(acc) for key, acc in batch.items()])
+
+    def _recompute_sql(self, where: str = '') -> str:
+        """從原始資料重新計算彙總的 SQL"""
+        return f'''
+            SELECT date(scrape_datetime) AS date,
+                   COALESCE(model, 'UNKNOWN') AS model,
+                   {price_band_sql()} AS band,
+                   COUNT(*), SUM(price), SUM(CAST(price AS REAL) * price),
+                   MIN(price), MAX(price),
+                   COALESCE(SUM(mileage), 0), COUNT(mileage)
+            FROM vehicle_prices
+            WHERE price IS NOT NULL {where}
+            GROUP BY 1, 2, 3
+        '''
+
+    def raw_tier_start(self) -> Optional[str]:
+        """原始資料目前涵蓋的最早日期（更早的日期已被保留策略彙整）"""
+        row = self.conn.execute("SELECT MIN(date(scrape_datetime)) FROM vehicle_prices").fetchone()
+        return row[0] if row else None
+
+    def rebuild(self, dates: Optional[List[str]] = None):
+        """
+        由原始資料重建彙總
+
+        Args:
+            dates: 只重建指定日期；None 表示重建原始資料涵蓋的所有日期
+        """
+        if dates is None:
+            start = self.raw_tier_start()
+            if start is None:
+                return
+            where, params = "AND date(scrape_datetime) >= ?", [start]
+            delete_where = "date >= ?"
+        else:
+            if not dates:
+                return
+            placeholders = ', '.join('?' * len(dates))
+            where, params = f"AND date(scrape_datetime) IN ({placeholders})", list(dates)
+            delete_where = f"date IN ({placeholders})"
+
+        self.conn.execute(f"DELETE FROM agg_daily_model_band WHERE {delete_where}", params)
+        self.conn.execute(f'''
+            INSERT INTO agg_daily_model_band
+                (date, model, band, observations, price_sum, price_sq_sum,
+                 price_min, price_max, mileage_sum, mileage_count)
+            {self._recompute_sql(where)}
+        ''', params)
+
+    def check_consistency(self, tolerance: float = 1e-6) -> List[Tuple]:
+        """
+        與原始資料的完整重新計算比對（僅比對原始資料仍保留的日期）
+
+        Returns:
+            List[Tuple]: 不一致的 (date, model, band, 欄位, 彙總值, 重新計算值)
+        """
+        start = self.raw_tier_start()
+        if start is None:
+            return []
+
+        expected = {
+            row[:3]: row[3:]
+            for row in self.conn.execute(self._recompute_sql("AND date(scrape_datetime) >= ?"), (start,))
+        }
+        actual = {
+            row[:3]: row[3:]
+            for row in self.conn.execute(f'''
+                SELECT date, model, band, {', '.join(_FIELDS)}
+                FROM agg_daily_model_band WHERE date >= ?
+            ''', (start,))
+        }
+
+        mismatches = []
+        for key in sorted(set(expected) | set(actual)):
+            exp = expected.get(key, (0,) * len(_FIELDS))
+            act = actual.get(key, (0,) * len(_FIELDS))
+            for field, a, e in zip(_FIELDS, act, exp):
+                if a is None or e is None:
+                    if a != e:
+                        mismatches.append(key + (field, a, e))
+                elif abs(a - e) > tolerance * max(1.0, abs(e)):
+                    mismatches.append(key + (field, a, e))
+        return mismatches
+
+    def _read(self, view: str, key: str) -> List[Dict]:
+        """讀取檢視並計算平均與標準差"""
+        rows = []
+        for row in self.conn.execute(f"SELECT {key}, {', '.join(_FIELDS)} FROM {view} ORDER BY {key}"):
+            stats = dict(zip([key] + _FIELDS, row))
+            stats.update(_derived(stats))
+            rows.append(stats)
+        return rows
+
+    def by_day(self) -> List[Dict]:
+        """每日統計"""
+        return self._read('agg_by_day', 'date')
+
+    def by_model(self) -> List[Dict]:
+        """各車型統計"""
+        return self._read('agg_by_model', 'model')
+
+    def by_band(self) -> List[Dict]:
+        """各價格區間統計（包含沒有車輛的區間）"""
+        found = {row['band']: row for row in self._read('agg_by_band', 'band')}
+        rows = []
+        for band, (_, _, label) in enumerate(PRICE_BANDS):
+            row = found.get(band) or {'band': band, 'observations': 0}
+            row['label'] = label
+            rows.append(row)
+        return rows
+
+    def overall(self) -> Dict:
+        """全部資料統計"""
+        row = self.conn.execute(f'''
+            SELECT SUM(observations), SUM(price_sum), SUM(price_sq_sum), MIN(price_min),
+                   MAX(price_max), SUM(mileage_sum), SUM(mileage_count),
+                   MIN(date), MAX(date)
+            FROM agg_daily_model_band
+        ''').fetchone()
+        stats = dict(zip(_FIELDS + ['first_date', 'last_date'], row))
+        stats['observations'] = stats['observations'] or 0
+        stats.update(_derived(stats))
+        return stats
+
+    def is_empty(self) -> bool:
+        """彙總表是否尚無資料"""
+        try:
+            return self.conn.execute("SELECT 1 FROM agg_daily_model_band LIMIT 1").fetchone() is None
+        except sqlite3.OperationalError:
+            return True
+
+
+def _derived(stats: Dict) -> Dict:
+    """由總和推導平均價格、標準差與平均里程"""
+    n = stats.get('observations') or 0
+    derived = {'price_mean': None, 'price_std': None, 'mileage_mean': None}
+    if n:
+        mean = stats['price_sum'] / n
+        derived['price_mean'] = mean
+        if n > 1:
+            variance = (stats['price_sq_sum'] - n * mean * mean) / (n - 1)
+            derived['price_std'] = max(variance, 0.0) ** 0.5
+    if stats.get('mileage_count'):
+        derived['mileage_mean'] = stats['mileage_sum'] / stats['mileage_count']
+    return derived
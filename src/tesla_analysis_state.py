@@ -0,0 +1,578 @@
+#!/home/cclin/.local/python311/bin/python3
+"""
+Tesla 增量分析狀態
+保存累計總和 / 筆數 / 極值 / 分組累加器與 id 水位，每次分析只納入上次之後新增的資料
+"""
+
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from tesla_market_stats import (MarketStats, BAND_EDGES, BAND_LABELS, BUCKET_PERIODS, TOP_COLORS,
+                                compute_trend_stats)
+from tesla_storage import StorageBackend, HEATMAP_MAX_COLUMNS, heatmap_bucket, compact_frame
+from tesla_retention import has_rollup_tier
+
+logger = logging.getLogger(__name__)
+
+# 狀態格式版本；累加器定義變更時遞增，舊狀態會自動完整重建
+STATE_VERSION = 1
+
+# 價格分組寬度（元）：用於中位數 / 四分位數與直方圖
+PRICE_BIN = 10000
+# 價格與里程密度圖分組寬度（元、公里）
+DENSITY_PRICE_BIN = 50000
+DENSITY_MILEAGE_BIN = 2000
+
+# 累加器欄位：(筆數, 價格總和, 價格平方和, 最低價, 最高價, 里程總和, 里程筆數)
+_ACC_FIELDS = ['count', 'price_sum', 'price_sq_sum', 'price_min', 'price_max',
+               'mileage_sum', 'mileage_count']
+
+# 新增觀測讀取欄位
+_VEHICLE_COLUMNS = ['vin', 'model', 'year', 'price', 'mileage', 'exterior_color', 'scrape_datetime']
+
+
+def _empty_state() -> Dict:
+    """空白狀態"""
+    return {
+        'version': STATE_VERSION,
+        'watermark': {'vehicle_prices': 0, 'price_trends': 0},
+        'updated_at': None,
+        'overall': [0, 0, 0.0, None, None, 0, 0],
+        'first_seen': None,
+        'last_seen': None,
+        'per_model': {},
+        'per_year': {},
+        'per_color': {},
+        'per_band': [0] * len(BAND_LABELS),
+        'daily_counts': {},
+        'price_bins': {},
+        'density': {},
+        'fit': [0, 0.0, 0.0, 0.0, 0.0],
+        'trend_daily': {},
+    }
+
+
+def _merge_acc(acc: List, other: List) -> List:
+    """合併兩個累加器"""
+    if not other[0]:
+        return acc
+    if not acc[0]:
+        return list(other)
+    return [acc[0] + other[0], acc[1] + other[1], acc[2] + other[2],
+            min(acc[3], other[3]), max(acc[4], other[4]),
+            acc[5] + other[5], acc[6] + other[6]]
+
+
+def _add_counts(target: Dict, counts: pd.Series):
+    """將分組數量加入字典（鍵轉為字串以便存成 JSON）"""
+    for key, value in counts.items():
+        key = str(key)
+        target[key] = target.get(key, 0) + int(value)
+
+
+def _bin_quantile(bins: np.ndarray, counts: np.ndarray, q: float,
+                  low: float, high: float) -> float:
+    """由價格分組數量估計分位數（組內線性內插，限制在實際最小 / 最大值之間）"""
+    total = counts.sum()
+    position = q * total
+    cumulative = np.cumsum(counts)
+    i = int(np.searchsorted(cumulative, position, side='left'))
+    i = min(i, len(bins) - 1)
+    before = cumulative[i] - counts[i]
+    fraction = (position - before) / counts[i] if counts[i] else 0.0
+    value = (bins[i] + fraction) * PRICE_BIN
+    return float(min(max(value, low), high))
+
+
+class AnalysisState:
+    """持久化的增量分析狀態（存於 SQLite 的 analysis_state / analysis_vins 表格）"""
+
+    def __init__(self, storage: StorageBackend):
+        """
+        初始化分析狀態
+
+        Args:
+            storage: SQLite 儲存實作
+        """
+        self.storage = storage
+        self.conn = storage.conn
+        self.state = _empty_state()
+
+    def init_schema(self):
+        """建立狀態表格"""
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS analysis_state (
+                name TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS analysis_vins (
+                vin TEXT PRIMARY KEY
+            ) WITHOUT ROWID
+        ''')
+
+    def load(self) -> bool:
+        """
+        讀取已保存的狀態
+
+        Returns:
+            bool: 是否有可用的狀態（版本不符時視為沒有）
+        """
+        row = self.conn.execute("SELECT value FROM analysis_state WHERE name = 'state'").fetchone()
+        if row:
+            state = json.loads(row[0])
+            if state.get('version') == STATE_VERSION:
+                self.state = state
+                return True
+        self.state = _empty_state()
+        return False
+
+    def _save(self):
+        """保存狀態"""
+        self.state['updated_at'] = datetime.now().isoformat(timespec='seconds')
+        self.conn.execute(
+            "INSERT OR REPLACE INTO analysis_state (name, value) VALUES ('state', ?)",
+            (json.dumps(self.state, ensure_ascii=False),)
+        )
+
+    def get_marker(self, name: str, default=None):
+        """讀取其他增量工作（例如 CSV 報告）的水位"""
+        self.init_schema()
+        row = self.conn.execute("SELECT value FROM analysis_state WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_marker(self, name: str, value):
+        """保存其他增量工作的水位"""
+        self.conn.execute("INSERT OR REPLACE INTO analysis_state (name, value) VALUES (?, ?)",
+                          (name, json.dumps(value)))
+        self.conn.commit()
+
+    def invalidate(self):
+        """捨棄已保存的狀態與報告水位（既有資料列被修改時使用），下次 update 時完整重算並重寫報告"""
+        self.init_schema()
+        self.conn.execute("DELETE FROM analysis_state WHERE name IN ('state', 'report_watermark')")
+        self.conn.commit()
+        self.state = _empty_state()
+
+    def _max_id(self, table: str) -> int:
+        """表格目前的最大 id"""
+        row = self.conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()
+        return int(row[0])
+
+    def update(self, full_rebuild: bool = False, chunksize: int = 100000) -> Tuple[int, int]:
+        """
+        納入上次水位之後新增的資料並保存
+
+        Args:
+            full_rebuild: 捨棄現有狀態，從頭重新計算
+            chunksize: 每次讀取筆數
+
+        Returns:
+            Tuple[int, int]: 本次納入的 (觀測筆數, 趨勢筆數)
+        """
+        self.init_schema()
+        if full_rebuild or not self.load():
+            return self.rebuild(chunksize)
+
+        watermark = self.state['watermark']
+        vehicle_max = self._max_id('vehicle_prices')
+        trend_max = self._max_id('price_trends')
+
+        columns = ', '.join(_VEHICLE_COLUMNS)
+        vehicles = self._fold_vehicles(
+            self.storage.iter_frames(
+                f"SELECT {columns} FROM vehicle_prices WHERE id > ? AND id <= ? ORDER BY id",
+                (watermark['vehicle_prices'], vehicle_max), chunksize),
+            record_vins=True)
+        trends = self._fold_trends(
+            self.storage.iter_frames(
+                "SELECT model, price, change_percentage, date_recorded FROM price_trends "
+                "WHERE id > ? AND id <= ? ORDER BY id",
+                (watermark['price_trends'], trend_max), chunksize))
+
+        watermark.update({'vehicle_prices': vehicle_max, 'price_trends': trend_max})
+        self._save()
+        self.conn.commit()
+        if vehicles or trends:
+            logger.info(f"分析狀態已納入 {vehicles} 筆觀測、{trends} 筆趨勢")
+        return vehicles, trends
+
+    def rebuild(self, chunksize: int = 100000) -> Tuple[int, int]:
+        """
+        從頭重新計算狀態（包含保留策略彙整後的每日資料）
+
+        Returns:
+            Tuple[int, int]: 納入的 (觀測筆數, 趨勢筆數)
+        """
+        self.init_schema()
+        self.state = _empty_state()
+        self.conn.execute("DELETE FROM analysis_vins")
+
+        vehicle_max = self._max_id('vehicle_prices')
+        trend_max = self._max_id('price_trends')
+        vehicles, trends = self._compute_all(chunksize, record_vins=True)
+
+        self.state['watermark'] = {'vehicle_prices': vehicle_max, 'price_trends': trend_max}
+        self._save()
+        self.conn.commit()
+        logger.info(f"分析狀態已完整重建（{vehicles} 筆觀測、{trends} 筆趨勢）")
+        return vehicles, trends
+
+    def _compute_all(self, chunksize: int, record_vins: bool) -> Tuple[int, int]:
+        """
+        從所有資料來源累加（不保存）
+
+        保留策略彙整後的每日資料一列代表同一 VIN 當日的多筆觀測：以 observations 加權、
+        極值取當日最低 / 最高價，筆數與增量累加時的原始觀測一致。
+        """
+        if has_rollup_tier(self.conn):
+            columns = ', '.join(_VEHICLE_COLUMNS)
+            raw = self.storage.iter_frames(
+                f"SELECT {columns} FROM vehicle_prices ORDER BY id", (), chunksize)
+            rollup = self.storage.iter_frames(f'''
+                SELECT vin, model, year, last_price AS price, last_mileage AS mileage,
+                       exterior_color, last_seen AS scrape_datetime,
+                       observations, min_price, max_price
+                FROM vehicle_daily ORDER BY date, vin
+            ''', (), chunksize)
+            vehicles = self._fold_vehicles(raw, record_vins=record_vins)
+            vehicles += self._fold_vehicles(rollup, record_vins=record_vins)
+        else:
+            # 沒有彙整層時所有觀測都在原始資料（SQLite 時優先使用欄式快取）
+            vehicles = self._fold_vehicles(
+                self.storage.iter_observations(_VEHICLE_COLUMNS, chunksize=chunksize),
+                record_vins=record_vins)
+        trends = self._fold_trends(
+            self.storage.iter_frames(
+                "SELECT model, price, change_percentage, date_recorded FROM price_trends ORDER BY id",
+                (), chunksize))
+        return vehicles, trends
+
+    def _all_observations_query(self) -> Tuple[str, Tuple]:
+        """所有觀測來源（原始資料與彙整層）的查詢"""
+        columns = ', '.join(_VEHICLE_COLUMNS)
+        sql = ' UNION ALL '.join(f"SELECT {columns} FROM {source}"
+                                 for source in self.storage.observation_sources())
+        return sql, ()
+
+    def _fold_vehicles(self, chunks: Iterable[pd.DataFrame], record_vins: bool) -> int:
+        """
+        將觀測分塊累加到狀態
+
+        分塊有 observations 欄位時每列以其加權（彙整層），有 min_price / max_price 欄位時以其計算極值。
+
+        Returns:
+            int: 累加的觀測筆數（加權後）
+        """
+        state = self.state
+        folded = 0
+        for df in chunks:
+            df = compact_frame(df)
+            df = df[df['price'].notna()]
+            if df.empty:
+                continue
+
+            prices = df['price'].to_numpy(dtype=np.float64)
+            weights = (df['observations'].to_numpy(dtype=np.int64) if 'observations' in df.columns
+                       else np.ones(len(df), dtype=np.int64))
+            lows = df['min_price'].fillna(df['price']).to_numpy(dtype=np.float64) \
+                if 'min_price' in df.columns else prices
+            highs = df['max_price'].fillna(df['price']).to_numpy(dtype=np.float64) \
+                if 'max_price' in df.columns else prices
+            mileage = df['mileage'].to_numpy(dtype=np.float64, na_value=np.nan)
+            has_mileage = np.isfinite(mileage)
+            mileage_weights = np.where(has_mileage, weights, 0)
+            models = df['model'].astype(object).fillna('UNKNOWN').astype(str)
+            folded += int(weights.sum())
+
+            # 整體與各車型累加器
+            state['overall'] = _merge_acc(state['overall'], [
+                int(weights.sum()), int((prices * weights).sum()), float((prices * prices * weights).sum()),
+                int(lows.min()), int(highs.max()),
+                int((np.where(has_mileage, mileage, 0) * weights).sum()), int(mileage_weights.sum())
+            ])
+            frame = pd.DataFrame({'model': models.to_numpy(), 'weight': weights,
+                                  'price_sum': prices * weights,
+                                  'price_sq': prices * prices * weights,
+                                  'low': lows, 'high': highs,
+                                  'mileage': np.where(has_mileage, mileage, 0) * weights,
+                                  'has_mileage': mileage_weights})
+            grouped = frame.groupby('model').agg(
+                count=('weight', 'sum'), price_sum=('price_sum', 'sum'), price_sq_sum=('price_sq', 'sum'),
+                price_min=('low', 'min'), price_max=('high', 'max'),
+                mileage_sum=('mileage', 'sum'), mileage_count=('has_mileage', 'sum'))
+            for model, row in grouped.iterrows():
+                acc = [int(row['count']), int(row['price_sum']), float(row['price_sq_sum']),
+                       int(row['price_min']), int(row['price_max']),
+                       int(row['mileage_sum']), int(row['mileage_count'])]
+                state['per_model'][model] = _merge_acc(
+                    state['per_model'].get(model, [0, 0, 0.0, None, None, 0, 0]), acc)
+
+            # 年份 / 顏色 / 價格區間 / 每日數量
+            weight_series = pd.Series(weights, index=df.index)
+            years = df['year'].dropna().astype(int)
+            _add_counts(state['per_year'], weight_series[years.index].groupby(years.to_numpy()).sum())
+            colors = df['exterior_color'].dropna().astype(str)
+            _add_counts(state['per_color'], weight_series[colors.index].groupby(colors.to_numpy()).sum())
+            bands = np.bincount(np.searchsorted(BAND_EDGES, prices, side='right'),
+                                weights=weights, minlength=len(BAND_LABELS))
+            state['per_band'] = [a + int(b) for a, b in zip(state['per_band'], bands)]
+            _add_counts(state['daily_counts'],
+                        weight_series.groupby(df['scrape_datetime'].dt.strftime('%Y-%m-%d').to_numpy()).sum())
+
+            first = str(df['scrape_datetime'].min())
+            last = str(df['scrape_datetime'].max())
+            state['first_seen'] = min(filter(None, [state['first_seen'], first]))
+            state['last_seen'] = max(filter(None, [state['last_seen'], last]))
+
+            # 各車型價格分組（分位數與直方圖）
+            price_bins = (prices // PRICE_BIN).astype(np.int64)
+            for (model, price_bin), count in frame.assign(bin=price_bins) \
+                    .groupby(['model', 'bin'])['weight'].sum().items():
+                bins = state['price_bins'].setdefault(model, {})
+                bins[str(price_bin)] = bins.get(str(price_bin), 0) + int(count)
+
+            # 價格與里程密度、線性趨勢（千公里 → 萬元）所需的總和
+            if has_mileage.any():
+                valid_mileage = mileage[has_mileage]
+                valid_prices = prices[has_mileage]
+                valid_weights = weights[has_mileage]
+                keys = pd.Series((valid_mileage // DENSITY_MILEAGE_BIN).astype(np.int64)).astype(str) \
+                    + ',' + pd.Series((valid_prices // DENSITY_PRICE_BIN).astype(np.int64)).astype(str)
+                _add_counts(state['density'], pd.Series(valid_weights).groupby(keys.to_numpy()).sum())
+
+                x = valid_mileage / 1000
+                y = valid_prices / 10000
+                fit = state['fit']
+                state['fit'] = [fit[0] + int(valid_weights.sum()), fit[1] + float((x * valid_weights).sum()),
+                                fit[2] + float((y * valid_weights).sum()),
+                                fit[3] + float((x * x * valid_weights).sum()),
+                                fit[4] + float((x * y * valid_weights).sum())]
+
+            if record_vins and 'vin' in df.columns:
+                self.conn.executemany("INSERT OR IGNORE INTO analysis_vins (vin) VALUES (?)",
+                                      ((vin,) for vin in df['vin'].dropna().astype(str).unique()))
+        return folded
+
+    def _fold_trends(self, chunks: Iterable[pd.DataFrame]) -> int:
+        """將價格趨勢分塊累加到狀態（車型 × 日期：價格總和 / 筆數 / 變動總和 / 變動筆數）"""
+        trend_daily = self.state['trend_daily']
+        folded = 0
+        for df in chunks:
+            if df.empty:
+                continue
+            folded += len(df)
+            df = df.assign(model=df['model'].fillna('UNKNOWN').astype(str),
+                           date=pd.to_datetime(df['date_recorded']).dt.strftime('%Y-%m-%d'))
+            grouped = df.groupby(['model', 'date']).agg(
+                price_sum=('price', 'sum'), price_count=('price', 'count'),
+                change_sum=('change_percentage', 'sum'), change_count=('change_percentage', 'count'))
+            for (model, date), row in grouped.iterrows():
+                days = trend_daily.setdefault(model, {})
+                acc = days.get(date, [0, 0, 0.0, 0])
+                days[date] = [acc[0] + int(row['price_sum']), acc[1] + int(row['price_count']),
+                              acc[2] + float(row['change_sum']), acc[3] + int(row['change_count'])]
+        return folded
+
+    def unique_vins(self) -> int:
+        """已出現過的 VIN 數"""
+        return self.conn.execute("SELECT COUNT(*) FROM analysis_vins").fetchone()[0]
+
+    def verify(self, tolerance: float = 1e-6) -> List[str]:
+        """
+        與完整重新計算比對（不修改已保存的狀態）
+
+        Returns:
+            List[str]: 不一致的項目說明
+        """
+        self.init_schema()
+        self.load()
+        incremental = self.state
+
+        fresh = AnalysisState(self.storage)
+        fresh._compute_all(100000, record_vins=False)
+        expected = fresh.state
+
+        mismatches = []
+        for key in expected:
+            if key in ('watermark', 'updated_at', 'version'):
+                continue
+            _compare(key, incremental.get(key), expected[key], tolerance, mismatches)
+
+        sql, params = self._all_observations_query()
+        distinct = self.conn.execute(
+            f"SELECT COUNT(DISTINCT vin) FROM ({sql}) WHERE price IS NOT NULL", params).fetchone()[0]
+        if distinct != self.unique_vins():
+            mismatches.append(f"unique_vins: 增量={self.unique_vins()} 重新計算={distinct}")
+        return mismatches
+
+
+def _compare(path: str, actual, expected, tolerance: float, mismatches: List[str]):
+    """遞迴比對狀態內容"""
+    if isinstance(expected, dict) or isinstance(actual, dict):
+        actual, expected = actual or {}, expected or {}
+        for key in sorted(set(actual) | set(expected)):
+            _compare(f"{path}.{key}", actual.get(key), expected.get(key), tolerance, mismatches)
+    elif isinstance(expected, list) or isinstance(actual, list):
+        actual, expected = actual or [], expected or []
+        if len(actual) != len(expected):
+            mismatches.append(f"{path}: 增量={actual} 重新計算={expected}")
+            return
+        for i, (a, e) in enumerate(zip(actual, expected)):
+            _compare(f"{path}[{i}]", a, e, tolerance, mismatches)
+    elif isinstance(expected, (int, float)) and isinstance(actual, (int, float)):
+        if abs(actual - expected) > tolerance * max(1.0, abs(expected)):
+            mismatches.append(f"{path}: 增量={actual} 重新計算={expected}")
+    elif actual != expected:
+        mismatches.append(f"{path}: 增量={actual} 重新計算={expected}")
+
+
+def _acc_frame(accumulators: Dict[str, List]) -> pd.DataFrame:
+    """累加器字典轉為 DataFrame 並計算平均"""
+    df = pd.DataFrame.from_dict(accumulators, orient='index', columns=_ACC_FIELDS).sort_index()
+    df['price_mean'] = df['price_sum'] / df['count']
+    df['mileage_mean'] = (df['mileage_sum'] / df['mileage_count']).where(df['mileage_count'] > 0)
+    return df
+
+
+def stats_from_state(state: AnalysisState, hist_bins: int = 30,
+                     heatmap_window_days: Optional[int] = None,
+                     heatmap_max_columns: int = HEATMAP_MAX_COLUMNS) -> MarketStats:
+    """
+    由增量狀態建立市場統計（不載入原始觀測）
+
+    中位數與四分位數由 1 萬元分組估計；散點圖以密度分組呈現
+
+    Args:
+        state: 已更新的分析狀態
+        hist_bins: 價格直方圖分組數
+        heatmap_window_days: 熱力圖只取最近 N 天
+        heatmap_max_columns: 熱力圖最多欄數
+
+    Returns:
+        MarketStats: 統計結果
+    """
+    data = state.state
+    stats = MarketStats()
+    count, price_sum, price_sq_sum, price_min, price_max = data['overall'][:5]
+    if not count:
+        return stats
+
+    # 各車型價格分組
+    model_bins = {}
+    for model, bins in data['price_bins'].items():
+        keys = np.array(sorted(int(b) for b in bins), dtype=np.int64)
+        model_bins[model] = (keys, np.array([bins[str(b)] for b in keys], dtype=np.int64))
+    all_bins = pd.concat([pd.Series(c, index=k) for k, c in model_bins.values()]).groupby(level=0).sum()
+
+    mean = price_sum / count
+    variance = (price_sq_sum - count * mean * mean) / (count - 1) if count > 1 else None
+    stats.overall = {
+        'count': count,
+        'price_mean': mean,
+        'price_median': _bin_quantile(all_bins.index.to_numpy(), all_bins.to_numpy(), 0.5,
+                                      price_min, price_max),
+        'price_min': price_min,
+        'price_max': price_max,
+        'price_std': max(variance, 0.0) ** 0.5 if variance is not None else None,
+        'unique_vins': state.unique_vins(),
+        'first_seen': pd.Timestamp(data['first_seen']) if data['first_seen'] else None,
+        'last_seen': pd.Timestamp(data['last_seen']) if data['last_seen'] else None,
+    }
+
+    # 各車型統計與箱型圖
+    per_model = _acc_frame(data['per_model'])
+    per_model[['price_q1', 'price_median', 'price_q3']] = np.nan
+    box_stats = []
+    for model, row in per_model.iterrows():
+        keys, counts = model_bins[model]
+        q1, median, q3 = (_bin_quantile(keys, counts, q, row['price_min'], row['price_max'])
+                          for q in (0.25, 0.5, 0.75))
+        per_model.loc[model, ['price_q1', 'price_median', 'price_q3']] = [q1, median, q3]
+
+        iqr = q3 - q1
+        low_fence, high_fence = q1 - 1.5 * iqr, q3 + 1.5 * iqr
+        lows = keys * PRICE_BIN
+        inside = (lows + PRICE_BIN > low_fence) & (lows <= high_fence)
+        whislo = row['price_min'] if row['price_min'] >= low_fence else \
+            max(lows[inside].min(), low_fence) if inside.any() else q1
+        whishi = row['price_max'] if row['price_max'] <= high_fence else \
+            min(lows[inside].max() + PRICE_BIN, high_fence) if inside.any() else q3
+        box_stats.append({
+            'label': model,
+            'q1': q1 / 10000, 'med': median / 10000, 'q3': q3 / 10000,
+            'whislo': whislo / 10000, 'whishi': whishi / 10000,
+            # 離群值以分組中心代表，點數不隨資料量增加
+            'fliers': (lows[~inside] + PRICE_BIN / 2) / 10000,
+        })
+    stats.per_model = per_model[['count', 'price_mean', 'price_min', 'price_max',
+                                 'price_q1', 'price_median', 'price_q3', 'mileage_mean']]
+    stats.box_stats = box_stats
+
+    # 年份 / 顏色 / 價格區間 / 每日數量
+    stats.per_year = pd.Series({int(k): v for k, v in data['per_year'].items()}, dtype='int64').sort_index()
+    colors = pd.Series(data['per_color'], dtype='int64').sort_values(ascending=False)
+    stats.per_color = colors[colors > 0].head(TOP_COLORS)
+    stats.per_band = pd.Series(data['per_band'], index=BAND_LABELS, dtype='int64')
+    stats.daily_counts = pd.Series(
+        {pd.Timestamp(k).date(): v for k, v in sorted(data['daily_counts'].items())}, dtype='int64')
+
+    # 直方圖：將 1 萬元分組重新分為 hist_bins 組
+    centers = (all_bins.index.to_numpy() + 0.5) * PRICE_BIN / 10000
+    stats.price_histogram = np.histogram(centers, bins=hist_bins, weights=all_bins.to_numpy(),
+                                         range=(price_min / 10000, price_max / 10000))
+
+    # 價格與里程密度
+    if data['density']:
+        cells = np.array([[int(v) for v in key.split(',')] for key in data['density']])
+        values = np.array(list(data['density'].values()))
+        x0, y0 = cells.min(axis=0)
+        x1, y1 = cells.max(axis=0)
+        grid = np.zeros((x1 - x0 + 1, y1 - y0 + 1))
+        grid[cells[:, 0] - x0, cells[:, 1] - y0] = values
+        x_edges = np.arange(x0, x1 + 2) * DENSITY_MILEAGE_BIN / 1000
+        y_edges = np.arange(y0, y1 + 2) * DENSITY_PRICE_BIN / 10000
+        stats.scatter_density = (grid, x_edges, y_edges)
+
+    # 線性趨勢（最小平方法的閉合解）
+    n, sx, sy, sxx, sxy = data['fit']
+    denominator = n * sxx - sx * sx
+    if n > 10 and denominator:
+        slope = (n * sxy - sx * sy) / denominator
+        stats.trend_coefficients = np.array([slope, (sy - slope * sx) / n])
+
+    _trend_stats_from_state(stats, data['trend_daily'], heatmap_window_days, heatmap_max_columns)
+    return stats
+
+
+def _trend_stats_from_state(stats: MarketStats, trend_daily: Dict,
+                            window_days: Optional[int], max_columns: int):
+    """由車型 × 日期累加器建立趨勢線與熱力圖"""
+    rows = [(model, date, *acc) for model, days in trend_daily.items() for date, acc in days.items()]
+    if not rows:
+        return
+
+    daily = pd.DataFrame(rows, columns=['model', 'date_recorded', 'price_sum', 'price_count',
+                                        'change_sum', 'change_count'])
+    daily['date_recorded'] = pd.to_datetime(daily['date_recorded'])
+    daily['price'] = daily['price_sum'] / daily['price_count'].where(daily['price_count'] > 0)
+
+    # 熱力圖：依相同規則分組後以總和 / 筆數計算平均
+    first, last = daily['date_recorded'].min(), daily['date_recorded'].max()
+    if window_days:
+        first = max(first, last - timedelta(days=window_days - 1))
+    bucket, first = heatmap_bucket(first, last, max_columns)
+    window = daily[daily['date_recorded'] >= first]
+    buckets = window['date_recorded'].dt.to_period(BUCKET_PERIODS[bucket]).dt.start_time.rename('bucket')
+    sums = window.groupby([window['model'], buckets])[['change_sum', 'change_count']].sum()
+    heatmap = (sums['change_sum'] / sums['change_count'].where(sums['change_count'] > 0)) \
+        .rename('change_percentage').dropna().reset_index()
+
+    compute_trend_stats(stats, daily[['model', 'date_recorded', 'price']].dropna(),
+                        heatmap=(heatmap, bucket))
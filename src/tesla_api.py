@@ -0,0 +1,398 @@
+#!/home/cclin/.local/python311/bin/python3
+"""
+Tesla 價格查詢 API
+本機唯讀 HTTP JSON 服務（標準函式庫），查詢皆走索引，回應以 LRU 快取並支援 ETag / If-None-Match
+"""
+
+import json
+import queue
+import hashlib
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+from tesla_sketches import SketchStore, quantile_column
+from tesla_retention import has_rollup_tier, ROLLUP_OBSERVATIONS_SQL
+
+logger = logging.getLogger(__name__)
+
+# 預設位址（只聽本機）
+API_HOST = '127.0.0.1'
+API_PORT = 8765
+
+# 快取的回應數
+CACHE_ENTRIES = 512
+# 唯讀連線池大小
+POOL_SIZE = 4
+# 不快取的端點（內容本身反映服務狀態）
+UNCACHED_ROUTES = {'health'}
+# 清單類查詢的預設 / 最大筆數
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 5000
+
+
+class ApiError(Exception):
+    """查詢錯誤（帶 HTTP 狀態碼）"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class ResponseCache:
+    """以 OrderedDict 實作的 LRU 回應快取（執行緒安全）"""
+
+    def __init__(self, max_entries: int = CACHE_ENTRIES):
+        """
+        初始化快取
+
+        Args:
+            max_entries: 最多保留的回應數
+        """
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, Tuple[bytes, str]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Tuple[bytes, str]]:
+        """取得 (內容, ETag)，並標記為最近使用"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: str, entry: Tuple[bytes, str]):
+        """加入回應，超過上限時移除最久未使用的項目"""
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """清除所有回應"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class PriceQueryService:
+    """查詢實作（與 HTTP 無關）：唯讀連線池、路由與快取失效"""
+
+    def __init__(self, db_path: str = "tesla_prices.db", cache_entries: int = CACHE_ENTRIES,
+                 pool_size: int = POOL_SIZE):
+        """
+        初始化查詢服務（資料表與索引需已由 SQLiteStorage.init_schema 建立）
+
+        Args:
+            db_path: 資料庫路徑
+            cache_entries: LRU 快取的回應數
+            pool_size: 唯讀連線數
+        """
+        self.db_path = db_path
+        self.cache = ResponseCache(cache_entries)
+        self._pool: 'queue.Queue[sqlite3.Connection]' = queue.Queue()
+        for _ in range(pool_size):
+            self._pool.put(self._connect())
+
+        # 其他連線（爬蟲寫入新一輪資料）提交後 data_version 會改變，以此判斷快取失效
+        self._watch = self._connect()
+        self._watch_lock = threading.Lock()
+        self._data_version = self._read_data_version()
+
+        self.routes = {
+            'health': self.health,
+            'vins': self.vin_history,
+            'inventory': self.inventory,
+            'daily': self.daily,
+            'quantiles': self.quantiles,
+            'events': self.events,
+        }
+
+    def _connect(self) -> sqlite3.Connection:
+        """開啟唯讀連線"""
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _read_data_version(self) -> int:
+        with self._watch_lock:
+            return self._watch.execute("PRAGMA data_version").fetchone()[0]
+
+    def check_invalidation(self) -> bool:
+        """資料庫有新的提交時清除快取；回傳是否清除"""
+        version = self._read_data_version()
+        if version == self._data_version:
+            return False
+        self._data_version = version
+        self.cache.clear()
+        logger.info("資料庫已更新，清除 API 回應快取")
+        return True
+
+    def close(self):
+        """關閉所有連線"""
+        while not self._pool.empty():
+            self._pool.get_nowait().close()
+        self._watch.close()
+
+    def handle(self, target: str) -> Tuple[int, bytes, Optional[str]]:
+        """
+        處理一個 GET 請求
+
+        Args:
+            target: 請求路徑（含查詢字串）
+
+        Returns:
+            Tuple: (HTTP 狀態碼, JSON 內容, ETag；錯誤時為 None)
+        """
+        self.check_invalidation()
+
+        url = urlsplit(target)
+        params = dict(parse_qsl(url.query))
+        # 快取鍵使用排序後的參數，參數順序不同的相同查詢共用結果
+        key = url.path + '?' + '&'.join(f"{k}={v}" for k, v in sorted(params.items()))
+        cached = self.cache.get(key)
+        if cached is not None:
+            return 200, cached[0], cached[1]
+
+        parts = [unquote(p) for p in url.path.strip('/').split('/') if p]
+        name = parts[0] if parts else 'health'
+        try:
+            route = self.routes.get(name)
+            if route is None:
+                raise ApiError(404, f"未知的路徑: {url.path}")
+            conn = self._pool.get()
+            try:
+                payload = route(conn, parts[1:], params)
+            finally:
+                self._pool.put(conn)
+        except ApiError as e:
+            return e.status, _encode({'error': str(e)}), None
+        except ValueError as e:
+            return 400, _encode({'error': str(e)}), None
+        except sqlite3.Error as e:
+            logger.error(f"API 查詢失敗 {target}: {e}")
+            return 500, _encode({'error': str(e)}), None
+
+        body = _encode(payload)
+        etag = '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+        if name not in UNCACHED_ROUTES:
+            self.cache.put(key, (body, etag))
+        return 200, body, etag
+
+    # ---- 端點 -------------------------------------------------------------
+
+    def health(self, conn: sqlite3.Connection, parts: List[str], params: Dict) -> Dict:
+        """GET /health：最新觀測時間與快取狀態"""
+        latest = conn.execute("SELECT MAX(scrape_datetime) FROM vehicle_prices").fetchone()[0]
+        return {'status': 'ok', 'latest_observation': latest,
+                'cache': {'entries': len(self.cache), 'hits': self.cache.hits,
+                          'misses': self.cache.misses}}
+
+    def vin_history(self, conn: sqlite3.Connection, parts: List[str], params: Dict) -> Dict:
+        """
+        GET /vins/<vin>/history：單一 VIN 的觀測、每日趨勢與價格變動事件
+
+        保留策略彙整過的日期以每日最後一筆呈現（rolled_up 為 1）。
+        """
+        if len(parts) != 2 or parts[1] != 'history':
+            raise ApiError(404, "路徑格式為 /vins/<vin>/history")
+        vin = parts[0]
+
+        # UNIQUE(vin, scrape_datetime) / UNIQUE(vin, date_recorded) / vehicle_daily 主鍵的索引
+        sources = [('vehicle_prices', 0)]
+        if has_rollup_tier(conn):
+            sources.append((f"({ROLLUP_OBSERVATIONS_SQL})", 1))
+        observations = _rows(conn, ' UNION ALL '.join(f'''
+            SELECT scrape_datetime, model, year, trim, price, mileage, location, {rolled_up} AS rolled_up
+            FROM {source} WHERE vin = ?
+        ''' for source, rolled_up in sources) + " ORDER BY scrape_datetime", (vin,) * len(sources))
+        if not observations:
+            raise ApiError(404, f"找不到車輛: {vin}")
+        trends = _rows(conn, '''
+            SELECT date_recorded, price, price_change, change_percentage
+            FROM price_trends WHERE vin = ? ORDER BY date_recorded
+        ''', (vin,))
+        events = _rows(conn, '''
+            SELECT event_type, old_price, new_price, price_change, change_percentage, seen_at
+            FROM events WHERE vin = ? ORDER BY id
+        ''', (vin,)) if _has_table(conn, 'events') else []
+        return {'vin': vin, 'observations': observations, 'trends': trends, 'events': events}
+
+    def inventory(self, conn: sqlite3.Connection, parts: List[str], params: Dict) -> Dict:
+        """
+        GET /inventory：最新一天在架車輛的各車型摘要
+        GET /inventory/<model>：該車型在架車輛清單
+        """
+        latest = conn.execute("SELECT MAX(scrape_datetime) FROM vehicle_prices").fetchone()[0]
+        if latest is None:
+            return {'date': None, 'models': []}
+        day = str(latest)[:10]
+
+        # 同一天重複出現的車輛只取最後一筆（scrape_datetime 索引限縮範圍）
+        latest_rows = '''
+            SELECT * FROM vehicle_prices
+            WHERE id IN (SELECT MAX(id) FROM vehicle_prices
+                         WHERE scrape_datetime >= ? {model_filter} GROUP BY vin)
+        '''
+        if parts:
+            model = parts[0]
+            vehicles = _rows(conn, f'''
+                SELECT vin, year, trim, price, mileage, location, exterior_color, scrape_datetime
+                FROM ({latest_rows.format(model_filter='AND model = ?')})
+                ORDER BY price
+            ''', (day, model))
+            return {'date': day, 'model': model, 'count': len(vehicles), 'vehicles': vehicles}
+
+        models = _rows(conn, f'''
+            SELECT COALESCE(model, 'UNKNOWN') AS model, COUNT(*) AS count,
+                   MIN(price) AS price_min, MAX(price) AS price_max,
+                   ROUND(AVG(price)) AS price_mean, ROUND(AVG(mileage)) AS mileage_mean
+            FROM ({latest_rows.format(model_filter='')})
+            GROUP BY 1 ORDER BY 1
+        ''', (day,))
+        return {'date': day, 'models': models}
+
+    def daily(self, conn: sqlite3.Connection, parts: List[str], params: Dict) -> Dict:
+        """GET /daily?start=&end=&model=：每日彙總（agg_daily_model_band 主鍵的日期範圍掃描）"""
+        conditions, values = [], []
+        if params.get('start'):
+            conditions.append("date >= ?")
+            values.append(params['start'])
+        if params.get('end'):
+            conditions.append("date <= ?")
+            values.append(params['end'])
+        if params.get('model'):
+            conditions.append("model = ?")
+            values.append(params['model'])
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        group = 'date, model' if params.get('by_model', '1') != '0' else 'date'
+        rows = _rows(conn, f'''
+            SELECT {group}, SUM(observations) AS observations,
+                   ROUND(1.0 * SUM(price_sum) / SUM(observations)) AS price_mean,
+                   MIN(price_min) AS price_min, MAX(price_max) AS price_max,
+                   ROUND(1.0 * SUM(mileage_sum) / NULLIF(SUM(mileage_count), 0)) AS mileage_mean
+            FROM agg_daily_model_band {where}
+            GROUP BY {group} ORDER BY {group}
+        ''', tuple(values))
+        return {'days': rows}
+
+    def quantiles(self, conn: sqlite3.Connection, parts: List[str], params: Dict) -> Dict:
+        """GET /quantiles?start=&end=&model=&q=0.1,0.5,0.9：由分位數草圖合併的價格分位數"""
+        qs = tuple(float(q) for q in params.get('q', '0.1,0.5,0.9').split(','))
+        if not all(0 <= q <= 1 for q in qs):
+            raise ValueError("分位點需介於 0 與 1 之間")
+        models = [params['model']] if params.get('model') else None
+        sketch = SketchStore(conn).merged(params.get('start'), params.get('end'), models)
+        return {'observations': sketch.n,
+                'quantiles': {quantile_column(q): value
+                              for q, value in zip(qs, sketch.quantiles(qs))}}
+
+    def events(self, conn: sqlite3.Connection, parts: List[str], params: Dict) -> Dict:
+        """GET /events?since=&type=&limit=：最近的價格變動事件（新到舊）"""
+        if not _has_table(conn, 'events'):
+            return {'events': []}
+        # LIMIT 為負數時 SQLite 視為不限筆數
+        limit = max(1, min(int(params.get('limit', DEFAULT_LIMIT)), MAX_LIMIT))
+        conditions, values = [], []
+        if params.get('since'):
+            conditions.append("seen_at >= ?")
+            values.append(params['since'])
+        if params.get('type'):
+            conditions.append("event_type = ?")
+            values.append(params['type'])
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        return {'events': _rows(conn, f'''
+            SELECT vin, model, event_type, old_price, new_price, price_change,
+                   change_percentage, previous_seen, seen_at
+            FROM events {where} ORDER BY id DESC LIMIT ?
+        ''', tuple(values) + (limit,))}
+
+
+def _rows(conn: sqlite3.Connection, sql: str, params: Tuple = ()) -> List[Dict]:
+    """查詢結果轉為 dict 列表"""
+    return [dict(row) for row in conn.execute(sql, params)]
+
+
+def _has_table(conn: sqlite3.Connection, table: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?",
+                        (table,)).fetchone() is not None
+
+
+def _encode(payload: Dict) -> bytes:
+    """精簡 JSON"""
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """HTTP 處理（只支援 GET / HEAD）"""
+
+    server_version = 'TeslaPriceAPI/1.0'
+    protocol_version = 'HTTP/1.1'
+    # 標頭與內容分兩次寫出，關閉 Nagle 避免 keep-alive 連線每個請求多等一個延遲 ACK
+    disable_nagle_algorithm = True
+
+    def _respond(self, send_body: bool):
+        status, body, etag = self.server.service.handle(self.path)
+
+        # If-None-Match 命中時只回 304，不傳內容
+        if etag is not None:
+            tags = {tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')}
+            if etag in tags or '*' in tags:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        self._respond(True)
+
+    def do_HEAD(self):
+        self._respond(False)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+class PriceApiServer(ThreadingHTTPServer):
+    """價格查詢 HTTP 伺服器"""
+
+    daemon_threads = True
+
+    def __init__(self, service: PriceQueryService, host: str = API_HOST, port: int = API_PORT):
+        """
+        初始化伺服器
+
+        Args:
+            service: 查詢服務
+            host: 監聽位址
+            port: 監聽埠（0 表示自動選擇）
+        """
+        super().__init__((host, port), _Handler)
+        self.service = service
+
+    def server_close(self):
+        super().server_close()
+        self.service.close()
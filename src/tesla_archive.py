@@ -0,0 +1,262 @@
+#!/home/cclin/.local/python311/bin/python3
+"""
+Tesla 價格歷史 Parquet 封存
+依日期與車型分區匯出 vehicle_prices / price_trends，支援增量匯出與分區裁剪讀取
+"""
+
+import os
+import json
+import shutil
+import sqlite3
+import logging
+from typing import List, Optional
+
+import pandas as pd
+
+# 嘗試導入 pyarrow
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    print("建議安裝 pyarrow: pip install pyarrow")
+    HAS_PYARROW = False
+
+logger = logging.getLogger(__name__)
+
+# 各表格的分區日期來源欄位
+ARCHIVE_TABLES = {
+    'vehicle_prices': 'scrape_datetime',
+    'price_trends': 'date_recorded',
+}
+
+# 不匯出的欄位（原始文字已另存於 raw_texts）
+EXCLUDED_COLUMNS = {'raw_data'}
+
+WATERMARK_FILE = '_watermark.json'
+
+# 水位中記錄已匯出但之後被就地修改、需要重新匯出的日期分區
+STALE_KEY = 'stale_dates'
+
+
+def _partitioning():
+    """分區結構：date=YYYY-MM-DD/model=XXX（皆為字串）"""
+    return ds.partitioning(
+        pa.schema([('date', pa.string()), ('model', pa.string())]),
+        flavor='hive'
+    )
+
+
+class ParquetArchiveExporter:
+    """將 SQLite 價格歷史增量匯出為分區 Parquet"""
+
+    def __init__(self, db_path: str = "tesla_prices.db", archive_dir: str = "tesla_archive"):
+        """
+        初始化匯出工具
+
+        Args:
+            db_path: 資料庫路徑
+            archive_dir: 封存目錄
+        """
+        if not HAS_PYARROW:
+            raise ImportError("匯出 Parquet 需要 pyarrow: pip install pyarrow")
+
+        self.db_path = db_path
+        self.archive_dir = archive_dir
+
+    def load_watermark(self) -> dict:
+        """讀取各表格上次匯出的最大 id"""
+        return _load_watermark(self.archive_dir)
+
+    def save_watermark(self, watermark: dict):
+        """寫入匯出水位（先寫暫存檔再取代，避免中斷時損毀）"""
+        _save_watermark(self.archive_dir, watermark)
+
+    def export(self, chunksize: int = 100000) -> dict:
+        """
+        增量匯出所有表格
+
+        Args:
+            chunksize: 每批從 SQLite 讀取的筆數
+
+        Returns:
+            dict: 各表格本次匯出的筆數
+        """
+        watermark = self.load_watermark()
+        exported = {}
+
+        conn = sqlite3.connect(self.db_path)
+        try:
+            for table, date_column in ARCHIVE_TABLES.items():
+                exists = conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)
+                ).fetchone()
+                if not exists:
+                    continue
+
+                columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")
+                           if row[1] not in EXCLUDED_COLUMNS]
+                last_id = watermark.get(table, 0)
+                count = 0
+
+                stale = watermark.get(STALE_KEY, {}).get(table)
+                if stale:
+                    rewritten = self._reexport_dates(conn, table, columns, date_column, stale, last_id, chunksize)
+                    del watermark[STALE_KEY][table]
+                    self.save_watermark(watermark)
+                    logger.info(f"{table}: 重新匯出 {len(stale)} 個日期分區（{rewritten} 筆）")
+
+                query = f"""
+                    SELECT {', '.join(columns)} FROM {table}
+                    WHERE id > ?
+                    ORDER BY id
+                """
+                for chunk in pd.read_sql_query(query, conn, params=(last_id,), chunksize=chunksize):
+                    if chunk.empty:
+                        continue
+                    self._write_chunk(table, chunk, date_column)
+
+                    count += len(chunk)
+                    last_id = int(chunk['id'].max())
+                    # 每批寫入後推進水位，中斷後可從此處續傳
+                    watermark[table] = last_id
+                    self.save_watermark(watermark)
+
+                exported[table] = count
+                logger.info(f"{table}: 匯出 {count} 筆 (水位 id={last_id})")
+        finally:
+            conn.close()
+
+        return exported
+
+    def _reexport_dates(self, conn: sqlite3.Connection, table: str, columns: List[str],
+                        date_column: str, dates: List[str], last_id: int, chunksize: int) -> int:
+        """
+        刪除指定日期的分區，並重新匯出其中水位以內的資料列（水位之後的由增量匯出處理）
+
+        Returns:
+            int: 重新匯出的筆數
+        """
+        for day in dates:
+            shutil.rmtree(os.path.join(self.archive_dir, table, f"date={day}"), ignore_errors=True)
+
+        query = f"""
+            SELECT {', '.join(columns)} FROM {table}
+            WHERE id <= ? AND date({date_column}) IN ({', '.join('?' * len(dates))})
+            ORDER BY id
+        """
+        count = 0
+        for chunk in pd.read_sql_query(query, conn, params=(last_id, *dates), chunksize=chunksize):
+            if not chunk.empty:
+                self._write_chunk(table, chunk, date_column)
+                count += len(chunk)
+        return count
+
+    def _write_chunk(self, table: str, chunk: pd.DataFrame, date_column: str):
+        """將一批資料寫入對應的日期/車型分區"""
+        chunk = chunk.copy()
+        chunk['date'] = chunk[date_column].astype(str).str[:10]
+        chunk['model'] = chunk['model'].fillna('UNKNOWN')
+
+        first_id = int(chunk['id'].min())
+        last_id = int(chunk['id'].max())
+
+        pq.write_to_dataset(
+            pa.Table.from_pandas(chunk, preserve_index=False),
+            root_path=os.path.join(self.archive_dir, table),
+            partitioning=_partitioning(),
+            basename_template=f"part-{first_id}-{last_id}-{{i}}.parquet",
+            existing_data_behavior='overwrite_or_ignore'
+        )
+
+
+def _load_watermark(archive_dir: str) -> dict:
+    """讀取封存目錄的匯出水位（沒有時為空）"""
+    path = os.path.join(archive_dir, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _save_watermark(archive_dir: str, watermark: dict):
+    """寫入匯出水位（先寫暫存檔再取代）"""
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, WATERMARK_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(watermark, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def mark_stale(archive_dir: str, table: str, dates: List[str]) -> bool:
+    """
+    標記已匯出的日期分區需要重新匯出（資料列被就地修改後使用，例如重新解析；不需要 pyarrow）
+
+    下次 export() 會先刪除並重寫這些分區。
+
+    Args:
+        archive_dir: 封存目錄
+        table: 表格名稱
+        dates: 日期（YYYY-MM-DD）
+
+    Returns:
+        bool: 是否有已匯出的封存需要標記
+    """
+    watermark = _load_watermark(archive_dir)
+    if not dates or not watermark.get(table):
+        return False
+    stale = watermark.setdefault(STALE_KEY, {})
+    stale[table] = sorted(set(stale.get(table, [])) | set(dates))
+    _save_watermark(archive_dir, watermark)
+    return True
+
+
+def load_archive(archive_dir: str, table: str,
+                 columns: Optional[List[str]] = None,
+                 start_date: Optional[str] = None,
+                 end_date: Optional[str] = None,
+                 models: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    從 Parquet 封存讀取資料（欄位裁剪 + 分區裁剪）
+
+    Args:
+        archive_dir: 封存目錄
+        table: 表格名稱（vehicle_prices 或 price_trends）
+        columns: 需要的欄位，None 表示全部
+        start_date: 起始日期（含），格式 YYYY-MM-DD
+        end_date: 結束日期（含），格式 YYYY-MM-DD
+        models: 只讀取指定車型
+
+    Returns:
+        pd.DataFrame: 讀取結果
+    """
+    if not HAS_PYARROW:
+        raise ImportError("讀取 Parquet 封存需要 pyarrow: pip install pyarrow")
+
+    path = os.path.join(archive_dir, table)
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=columns or [])
+
+    dataset = ds.dataset(path, format='parquet', partitioning=_partitioning())
+
+    # 分區欄位上的條件只會開啟符合的目錄
+    expression = None
+    conditions = []
+    if start_date:
+        conditions.append(ds.field('date') >= str(start_date)[:10])
+    if end_date:
+        conditions.append(ds.field('date') <= str(end_date)[:10])
+    if models:
+        conditions.append(ds.field('model').isin(list(models)))
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+
+    if columns is not None:
+        columns = [c for c in columns if c in dataset.schema.names]
+
+    df = dataset.to_table(columns=columns, filter=expression).to_pandas()
+    if columns is None and 'date' in df.columns:
+        df = df.drop(columns=['date'])
+    return df
@@ -0,0 +1,115 @@
+#!/home/cclin/.local/python311/bin/python3
+"""
+Tesla 車輛卡片文字解析
+由卡片文字取出價格、VIN、年份、里程、地點、顏色與車款，不依賴瀏覽器，
+爬蟲即時解析與重新解析歷史原始文字（tesla_reparse）共用同一份規則
+"""
+
+import re
+from typing import Dict, Optional
+
+# 解析規則版本；修正解析錯誤時遞增，重新解析會從頭處理所有原始文字
+PARSER_VERSION = 1
+
+# 價格（必要欄位；10 萬到 1000 萬之間才視為價格）
+PRICE_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in (
+    r'NT\$\s*([\d,]+)',
+    r'TWD\s*([\d,]+)',
+    r'NTD\s*([\d,]+)',
+    r'\$\s*([\d,]+)',
+    r'([\d,]+)\s*元',
+    r'售價[：:]\s*([\d,]+)',
+    r'Price[：:]\s*([\d,]+)',
+)]
+
+VIN_PATTERN = re.compile(r'5YJ[A-Z0-9]{14}')
+
+YEAR_PATTERNS = [re.compile(pattern) for pattern in (
+    r'(20[12][0-9])\s*年',
+    r'Year[：:]\s*(20[12][0-9])',
+    r'(20[12][0-9])\s+Model',
+    r'(20[12][0-9])',
+)]
+
+# 里程（0 到 50 萬公里）
+MILEAGE_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in (
+    r'([\d,]+)\s*(?:km|公里|KM)',
+    r'里程[：:]\s*([\d,]+)',
+    r'Mileage[：:]\s*([\d,]+)',
+    r'ODO[：:]\s*([\d,]+)',
+)]
+
+LOCATIONS = [
+    '台北', '新北', '桃園', '台中', '台南', '高雄',
+    '基隆', '新竹', '苗栗', '彰化', '南投', '雲林',
+    '嘉義', '屏東', '宜蘭', '花蓮', '台東', '澎湖',
+    '金門', '連江', 'Taipei', 'Taichung', 'Kaohsiung'
+]
+
+COLORS = {
+    'Pearl White': '珍珠白',
+    'Solid Black': '純黑',
+    'Midnight Silver': '午夜銀',
+    'Deep Blue': '深藍',
+    'Red': '紅色',
+    '珍珠白': '珍珠白',
+    '純黑': '純黑',
+    '午夜銀': '午夜銀',
+    '深藍': '深藍',
+    '紅色': '紅色'
+}
+
+# extract_fields 回傳的欄位
+EXTRACTED_FIELDS = ('vin', 'price', 'year', 'mileage', 'location', 'exterior_color', 'trim')
+
+
+def _first_number(patterns, text: str, low: int, high: int) -> Optional[int]:
+    """依序嘗試各規則（每個規則只看第一個符合處），回傳第一個落在範圍內的數字"""
+    for pattern in patterns:
+        match = pattern.search(text)
+        digits = match.group(1).replace(',', '') if match else ''
+        if digits and low <= int(digits) <= high:
+            return int(digits)
+    return None
+
+
+def extract_fields(text: Optional[str]) -> Optional[Dict]:
+    """
+    由卡片文字取出車輛欄位
+
+    Args:
+        text: 卡片文字
+
+    Returns:
+        Optional[Dict]: EXTRACTED_FIELDS 各欄位（找不到為 None）；沒有合理價格時不是車輛卡片，回傳 None
+    """
+    if not text or len(text) < 10:
+        return None
+
+    price = _first_number(PRICE_PATTERNS, text, 100000, 10000000)
+    if price is None:
+        return None
+
+    vin_match = VIN_PATTERN.search(text)
+
+    location = next((location for location in LOCATIONS if location in text), None)
+    colour = next((chi for eng, chi in COLORS.items() if eng in text or chi in text), None)
+
+    if 'Long Range' in text or '長續航' in text:
+        trim = 'Long Range'
+    elif 'Performance' in text or '高性能' in text:
+        trim = 'Performance'
+    elif 'Standard' in text or '標準' in text:
+        trim = 'Standard Range'
+    else:
+        trim = None
+
+    return {
+        'vin': vin_match.group() if vin_match else None,
+        'price': price,
+        'year': _first_number(YEAR_PATTERNS, text, 2010, 2025),
+        'mileage': _first_number(MILEAGE_PATTERNS, text, 0, 500000),
+        'location': location,
+        'exterior_color': colour,
+        'trim': trim,
+    }
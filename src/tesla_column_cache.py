@@ -0,0 +1,368 @@
+#!/home/cclin/.local/python311/bin/python3
+"""
+Tesla 觀測欄式快取
+將分析用欄位存為記憶體映射的 .npy 檔（價格 / 里程 / 年份、epoch 秒、字典編碼的 VIN / 車型 / 車款 / 地點 / 顏色），
+每輪爬取後附加新資料列，分析程式以 mmap 零複製開啟，多個程序共用同一份分頁快取
+"""
+
+import os
+import json
+import sqlite3
+import logging
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from tesla_retention import has_rollup_tier, ROLLUP_OBSERVATIONS_SQL
+
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    HAS_FCNTL = False
+
+logger = logging.getLogger(__name__)
+
+# 快取格式版本；欄位或編碼變更時遞增，使快取重建
+CACHE_VERSION = 1
+
+# 字典編碼的欄位（-1 表示缺值）
+CODED_COLUMNS = ['vin', 'model', 'trim', 'location', 'exterior_color']
+
+# 數值欄位與存放型態（型態最小值表示缺值）
+NUMERIC_DTYPES = {'price': np.int32, 'mileage': np.int32, 'year': np.int16}
+
+# 時間欄位以 epoch 秒存放（int64 最小值即 NaT）
+TIME_COLUMN = 'scrape_datetime'
+
+CACHED_COLUMNS = CODED_COLUMNS + list(NUMERIC_DTYPES) + [TIME_COLUMN]
+
+# 重建時每次讀取筆數
+CHUNK_ROWS = 200000
+
+# 附加的資料列在此數量以上時記錄日誌
+LOG_APPEND_ROWS = 1000
+
+
+def cache_dir_for(db_path: str) -> Optional[str]:
+    """資料庫對應的快取目錄（記憶體資料庫不快取）"""
+    if not db_path or db_path == ':memory:':
+        return None
+    return os.path.splitext(db_path)[0] + '_columns'
+
+
+def _npy_append(path: str, values: np.ndarray):
+    """
+    將資料附加到 .npy 檔並就地更新標頭中的長度
+
+    numpy 寫入標頭時已為長度預留位數，標頭長度不變；若仍改變則拋出例外由呼叫端重建
+    """
+    if not os.path.exists(path):
+        np.save(path, values)
+        return
+
+    with open(path, 'r+b') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+
+        f.seek(offset + shape[0] * dtype.itemsize)
+        f.truncate()
+        f.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+
+        header = {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': fortran_order,
+                  'shape': (shape[0] + len(values),)}
+        f.seek(0)
+        if version == (1, 0):
+            np.lib.format.write_array_header_1_0(f, header)
+        else:
+            np.lib.format.write_array_header_2_0(f, header)
+        if f.tell() != offset:
+            raise ValueError(f"{path} 標頭長度改變")
+
+
+class ColumnCache:
+    """vehicle_prices（含保留策略彙整層）的欄式快取"""
+
+    def __init__(self, conn: sqlite3.Connection, cache_dir: Optional[str]):
+        """
+        初始化快取
+
+        Args:
+            conn: 資料庫連線
+            cache_dir: 快取目錄（None 表示停用）
+        """
+        self.conn = conn
+        self.cache_dir = cache_dir
+        self.manifest: Optional[Dict] = None
+        self.dictionaries: Dict[str, List[str]] = {}
+        self._columns: Dict = {}
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.cache_dir, name)
+
+    def _source_state(self) -> Dict:
+        """資料來源目前的狀態（判斷可否附加或需重建；table_version 反映就地修改）"""
+        count, min_id, max_id = self.conn.execute(
+            "SELECT COUNT(*), MIN(id), MAX(id) FROM vehicle_prices").fetchone()
+        rollup = None
+        if has_rollup_tier(self.conn):
+            rollup = list(self.conn.execute(
+                "SELECT COUNT(*), MAX(last_seen) FROM vehicle_daily").fetchone())
+        version = 0
+        if self.conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'table_versions'").fetchone():
+            row = self.conn.execute(
+                "SELECT version FROM table_versions WHERE name = 'vehicle_prices'").fetchone()
+            version = row[0] if row else 0
+        return {'raw_rows': count, 'min_id': min_id, 'max_id': max_id or 0, 'rollup': rollup,
+                'table_version': version}
+
+    def _load_manifest(self) -> Optional[Dict]:
+        """讀取快取描述（版本不符或檔案不完整時視為沒有快取）"""
+        try:
+            with open(self._path('manifest.json'), encoding='utf-8') as f:
+                manifest = json.load(f)
+            with open(self._path('dictionaries.json'), encoding='utf-8') as f:
+                dictionaries = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest.get('version') != CACHE_VERSION:
+            return None
+        for column in CACHED_COLUMNS:
+            path = self._path(f"{column}.npy")
+            if not os.path.exists(path) or len(np.load(path, mmap_mode='r')) < manifest['rows']:
+                return None
+        self.dictionaries = dictionaries
+        return manifest
+
+    def _save_manifest(self, manifest: Dict):
+        """寫入字典與快取描述（先寫暫存檔再取代，描述最後寫入）"""
+        for name, payload in (('dictionaries.json', self.dictionaries), ('manifest.json', manifest)):
+            temp_path = self._path(name + '.tmp')
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(payload, f, ensure_ascii=False)
+            os.replace(temp_path, self._path(name))
+        self.manifest = manifest
+        self._columns = {}
+
+    def _encode(self, df: pd.DataFrame) -> Dict[str, np.ndarray]:
+        """將一塊資料轉為快取欄位（字典編碼沿用並擴充既有字典）"""
+        arrays = {}
+        for column in CODED_COLUMNS:
+            values = self.dictionaries.setdefault(column, [])
+            lookup = {value: code for code, value in enumerate(values)}
+            codes, uniques = pd.factorize(df[column].astype(object))
+            mapping = np.empty(len(uniques), dtype=np.int32)
+            for i, value in enumerate(uniques):
+                value = str(value)
+                if value not in lookup:
+                    lookup[value] = len(values)
+                    values.append(value)
+                mapping[i] = lookup[value]
+            arrays[column] = np.where(codes < 0, -1, mapping[codes] if len(mapping) else -1).astype(np.int32)
+
+        for column, dtype in NUMERIC_DTYPES.items():
+            values = pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+            arrays[column] = np.where(np.isnan(values), np.iinfo(dtype).min, values).astype(dtype)
+
+        epoch = pd.to_numeric(df[TIME_COLUMN], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+        arrays[TIME_COLUMN] = np.where(np.isnan(epoch), np.iinfo(np.int64).min, epoch).astype(np.int64)
+        return arrays
+
+    def _query(self, source: str, where: str = '') -> str:
+        """讀取快取欄位的查詢（時間於 SQL 端轉為 epoch 秒）"""
+        columns = [f"CAST(strftime('%s', {TIME_COLUMN}) AS INTEGER) AS {TIME_COLUMN}"
+                   if column == TIME_COLUMN else column for column in CACHED_COLUMNS]
+        return f"SELECT {', '.join(columns)} FROM {source}{where}"
+
+    def _append_chunks(self, chunks) -> int:
+        """將查詢結果分塊附加到各欄位檔"""
+        appended = 0
+        for df in chunks:
+            if df.empty:
+                continue
+            for column, values in self._encode(df).items():
+                _npy_append(self._path(f"{column}.npy"), values)
+            appended += len(df)
+        return appended
+
+    def rebuild(self) -> int:
+        """
+        由所有觀測來源重建快取（彙整層在前，原始資料依 id 排序）
+
+        Returns:
+            int: 快取筆數
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.invalidate()
+        for column in CACHED_COLUMNS:
+            path = self._path(f"{column}.npy")
+            if os.path.exists(path):
+                os.remove(path)
+        self.dictionaries = {}
+        state = self._source_state()
+
+        rows = 0
+        if has_rollup_tier(self.conn):
+            rows += self._append_chunks(pd.read_sql_query(
+                self._query(f"({ROLLUP_OBSERVATIONS_SQL})"), self.conn, chunksize=CHUNK_ROWS))
+        rows += self._append_chunks(pd.read_sql_query(
+            self._query('vehicle_prices', ' WHERE id <= ? ORDER BY id'), self.conn,
+            params=(state['max_id'],), chunksize=CHUNK_ROWS))
+        for column in CACHED_COLUMNS:
+            path = self._path(f"{column}.npy")
+            if not os.path.exists(path):
+                np.save(path, np.empty(0, dtype=np.int32 if column in CODED_COLUMNS
+                                       else NUMERIC_DTYPES.get(column, np.int64)))
+
+        self._save_manifest({'version': CACHE_VERSION, 'rows': rows, **state})
+        logger.info(f"欄式快取已重建（{rows} 筆）")
+        return rows
+
+    def _sync_locked(self) -> int:
+        manifest = self._load_manifest()
+        state = self._source_state()
+        if manifest is None or manifest['rollup'] != state['rollup'] \
+                or manifest.get('table_version') != state['table_version'] \
+                or (manifest['raw_rows'] and manifest['min_id'] != state['min_id']):
+            return self.rebuild()
+
+        # 只附加上次之後新增的原始資料列；資料列數不符（有刪除）時重建
+        new_rows = self.conn.execute("SELECT COUNT(*) FROM vehicle_prices WHERE id > ? AND id <= ?",
+                                     (manifest['max_id'], state['max_id'])).fetchone()[0]
+        if manifest['raw_rows'] + new_rows != state['raw_rows']:
+            return self.rebuild()
+        if not new_rows:
+            self.manifest = manifest
+            return 0
+
+        # 截掉上次未完成的附加（描述檔最後寫入，以其筆數為準）
+        for column in CACHED_COLUMNS:
+            path = self._path(f"{column}.npy")
+            if len(np.load(path, mmap_mode='r')) != manifest['rows']:
+                return self.rebuild()
+        try:
+            appended = self._append_chunks(pd.read_sql_query(
+                self._query('vehicle_prices', ' WHERE id > ? AND id <= ? ORDER BY id'), self.conn,
+                params=(manifest['max_id'], state['max_id']), chunksize=CHUNK_ROWS))
+        except ValueError as e:
+            logger.warning(f"欄式快取無法附加，將重建: {e}")
+            return self.rebuild()
+
+        self._save_manifest({**manifest, **state, 'rows': manifest['rows'] + appended})
+        if appended >= LOG_APPEND_ROWS:
+            logger.info(f"欄式快取已附加 {appended} 筆")
+        return appended
+
+    def sync(self) -> int:
+        """
+        使快取與資料庫一致：只有新增資料時附加，有刪除、就地修改或保留策略彙整時重建
+
+        Returns:
+            int: 附加（或重建）的筆數
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(self._path('.lock'), 'w') as lock:
+            if HAS_FCNTL:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            return self._sync_locked()
+
+    def invalidate(self):
+        """捨棄快取（既有資料列被修改時使用），下次 sync 時重建"""
+        self.manifest = None
+        self._columns = {}
+        if self.cache_dir and os.path.exists(self._path('manifest.json')):
+            os.remove(self._path('manifest.json'))
+
+    def column(self, name: str) -> np.ndarray:
+        """以 mmap 開啟的欄位（唯讀、零複製）"""
+        if name not in self._columns:
+            self._columns[name] = np.load(self._path(f"{name}.npy"), mmap_mode='r')[:self.manifest['rows']]
+        return self._columns[name]
+
+    def _sorted_dictionary(self, name: str) -> tuple:
+        """排序後的字典與原編碼 → 排序後編碼的對照"""
+        key = ('sorted', name)
+        if key not in self._columns:
+            values = self.dictionaries.get(name, [])
+            order = np.argsort(np.array(values, dtype=object), kind='stable') if values else np.empty(0, int)
+            rank = np.empty(len(values), dtype=np.int32)
+            rank[order] = np.arange(len(values), dtype=np.int32)
+            self._columns[key] = ([values[i] for i in order], rank)
+        return self._columns[key]
+
+    def _series(self, name: str, rows=slice(None)) -> pd.Series:
+        """將欄位轉為與 compact_frame 相同型態的 Series（沒有缺值時直接包裝 mmap 陣列）"""
+        values = self.column(name)[rows]
+        if name in CODED_COLUMNS:
+            # 類別依字典順序排列，與由資料庫讀取時相同（分組與圖表順序一致）
+            categories, rank = self._sorted_dictionary(name)
+            codes = np.where(values < 0, -1, rank[np.maximum(values, 0)]) if len(rank) else values
+            series = pd.Series(pd.Categorical.from_codes(codes, categories=categories), name=name)
+            return series if name == 'vin' else series.cat.remove_unused_categories()
+        if name == TIME_COLUMN:
+            return pd.Series(values.view('datetime64[s]'), name=name)
+
+        dtype = NUMERIC_DTYPES[name]
+        missing = values == np.iinfo(dtype).min
+        if missing.any():
+            return pd.Series(pd.arrays.IntegerArray(np.where(missing, 0, values).astype(dtype), missing),
+                             name=name)
+        return pd.Series(values, name=name, copy=False)
+
+    def covers(self, columns: Optional[List[str]]) -> bool:
+        """快取是否包含所有需要的欄位"""
+        return all(column in CACHED_COLUMNS for column in (columns or CACHED_COLUMNS))
+
+    def frame(self, columns: Optional[List[str]] = None, start_date: Optional[str] = None,
+              end_date: Optional[str] = None, models: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        由快取建立觀測資料（條件與排序同 read_observations：含時間欄位時新到舊）
+
+        Args:
+            columns: 需要的欄位，None 使用所有快取欄位
+            start_date: 起始日期（含）
+            end_date: 結束日期（含）
+            models: 只取指定車型
+
+        Returns:
+            pd.DataFrame: 觀測資料
+        """
+        columns = columns or CACHED_COLUMNS
+        rows = np.ones(self.manifest['rows'], dtype=bool)
+        epoch = self.column(TIME_COLUMN)
+        if start_date:
+            rows &= epoch >= pd.Timestamp(start_date).normalize().value // 10 ** 9
+        if end_date:
+            rows &= epoch < (pd.Timestamp(end_date).normalize() + pd.Timedelta(days=1)).value // 10 ** 9
+        if models:
+            categories = self.dictionaries.get('model', [])
+            codes = [categories.index(model) for model in models if model in categories]
+            rows &= np.isin(self.column('model'), codes)
+
+        if TIME_COLUMN in columns:
+            selected = np.flatnonzero(rows)
+            order = selected[np.argsort(epoch[selected], kind='stable')[::-1]]
+        elif rows.all():
+            order = slice(None)
+        else:
+            order = np.flatnonzero(rows)
+        return pd.DataFrame({column: self._series(column, order) for column in columns})
+
+    def iter_frames(self, columns: Optional[List[str]] = None,
+                    chunksize: int = 100000) -> Iterator[pd.DataFrame]:
+        """
+        依快取順序分塊產生觀測資料（每塊皆為 mmap 的切片，不排序）
+
+        Args:
+            columns: 需要的欄位，None 使用所有快取欄位
+            chunksize: 每塊筆數
+        """
+        columns = columns or CACHED_COLUMNS
+        for start in range(0, self.manifest['rows'], chunksize):
+            rows = slice(start, start + chunksize)
+            yield pd.DataFrame({column: self._series(column, rows) for column in columns})
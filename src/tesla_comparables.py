@@ -0,0 +1,347 @@
+#!/home/cclin/.local/python311/bin/python3
+"""
+Tesla 相似車輛搜尋
+每個車型 / 車款分組以年份與里程建立 KD 樹（numpy 實作），找出最相近的在架與歷史車輛並估計合理價格
+樹依分組指紋增量重建並快取於 .npz 檔
+"""
+
+import os
+import json
+import heapq
+import sqlite3
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from tesla_retention import has_rollup_tier
+
+logger = logging.getLogger(__name__)
+
+# 快取檔與格式版本；特徵或樹結構變更時遞增，使快取失效
+COMPARABLES_CACHE = 'tesla_comparables.npz'
+COMPARABLES_VERSION = 1
+
+# 特徵正規化：每年行駛約 15,000 公里，使 1 年車齡與 15,000 公里距離相同
+KM_PER_YEAR = 15000
+
+# 葉節點最多的點數
+LEAF_SIZE = 16
+
+# 顏色不同時加上的距離（約半年車齡），指定顏色時先多取候選再重新排序
+COLOUR_PENALTY = 0.5
+COLOUR_CANDIDATES = 3
+
+# 合理價格以 1 / (距離 + 此值) 加權，避免完全相同的車輛權重無限大
+DISTANCE_EPSILON = 0.25
+
+# 車款不足 k 輛時改用的車型層級分組
+ALL_TRIMS = '*'
+
+# 每個分組保存的欄位
+PARTITION_FIELDS = ['vin', 'status', 'price', 'year', 'mileage', 'colour', 'last_seen', 'sold_at']
+
+
+def features(year, mileage) -> np.ndarray:
+    """正規化特徵：[年份, 里程 / 每年里程]"""
+    return np.column_stack([np.asarray(year, dtype=np.float64),
+                            np.asarray(mileage, dtype=np.float64) / KM_PER_YEAR])
+
+
+def build_tree(points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    建立隱式 KD 樹：每個區段 [lo, hi) 在中點 mid 依 depth % 2 軸切分
+
+    樹結構由排列順序決定，切分值存於 splits[mid]（各節點的中點互不相同），快取時只需保存排序後的資料與 splits
+
+    Args:
+        points: 特徵 (N, 2)
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (排列索引, 切分值)
+    """
+    order = np.arange(len(points))
+    splits = np.zeros(len(points))
+    stack = [(0, len(points), 0)]
+    while stack:
+        lo, hi, depth = stack.pop()
+        if hi - lo <= LEAF_SIZE:
+            continue
+        mid = (lo + hi) // 2
+        axis = depth % 2
+        segment = order[lo:hi]
+        order[lo:hi] = segment[np.argpartition(points[segment, axis], mid - lo)]
+        splits[mid] = points[order[mid], axis]
+        stack.append((lo, mid, depth + 1))
+        stack.append((mid, hi, depth + 1))
+    return order, splits
+
+
+def knn(points: np.ndarray, splits: np.ndarray, query: np.ndarray, k: int) -> List[Tuple[float, int]]:
+    """
+    在已依 build_tree 排序的點中找最近的 k 個
+
+    Args:
+        points: 排序後的特徵 (N, 2)
+        splits: build_tree 的切分值
+        query: 查詢特徵 (2,)
+        k: 數量
+
+    Returns:
+        List[Tuple[float, int]]: (距離, 索引)，由近到遠
+    """
+    best: List[Tuple[float, int]] = []  # (-距離平方, 索引) 的最大堆積
+    qx, qy = float(query[0]), float(query[1])
+
+    def search(lo: int, hi: int, depth: int):
+        if hi - lo <= LEAF_SIZE:
+            block = points[lo:hi]
+            distances = (block[:, 0] - qx) ** 2 + (block[:, 1] - qy) ** 2
+            for offset, distance in enumerate(distances.tolist()):
+                if len(best) < k:
+                    heapq.heappush(best, (-distance, lo + offset))
+                elif distance < -best[0][0]:
+                    heapq.heapreplace(best, (-distance, lo + offset))
+            return
+        mid = (lo + hi) // 2
+        diff = (qx, qy)[depth % 2] - splits[mid]
+        near, far = ((lo, mid), (mid, hi)) if diff < 0 else ((mid, hi), (lo, mid))
+        search(near[0], near[1], depth + 1)
+        if len(best) < k or diff * diff < -best[0][0]:
+            search(far[0], far[1], depth + 1)
+
+    if len(points):
+        search(0, len(points), 0)
+    return [(float(np.sqrt(-distance)), index) for distance, index in sorted(best, reverse=True)]
+
+
+class ComparablesIndex:
+    """各 (車型, 車款) 分組的 KD 樹；車型層級分組（車款 '*'）為該車型所有車款的合併"""
+
+    def __init__(self, conn: sqlite3.Connection, cache_path: Optional[str] = COMPARABLES_CACHE):
+        """
+        初始化索引
+
+        Args:
+            conn: 資料庫連線（需已建立 listings 表格）
+            cache_path: 快取檔（None 表示不快取）
+        """
+        self.conn = conn
+        self.cache_path = cache_path
+        self.partitions: Dict[Tuple[str, str], Dict[str, np.ndarray]] = {}
+        self.fingerprints: Dict[Tuple[str, str], List] = {}
+        self._loaded = False
+
+    def _current_fingerprints(self) -> Dict[Tuple[str, str], List]:
+        """各分組目前的指紋（車輛數、最後一輪、觀測次數、已售出數）"""
+        return {(model, trim or ''): [count, last_sweep, sightings, sold]
+                for model, trim, count, last_sweep, sightings, sold in self.conn.execute('''
+                    SELECT model, trim, COUNT(*), MAX(last_sweep_id), SUM(sightings),
+                           SUM(status = 'sold')
+                    FROM listings GROUP BY model, trim
+                ''')}
+
+    def _load_cache(self):
+        """讀取快取檔（版本不符或損毀時忽略）"""
+        self._loaded = True
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with np.load(self.cache_path) as data:
+                manifest = json.loads(str(data['manifest']))
+                if manifest.get('version') != COMPARABLES_VERSION:
+                    return
+                for i, entry in enumerate(manifest['partitions']):
+                    key = (entry['model'], entry['trim'])
+                    self.partitions[key] = {field: data[f"p{i}_{field}"]
+                                            for field in PARTITION_FIELDS + ['points', 'splits']}
+                    self.fingerprints[key] = entry['fingerprint']
+        except Exception as e:
+            logger.warning(f"相似車輛快取無法讀取，將重建: {e}")
+            self.partitions, self.fingerprints = {}, {}
+
+    def _save_cache(self):
+        """寫入快取檔（先寫暫存檔再取代）"""
+        if not self.cache_path:
+            return
+        arrays = {}
+        entries = []
+        for i, (key, partition) in enumerate(sorted(self.partitions.items())):
+            entries.append({'model': key[0], 'trim': key[1], 'fingerprint': self.fingerprints.get(key)})
+            for field, values in partition.items():
+                arrays[f"p{i}_{field}"] = values
+        arrays['manifest'] = np.array(json.dumps({'version': COMPARABLES_VERSION,
+                                                  'partitions': entries}))
+        temp_path = self.cache_path + '.tmp.npz'
+        np.savez(temp_path, **arrays)
+        os.replace(temp_path, self.cache_path)
+
+    def _rollup_fallback(self) -> Tuple[str, str, str]:
+        """原始資料已被彙整的車輛改讀每日彙整：回傳 (里程運算式, 顏色運算式, JOIN 子句)"""
+        if has_rollup_tier(self.conn):
+            return ('d.last_mileage', 'd.exterior_color',
+                    "LEFT JOIN vehicle_daily d ON d.vin = l.vin AND d.date = date(l.last_seen)")
+        return 'NULL', 'NULL', ''
+
+    def _read_partition(self, model: str, trim: str) -> Dict[str, np.ndarray]:
+        """讀取一個車款分組的車輛（里程與顏色取最後一次觀測）"""
+        mileage, colour, rollup_join = self._rollup_fallback()
+        rows = self.conn.execute(f'''
+            SELECT l.vin, l.status, l.last_price, COALESCE(l.year, v.year),
+                   COALESCE(v.mileage, {mileage}), COALESCE(v.exterior_color, {colour}, ''),
+                   l.last_seen, COALESCE(l.sold_at, '')
+            FROM listings l
+            LEFT JOIN vehicle_prices v ON v.vin = l.vin AND v.scrape_datetime = l.last_seen
+            {rollup_join}
+            WHERE l.model = ? AND l.trim IS ?
+        ''', (model, trim or None)).fetchall()
+        # 沒有年份或里程的車輛無法比較
+        rows = [row for row in rows if row[3] is not None and row[4] is not None]
+        return self._build([np.array(column) for column in zip(*rows)] if rows else None)
+
+    @staticmethod
+    def _build(columns: Optional[List[np.ndarray]]) -> Dict[str, np.ndarray]:
+        """由欄位建立分組（依 KD 樹順序排列）"""
+        if columns is None:
+            columns = [np.array([], dtype=str)] * len(PARTITION_FIELDS)
+        partition = dict(zip(PARTITION_FIELDS, columns))
+        for field in ('vin', 'status', 'colour', 'last_seen', 'sold_at'):
+            partition[field] = partition[field].astype(str)
+        partition['price'] = np.array([np.nan if price is None else price for price in partition['price']],
+                                      dtype=np.float64)
+        partition['year'] = partition['year'].astype(np.int64)
+        partition['mileage'] = partition['mileage'].astype(np.int64)
+        points = features(partition['year'], partition['mileage'])
+        order, splits = build_tree(points)
+        partition = {field: values[order] for field, values in partition.items()}
+        partition['points'] = points[order]
+        partition['splits'] = splits
+        return partition
+
+    def invalidate(self):
+        """捨棄所有分組與快取檔（既有觀測被修改時使用），下次 refresh 時全部重建"""
+        self.partitions, self.fingerprints = {}, {}
+        self._loaded = True
+        if self.cache_path and os.path.exists(self.cache_path):
+            os.remove(self.cache_path)
+
+    def refresh(self) -> int:
+        """
+        重建指紋有變動的分組並更新快取（每輪爬取後呼叫，查詢前也會自動呼叫）
+
+        Returns:
+            int: 重建的車款分組數
+        """
+        if not self._loaded:
+            self._load_cache()
+
+        current = self._current_fingerprints()
+        changed = [key for key, fingerprint in current.items() if self.fingerprints.get(key) != fingerprint]
+        removed = [key for key in self.partitions if key[1] != ALL_TRIMS and key not in current]
+        if not changed and not removed:
+            return 0
+
+        for key in removed:
+            del self.partitions[key]
+            self.fingerprints.pop(key, None)
+        for key in changed:
+            self.partitions[key] = self._read_partition(*key)
+            self.fingerprints[key] = current[key]
+
+        # 受影響車型的車型層級分組由各車款合併重建
+        for model in {key[0] for key in changed + removed}:
+            trims = [partition for key, partition in self.partitions.items()
+                     if key[0] == model and key[1] != ALL_TRIMS]
+            if not trims:
+                self.partitions.pop((model, ALL_TRIMS), None)
+                continue
+            columns = [np.concatenate([partition[field] for partition in trims])
+                       for field in PARTITION_FIELDS]
+            self.partitions[(model, ALL_TRIMS)] = self._build(columns)
+            self.fingerprints[(model, ALL_TRIMS)] = None
+
+        self._save_cache()
+        logger.info(f"相似車輛索引已重建 {len(changed)} 個分組")
+        return len(changed)
+
+    def query(self, model: str, trim: Optional[str], year: int, mileage: int,
+              colour: Optional[str] = None, k: int = 10, exclude_vin: Optional[str] = None) -> Dict:
+        """
+        找出最相近的 k 輛車並估計合理價格
+
+        Args:
+            model: 車型
+            trim: 車款（該車款不足 k 輛時改用整個車型）
+            year: 年份
+            mileage: 里程
+            colour: 外觀顏色（指定時顏色相同者優先）
+            k: 數量
+            exclude_vin: 排除的 VIN（以 VIN 查詢時排除自己）
+
+        Returns:
+            Dict: partition / comparables / fair_price
+        """
+        if not self._loaded:
+            self.refresh()
+
+        key = (model, trim or '')
+        partition = self.partitions.get(key)
+        if partition is None or len(partition['vin']) < k + (exclude_vin is not None):
+            key = (model, ALL_TRIMS)
+            partition = self.partitions.get(key)
+        if partition is None:
+            return {'partition': None, 'comparables': [], 'fair_price': None}
+
+        candidates = k * (COLOUR_CANDIDATES if colour else 1) + (exclude_vin is not None)
+        query = features([year], [mileage])[0]
+        ranked = []
+        for distance, index in knn(partition['points'], partition['splits'], query, candidates):
+            if partition['vin'][index] == exclude_vin:
+                continue
+            if colour and partition['colour'][index].lower() != colour.lower():
+                distance += COLOUR_PENALTY
+            ranked.append((distance, index))
+        ranked = sorted(ranked)[:k]
+
+        comparables = [{
+            'vin': str(partition['vin'][index]),
+            'status': str(partition['status'][index]),
+            'price': None if np.isnan(partition['price'][index]) else int(partition['price'][index]),
+            'year': int(partition['year'][index]),
+            'mileage': int(partition['mileage'][index]),
+            'colour': str(partition['colour'][index]) or None,
+            'last_seen': str(partition['last_seen'][index]),
+            'sold_at': str(partition['sold_at'][index]) or None,
+            'distance': round(distance, 4),
+        } for distance, index in ranked]
+
+        priced = [(1 / (item['distance'] + DISTANCE_EPSILON), item['price'])
+                  for item in comparables if item['price'] is not None]
+        fair_price = (sum(weight * price for weight, price in priced) / sum(weight for weight, _ in priced)
+                      if priced else None)
+        return {'partition': {'model': key[0], 'trim': key[1]}, 'comparables': comparables,
+                'fair_price': None if fair_price is None else round(fair_price)}
+
+    def query_vin(self, vin: str, k: int = 10) -> Optional[Dict]:
+        """
+        以 VIN 的規格查詢相似車輛（不含自己）
+
+        Returns:
+            Optional[Dict]: query() 的結果加上 vehicle（查詢的車輛）；找不到 VIN 時為 None
+        """
+        mileage, colour, rollup_join = self._rollup_fallback()
+        row = self.conn.execute(f'''
+            SELECT l.model, l.trim, COALESCE(l.year, v.year), COALESCE(v.mileage, {mileage}),
+                   COALESCE(v.exterior_color, {colour}), l.last_price
+            FROM listings l
+            LEFT JOIN vehicle_prices v ON v.vin = l.vin AND v.scrape_datetime = l.last_seen
+            {rollup_join}
+            WHERE l.vin = ?
+        ''', (vin,)).fetchone()
+        if row is None or row[2] is None or row[3] is None:
+            return None
+        model, trim, year, mileage, colour, price = row
+        result = self.query(model, trim, year, mileage, colour, k, exclude_vin=vin)
+        result['vehicle'] = {'vin': vin, 'model': model, 'trim': trim, 'year': year,
+                             'mileage': mileage, 'colour': colour, 'price': price}
+        return result
@@ -0,0 +1,414 @@
+#!/home/cclin/.local/python311/bin/python3
+"""
+Tesla HTML 儀表板
+將預先計算的市場統計轉為精簡 JSON，嵌入單一 HTML 檔以瀏覽器端 SVG 繪製（不使用 matplotlib）
+"""
+
+import os
+import json
+import math
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from tesla_market_stats import MarketStats, DENSITY_BINS
+
+# 輸出檔名（不含副檔名）
+DASHBOARD_FILE = 'tesla_dashboard'
+
+# 資料格式 / 頁面版本；變更時遞增，使輸出快取失效
+DASHBOARD_VERSION = 1
+
+
+def _num(value, digits: int = 1) -> Optional[float]:
+    """轉為四捨五入的數值（NaN / None 為 null）"""
+    if value is None:
+        return None
+    value = float(value)
+    return round(value, digits) if math.isfinite(value) else None
+
+
+def _nums(values, digits: int = 1) -> List[Optional[float]]:
+    """數值序列四捨五入"""
+    return [_num(v, digits) for v in values]
+
+
+def _date(value) -> Optional[str]:
+    """日期轉為 YYYY-MM-DD 字串"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    return pd.Timestamp(value).strftime('%Y-%m-%d')
+
+
+def _density(stats: MarketStats) -> Optional[Dict]:
+    """價格與里程 2-D 分組（只保留非零格）；統計只有散點時在此分組"""
+    if stats.scatter_density is not None:
+        counts, x_edges, y_edges = stats.scatter_density
+    elif stats.points_by_model:
+        mileage = np.concatenate([m for m, _ in stats.points_by_model.values()]) / 1000
+        prices = np.concatenate([p for _, p in stats.points_by_model.values()]) / 10000
+        valid = np.isfinite(mileage) & np.isfinite(prices)
+        if not valid.any():
+            return None
+        counts, x_edges, y_edges = np.histogram2d(mileage[valid], prices[valid], bins=DENSITY_BINS)
+    else:
+        return None
+
+    i, j = np.nonzero(counts)
+    return {
+        'x': _nums(x_edges),
+        'y': _nums(y_edges),
+        'cells': np.column_stack([i, j, counts[i, j]]).astype(np.int64).tolist(),
+    }
+
+
+def dashboard_data(stats: MarketStats) -> Dict:
+    """
+    將市場統計轉為儀表板 JSON（價格以萬元、日期以字串表示）
+
+    Args:
+        stats: 市場統計（需已加入趨勢資料）
+
+    Returns:
+        Dict: 可直接序列化的資料
+    """
+    overall = stats.overall
+    data = {
+        'generated': datetime.now().isoformat(sep=' ', timespec='seconds'),
+        'overall': {
+            'count': int(overall.get('count') or 0),
+            'unique_vins': int(overall.get('unique_vins') or 0),
+            'first_seen': _date(overall.get('first_seen')),
+            'last_seen': _date(overall.get('last_seen')),
+            **{key: _num((overall.get(key) or np.nan) / 10000, 2)
+               for key in ('price_mean', 'price_median', 'price_p10', 'price_p90',
+                           'price_min', 'price_max', 'price_std')},
+        },
+    }
+
+    counts, edges = stats.price_histogram
+    data['histogram'] = {'edges': _nums(edges, 2), 'counts': [int(c) for c in counts]}
+
+    # 箱型圖不帶離群值，資料量不隨觀測數增加
+    data['boxes'] = [{'label': str(box['label']),
+                      **{key: _num(box[key], 2) for key in ('whislo', 'q1', 'med', 'q3', 'whishi')}}
+                     for box in stats.box_stats]
+
+    data['models'] = [{
+        'model': str(model),
+        'count': int(row['count']),
+        'mean': _num(row['price_mean'] / 10000, 2),
+        'median': _num(row['price_median'] / 10000, 2),
+        'min': _num(row['price_min'] / 10000, 2),
+        'max': _num(row['price_max'] / 10000, 2),
+        'mileage': _num(row['mileage_mean'], 0),
+    } for model, row in stats.per_model.iterrows()]
+
+    data['density'] = _density(stats)
+    data['curves'] = {str(model): np.column_stack([_nums(x), _nums(y, 2)]).tolist()
+                      for model, (x, y) in stats.depreciation_curves.items()}
+
+    trends = {}
+    if not stats.trend_daily_avg.empty:
+        for model, group in stats.trend_daily_avg.groupby('model', sort=True, observed=True):
+            trends[str(model)] = [[_date(d), _num(p / 10000, 2)]
+                                  for d, p in zip(group['date_recorded'], group['price'])]
+    data['trends'] = trends
+    data['band'] = [[_date(row.date), _num(row.p10 / 10000, 2), _num(row.p50 / 10000, 2),
+                     _num(row.p90 / 10000, 2)]
+                    for row in stats.price_quantile_band.itertuples()]
+
+    heatmap = stats.trend_heatmap
+    data['heatmap'] = {
+        'bucket': stats.trend_heatmap_bucket,
+        'rows': [str(r) for r in heatmap.index],
+        'columns': [str(c) for c in heatmap.columns],
+        'values': [_nums(row, 2) for row in heatmap.to_numpy()],
+    }
+
+    data['daily'] = [[_date(d), int(n)] for d, n in stats.daily_counts.items()]
+    data['bands'] = {'labels': list(stats.per_band.index), 'counts': [int(n) for n in stats.per_band]}
+    data['colors'] = {'labels': [str(c) for c in stats.per_color.index],
+                      'counts': [int(n) for n in stats.per_color]}
+    data['years'] = {'labels': [str(y) for y in stats.per_year.index],
+                     'counts': [int(n) for n in stats.per_year]}
+    return data
+
+
+def write_dashboard(stats: MarketStats, path: str,
+                    title: str = 'Tesla 認證中古車市場儀表板') -> str:
+    """
+    輸出自含的 HTML 儀表板（資料、樣式與繪圖程式皆內嵌，不需網路）
+
+    Args:
+        stats: 市場統計
+        path: 輸出路徑
+        title: 頁面標題
+
+    Returns:
+        str: 輸出路徑
+    """
+    payload = json.dumps(dashboard_data(stats), ensure_ascii=False, separators=(',', ':'))
+    # 避免資料中的 "</" 提前結束 <script>
+    payload = payload.replace('</', '<\\/')
+    html = (_TEMPLATE.replace('__TITLE__', title)
+            .replace('__DATA__', payload))
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(html)
+    os.replace(tmp_path, path)
+    return path
+
+
+_TEMPLATE = r'''<!DOCTYPE html>
+<html lang="zh-Hant">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>__TITLE__</title>
+<style>
+body { font-family: "Microsoft JhengHei", "PingFang TC", "Noto Sans TC", sans-serif; margin: 0; background: #f5f6f8; color: #222; }
+header { background: #1f2937; color: #fff; padding: 14px 24px; }
+header h1 { margin: 0; font-size: 20px; }
+header small { color: #cbd5e1; }
+.kpis { display: flex; flex-wrap: wrap; gap: 12px; padding: 16px 24px 0; }
+.kpi { background: #fff; border-radius: 6px; padding: 10px 16px; box-shadow: 0 1px 2px rgba(0,0,0,.08); }
+.kpi b { display: block; font-size: 18px; }
+.kpi span { font-size: 12px; color: #666; }
+.grid { display: grid; grid-template-columns: repeat(auto-fit, minmax(520px, 1fr)); gap: 16px; padding: 16px 24px; }
+.card { background: #fff; border-radius: 6px; padding: 12px 16px; box-shadow: 0 1px 2px rgba(0,0,0,.08); }
+.card h2 { font-size: 15px; margin: 0 0 8px; }
+.controls { font-size: 12px; margin-bottom: 6px; }
+.controls label { margin-right: 10px; white-space: nowrap; }
+svg { width: 100%; height: auto; display: block; }
+svg text { font-size: 11px; fill: #444; }
+.axis line, .axis path { stroke: #bbb; }
+.grid-line { stroke: #eee; }
+table { border-collapse: collapse; font-size: 12px; width: 100%; }
+th, td { padding: 3px 6px; text-align: right; border-bottom: 1px solid #eee; }
+th:first-child, td:first-child { text-align: left; }
+.heatmap td { text-align: center; min-width: 28px; }
+.scroll { overflow-x: auto; }
+#tip { position: fixed; pointer-events: none; background: rgba(17,24,39,.9); color: #fff; font-size: 12px; padding: 4px 8px; border-radius: 4px; display: none; }
+</style>
+</head>
+<body>
+<header><h1>__TITLE__</h1><small id="meta"></small></header>
+<div class="kpis" id="kpis"></div>
+<div class="grid">
+  <div class="card"><h2>整體價格分布（萬元）</h2><div id="histogram"></div></div>
+  <div class="card"><h2>各車型價格分布（萬元）</h2><div id="boxes"></div></div>
+  <div class="card"><h2>價格與里程關係</h2><div id="density"></div></div>
+  <div class="card"><h2>各車型統計</h2><div id="models" class="scroll"></div></div>
+  <div class="card" style="grid-column: 1 / -1"><h2>各車型平均價格趨勢（萬元）</h2>
+    <div class="controls" id="trend-controls"></div><div id="trends"></div></div>
+  <div class="card" style="grid-column: 1 / -1"><h2 id="heatmap-title">價格變動熱力圖（%）</h2><div id="heatmap" class="scroll"></div></div>
+  <div class="card"><h2>每日新增車輛</h2><div id="daily"></div></div>
+  <div class="card"><h2>價格區間分布</h2><div id="bands"></div></div>
+  <div class="card"><h2>外觀顏色偏好</h2><div id="colors"></div></div>
+  <div class="card"><h2>年份分布</h2><div id="years"></div></div>
+</div>
+<div id="tip"></div>
+<script id="data" type="application/json">__DATA__</script>
+<script>
+(function () {
+  'use strict';
+  const D = JSON.parse(document.getElementById('data').textContent);
+  const NS = 'http://www.w3.org/2000/svg';
+  const PALETTE = ['#e15759', '#4e79a7', '#59a14f', '#f28e2b', '#76b7b2', '#edc948', '#b07aa1', '#ff9da7', '#9c755f', '#bab0ac'];
+  const W = 560, H = 300, M = {l: 52, r: 14, t: 10, b: 44};
+  const tip = document.getElementById('tip');
+
+  function el(tag, attrs, parent) {
+    const e = document.createElementNS(NS, tag);
+    for (const k in attrs) e.setAttribute(k, attrs[k]);
+    if (parent) parent.appendChild(e);
+    return e;
+  }
+  function hover(node, text) {
+    node.addEventListener('mousemove', ev => {
+      tip.textContent = text; tip.style.display = 'block';
+      tip.style.left = (ev.clientX + 12) + 'px'; tip.style.top = (ev.clientY + 12) + 'px';
+    });
+    node.addEventListener('mouseleave', () => { tip.style.display = 'none'; });
+  }
+  function fmt(v, d) { return v == null ? '-' : Number(v).toLocaleString(undefined, {maximumFractionDigits: d == null ? 1 : d}); }
+  function linear(d0, d1, r0, r1) { const s = (r1 - r0) / ((d1 - d0) || 1); return v => r0 + (v - d0) * s; }
+  function ticks(lo, hi, n) {
+    const step0 = (hi - lo) / n || 1, mag = Math.pow(10, Math.floor(Math.log10(step0)));
+    const step = [1, 2, 5, 10].map(m => m * mag).find(s => s >= step0);
+    const out = [];
+    for (let v = Math.ceil(lo / step) * step; v <= hi + 1e-9; v += step) out.push(+v.toFixed(10));
+    return out;
+  }
+  function frame(container, yLo, yHi) {
+    const svg = el('svg', {viewBox: `0 0 ${W} ${H}`}, document.getElementById(container));
+    const y = linear(yLo, yHi, H - M.b, M.t);
+    for (const t of ticks(yLo, yHi, 5)) {
+      el('line', {x1: M.l, x2: W - M.r, y1: y(t), y2: y(t), class: 'grid-line'}, svg);
+      el('text', {x: M.l - 6, y: y(t) + 4, 'text-anchor': 'end'}, svg).textContent = fmt(t);
+    }
+    el('line', {x1: M.l, x2: W - M.r, y1: H - M.b, y2: H - M.b, stroke: '#999'}, svg);
+    return {svg, y};
+  }
+  function xLabel(svg, x, text, rotate) {
+    const t = el('text', {x, y: H - M.b + 14, 'text-anchor': rotate ? 'end' : 'middle'}, svg);
+    if (rotate) t.setAttribute('transform', `rotate(-35 ${x} ${H - M.b + 14})`);
+    t.textContent = text;
+  }
+  function empty(container) { document.getElementById(container).textContent = '無資料'; }
+
+  function bars(container, labels, values, color) {
+    if (!values.length) return empty(container);
+    const {svg, y} = frame(container, 0, Math.max(...values) || 1);
+    const bw = (W - M.l - M.r) / values.length;
+    const rotate = labels.some(l => String(l).length > 4) && values.length > 5;
+    values.forEach((v, i) => {
+      const r = el('rect', {x: M.l + i * bw + bw * 0.1, y: y(v), width: bw * 0.8, height: H - M.b - y(v), fill: color}, svg);
+      hover(r, `${labels[i]}: ${fmt(v, 0)}`);
+      if (values.length <= 30) xLabel(svg, M.l + (i + 0.5) * bw, labels[i], rotate);
+    });
+  }
+
+  function timeSeries(container, series, opts) {
+    const node = document.getElementById(container);
+    node.innerHTML = '';
+    const all = series.flatMap(s => s.points);
+    if (!all.length && !(opts.band || []).length) return empty(container);
+    const times = all.map(p => Date.parse(p[0])).concat((opts.band || []).map(b => Date.parse(b[0])));
+    const values = all.map(p => p[1]).concat((opts.band || []).flatMap(b => [b[1], b[3]])).filter(v => v != null);
+    const t0 = Math.min(...times), t1 = Math.max(...times);
+    let lo = Math.min(...values), hi = Math.max(...values);
+    if (opts.zero) lo = 0;
+    const pad = (hi - lo) * 0.05 || 1;
+    const {svg, y} = frame(container, opts.zero ? 0 : lo - pad, hi + pad);
+    const x = linear(t0, t1, M.l, W - M.r);
+    const days = (t1 - t0) / 864e5;
+    for (let i = 0; i <= 5; i++) {
+      const t = t0 + (t1 - t0) * i / 5;
+      xLabel(svg, x(t), new Date(t).toISOString().slice(0, days > 400 ? 7 : 10), true);
+    }
+    if (opts.band && opts.band.length) {
+      const b = opts.band;
+      const upper = b.map(p => `${x(Date.parse(p[0]))},${y(p[3])}`);
+      const lower = b.slice().reverse().map(p => `${x(Date.parse(p[0]))},${y(p[1])}`);
+      el('polygon', {points: upper.concat(lower).join(' '), fill: '#888', 'fill-opacity': 0.15}, svg);
+      el('polyline', {points: b.map(p => `${x(Date.parse(p[0]))},${y(p[2])}`).join(' '), fill: 'none', stroke: '#111', 'stroke-dasharray': '2 3'}, svg);
+    }
+    series.forEach(s => {
+      const pts = s.points.filter(p => p[1] != null);
+      el('polyline', {points: pts.map(p => `${x(Date.parse(p[0]))},${y(p[1])}`).join(' '), fill: 'none', stroke: s.color, 'stroke-width': 2}, svg);
+      if (pts.length <= 200) pts.forEach(p => hover(el('circle', {cx: x(Date.parse(p[0])), cy: y(p[1]), r: 3, fill: s.color}, svg), `${s.name} ${p[0]}: ${fmt(p[1], 2)}`));
+    });
+  }
+
+  // 概況
+  const o = D.overall;
+  document.getElementById('meta').textContent = `${o.first_seen || ''} 至 ${o.last_seen || ''}　產生時間 ${D.generated}`;
+  const kpis = [['總記錄數', fmt(o.count, 0)], ['唯一車輛', fmt(o.unique_vins, 0)], ['平均價格', fmt(o.price_mean) + ' 萬'],
+    ['中位數', fmt(o.price_median) + ' 萬'], ['P10 / P90', o.price_p10 == null ? '-' : `${fmt(o.price_p10)} / ${fmt(o.price_p90)} 萬`],
+    ['價格範圍', `${fmt(o.price_min)} - ${fmt(o.price_max)} 萬`], ['標準差', fmt(o.price_std) + ' 萬']];
+  document.getElementById('kpis').innerHTML = kpis.map(k => `<div class="kpi"><span>${k[0]}</span><b>${k[1]}</b></div>`).join('');
+
+  // 直方圖
+  (function () {
+    const h = D.histogram;
+    if (!h.counts.length) return empty('histogram');
+    const {svg, y} = frame('histogram', 0, Math.max(...h.counts) || 1);
+    const x = linear(h.edges[0], h.edges[h.edges.length - 1], M.l, W - M.r);
+    h.counts.forEach((c, i) => hover(el('rect', {x: x(h.edges[i]), y: y(c), width: Math.max(x(h.edges[i + 1]) - x(h.edges[i]) - 1, 1), height: H - M.b - y(c), fill: '#4e79a7'}, svg),
+      `${fmt(h.edges[i])} - ${fmt(h.edges[i + 1])} 萬: ${c}`));
+    for (const t of ticks(h.edges[0], h.edges[h.edges.length - 1], 6)) xLabel(svg, x(t), fmt(t));
+    const marks = [['平均', o.price_mean, '#e15759'], ['中位數', o.price_median, '#59a14f']];
+    if (o.price_p10 != null) el('rect', {x: x(o.price_p10), y: M.t, width: x(o.price_p90) - x(o.price_p10), height: H - M.b - M.t, fill: '#59a14f', 'fill-opacity': 0.08}, svg);
+    marks.forEach(m => { if (m[1] != null) hover(el('line', {x1: x(m[1]), x2: x(m[1]), y1: M.t, y2: H - M.b, stroke: m[2], 'stroke-dasharray': '4 3', 'stroke-width': 2}, svg), `${m[0]}: ${fmt(m[1])} 萬`); });
+  })();
+
+  // 箱型圖
+  (function () {
+    const b = D.boxes;
+    if (!b.length) return empty('boxes');
+    const {svg, y} = frame('boxes', Math.min(...b.map(v => v.whislo)) * 0.95, Math.max(...b.map(v => v.whishi)) * 1.05);
+    const bw = (W - M.l - M.r) / b.length;
+    b.forEach((v, i) => {
+      const cx = M.l + (i + 0.5) * bw, half = bw * 0.3, color = PALETTE[i % PALETTE.length];
+      el('line', {x1: cx, x2: cx, y1: y(v.whislo), y2: y(v.whishi), stroke: '#555'}, svg);
+      const r = el('rect', {x: cx - half, y: y(v.q3), width: half * 2, height: Math.max(y(v.q1) - y(v.q3), 1), fill: color, 'fill-opacity': 0.6, stroke: '#555'}, svg);
+      el('line', {x1: cx - half, x2: cx + half, y1: y(v.med), y2: y(v.med), stroke: '#111', 'stroke-width': 2}, svg);
+      hover(r, `${v.label}: Q1 ${fmt(v.q1)} / 中位數 ${fmt(v.med)} / Q3 ${fmt(v.q3)} 萬`);
+      xLabel(svg, cx, v.label);
+    });
+  })();
+
+  // 價格與里程密度
+  (function () {
+    const d = D.density;
+    if (!d || !d.cells.length) return empty('density');
+    const {svg, y} = frame('density', d.y[0], d.y[d.y.length - 1]);
+    const x = linear(d.x[0], d.x[d.x.length - 1], M.l, W - M.r);
+    const maxLog = Math.log(Math.max(...d.cells.map(c => c[2])) + 1);
+    d.cells.forEach(c => {
+      const a = Math.log(c[2] + 1) / maxLog;
+      hover(el('rect', {x: x(d.x[c[0]]), y: y(d.y[c[1] + 1]), width: Math.max(x(d.x[c[0] + 1]) - x(d.x[c[0]]), 1), height: Math.max(y(d.y[c[1]]) - y(d.y[c[1] + 1]), 1),
+        fill: `rgba(68, 1, 84, ${0.15 + 0.85 * a})`}, svg), `${fmt(d.x[c[0]])}-${fmt(d.x[c[0] + 1])} 千公里, ${fmt(d.y[c[1]])}-${fmt(d.y[c[1] + 1])} 萬: ${c[2]}`);
+    });
+    Object.keys(D.curves).forEach((m, i) => {
+      el('polyline', {points: D.curves[m].filter(p => p[1] != null).map(p => `${x(p[0])},${y(p[1])}`).join(' '), fill: 'none', stroke: PALETTE[i % PALETTE.length], 'stroke-width': 2, 'stroke-dasharray': '6 3'}, svg);
+    });
+    for (const t of ticks(d.x[0], d.x[d.x.length - 1], 6)) xLabel(svg, x(t), fmt(t));
+    el('text', {x: W - M.r, y: H - 4, 'text-anchor': 'end'}, svg).textContent = '里程（千公里）';
+  })();
+
+  // 各車型統計表
+  document.getElementById('models').innerHTML = '<table><tr><th>車型</th><th>數量</th><th>平均</th><th>中位數</th><th>最低</th><th>最高</th><th>平均里程</th></tr>' +
+    D.models.map(m => `<tr><td>${m.model}</td><td>${fmt(m.count, 0)}</td><td>${fmt(m.mean)}</td><td>${fmt(m.median)}</td><td>${fmt(m.min)}</td><td>${fmt(m.max)}</td><td>${fmt(m.mileage, 0)}</td></tr>`).join('') + '</table>';
+
+  // 價格趨勢（可篩選車型與日期區間）
+  (function () {
+    const models = Object.keys(D.trends);
+    const dates = models.flatMap(m => D.trends[m].map(p => p[0])).sort();
+    const controls = document.getElementById('trend-controls');
+    if (!dates.length) return empty('trends');
+    controls.innerHTML = models.map((m, i) => `<label><input type="checkbox" data-model="${m}" checked> <span style="color:${PALETTE[i % PALETTE.length]}">■</span> ${m}</label>`).join('') +
+      `<label>從 <input type="date" id="trend-start" value="${dates[0]}"></label><label>至 <input type="date" id="trend-end" value="${dates[dates.length - 1]}"></label>` +
+      (D.band.length ? '<label><input type="checkbox" id="trend-band" checked> 市場 P10-P90 與滾動中位數</label>' : '');
+    function draw() {
+      const start = document.getElementById('trend-start').value, end = document.getElementById('trend-end').value;
+      const inRange = p => (!start || p[0] >= start) && (!end || p[0] <= end);
+      const series = models.map((m, i) => ({name: m, color: PALETTE[i % PALETTE.length], points: D.trends[m].filter(inRange)}))
+        .filter(s => controls.querySelector(`[data-model="${s.name}"]`).checked);
+      const bandBox = document.getElementById('trend-band');
+      timeSeries('trends', series, {band: bandBox && bandBox.checked ? D.band.filter(inRange) : []});
+    }
+    controls.addEventListener('change', draw);
+    draw();
+  })();
+
+  // 熱力圖
+  (function () {
+    const h = D.heatmap;
+    if (!h.rows.length) return empty('heatmap');
+    document.getElementById('heatmap-title').textContent = `價格變動熱力圖（%，${{day: '每日', week: '每週', month: '每月'}[h.bucket] || ''}平均）`;
+    const flat = h.values.flat().filter(v => v != null);
+    const lim = Math.max(...flat.map(Math.abs)) || 1;
+    const color = v => {
+      if (v == null) return '#fff';
+      const a = Math.min(Math.abs(v) / lim, 1);
+      return v > 0 ? `rgba(215, 48, 39, ${a})` : `rgba(26, 152, 80, ${a})`;
+    };
+    document.getElementById('heatmap').innerHTML = '<table class="heatmap"><tr><th>車型</th>' + h.columns.map(c => `<th>${c.slice(5)}</th>`).join('') + '</tr>' +
+      h.rows.map((r, i) => `<tr><td>${r}</td>` + h.values[i].map((v, j) => `<td title="${r} ${h.columns[j]}: ${fmt(v, 2)}%" style="background:${color(v)}">${h.columns.length <= 40 ? fmt(v) : ''}</td>`).join('') + '</tr>').join('') + '</table>';
+  })();
+
+  timeSeries('daily', [{name: '新增', color: '#4e79a7', points: D.daily}], {zero: true});
+  bars('bands', D.bands.labels, D.bands.counts, '#f28e2b');
+  bars('colors', D.colors.labels, D.colors.counts, '#76b7b2');
+  bars('years', D.years.labels, D.years.counts, '#59a14f');
+})();
+</script>
+</body>
+</html>
+'''
@@ -0,0 +1,266 @@
+#!/home/cclin/.local/python311/bin/python3
+"""
+Tesla 折舊模型
+各車型 / 車款分別以里程與車齡回歸價格，所有分組以一次批次最小平方法求解，並依資料指紋快取係數
+"""
+
+import json
+import hashlib
+import logging
+from datetime import datetime
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from tesla_storage import StorageBackend
+
+logger = logging.getLogger(__name__)
+
+# 係數格式版本；特徵或求解方式變更時遞增，使快取失效
+MODEL_VERSION = 1
+
+# 車款分組少於此筆數時改用車型層級的係數
+MIN_GROUP_SIZE = 20
+
+# 正規方程的微小脊迴歸項，避免資料退化（例如只有單一年份）時矩陣奇異
+RIDGE = 1e-10
+
+# 車型層級係數使用的車款名稱
+ALL_TRIMS = '*'
+
+# 係數欄位：價格（萬元）= intercept + mileage_coef × 里程（萬公里）+ age_coef × 車齡（年）
+COEFFICIENT_COLUMNS = ['model', 'trim', 'intercept', 'mileage_coef', 'age_coef',
+                       'observations', 'rmse', 'age_mean', 'mileage_max']
+
+
+def _design(df: pd.DataFrame, reference_year: int) -> np.ndarray:
+    """設計矩陣：[1, 里程（萬公里）, 車齡（年）]"""
+    return np.column_stack([
+        np.ones(len(df)),
+        df['mileage'].to_numpy(dtype=np.float64) / 10000,
+        reference_year - df['year'].to_numpy(dtype=np.float64),
+    ])
+
+
+def fit_grouped(X: np.ndarray, y: np.ndarray, codes: np.ndarray, groups: int) -> tuple:
+    """
+    以堆疊的正規方程一次求解所有分組的最小平方解
+
+    Args:
+        X: 設計矩陣 (N, k)
+        y: 目標值 (N,)
+        codes: 每列所屬的分組編號 (N,)
+        groups: 分組數
+
+    Returns:
+        tuple: (係數 (groups, k), 筆數 (groups,), 殘差均方根 (groups,))
+    """
+    k = X.shape[1]
+    xtx = np.empty((groups, k, k))
+    for i in range(k):
+        for j in range(i, k):
+            xtx[:, i, j] = xtx[:, j, i] = np.bincount(codes, weights=X[:, i] * X[:, j],
+                                                      minlength=groups)
+    xty = np.column_stack([np.bincount(codes, weights=X[:, i] * y, minlength=groups)
+                           for i in range(k)])
+    counts = np.bincount(codes, minlength=groups)
+
+    scale = np.maximum(np.abs(np.diagonal(xtx, axis1=1, axis2=2)).max(axis=1), 1.0)
+    xtx += RIDGE * scale[:, None, None] * np.eye(k)
+    coefficients = np.linalg.solve(xtx, xty[:, :, None])[:, :, 0]
+
+    residuals = y - np.einsum('nk,nk->n', X, coefficients[codes])
+    rmse = np.sqrt(np.bincount(codes, weights=residuals * residuals, minlength=groups)
+                   / np.maximum(counts, 1))
+    return coefficients, counts, rmse
+
+
+class DepreciationModel:
+    """各車型 / 車款的折舊回歸（係數存於 depreciation_coefficients 表格）"""
+
+    def __init__(self, storage: StorageBackend, reference_year: Optional[int] = None):
+        """
+        初始化折舊模型
+
+        Args:
+            storage: 儲存實作
+            reference_year: 計算車齡的基準年份（None 為今年）
+        """
+        self.storage = storage
+        self.conn = storage.conn
+        self.reference_year = reference_year or datetime.now().year
+        self.coefficients = pd.DataFrame(columns=COEFFICIENT_COLUMNS)
+        self.fingerprint: Optional[str] = None
+
+    def init_schema(self):
+        """建立係數表格"""
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS depreciation_coefficients (
+                fingerprint TEXT NOT NULL,
+                model TEXT NOT NULL,
+                trim TEXT NOT NULL,
+                intercept REAL,
+                mileage_coef REAL,
+                age_coef REAL,
+                observations INTEGER,
+                rmse REAL,
+                age_mean REAL,
+                mileage_max REAL,
+                PRIMARY KEY (model, trim)
+            )
+        ''')
+
+    def data_fingerprint(self) -> str:
+        """觀測資料與模型設定的指紋"""
+        payload = json.dumps({
+            'version': MODEL_VERSION,
+            'reference_year': self.reference_year,
+            'min_group_size': MIN_GROUP_SIZE,
+            'data': self.storage.table_fingerprint('vehicle_prices'),
+        }, default=str)
+        return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+    def _training_frame(self) -> pd.DataFrame:
+        """讀取訓練資料（只取回歸需要的欄位與完整的列；SQLite 時由欄式快取讀取）"""
+        df = self.storage.read_observations(['model', 'trim', 'year', 'mileage', 'price'])
+        return df.dropna(subset=['year', 'mileage', 'price']).reset_index(drop=True)
+
+    def fit(self, force: bool = False) -> pd.DataFrame:
+        """
+        擬合所有分組（資料指紋未變時直接讀取快取的係數）
+
+        Args:
+            force: 忽略快取重新擬合
+
+        Returns:
+            pd.DataFrame: 各 (model, trim) 的係數；trim 為 '*' 的列是車型層級係數
+        """
+        self.init_schema()
+        fingerprint = self.data_fingerprint()
+
+        if not force:
+            cached = self.storage.read_frame(
+                f"SELECT {', '.join(COEFFICIENT_COLUMNS)} FROM depreciation_coefficients "
+                f"WHERE fingerprint = ?", (fingerprint,))
+            if not cached.empty:
+                self.coefficients, self.fingerprint = cached, fingerprint
+                return cached
+
+        df = self._training_frame()
+        self.coefficients = self.fit_frame(df)
+        self.fingerprint = fingerprint
+
+        self.conn.execute("DELETE FROM depreciation_coefficients")
+        self.conn.executemany(f'''
+            INSERT INTO depreciation_coefficients (fingerprint, {', '.join(COEFFICIENT_COLUMNS)})
+            VALUES ({', '.join('?' * (len(COEFFICIENT_COLUMNS) + 1))})
+        ''', [(fingerprint,) + tuple(row) for row in
+              self.coefficients[COEFFICIENT_COLUMNS].itertuples(index=False)])
+        self.conn.commit()
+        logger.info(f"折舊模型已擬合 {len(self.coefficients)} 組（{len(df)} 筆觀測）")
+        return self.coefficients
+
+    def fit_frame(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        由資料擬合係數（車款層級與車型層級一起求解）
+
+        Args:
+            df: 含 model / trim / year / mileage / price 欄位的資料
+
+        Returns:
+            pd.DataFrame: 係數
+        """
+        if df.empty:
+            return pd.DataFrame(columns=COEFFICIENT_COLUMNS)
+
+        models = df['model'].astype(object).fillna('UNKNOWN').astype(str).to_numpy()
+        trims = df['trim'].astype(object).fillna('').astype(str).to_numpy()
+
+        # 車款分組與車型分組疊在同一批資料中，一次求解
+        keys = pd.MultiIndex.from_arrays([np.concatenate([models, models]),
+                                          np.concatenate([trims, np.full(len(df), ALL_TRIMS)])])
+        codes, groups = pd.factorize(keys)
+        X = _design(df, self.reference_year)
+        X = np.vstack([X, X])
+        y = np.tile(df['price'].to_numpy(dtype=np.float64) / 10000, 2)
+
+        coefficients, counts, rmse = fit_grouped(X, y, codes, len(groups))
+        age_mean = np.bincount(codes, weights=X[:, 2], minlength=len(groups)) / np.maximum(counts, 1)
+        mileage_max = pd.Series(X[:, 1]).groupby(codes).max().reindex(range(len(groups))).to_numpy()
+
+        result = pd.DataFrame({
+            'model': groups.get_level_values(0),
+            'trim': groups.get_level_values(1),
+            'intercept': coefficients[:, 0],
+            'mileage_coef': coefficients[:, 1],
+            'age_coef': coefficients[:, 2],
+            'observations': counts,
+            'rmse': rmse,
+            'age_mean': age_mean,
+            'mileage_max': mileage_max,
+        })
+        # 筆數不足的車款不保留，預測時改用車型層級
+        keep = (result['trim'] == ALL_TRIMS) | (result['observations'] >= MIN_GROUP_SIZE)
+        return result[keep].sort_values(['model', 'trim']).reset_index(drop=True)
+
+    def predict(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        預測合理價格與殘差
+
+        Args:
+            df: 含 model / trim / year / mileage / price 欄位的資料
+
+        Returns:
+            pd.DataFrame: 原資料加上 fair_price（元）與 residual（實際 - 合理，元）
+        """
+        if self.coefficients.empty:
+            self.fit()
+
+        result = df.copy()
+        coefficients = self.coefficients.set_index(['model', 'trim'])[
+            ['intercept', 'mileage_coef', 'age_coef']]
+        models = df['model'].astype(object).fillna('UNKNOWN').astype(str)
+        trims = df['trim'].astype(object).fillna('').astype(str)
+
+        # 先找車款層級係數，沒有時使用車型層級
+        trim_level = coefficients.reindex(pd.MultiIndex.from_arrays([models, trims])).to_numpy()
+        model_level = coefficients.reindex(
+            pd.MultiIndex.from_arrays([models, np.full(len(df), ALL_TRIMS)])).to_numpy()
+        coef = np.where(np.isnan(trim_level), model_level, trim_level)
+
+        X = _design(df, self.reference_year)
+        result['fair_price'] = np.einsum('nk,nk->n', X, coef) * 10000
+        result['residual'] = df['price'].to_numpy(dtype=np.float64) - result['fair_price']
+        return result
+
+    def fair_prices(self) -> pd.DataFrame:
+        """
+        每個 VIN 最新一筆觀測的合理價格與殘差（殘差為負表示低於合理價格）
+
+        Returns:
+            pd.DataFrame: vin / model / trim / year / mileage / price / fair_price / residual
+        """
+        df = self.storage.read_frame('''
+            SELECT vin, model, trim, year, mileage, price
+            FROM vehicle_prices
+            WHERE id IN (SELECT MAX(id) FROM vehicle_prices GROUP BY vin)
+              AND price IS NOT NULL AND mileage IS NOT NULL AND year IS NOT NULL
+        ''')
+        if df.empty:
+            return df
+        return self.predict(df).sort_values('residual').reset_index(drop=True)
+
+    def curves(self, points: int = 50) -> Dict[str, tuple]:
+        """
+        各車型在平均車齡下的折舊曲線（繪圖用）
+
+        Returns:
+            Dict[str, tuple]: 車型 → (里程（千公里）, 價格（萬元）)
+        """
+        curves = {}
+        for row in self.coefficients[self.coefficients['trim'] == ALL_TRIMS].itertuples():
+            x = np.linspace(0, row.mileage_max, points)
+            y = row.intercept + row.mileage_coef * x + row.age_coef * row.age_mean
+            curves[row.model] = (x * 10, y)
+        return curves
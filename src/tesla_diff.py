@@ -0,0 +1,194 @@
+#!/home/cclin/.local/python311/bin/python3
+"""
+Tesla 爬取輪次比對
+比較兩輪爬取的在架車輛：新增、移除，以及價格 / 里程 / 地點變動
+只讀取兩輪的投影欄位（sweep_id 索引），以 VIN 集合運算比對
+"""
+
+import sqlite3
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from tesla_retention import has_rollup_tier
+from tesla_fingerprint import FingerprintMap
+
+logger = logging.getLogger(__name__)
+
+# 比對的欄位
+DIFF_FIELDS = ['price', 'mileage', 'location']
+
+# 每輪車輛：VIN（缺少時為車輛指紋）→ 欄位值
+SweepSnapshot = Dict[str, Dict]
+
+
+def resolve_sweeps(conn: sqlite3.Connection, old_id: Optional[int] = None,
+                   new_id: Optional[int] = None) -> Tuple[Dict, Dict]:
+    """
+    決定要比對的兩輪（未指定時為最新一輪與前一輪；只指定 old_id 時與最新一輪比對）
+
+    Args:
+        conn: 資料庫連線
+        old_id: 較早的輪次
+        new_id: 較新的輪次
+
+    Returns:
+        Tuple[Dict, Dict]: 兩輪的 id / started_at / finished_at
+    """
+    def sweep(sweep_id: int) -> Dict:
+        row = conn.execute("SELECT id, started_at, finished_at FROM sweeps WHERE id = ?",
+                           (sweep_id,)).fetchone()
+        if row is None:
+            raise ValueError(f"找不到爬取輪次 {sweep_id}")
+        return {'id': row[0], 'started_at': row[1], 'finished_at': row[2]}
+
+    latest = [row[0] for row in conn.execute(
+        "SELECT id FROM sweeps ORDER BY started_at DESC, id DESC LIMIT 2")]
+    if new_id is None:
+        if old_id is None:
+            if len(latest) < 2:
+                raise ValueError("至少需要兩輪爬取才能比對")
+            new_id, old_id = latest
+        else:
+            new_id = latest[0]
+    if old_id is None:
+        row = conn.execute('''
+            SELECT id FROM sweeps
+            WHERE started_at < (SELECT started_at FROM sweeps WHERE id = ?)
+            ORDER BY started_at DESC, id DESC LIMIT 1
+        ''', (new_id,)).fetchone()
+        if row is None:
+            raise ValueError(f"爬取輪次 {new_id} 之前沒有可比對的輪次")
+        old_id = row[0]
+    return sweep(old_id), sweep(new_id)
+
+
+def load_snapshot(conn: sqlite3.Connection, sweep: Dict,
+                  aliases: Optional[Dict[str, str]] = None) -> SweepSnapshot:
+    """
+    讀取一輪的車輛（同一 VIN 取最後一筆；原始資料已被彙整時改讀每日彙整）
+
+    Args:
+        conn: 資料庫連線
+        sweep: resolve_sweeps 回傳的輪次
+        aliases: 指紋 → VIN（FingerprintMap.mapping；之後才得知 VIN 的車輛以 VIN 比對）
+
+    Returns:
+        SweepSnapshot: VIN → {model, price, mileage, location}
+    """
+    aliases = aliases or {}
+    snapshot: SweepSnapshot = {}
+    for vin, model, price, mileage, location in conn.execute('''
+        SELECT vin, model, price, mileage, location
+        FROM vehicle_prices WHERE sweep_id = ? AND vin IS NOT NULL ORDER BY id
+    ''', (sweep['id'],)):
+        snapshot[aliases.get(vin, vin)] = {'model': model, 'price': price, 'mileage': mileage, 'location': location}
+
+    if not snapshot and has_rollup_tier(conn):
+        for vin, model, price, mileage, location in conn.execute('''
+            SELECT vin, model, last_price, last_mileage, location
+            FROM vehicle_daily WHERE date = ?
+        ''', (str(sweep['started_at'])[:10],)):
+            snapshot[aliases.get(vin, vin)] = {'model': model, 'price': price, 'mileage': mileage, 'location': location}
+    return snapshot
+
+
+def diff_snapshots(old: SweepSnapshot, new: SweepSnapshot) -> Dict:
+    """
+    比對兩輪車輛
+
+    Args:
+        old: 較早一輪
+        new: 較新一輪
+
+    Returns:
+        Dict: added / removed / changed 清單與數量摘要
+    """
+    old_keys, new_keys = old.keys(), new.keys()
+    added = [dict(vin=vin, **new[vin]) for vin in sorted(new_keys - old_keys)]
+    removed = [dict(vin=vin, **old[vin]) for vin in sorted(old_keys - new_keys)]
+
+    changed = []
+    for vin in sorted(old_keys & new_keys):
+        before, after = old[vin], new[vin]
+        changes = {field: [before[field], after[field]] for field in DIFF_FIELDS
+                   if before[field] != after[field]}
+        if changes:
+            changed.append({'vin': vin, 'model': after['model'], 'changes': changes})
+
+    return {
+        'summary': {
+            'old_vehicles': len(old),
+            'new_vehicles': len(new),
+            'added': len(added),
+            'removed': len(removed),
+            'changed': len(changed),
+            'unchanged': len(old_keys & new_keys) - len(changed),
+        },
+        'added': added,
+        'removed': removed,
+        'changed': changed,
+    }
+
+
+def diff_sweeps(conn: sqlite3.Connection, old_id: Optional[int] = None,
+                new_id: Optional[int] = None) -> Dict:
+    """
+    比對兩輪爬取（參數同 resolve_sweeps）
+
+    Returns:
+        Dict: diff_snapshots 的結果，加上 old_sweep / new_sweep
+    """
+    old_sweep, new_sweep = resolve_sweeps(conn, old_id, new_id)
+    aliases = FingerprintMap(conn).mapping()
+    diff = diff_snapshots(load_snapshot(conn, old_sweep, aliases), load_snapshot(conn, new_sweep, aliases))
+    return {'old_sweep': old_sweep, 'new_sweep': new_sweep, **diff}
+
+
+def _value(field: str, value) -> str:
+    """表格用的欄位格式"""
+    if value is None:
+        return '-'
+    if field == 'price':
+        return f"NT${value:,}"
+    if field == 'mileage':
+        return f"{value:,} km"
+    return str(value)
+
+
+def format_diff(diff: Dict) -> str:
+    """
+    將比對結果排成可列印的表格
+
+    Args:
+        diff: diff_sweeps 的結果
+
+    Returns:
+        str: 表格文字
+    """
+    old_sweep, new_sweep, summary = diff['old_sweep'], diff['new_sweep'], diff['summary']
+    lines = [
+        f"輪次 {old_sweep['id']} ({old_sweep['started_at']}) → "
+        f"輪次 {new_sweep['id']} ({new_sweep['started_at']})",
+        f"車輛 {summary['old_vehicles']} → {summary['new_vehicles']}："
+        f"新增 {summary['added']} / 移除 {summary['removed']} / "
+        f"變動 {summary['changed']} / 未變 {summary['unchanged']}",
+    ]
+
+    def vehicle_rows(title: str, marker: str, vehicles: List[Dict]):
+        if not vehicles:
+            return
+        lines.append(f"\n{title}:")
+        for vehicle in vehicles:
+            lines.append(f"  {marker} {vehicle['vin']:<20} {str(vehicle['model']):<10} "
+                         f"{_value('price', vehicle['price']):>14} "
+                         f"{_value('mileage', vehicle['mileage']):>12}  {_value('location', vehicle['location'])}")
+
+    vehicle_rows('新增', '+', diff['added'])
+    vehicle_rows('移除', '-', diff['removed'])
+    if diff['changed']:
+        lines.append("\n變動:")
+        for vehicle in diff['changed']:
+            changes = '; '.join(f"{field} {_value(field, before)} → {_value(field, after)}"
+                                for field, (before, after) in vehicle['changes'].items())
+            lines.append(f"  ~ {vehicle['vin']:<20} {str(vehicle['model']):<10} {changes}")
+    return '\n'.join(lines)
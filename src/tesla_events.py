@@ -0,0 +1,232 @@
+#!/home/cclin/.local/python311/bin/python3
+"""
+Tesla 價格變動事件
+寫入觀測時以每個 VIN 的最新價格索引即時偵測降價 / 漲價，事件寫入 events 表格與 JSON Lines 檔
+"""
+
+import json
+import sqlite3
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 預設事件檔
+EVENTS_FILE = 'tesla_events.jsonl'
+
+# 事件類型
+PRICE_CUT = 'price_cut'
+PRICE_RISE = 'price_rise'
+
+# 事件欄位（events 表格與 JSON 共用）
+EVENT_FIELDS = ['vin', 'model', 'event_type', 'old_price', 'new_price', 'price_change',
+                'change_percentage', 'previous_seen', 'seen_at', 'detected_at']
+
+
+class PriceEventDetector:
+    """以 dict 保存每個 VIN 的 (最新價格, 觀測時間)，每筆觀測 O(1) 比對"""
+
+    def __init__(self, conn: sqlite3.Connection, events_path: Optional[str] = EVENTS_FILE,
+                 min_change: int = 1):
+        """
+        初始化偵測器
+
+        Args:
+            conn: 資料庫連線
+            events_path: JSON Lines 事件檔（None 表示只寫入資料表）
+            min_change: 價格變動至少此金額（元）才產生事件
+        """
+        self.conn = conn
+        self.events_path = events_path
+        self.min_change = min_change
+        self._index: Optional[Dict[str, Tuple[int, str]]] = None
+        self._dirty: Dict[str, Tuple[int, str]] = {}
+        self._pending: List[Dict] = []
+
+    def init_schema(self):
+        """建立事件與最新價格索引表格；索引為空時由既有觀測回填"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                vin TEXT NOT NULL,
+                model TEXT,
+                event_type TEXT NOT NULL,
+                old_price INTEGER,
+                new_price INTEGER,
+                price_change INTEGER,
+                change_percentage REAL,
+                previous_seen DATETIME,
+                seen_at DATETIME,
+                detected_at DATETIME
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_events_seen ON events(seen_at)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_events_vin ON events(vin)")
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS vin_last_price (
+                vin TEXT PRIMARY KEY,
+                price INTEGER NOT NULL,
+                seen_at DATETIME NOT NULL
+            ) WITHOUT ROWID
+        ''')
+
+        if not cursor.execute("SELECT 1 FROM vin_last_price LIMIT 1").fetchone():
+            filled = self._fill_index(cursor)
+            if filled > 0:
+                logger.info(f"已回填 {filled} 輛車的最新價格索引")
+
+    @staticmethod
+    def _fill_index(cursor: sqlite3.Cursor) -> int:
+        """由既有觀測寫入每個 VIN 的最新價格（依觀測時間；補寫的舊資料 id 較大，不能以 id 判斷）"""
+        cursor.execute('''
+            INSERT INTO vin_last_price (vin, price, seen_at)
+            SELECT vin, price, scrape_datetime FROM (
+                SELECT vin, price, scrape_datetime,
+                       ROW_NUMBER() OVER (PARTITION BY vin ORDER BY scrape_datetime DESC, id DESC) AS rn
+                FROM vehicle_prices
+                WHERE vin IS NOT NULL AND price IS NOT NULL
+            )
+            WHERE rn = 1
+        ''')
+        return cursor.rowcount
+
+    def rebuild(self, since: str) -> int:
+        """
+        觀測被就地修改後（例如重新解析）重建最新價格索引與 since 之後的事件（由呼叫端 commit）
+
+        前一筆觀測已被保留策略刪除的事件無法重算，維持原樣；事件檔只附加，不改寫。
+
+        Args:
+            since: 重建此時間（含）之後觀測到的事件，可只給日期
+
+        Returns:
+            int: 重建的事件數
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("DELETE FROM vin_last_price")
+        self._fill_index(cursor)
+        self._index, self._dirty, self._pending = None, {}, []
+
+        earliest = cursor.execute("SELECT MIN(scrape_datetime) FROM vehicle_prices").fetchone()[0]
+        if earliest is None:
+            return 0
+        cursor.execute("DELETE FROM events WHERE seen_at >= ? AND previous_seen >= ?",
+                       (since, str(earliest)))
+
+        # 與 observe() 相同：依觀測時間逐筆比對同一 VIN 的前一個價格
+        cursor.execute(f'''
+            WITH observations AS (
+                SELECT vin, model, price, scrape_datetime AS seen_at,
+                       LAG(price) OVER w AS old_price,
+                       LAG(scrape_datetime) OVER w AS previous_seen
+                FROM vehicle_prices
+                WHERE vin IS NOT NULL AND price IS NOT NULL AND scrape_datetime IS NOT NULL
+                WINDOW w AS (PARTITION BY vin ORDER BY scrape_datetime)
+            )
+            INSERT INTO events ({', '.join(EVENT_FIELDS)})
+            SELECT vin, model,
+                   CASE WHEN price < old_price THEN '{PRICE_CUT}' ELSE '{PRICE_RISE}' END,
+                   old_price, price, price - old_price,
+                   CASE WHEN old_price THEN ROUND((price - old_price) * 100.0 / old_price, 2) END,
+                   previous_seen, seen_at, ?
+            FROM observations
+            WHERE old_price IS NOT NULL AND seen_at >= ? AND ABS(price - old_price) >= ?
+            ORDER BY seen_at
+        ''', (datetime.now().isoformat(sep=' ', timespec='seconds'), since, max(self.min_change, 1)))
+        return cursor.rowcount
+
+    def _load_index(self) -> Dict[str, Tuple[int, str]]:
+        """第一次使用時載入索引（每個 VIN 一筆）"""
+        if self._index is None:
+            self._index = {vin: (price, str(seen_at)) for vin, price, seen_at in
+                           self.conn.execute("SELECT vin, price, seen_at FROM vin_last_price")}
+        return self._index
+
+    def observe(self, vin: Optional[str], model: Optional[str], price: Optional[int],
+                seen_at) -> Optional[Dict]:
+        """
+        比對一筆新觀測
+
+        Args:
+            vin: 車輛識別碼
+            model: 車型
+            price: 價格
+            seen_at: 觀測時間
+
+        Returns:
+            Optional[Dict]: 價格變動時的事件
+        """
+        if not vin or price is None or seen_at is None:
+            return None
+
+        index = self._load_index()
+        seen_at = str(seen_at)
+        previous = index.get(vin)
+
+        # 補寫較舊的觀測不影響最新價格
+        if previous is not None and seen_at <= previous[1]:
+            return None
+
+        index[vin] = self._dirty[vin] = (price, seen_at)
+        if previous is None:
+            return None
+
+        old_price, previous_seen = previous
+        change = price - old_price
+        if abs(change) < max(self.min_change, 1):
+            return None
+
+        event = {
+            'vin': vin,
+            'model': model,
+            'event_type': PRICE_CUT if change < 0 else PRICE_RISE,
+            'old_price': old_price,
+            'new_price': price,
+            'price_change': change,
+            'change_percentage': round(change / old_price * 100, 2) if old_price else None,
+            'previous_seen': previous_seen,
+            'seen_at': seen_at,
+            'detected_at': datetime.now().isoformat(sep=' ', timespec='seconds'),
+        }
+        self._pending.append(event)
+        return event
+
+    def flush(self) -> List[Dict]:
+        """
+        將索引變更與事件寫入資料表（與觀測同一個交易，由呼叫端 commit）
+
+        Returns:
+            List[Dict]: 本批事件，commit 後以 publish() 寫入事件檔
+        """
+        if self._dirty:
+            self.conn.executemany('''
+                INSERT INTO vin_last_price (vin, price, seen_at) VALUES (?, ?, ?)
+                ON CONFLICT(vin) DO UPDATE SET price = excluded.price, seen_at = excluded.seen_at
+            ''', [(vin, price, seen_at) for vin, (price, seen_at) in self._dirty.items()])
+            self._dirty = {}
+
+        events, self._pending = self._pending, []
+        if events:
+            self.conn.executemany(f'''
+                INSERT INTO events ({', '.join(EVENT_FIELDS)})
+                VALUES ({', '.join('?' * len(EVENT_FIELDS))})
+            ''', [tuple(event[field] for field in EVENT_FIELDS) for event in events])
+        return events
+
+    def publish(self, events: List[Dict]):
+        """將已提交的事件附加到 JSON Lines 檔"""
+        if not events or not self.events_path:
+            return
+        with open(self.events_path, 'a', encoding='utf-8') as f:
+            for event in events:
+                f.write(json.dumps(event, ensure_ascii=False) + '\n')
+        logger.info(f"偵測到 {len(events)} 筆價格變動事件")
+
+    def recent(self, limit: int = 20) -> List[Dict]:
+        """最近的事件（新到舊）"""
+        rows = self.conn.execute(f'''
+            SELECT {', '.join(EVENT_FIELDS)} FROM events ORDER BY id DESC LIMIT ?
+        ''', (limit,)).fetchall()
+        return [dict(zip(EVENT_FIELDS, row)) for row in rows]
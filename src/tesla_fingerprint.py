@@ -0,0 +1,195 @@
+#!/home/cclin/.local/python311/bin/python3
+"""
+Tesla 車輛指紋
+沒有 VIN 的車輛以正規化後的穩定欄位（網址代碼、data-id、年份 / 車款 / 里程 / 顏色）計算指紋，
+不含價格與爬取時間，同一輛車在每次滾動與每輪爬取都得到相同識別碼；
+指紋與 VIN 的對應存於 vehicle_fingerprints 表格，之後只看到指紋時可還原為 VIN
+"""
+
+import re
+import sqlite3
+import hashlib
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# 指紋前綴（與 VIN 及舊版 12 碼 MD5 識別碼區分）
+FINGERPRINT_PREFIX = 'fp_'
+
+# 網址代碼為 17 碼 VIN 時直接作為 VIN（不含 I / O / Q）
+VIN_PATTERN = re.compile(r'^[A-HJ-NPR-Z0-9]{17}$')
+
+# 可作為車輛代碼的最短長度（需含數字）
+MIN_SLUG_LENGTH = 8
+
+# 沒有網址與 data-id 時使用的屬性欄位（價格會調整、地點可能轉移，皆不納入）
+ATTRIBUTE_FIELDS = ('model', 'year', 'trim', 'mileage', 'exterior_color')
+
+
+def _normalize(value) -> str:
+    """忽略大小寫與空白；None 為空字串"""
+    if value is None:
+        return ''
+    return ''.join(str(value).split()).upper()
+
+
+def listing_slug(url: Optional[str]) -> Optional[str]:
+    """
+    取出車輛頁面網址的最後一段路徑（忽略網域、語系與查詢參數；列表頁等非車輛網址回傳 None）
+
+    Args:
+        url: 車輛頁面網址
+
+    Returns:
+        Optional[str]: 正規化後的代碼，沒有時為 None
+    """
+    if not url:
+        return None
+    segments = [segment for segment in urlsplit(str(url)).path.split('/') if segment]
+    if not segments:
+        return None
+    slug = _normalize(segments[-1])
+    # 'used'、'my' 之類的列表頁路徑不是單一車輛的代碼
+    return slug if len(slug) >= MIN_SLUG_LENGTH and any(c.isdigit() for c in slug) else None
+
+
+def vin_from_url(url: Optional[str]) -> Optional[str]:
+    """網址代碼是 VIN 時回傳 VIN"""
+    slug = listing_slug(url)
+    return slug if slug and VIN_PATTERN.match(slug) else None
+
+
+def is_specific(vehicle) -> bool:
+    """指紋是否足以區分單一車輛（有網址代碼、data-id 或里程）"""
+    return bool(listing_slug(vehicle.get('listing_url')) or _normalize(vehicle.get('data_id'))
+                or vehicle.get('mileage') is not None)
+
+
+def vehicle_fingerprint(vehicle) -> str:
+    """
+    計算車輛指紋（優先使用網址代碼，其次 data-id，最後為車型 / 年份 / 車款 / 里程 / 顏色）
+
+    連里程都沒有時再加入價格，避免同款車輛互相覆蓋（這類指紋在降價後會改變，也不建立 VIN 對應）。
+
+    Args:
+        vehicle: VehicleRecord 或 dict（以 get() 讀取欄位）
+
+    Returns:
+        str: 'fp_' 加 16 碼十六進位
+    """
+    slug = listing_slug(vehicle.get('listing_url'))
+    data_id = _normalize(vehicle.get('data_id'))
+    if slug:
+        material = f"url|{slug}"
+    elif data_id:
+        material = f"id|{_normalize(vehicle.get('model'))}|{data_id}"
+    else:
+        fields = ATTRIBUTE_FIELDS if vehicle.get('mileage') is not None else ATTRIBUTE_FIELDS + ('price',)
+        material = 'attr|' + '|'.join(_normalize(vehicle.get(field)) for field in fields)
+    return FINGERPRINT_PREFIX + hashlib.blake2b(material.encode(), digest_size=8).hexdigest()
+
+
+def is_fingerprint(key: Optional[str]) -> bool:
+    """識別碼是否為指紋"""
+    return bool(key) and str(key).startswith(FINGERPRINT_PREFIX)
+
+
+class FingerprintMap:
+    """指紋 → VIN 對應（vehicle_fingerprints 表格，第一次使用時整表載入記憶體）"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        """
+        初始化對應表
+
+        Args:
+            conn: 資料庫連線
+        """
+        self.conn = conn
+        self._vins: Optional[Dict[str, str]] = None
+        self._candidates: Dict[str, Set[str]] = {}
+
+    def init_schema(self):
+        """建立對應表格"""
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS vehicle_fingerprints (
+                fingerprint TEXT PRIMARY KEY,
+                vin TEXT NOT NULL,
+                linked_at DATETIME
+            ) WITHOUT ROWID
+        ''')
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_vehicle_fingerprints_vin "
+                          "ON vehicle_fingerprints(vin)")
+
+    def mapping(self) -> Dict[str, str]:
+        """所有指紋 → VIN（資料表不存在時為空）"""
+        if self._vins is None:
+            exists = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'vehicle_fingerprints'"
+            ).fetchone()
+            self._vins = dict(self.conn.execute(
+                "SELECT fingerprint, vin FROM vehicle_fingerprints")) if exists else {}
+        return self._vins
+
+    def canonical(self, key: Optional[str]) -> Optional[str]:
+        """將指紋還原為已知的 VIN（其他識別碼原樣回傳）"""
+        if not is_fingerprint(key):
+            return key
+        return self.mapping().get(key, key)
+
+    def resolve(self, vehicle) -> Optional[str]:
+        """
+        決定一筆觀測寫入的車輛識別碼，並記下本批看到的指紋 → VIN 候選對應
+
+        有 VIN 時回傳 VIN；沒有時回傳指紋已知對應的 VIN，否則回傳指紋本身。
+        候選對應到 take_linked() 時才寫入。
+
+        Args:
+            vehicle: VehicleRecord 或 dict
+
+        Returns:
+            Optional[str]: 車輛識別碼
+        """
+        unique_id = vehicle.get('unique_id')
+        fingerprint = unique_id if is_fingerprint(unique_id) else vehicle_fingerprint(vehicle)
+        vin = vehicle.get('vin')
+        if not vin:
+            return self.mapping().get(fingerprint, fingerprint)
+
+        if is_specific(vehicle):
+            self._candidates.setdefault(fingerprint, set()).add(vin)
+        return vin
+
+    def take_linked(self) -> List[Tuple[str, str]]:
+        """
+        寫入並取出本批新建立的 (指紋, VIN) 對應（由呼叫端合併以指紋記錄的舊資料）
+
+        同一批中對應到多個 VIN 的指紋無法區分車輛，不建立對應；
+        已對應到其他 VIN 的指紋維持原對應，不會來回改寫。
+
+        Returns:
+            List[Tuple[str, str]]: 新對應
+        """
+        candidates, self._candidates = self._candidates, {}
+        vins = self.mapping()
+        linked = []
+        for fingerprint, candidate_vins in candidates.items():
+            if len(candidate_vins) > 1:
+                logger.debug(f"指紋 {fingerprint} 在同一批對應到 {len(candidate_vins)} 個 VIN，不建立對應")
+                continue
+            vin = next(iter(candidate_vins))
+            if fingerprint in vins:
+                if vins[fingerprint] != vin:
+                    logger.debug(f"指紋 {fingerprint} 已對應到 {vins[fingerprint]}，不改為 {vin}")
+                continue
+            vins[fingerprint] = vin
+            linked.append((fingerprint, vin))
+
+        linked_at = datetime.now().isoformat(sep=' ', timespec='seconds')
+        self.conn.executemany('''
+            INSERT OR IGNORE INTO vehicle_fingerprints (fingerprint, vin, linked_at)
+            VALUES (?, ?, ?)
+        ''', [(fingerprint, vin, linked_at) for fingerprint, vin in linked])
+        return linked
@@ -0,0 +1,329 @@
+#!/home/cclin/.local/python311/bin/python3
+"""
+Tesla 上架生命週期
+每輪爬取（sweep）結束時，以本輪 VIN 集合與在架清單比對，增量維護首次 / 最後出現、下架售價與在架天數
+"""
+
+import sqlite3
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from tesla_retention import has_rollup_tier
+from tesla_fingerprint import FingerprintMap
+
+logger = logging.getLogger(__name__)
+
+# 上架狀態
+ACTIVE = 'active'
+SOLD = 'sold'
+
+# 本輪看到的車輛：VIN → (車型, 車款, 年份, 價格, 觀測時間)
+SweepVehicles = Dict[str, Tuple[str, Optional[str], Optional[int], Optional[int], str]]
+
+
+class ListingTracker:
+    """每輛車一列的上架生命週期（listings 表格）與爬取輪次紀錄（sweeps 表格）"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        """
+        初始化追蹤器
+
+        Args:
+            conn: 資料庫連線
+        """
+        self.conn = conn
+
+    def init_schema(self):
+        """建立表格與索引；listings 為空且已有觀測時由歷史資料回填"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sweeps (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                started_at DATETIME NOT NULL,
+                finished_at DATETIME,
+                observations INTEGER,
+                vins INTEGER,
+                models TEXT,
+                new_listings INTEGER,
+                relisted INTEGER,
+                delisted INTEGER,
+                legacy INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS listings (
+                vin TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                trim TEXT,
+                year INTEGER,
+                status TEXT NOT NULL,
+                first_seen DATETIME NOT NULL,
+                last_seen DATETIME NOT NULL,
+                first_sweep_id INTEGER,
+                last_sweep_id INTEGER,
+                first_price INTEGER,
+                last_price INTEGER,
+                min_price INTEGER,
+                max_price INTEGER,
+                sightings INTEGER NOT NULL,
+                relists INTEGER NOT NULL DEFAULT 0,
+                sold_at DATETIME,
+                sale_price INTEGER,
+                days_on_market REAL
+            )
+        ''')
+        # 比對在架清單、上架 / 下架期間統計與車型 / 車款分組皆走索引
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_listings_status_model ON listings(status, model)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_listings_first_seen ON listings(first_seen)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_listings_sold_at ON listings(sold_at)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_listings_model_trim ON listings(model, trim)")
+
+        if not cursor.execute("SELECT 1 FROM listings LIMIT 1").fetchone():
+            if cursor.execute("SELECT 1 FROM vehicle_prices LIMIT 1").fetchone():
+                logger.info("回填上架生命週期...")
+                self.rebuild()
+
+    def begin_sweep(self, started_at: str) -> int:
+        """
+        建立新的爬取輪次
+
+        Args:
+            started_at: 本輪第一筆觀測時間
+
+        Returns:
+            int: sweep_id
+        """
+        return self.conn.execute("INSERT INTO sweeps (started_at) VALUES (?)",
+                                 (started_at,)).lastrowid
+
+    def end_sweep(self, sweep_id: int, seen: SweepVehicles) -> Dict:
+        """
+        結束爬取輪次：更新本輪看到的車輛，並將本輪涵蓋車型中未再出現的在架車輛標為已售出
+
+        只比對本輪有資料的車型，某車型爬取失敗時不會將其所有車輛誤判為售出。
+        在架天數為首次到最後一次出現的間隔。
+
+        Args:
+            sweep_id: begin_sweep 的回傳值
+            seen: 本輪看到的車輛（同一 VIN 只保留最後一筆）
+
+        Returns:
+            Dict: 本輪的 new_listings / relisted / delisted 數量
+        """
+        cursor = self.conn.cursor()
+        started_at = cursor.execute("SELECT started_at FROM sweeps WHERE id = ?",
+                                    (sweep_id,)).fetchone()[0]
+
+        cursor.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS sweep_seen (
+                vin TEXT PRIMARY KEY, model TEXT, trim TEXT, year INTEGER,
+                price INTEGER, seen_at DATETIME
+            )
+        ''')
+        cursor.execute("DELETE FROM sweep_seen")
+        cursor.executemany("INSERT OR REPLACE INTO sweep_seen VALUES (?, ?, ?, ?, ?, ?)",
+                           [(vin,) + values for vin, values in seen.items()])
+
+        new_listings = cursor.execute('''
+            SELECT COUNT(*) FROM sweep_seen s
+            WHERE NOT EXISTS (SELECT 1 FROM listings l WHERE l.vin = s.vin)
+        ''').fetchone()[0]
+        relisted = cursor.execute(f'''
+            SELECT COUNT(*) FROM sweep_seen s JOIN listings l ON l.vin = s.vin
+            WHERE l.status = '{SOLD}'
+        ''').fetchone()[0]
+
+        # UPDATE 右側一律讀取舊值，relists 以更新前的狀態判斷
+        cursor.execute(f'''
+            INSERT INTO listings
+                (vin, model, trim, year, status, first_seen, last_seen, first_sweep_id,
+                 last_sweep_id, first_price, last_price, min_price, max_price, sightings, relists)
+            SELECT vin, model, trim, year, '{ACTIVE}', seen_at, seen_at, ?, ?,
+                   price, price, price, price, 1, 0
+            FROM sweep_seen WHERE true
+            ON CONFLICT(vin) DO UPDATE SET
+                model = excluded.model,
+                trim = COALESCE(excluded.trim, trim),
+                year = COALESCE(excluded.year, year),
+                relists = relists + (status = '{SOLD}'),
+                status = '{ACTIVE}',
+                last_seen = MAX(last_seen, excluded.last_seen),
+                last_sweep_id = excluded.last_sweep_id,
+                last_price = COALESCE(excluded.last_price, last_price),
+                min_price = MIN(COALESCE(min_price, excluded.min_price), COALESCE(excluded.min_price, min_price)),
+                max_price = MAX(COALESCE(max_price, excluded.max_price), COALESCE(excluded.max_price, max_price)),
+                sightings = sightings + 1,
+                sold_at = NULL,
+                sale_price = NULL,
+                days_on_market = NULL
+        ''', (sweep_id, sweep_id))
+
+        models = sorted({values[0] for values in seen.values()})
+        delisted = 0
+        if models:
+            delisted = cursor.execute(f'''
+                UPDATE listings
+                SET status = '{SOLD}', sold_at = ?, sale_price = last_price,
+                    days_on_market = ROUND(julianday(last_seen) - julianday(first_seen), 2)
+                WHERE status = '{ACTIVE}' AND model IN ({', '.join('?' * len(models))})
+                  AND vin NOT IN (SELECT vin FROM sweep_seen)
+            ''', [started_at] + models).rowcount
+
+        finished_at = max((values[4] for values in seen.values()), default=started_at)
+        cursor.execute('''
+            UPDATE sweeps SET finished_at = ?, vins = ?, models = ?,
+                   new_listings = ?, relisted = ?, delisted = ?,
+                   observations = (SELECT COUNT(*) FROM vehicle_prices WHERE sweep_id = ?)
+            WHERE id = ?
+        ''', (finished_at, len(seen), ','.join(models), new_listings, relisted, delisted,
+              sweep_id, sweep_id))
+        cursor.execute("DELETE FROM sweep_seen")
+
+        return {'new_listings': new_listings, 'relisted': relisted, 'delisted': delisted}
+
+    def merge_alias(self, alias: str, vin: str):
+        """
+        將以指紋記錄的車輛併入其 VIN（之後才得知 VIN 的車輛不會被當成一輛下架、一輛新上架）
+
+        Args:
+            alias: 車輛指紋
+            vin: 對應的 VIN
+        """
+        cursor = self.conn.cursor()
+        if not cursor.execute("SELECT 1 FROM listings WHERE vin = ?", (alias,)).fetchone():
+            return
+        if not cursor.execute("SELECT 1 FROM listings WHERE vin = ?", (vin,)).fetchone():
+            cursor.execute("UPDATE listings SET vin = ? WHERE vin = ?", (vin, alias))
+            return
+
+        # 兩筆皆存在：保留較早的首次出現與較晚的最後出現，狀態取最後出現的一筆
+        cursor.execute('''
+            UPDATE listings AS l SET
+                first_seen = MIN(l.first_seen, a.first_seen),
+                first_sweep_id = CASE WHEN a.first_seen < l.first_seen THEN a.first_sweep_id ELSE l.first_sweep_id END,
+                first_price = CASE WHEN a.first_seen < l.first_seen THEN a.first_price ELSE l.first_price END,
+                status = CASE WHEN a.last_seen > l.last_seen THEN a.status ELSE l.status END,
+                sold_at = CASE WHEN a.last_seen > l.last_seen THEN a.sold_at ELSE l.sold_at END,
+                sale_price = CASE WHEN a.last_seen > l.last_seen THEN a.sale_price ELSE l.sale_price END,
+                last_seen = MAX(l.last_seen, a.last_seen),
+                last_sweep_id = CASE WHEN a.last_seen > l.last_seen THEN a.last_sweep_id ELSE l.last_sweep_id END,
+                last_price = CASE WHEN a.last_seen > l.last_seen THEN a.last_price ELSE l.last_price END,
+                min_price = MIN(COALESCE(l.min_price, a.min_price), COALESCE(a.min_price, l.min_price)),
+                max_price = MAX(COALESCE(l.max_price, a.max_price), COALESCE(a.max_price, l.max_price)),
+                sightings = l.sightings + a.sightings,
+                relists = l.relists + a.relists,
+                trim = COALESCE(l.trim, a.trim),
+                year = COALESCE(l.year, a.year)
+            FROM (SELECT * FROM listings WHERE vin = ?) AS a
+            WHERE l.vin = ?
+        ''', (alias, vin))
+        cursor.execute(f'''
+            UPDATE listings SET days_on_market = ROUND(julianday(last_seen) - julianday(first_seen), 2)
+            WHERE vin = ? AND status = '{SOLD}'
+        ''', (vin,))
+        cursor.execute("DELETE FROM listings WHERE vin = ?", (alias,))
+
+    def _assign_legacy_sweeps(self):
+        """沒有 sweep_id 的舊資料（與已被彙整的日期）以每個日期視為一輪"""
+        cursor = self.conn.cursor()
+        days = {day: (first, last) for day, first, last in cursor.execute('''
+            SELECT date(scrape_datetime), MIN(scrape_datetime), MAX(scrape_datetime)
+            FROM vehicle_prices WHERE sweep_id IS NULL GROUP BY 1
+        ''')}
+        if has_rollup_tier(self.conn):
+            covered = {row[0] for row in cursor.execute("SELECT DISTINCT date(started_at) FROM sweeps")}
+            for day, first, last in cursor.execute(
+                    "SELECT date, MIN(last_seen), MAX(last_seen) FROM vehicle_daily GROUP BY date"):
+                if day not in covered:
+                    first_raw, last_raw = days.get(day, (first, last))
+                    days[day] = (min(first, first_raw), max(last, last_raw))
+
+        for day in sorted(days):
+            first, last = days[day]
+            sweep_id = cursor.execute(
+                "INSERT INTO sweeps (started_at, finished_at, legacy) VALUES (?, ?, 1)",
+                (first, last)).lastrowid
+            next_day = (datetime.strptime(day, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+            cursor.execute('''
+                UPDATE vehicle_prices SET sweep_id = ?
+                WHERE sweep_id IS NULL AND scrape_datetime >= ? AND scrape_datetime < ?
+            ''', (sweep_id, day, next_day))
+        if days:
+            logger.info(f"舊資料已依日期分為 {len(days)} 輪")
+
+    def _sweep_vehicles(self, sweep_id: int, started_at: str, raw_start: Optional[str],
+                        aliases: Dict[str, str]) -> SweepVehicles:
+        """重播用：某一輪看到的車輛（原始資料已被保留策略刪除的日期改讀每日彙整；已知 VIN 的指紋還原為 VIN）"""
+        seen: SweepVehicles = {}
+        if raw_start is None or str(started_at)[:10] <= raw_start:
+            if has_rollup_tier(self.conn):
+                for vin, model, trim, year, price, seen_at in self.conn.execute('''
+                    SELECT vin, COALESCE(model, 'UNKNOWN'), trim, year, last_price, last_seen
+                    FROM vehicle_daily WHERE date = ?
+                ''', (str(started_at)[:10],)):
+                    seen[aliases.get(vin, vin)] = (model, trim, year, price, seen_at)
+        for vin, model, trim, year, price, seen_at in self.conn.execute('''
+            SELECT vin, COALESCE(model, 'UNKNOWN'), trim, year, price, scrape_datetime
+            FROM vehicle_prices WHERE sweep_id = ? AND vin IS NOT NULL ORDER BY id
+        ''', (sweep_id,)):
+            seen[aliases.get(vin, vin)] = (model, trim, year, price, seen_at)
+        return seen
+
+    def rebuild(self):
+        """依輪次順序重播所有歷史觀測，重建 listings"""
+        self._assign_legacy_sweeps()
+        self.conn.execute("DELETE FROM listings")
+        raw_start = self.conn.execute(
+            "SELECT MIN(date(scrape_datetime)) FROM vehicle_prices").fetchone()[0]
+
+        aliases = FingerprintMap(self.conn).mapping()
+        sweeps = self.conn.execute("SELECT id, started_at FROM sweeps ORDER BY started_at, id").fetchall()
+        for sweep_id, started_at in sweeps:
+            self.end_sweep(sweep_id, self._sweep_vehicles(sweep_id, started_at, raw_start, aliases))
+        logger.info(f"已重播 {len(sweeps)} 輪爬取")
+
+    def turnover(self, start_date: Optional[str] = None, end_date: Optional[str] = None) -> List[Dict]:
+        """
+        各車型在日期區間內的上架 / 售出數量、平均在架天數與售價，以及目前在架數
+
+        Args:
+            start_date: 起始日期（含）
+            end_date: 結束日期（含）
+
+        Returns:
+            List[Dict]: 每個車型一筆
+        """
+        def window(column: str) -> Tuple[str, list]:
+            conditions, params = [], []
+            if start_date:
+                conditions.append(f"{column} >= ?")
+                params.append(start_date)
+            if end_date:
+                conditions.append(f"{column} < date(?, '+1 day')")
+                params.append(end_date)
+            return ' AND '.join(conditions) or '1', params
+
+        listed_where, listed_params = window('first_seen')
+        sold_where, sold_params = window('sold_at')
+        report: Dict[str, Dict] = {}
+
+        def row(model: str) -> Dict:
+            return report.setdefault(model, {
+                'model': model, 'listed': 0, 'sold': 0, 'active': 0,
+                'avg_days_on_market': None, 'avg_sale_price': None,
+            })
+
+        for model, listed in self.conn.execute(
+                f"SELECT model, COUNT(*) FROM listings WHERE {listed_where} GROUP BY model",
+                listed_params):
+            row(model)['listed'] = listed
+        for model, sold, days, price in self.conn.execute(f'''
+            SELECT model, COUNT(*), AVG(days_on_market), AVG(sale_price)
+            FROM listings WHERE sold_at IS NOT NULL AND {sold_where} GROUP BY model
+        ''', sold_params):
+            row(model).update({'sold': sold, 'avg_days_on_market': days, 'avg_sale_price': price})
+        for model, active in self.conn.execute(
+                f"SELECT model, COUNT(*) FROM listings WHERE status = '{ACTIVE}' GROUP BY model"):
+            row(model)['active'] = active
+        return [report[model] for model in sorted(report)]
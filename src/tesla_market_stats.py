@@ -0,0 +1,421 @@
+#!/home/cclin/.local/python311/bin/python3
+"""
+Tesla 市場統計
+以單次向量化分組計算各車型 / 年份 / 顏色 / 價格區間統計，供所有圖表與文字報表共用
+"""
+
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from tesla_aggregates import AggregateStore, PRICE_BANDS
+from tesla_storage import HEATMAP_MAX_COLUMNS, heatmap_bucket
+from tesla_sketches import SketchStore, BAND_QUANTILES, ROLLING_DAYS
+
+# 價格區間邊界（元），與 PRICE_BANDS 對應
+BAND_EDGES = np.array([low * 10000 for low, _, _ in PRICE_BANDS[1:]], dtype=np.int64)
+BAND_LABELS = [label for _, _, label in PRICE_BANDS]
+
+# 外觀顏色最多顯示數量
+TOP_COLORS = 8
+
+# 超過此點數時，價格與里程散點圖改以 2-D 分組密度繪製
+SCATTER_POINT_LIMIT = 20000
+# 密度圖分組數（里程, 價格）
+DENSITY_BINS = (120, 80)
+# 每條趨勢線的最多點數，超過時以 LTTB 降採樣
+TREND_POINT_LIMIT = 600
+
+# 熱力圖時間分組的 pandas 週期與欄標籤格式
+BUCKET_PERIODS = {'day': 'D', 'week': 'W-SUN', 'month': 'M'}
+_BUCKET_LABELS = {'day': '%Y-%m-%d', 'week': '%Y-%m-%d', 'month': '%Y-%m'}
+
+
+class MarketStats:
+    """市場統計結果（圖表與報表只讀取此物件，不再掃描原始資料）"""
+
+    def __init__(self):
+        # 整體統計：count / price_mean / price_median / price_min / price_max / price_std
+        #           / unique_vins / first_seen / last_seen（有分位數草圖時另有 price_p10 / price_p90）
+        self.overall: Dict = {'count': 0}
+        # 各車型統計（index 為車型）：count / price_mean / price_min / price_max
+        #           / price_q1 / price_median / price_q3 / mileage_mean
+        self.per_model = pd.DataFrame()
+        # 各年份 / 顏色數量
+        self.per_year = pd.Series(dtype='int64')
+        self.per_color = pd.Series(dtype='int64')
+        # 價格區間數量（index 為區間標籤，順序與 PRICE_BANDS 相同）
+        self.per_band = pd.Series(0, index=BAND_LABELS, dtype='int64')
+        # 每日觀測數
+        self.daily_counts = pd.Series(dtype='int64')
+        # 價格直方圖（萬元）：(counts, edges)
+        self.price_histogram = (np.zeros(0), np.zeros(0))
+        # 箱型圖統計（Axes.bxp 格式）
+        self.box_stats: List[Dict] = []
+        # 各車型的 (里程, 價格) 陣列（資料量超過 SCATTER_POINT_LIMIT 時不保留）
+        self.points_by_model: Dict[str, tuple] = {}
+        # 價格與里程 2-D 密度：(counts, 里程邊界（千公里）, 價格邊界（萬元）)
+        self.scatter_density: Optional[tuple] = None
+        # 價格對里程的整體線性趨勢係數（萬元 / 千公里）
+        self.trend_coefficients: Optional[np.ndarray] = None
+        # 各車型折舊曲線：(里程（千公里）, 價格（萬元）)，有值時取代整體趨勢線
+        self.depreciation_curves: Dict[str, tuple] = {}
+        # 價格趨勢：各日期 × 車型平均價格（date_recorded / model / price）
+        self.trend_daily_avg = pd.DataFrame()
+        # 價格變動熱力圖資料（index 為車型、欄為時間分組標籤，欄數有上限）
+        self.trend_heatmap = pd.DataFrame()
+        # 熱力圖時間分組：'day' / 'week' / 'month'
+        self.trend_heatmap_bucket = 'day'
+        # 趨勢線是否經過降採樣
+        self.trend_downsampled = False
+        # 市場價格滾動分位數（date / p10 / p50 / p90），由每日分位數草圖合併
+        self.price_quantile_band = pd.DataFrame()
+
+
+def _band_counts(prices: np.ndarray) -> pd.Series:
+    """以 searchsorted + bincount 一次計算所有價格區間的數量"""
+    bands = np.searchsorted(BAND_EDGES, prices, side='right')
+    counts = np.bincount(bands, minlength=len(BAND_LABELS))
+    return pd.Series(counts, index=BAND_LABELS, dtype='int64')
+
+
+def _box_stats(df: pd.DataFrame, per_model: pd.DataFrame) -> List[Dict]:
+    """由各車型四分位數計算箱型圖統計（鬚線為 1.5 IQR 內的極值）"""
+    if df.empty:
+        return []
+
+    codes = df['model'].astype(str).to_numpy()
+    quartiles = per_model[['price_q1', 'price_q3']].reindex(codes).to_numpy()
+    iqr = quartiles[:, 1] - quartiles[:, 0]
+    prices = df['price'].to_numpy(dtype=np.float64) / 10000
+    low_fence = quartiles[:, 0] / 10000 - 1.5 * iqr / 10000
+    high_fence = quartiles[:, 1] / 10000 + 1.5 * iqr / 10000
+    inside = (prices >= low_fence) & (prices <= high_fence)
+
+    whiskers = pd.DataFrame({'model': codes, 'price': prices})[inside] \
+        .groupby('model')['price'].agg(['min', 'max'])
+    fliers = pd.DataFrame({'model': codes[~inside], 'price': prices[~inside]}) \
+        .groupby('model')['price'].apply(np.asarray)
+
+    stats = []
+    for model, row in per_model.iterrows():
+        stats.append({
+            'label': model,
+            'q1': row['price_q1'] / 10000,
+            'med': row['price_median'] / 10000,
+            'q3': row['price_q3'] / 10000,
+            'whislo': whiskers['min'].get(model, row['price_q1'] / 10000),
+            'whishi': whiskers['max'].get(model, row['price_q3'] / 10000),
+            'fliers': fliers.get(model, np.array([])),
+        })
+    return stats
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets 降採樣，保留折線的峰谷形狀
+
+    Args:
+        x: 已排序的 x 座標
+        y: y 座標
+        threshold: 保留點數
+
+    Returns:
+        np.ndarray: 保留點的索引（遞增）
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    every = (n - 2) / (threshold - 2)
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+
+        # 與前一個選取點、下一組平均點構成的三角形面積最大者
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a])
+                      - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+    return indices
+
+
+def points_by_model(df: pd.DataFrame) -> Dict[str, tuple]:
+    """
+    各車型的 (里程, 價格) 陣列
+
+    Args:
+        df: 含 model / price / mileage 欄位且價格不為空的資料
+
+    Returns:
+        Dict[str, tuple]: 車型 → (里程, 價格)
+    """
+    prices = df['price'].to_numpy(dtype=np.float64)
+    mileage = df['mileage'].to_numpy(dtype=np.float64, na_value=np.nan)
+    # groupby.indices 一次取得各車型的列位置
+    indices = df.groupby(df['model'].astype(str), observed=True, sort=True).indices
+    return {model: (mileage[positions], prices[positions]) for model, positions in indices.items()}
+
+
+def compute_market_stats(df_vehicles: pd.DataFrame,
+                         aggregates: Optional[AggregateStore] = None,
+                         hist_bins: int = 30,
+                         scatter_limit: int = SCATTER_POINT_LIMIT) -> MarketStats:
+    """
+    計算市場統計（每個維度一次向量化分組）
+
+    Args:
+        df_vehicles: 車輛資料DataFrame
+        aggregates: 提供時，數量 / 平均 / 極值直接讀取彙總表
+        hist_bins: 價格直方圖分組數
+        scatter_limit: 超過此筆數時散點圖改用 2-D 密度
+
+    Returns:
+        MarketStats: 統計結果
+    """
+    stats = MarketStats()
+    df = df_vehicles[df_vehicles['price'].notna()] if not df_vehicles.empty else df_vehicles
+    if df.empty:
+        return stats_from_aggregates(aggregates) if aggregates is not None else stats
+
+    prices = df['price'].to_numpy(dtype=np.float64)
+
+    # 整體統計
+    stats.overall = {
+        'count': len(df),
+        'price_mean': prices.mean(),
+        'price_median': float(np.median(prices)),
+        'price_min': prices.min(),
+        'price_max': prices.max(),
+        'price_std': df['price'].std(),
+        'unique_vins': df['vin'].nunique() if 'vin' in df.columns else None,
+        'first_seen': df['scrape_datetime'].min() if 'scrape_datetime' in df.columns else None,
+        'last_seen': df['scrape_datetime'].max() if 'scrape_datetime' in df.columns else None,
+    }
+
+    # 各車型：一次 groupby 取得所有統計
+    grouped = df.groupby(df['model'].astype(str), observed=True, sort=True)
+    per_model = grouped['price'].agg(count='size', price_mean='mean',
+                                     price_min='min', price_max='max')
+    quantiles = grouped['price'].quantile([0.25, 0.5, 0.75]).unstack()
+    per_model['price_q1'] = quantiles[0.25]
+    per_model['price_median'] = quantiles[0.5]
+    per_model['price_q3'] = quantiles[0.75]
+    per_model['mileage_mean'] = grouped['mileage'].mean() if 'mileage' in df.columns else np.nan
+    stats.per_model = per_model
+
+    # 年份 / 顏色 / 價格區間 / 每日數量
+    if 'year' in df.columns:
+        stats.per_year = df['year'].value_counts().sort_index()
+    if 'exterior_color' in df.columns:
+        colors = df['exterior_color'].value_counts()
+        stats.per_color = colors[colors > 0].head(TOP_COLORS)
+    stats.per_band = _band_counts(prices)
+    if 'scrape_datetime' in df.columns:
+        stats.daily_counts = df.groupby(df['scrape_datetime'].dt.date).size()
+
+    # 直方圖與箱型圖
+    stats.price_histogram = np.histogram(prices / 10000, bins=hist_bins)
+    stats.box_stats = _box_stats(df, per_model)
+
+    # 散點圖資料：資料量小時保留各車型的點，超過門檻時改為 2-D 分組數量（繪圖成本固定）
+    if 'mileage' in df.columns:
+        mileage = df['mileage'].to_numpy(dtype=np.float64, na_value=np.nan)
+        if len(df) > scatter_limit:
+            valid = np.isfinite(mileage)
+            stats.scatter_density = np.histogram2d(mileage[valid] / 1000, prices[valid] / 10000,
+                                                   bins=DENSITY_BINS)
+        else:
+            stats.points_by_model = points_by_model(df)
+
+        if len(df) > 10:
+            stats.trend_coefficients = np.polyfit(np.nan_to_num(mileage) / 1000, prices / 10000, 1)
+
+    # 彙總表涵蓋完整歷史（包含已被保留策略彙整的資料），數量與平均以彙總表為準
+    if aggregates is not None:
+        _apply_aggregates(stats, aggregates)
+
+    return stats
+
+
+def _apply_aggregates(stats: MarketStats, aggregates: AggregateStore):
+    """以彙總表的數量、平均與極值覆蓋"""
+    overall = aggregates.overall()
+    if not overall['observations']:
+        return
+
+    stats.overall.update({
+        'count': overall['observations'],
+        'price_mean': overall['price_mean'],
+        'price_min': overall['price_min'],
+        'price_max': overall['price_max'],
+        'price_std': overall['price_std'],
+    })
+
+    by_model = pd.DataFrame(aggregates.by_model()).set_index('model')
+    per_model = by_model.rename(columns={'observations': 'count'})[
+        ['count', 'price_mean', 'price_min', 'price_max', 'mileage_mean']].copy()
+    for column in ('price_q1', 'price_median', 'price_q3'):
+        if column in stats.per_model.columns:
+            per_model[column] = stats.per_model[column].reindex(per_model.index)
+        else:
+            per_model[column] = np.nan
+    stats.per_model = per_model
+
+    stats.per_band = pd.Series([row['observations'] for row in aggregates.by_band()],
+                               index=BAND_LABELS, dtype='int64')
+    stats.daily_counts = pd.Series(
+        {pd.Timestamp(row['date']).date(): row['observations'] for row in aggregates.by_day()},
+        dtype='int64'
+    )
+
+
+def stats_from_aggregates(aggregates: AggregateStore, sketches: Optional[SketchStore] = None) -> MarketStats:
+    """
+    只由彙總表建立統計（不載入原始資料；不含年份、顏色等需原始資料的項目）
+
+    overall 的欄位與 compute_market_stats 相同：無法由彙總表取得的 unique_vins 為 None，
+    price_median 有草圖時為草圖估計值，否則為 None。
+
+    Args:
+        aggregates: 彙總表
+        sketches: 分位數草圖（提供中位數）
+
+    Returns:
+        MarketStats: 統計結果
+    """
+    stats = MarketStats()
+    overall = aggregates.overall()
+    if not overall['observations']:
+        return stats
+
+    stats.overall = {
+        'count': overall['observations'],
+        'price_median': sketches.quantiles((0.5,))[0.5] if sketches is not None else None,
+        'unique_vins': None,
+        'first_seen': overall['first_date'],
+        'last_seen': overall['last_date'],
+    }
+    stats.per_model = pd.DataFrame(columns=['price_q1', 'price_median', 'price_q3'])
+    _apply_aggregates(stats, aggregates)
+    return stats
+
+
+def apply_sketch_quantiles(stats: MarketStats, sketches: SketchStore,
+                           window_days: int = ROLLING_DAYS) -> MarketStats:
+    """
+    以分位數草圖提供中位數、四分位數、P10 / P90 與滾動分位數帶（不載入原始價格）
+
+    Args:
+        stats: 市場統計（就地更新）
+        sketches: 每日 × 車型分位數草圖
+        window_days: 滾動分位數的視窗天數
+
+    Returns:
+        MarketStats: 更新後的統計
+    """
+    p10, median, p90 = sketches.quantiles(BAND_QUANTILES).values()
+    if median is None:
+        return stats
+    stats.overall.update({'price_p10': p10, 'price_median': median, 'price_p90': p90})
+
+    # 各車型四分位數與箱型圖（鬚線至少延伸到四分位數）
+    quartiles = sketches.quantiles_by_model((0.25, 0.5, 0.75))
+    models = stats.per_model.index.intersection(quartiles.index)
+    if len(models):
+        stats.per_model.loc[models, ['price_q1', 'price_median', 'price_q3']] = \
+            quartiles.loc[models, ['p25', 'p50', 'p75']].to_numpy()
+    for box in stats.box_stats:
+        if box['label'] in quartiles.index:
+            q1, med, q3 = quartiles.loc[box['label'], ['p25', 'p50', 'p75']] / 10000
+            box.update({'q1': q1, 'med': med, 'q3': q3,
+                        'whislo': min(box['whislo'], q1), 'whishi': max(box['whishi'], q3)})
+
+    stats.price_quantile_band = sketches.rolling(window_days)
+    return stats
+
+
+def heatmap_from_trends(df_trends: pd.DataFrame, window_days: Optional[int] = None,
+                        max_columns: int = HEATMAP_MAX_COLUMNS) -> tuple:
+    """
+    以 pandas 彙總熱力圖（無法下推至 SQL 時使用，例如 Parquet 封存），分組規則與儲存層相同
+
+    Args:
+        df_trends: 價格趨勢DataFrame
+        window_days: 只取最近 N 天
+        max_columns: 最多欄數
+
+    Returns:
+        tuple: (model / bucket / change_percentage 的 DataFrame, 分組名稱)
+    """
+    dates = df_trends['date_recorded']
+    first, last = dates.min(), dates.max()
+    if window_days:
+        first = max(first, last - pd.Timedelta(days=window_days - 1))
+    bucket, first = heatmap_bucket(first, last, max_columns)
+
+    df = df_trends.loc[dates >= first, ['model', 'date_recorded', 'change_percentage']]
+    buckets = df['date_recorded'].dt.to_period(BUCKET_PERIODS[bucket]).dt.start_time
+    heatmap = df.groupby([df['model'], buckets.rename('bucket')], observed=True)['change_percentage'] \
+        .mean().reset_index()
+    return heatmap, bucket
+
+
+def compute_trend_stats(stats: MarketStats, df_trends: pd.DataFrame,
+                        point_limit: int = TREND_POINT_LIMIT,
+                        heatmap: Optional[tuple] = None,
+                        window_days: Optional[int] = None,
+                        max_columns: int = HEATMAP_MAX_COLUMNS) -> MarketStats:
+    """
+    計算價格趨勢圖使用的統計並存入 stats
+
+    Args:
+        stats: 市場統計
+        df_trends: 價格趨勢DataFrame
+        point_limit: 每個車型趨勢線的最多點數，超過時以 LTTB 降採樣
+        heatmap: 儲存層 read_trend_heatmap 的結果；None 時由 df_trends 計算
+        window_days: 熱力圖只取最近 N 天（heatmap 為 None 時使用）
+        max_columns: 熱力圖最多欄數（heatmap 為 None 時使用）
+
+    Returns:
+        MarketStats: 同一個 stats 物件
+    """
+    if df_trends.empty:
+        return stats
+
+    daily_avg = df_trends.groupby(['model', 'date_recorded'], observed=True)['price'] \
+        .mean().reset_index()
+
+    # 各車型分別降採樣，點數上限固定，繪圖時間不隨歷史長度增加
+    keep = []
+    for _, positions in daily_avg.groupby('model', observed=True).indices.items():
+        if len(positions) > point_limit:
+            series = daily_avg.iloc[positions]
+            x = series['date_recorded'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+            positions = positions[lttb(x, series['price'].to_numpy(), point_limit)]
+            stats.trend_downsampled = True
+        keep.append(positions)
+    stats.trend_daily_avg = daily_avg.iloc[np.sort(np.concatenate(keep))] \
+        .sort_values(['date_recorded', 'model']).reset_index(drop=True)
+
+    # 熱力圖：已分組的長表轉為 車型 × 時間 的寬表
+    if heatmap is None:
+        heatmap = heatmap_from_trends(df_trends, window_days, max_columns)
+    df_heatmap, bucket = heatmap
+    if not df_heatmap.empty:
+        pivot = df_heatmap.pivot_table(values='change_percentage', index='model',
+                                       columns='bucket', aggfunc='mean', observed=True)
+        pivot.columns = pd.DatetimeIndex(pivot.columns).strftime(_BUCKET_LABELS[bucket])
+        stats.trend_heatmap = pivot
+    stats.trend_heatmap_bucket = bucket
+    return stats
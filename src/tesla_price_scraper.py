@@ -6,14 +6,17 @@ Tesla 台灣認證中古車爬蟲 - 完整動態載入版本
 """
 
 import time
-import json
-import sqlite3
 from datetime import datetime
 import logging
-import re
 import random
 from typing import List, Dict, Optional, Set
 
+from tesla_storage import SQLiteStorage
+from tesla_comparables import ComparablesIndex
+from tesla_vehicle_record import VehicleRecord, records_to_json
+from tesla_fingerprint import vehicle_fingerprint, vin_from_url
+from tesla_card_parser import extract_fields
+
 # 先導入 selenium webdriver（一定需要）
 from selenium import webdriver
 from selenium.webdriver.common.by import By
@@ -63,9 +66,14 @@ logger = logging.getLogger(__name__)
 class TeslaPriceScraper:
     """Tesla 完整動態載入爬蟲 - 處理虛擬滾動"""
 
-    def __init__(self, db_path: str = "tesla_prices.db", debug_mode: bool = False):
+    def __init__(self, db_path: str = "tesla_prices.db", debug_mode: bool = False,
+                 keep_raw: bool = True):
         self.db_path = db_path
         self.debug_mode = debug_mode
+        # 每輛車保存一份原始卡片文字（供重新解析）；keep_raw=False 明確停用
+        self.keep_raw = keep_raw
+        # 同一輪所有車輛共用的爬取時間
+        self.sweep_datetime: Optional[str] = None
 
         # 初始化 User Agent
         if HAS_FAKE_UA:
@@ -88,44 +96,9 @@ class TeslaPriceScraper:
 
     def init_database(self):
         """初始化資料庫"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS vehicle_prices (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                vin TEXT,
-                model TEXT,
-                year INTEGER,
-                trim TEXT,
-                price INTEGER,
-                mileage INTEGER,
-                location TEXT,
-                exterior_color TEXT,
-                interior_color TEXT,
-                autopilot_type TEXT,
-                scrape_datetime DATETIME,
-                listing_url TEXT,
-                raw_data TEXT,
-                UNIQUE(vin, scrape_datetime)
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS price_trends (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                vin TEXT,
-                model TEXT,
-                price INTEGER,
-                price_change INTEGER,
-                change_percentage REAL,
-                date_recorded DATE,
-                UNIQUE(vin, date_recorded)
-            )
-        ''')
-
-        conn.commit()
-        conn.close()
+        storage = SQLiteStorage(self.db_path)
+        storage.init_schema()
+        storage.close()
         logger.info("資料庫初始化完成")
 
     def get_random_user_agent(self):
@@ -261,7 +234,12 @@ class TeslaPriceScraper:
             driver.refresh()
             time.sleep(random.uniform(5, 8))
 
-    def scroll_and_collect_vehicles(self, driver, model: str) -> List[Dict]:
+    def begin_sweep(self) -> str:
+        """開始新一輪爬取，回傳本輪共用的時間字串"""
+        self.sweep_datetime = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        return self.sweep_datetime
+
+    def scroll_and_collect_vehicles(self, driver, model: str) -> List[VehicleRecord]:
         """
         滾動頁面並收集所有出現過的車輛（處理虛擬滾動）
 
@@ -270,12 +248,13 @@ class TeslaPriceScraper:
             model: 車型
 
         Returns:
-            List[Dict]: 所有收集到的車輛資料
+            List[VehicleRecord]: 所有收集到的車輛資料
         """
         logger.info("開始滾動並收集車輛資料...")
 
-        # 使用 Set 儲存已見過的車輛（根據唯一識別碼去重）
-        collected_vehicles = {}  # 使用 dict，key 為唯一識別碼
+        # 根據 VIN（沒有時為車輛指紋）去重，同一輛車某次滾動才出現 VIN 時保留有 VIN 的紀錄
+        collected_vehicles: Dict[str, VehicleRecord] = {}
+        vin_fingerprints: Set[str] = set()
         no_new_vehicles_count = 0
         last_count = 0
 
@@ -293,10 +272,7 @@ class TeslaPriceScraper:
             # 將新車輛加入到總集合中
             new_vehicles_count = 0
             for vehicle in current_batch:
-                # 使用 VIN 或其他唯一識別碼作為 key
-                unique_key = vehicle.get('vin') or vehicle.get('unique_id') or str(vehicle)
-                if unique_key and unique_key not in collected_vehicles:
-                    collected_vehicles[unique_key] = vehicle
+                if self._collect(collected_vehicles, vin_fingerprints, vehicle):
                     new_vehicles_count += 1
 
             current_total = len(collected_vehicles)
@@ -330,9 +306,7 @@ class TeslaPriceScraper:
         # 最後再檢查一次
         final_batch = self.collect_visible_vehicles(driver, model)
         for vehicle in final_batch:
-            unique_key = vehicle.get('vin') or vehicle.get('unique_id') or str(vehicle)
-            if unique_key and unique_key not in collected_vehicles:
-                collected_vehicles[unique_key] = vehicle
+            self._collect(collected_vehicles, vin_fingerprints, vehicle)
 
         # 轉換為列表返回
         result = list(collected_vehicles.values())
@@ -340,7 +314,36 @@ class TeslaPriceScraper:
 
         return result
 
-    def collect_visible_vehicles(self, driver, model: str) -> List[Dict]:
+    @staticmethod
+    def _collect(collected: Dict[str, VehicleRecord], vin_fingerprints: Set[str],
+                 vehicle: VehicleRecord) -> bool:
+        """
+        以車輛識別碼（有 VIN 時為 VIN，否則為指紋）加入收集結果
+
+        指紋可能對應多輛 VIN 不同的車，不能只以指紋去重；某次滾動才出現 VIN 時，
+        改以 VIN 保存先前只以指紋收集到的紀錄，之後同指紋但沒有 VIN 的紀錄也不再重複加入。
+
+        Args:
+            collected: 識別碼 → 車輛
+            vin_fingerprints: 已收集到有 VIN 車輛的指紋
+            vehicle: 車輛資料
+
+        Returns:
+            bool: 是否為新車輛
+        """
+        key = vehicle.key
+        if key in collected:
+            return False
+        if vehicle.vin:
+            vin_fingerprints.add(vehicle.unique_id)
+            collected[key] = vehicle
+            return collected.pop(vehicle.unique_id, None) is None
+        if vehicle.unique_id in vin_fingerprints:
+            return False
+        collected[key] = vehicle
+        return True
+
+    def collect_visible_vehicles(self, driver, model: str) -> List[VehicleRecord]:
         """
         收集當前可見的車輛資料
 
@@ -349,7 +352,7 @@ class TeslaPriceScraper:
             model: 車型
 
         Returns:
-            List[Dict]: 當前可見的車輛資料
+            List[VehicleRecord]: 當前可見的車輛資料
         """
         vehicles = []
 
@@ -453,7 +456,7 @@ class TeslaPriceScraper:
             }});
         """)
 
-    def parse_vehicle_element_enhanced(self, element, model: str) -> Optional[Dict]:
+    def parse_vehicle_element_enhanced(self, element, model: str) -> Optional[VehicleRecord]:
         """
         增強版車輛元素解析
 
@@ -462,165 +465,52 @@ class TeslaPriceScraper:
             model: 車型
 
         Returns:
-            Optional[Dict]: 解析後的車輛資料
+            Optional[VehicleRecord]: 解析後的車輛資料
         """
         try:
-            # 獲取元素文字
+            # 獲取元素文字並解析（文字過短或沒有合理價格時不是車輛元素）
             text = element.text
-            if not text or len(text) < 10:
+            fields = extract_fields(text)
+            if fields is None:
                 return None
 
-            # 基本資料結構
-            data = {
-                'model': model.upper(),
-                'scrape_datetime': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            }
+            # 基本資料（時間字串由同一輪所有車輛共用）
+            record = VehicleRecord(model.upper(), self.sweep_datetime or self.begin_sweep(), **fields)
 
-            # 嘗試獲取 data 屬性
+            # data 屬性的 VIN 優先於文字中的 VIN
             try:
-                data_vin = element.get_attribute('data-vin')
-                if data_vin:
-                    data['vin'] = data_vin
-
-                data_id = element.get_attribute('data-id')
-                if data_id:
-                    data['unique_id'] = data_id
+                record.vin = element.get_attribute('data-vin') or record.vin
+                record.data_id = element.get_attribute('data-id') or None
             except:
                 pass
 
-            # 提取價格（必要欄位）
-            price_patterns = [
-                r'NT\$\s*([\d,]+)',
-                r'TWD\s*([\d,]+)',
-                r'NTD\s*([\d,]+)',
-                r'\$\s*([\d,]+)',
-                r'([\d,]+)\s*元',
-                r'售價[：:]\s*([\d,]+)',
-                r'Price[：:]\s*([\d,]+)'
-            ]
-
-            price_found = False
-            for pattern in price_patterns:
-                price_match = re.search(pattern, text, re.IGNORECASE)
-                if price_match:
-                    price_str = price_match.group(1).replace(',', '')
-                    price = int(price_str)
-                    # 檢查價格是否合理（10萬到1000萬之間）
-                    if 100000 <= price <= 10000000:
-                        data['price'] = price
-                        price_found = True
-                        break
-
-            # 如果沒有價格，這可能不是車輛元素
-            if not price_found:
-                return None
-
-            # 提取 VIN（如果還沒有）
-            if 'vin' not in data:
-                vin_match = re.search(r'5YJ[A-Z0-9]{14}', text)
-                if vin_match:
-                    data['vin'] = vin_match.group()
-                else:
-                    # 生成唯一ID（使用價格和部分文字的hash）
-                    import hashlib
-                    unique_text = f"{model}_{data['price']}_{text[:50]}"
-                    data['unique_id'] = hashlib.md5(unique_text.encode()).hexdigest()[:12]
-
-            # 提取年份
-            year_patterns = [
-                r'(20[12][0-9])\s*年',
-                r'Year[：:]\s*(20[12][0-9])',
-                r'(20[12][0-9])\s+Model',
-                r'(20[12][0-9])'
-            ]
-
-            for pattern in year_patterns:
-                year_match = re.search(pattern, text)
-                if year_match:
-                    year = int(year_match.group(1))
-                    if 2010 <= year <= 2025:
-                        data['year'] = year
-                        break
-
-            # 提取里程
-            mileage_patterns = [
-                r'([\d,]+)\s*(?:km|公里|KM)',
-                r'里程[：:]\s*([\d,]+)',
-                r'Mileage[：:]\s*([\d,]+)',
-                r'ODO[：:]\s*([\d,]+)'
-            ]
-
-            for pattern in mileage_patterns:
-                mileage_match = re.search(pattern, text, re.IGNORECASE)
-                if mileage_match:
-                    mileage_str = mileage_match.group(1).replace(',', '')
-                    mileage = int(mileage_str)
-                    # 檢查里程是否合理（0到50萬公里）
-                    if 0 <= mileage <= 500000:
-                        data['mileage'] = mileage
-                        break
-
-            # 提取地點
-            locations = [
-                '台北', '新北', '桃園', '台中', '台南', '高雄',
-                '基隆', '新竹', '苗栗', '彰化', '南投', '雲林',
-                '嘉義', '屏東', '宜蘭', '花蓮', '台東', '澎湖',
-                '金門', '連江', 'Taipei', 'Taichung', 'Kaohsiung'
-            ]
-
-            for location in locations:
-                if location in text:
-                    data['location'] = location
-                    break
-
-            # 提取顏色
-            colors = {
-                'Pearl White': '珍珠白',
-                'Solid Black': '純黑',
-                'Midnight Silver': '午夜銀',
-                'Deep Blue': '深藍',
-                'Red': '紅色',
-                '珍珠白': '珍珠白',
-                '純黑': '純黑',
-                '午夜銀': '午夜銀',
-                '深藍': '深藍',
-                '紅色': '紅色'
-            }
-
-            for eng, chi in colors.items():
-                if eng in text or chi in text:
-                    data['exterior_color'] = chi
-                    break
-
-            # 提取配置
-            if 'Long Range' in text or '長續航' in text:
-                data['trim'] = 'Long Range'
-            elif 'Performance' in text or '高性能' in text:
-                data['trim'] = 'Performance'
-            elif 'Standard' in text or '標準' in text:
-                data['trim'] = 'Standard Range'
-
             # 嘗試獲取連結
             try:
                 links = element.find_elements(By.TAG_NAME, "a")
                 for link in links:
                     href = link.get_attribute('href')
                     if href and 'tesla.com' in href:
-                        data['listing_url'] = href
+                        record.listing_url = href
                         break
             except:
                 pass
 
-            # 儲存原始資料（限制長度）
-            data['raw_data'] = text[:500]
+            # 網址代碼是 VIN 時補上；指紋只取穩定欄位，同一輛車每次滾動與每輪爬取都相同
+            if not record.vin:
+                record.vin = vin_from_url(record.listing_url)
+            record.unique_id = vehicle_fingerprint(record)
+
+            # 原始資料（限制長度；收集時已去重，每輛車只保存一份）
+            if self.keep_raw:
+                record.raw_data = text[:500]
 
-            return data
+            return record
 
         except Exception as e:
             logger.debug(f"解析元素失敗: {e}")
             return None
 
-    def scrape_with_retry(self, model: str, max_retries: int = 3) -> List[Dict]:
+    def scrape_with_retry(self, model: str, max_retries: int = 3) -> List[VehicleRecord]:
         """
         使用重試機制爬取資料
         """
@@ -644,7 +534,7 @@ class TeslaPriceScraper:
 
         return []
 
-    def scrape_with_selenium(self, model: str) -> List[Dict]:
+    def scrape_with_selenium(self, model: str) -> List[VehicleRecord]:
         """
         使用 Selenium 爬取資料（處理虛擬滾動）
         """
@@ -687,7 +577,7 @@ class TeslaPriceScraper:
 
                 # 儲存收集到的資料
                 with open(f'debug_{model}_vehicles.json', 'w', encoding='utf-8') as f:
-                    json.dump(vehicles, f, ensure_ascii=False, indent=2, default=str)
+                    f.write(records_to_json(vehicles))
                 logger.info(f"已儲存車輛資料: debug_{model}_vehicles.json")
 
             logger.info(f"成功收集 {len(vehicles)} 輛車的資料")
@@ -710,6 +600,7 @@ class TeslaPriceScraper:
         logger.info("="*60)
 
         all_vehicles = []
+        self.begin_sweep()
 
         for model in self.base_urls.keys():
             logger.info(f"\n處理 {model.upper()}")
@@ -738,7 +629,7 @@ class TeslaPriceScraper:
             logger.warning("\n⚠️ 未獲取到任何資料")
             self.suggest_alternative_methods()
 
-    def print_summary(self, vehicles: List[Dict]):
+    def print_summary(self, vehicles: List[VehicleRecord]):
         """列印爬取結果摘要"""
         logger.info("\n" + "="*60)
         logger.info("爬取結果摘要")
@@ -747,20 +638,20 @@ class TeslaPriceScraper:
         # 統計各車型數量
         model_counts = {}
         for vehicle in vehicles:
-            model = vehicle.get('model', 'Unknown')
+            model = vehicle.model or 'Unknown'
             model_counts[model] = model_counts.get(model, 0) + 1
 
         for model, count in model_counts.items():
             logger.info(f"{model}: {count} 輛")
 
         # 統計價格範圍
-        prices = [v['price'] for v in vehicles if 'price' in v]
+        prices = [v.price for v in vehicles if v.price is not None]
         if prices:
             logger.info(f"\n價格範圍: NT${min(prices):,} - NT${max(prices):,}")
             logger.info(f"平均價格: NT${sum(prices)/len(prices):,.0f}")
 
         # 顯示部分 VIN 以確認資料
-        vins = [v.get('vin', v.get('unique_id', 'N/A'))[:10] for v in vehicles[:5]]
+        vins = [(v.key or 'N/A')[:10] for v in vehicles[:5]]
         logger.info(f"\n前5筆資料識別碼: {', '.join(vins)}")
 
     def suggest_alternative_methods(self):
@@ -789,44 +680,24 @@ class TeslaPriceScraper:
    - 使用瀏覽器擴充功能輔助
         """)
 
-    def save_to_database(self, vehicles: List[Dict]):
+    def save_to_database(self, vehicles: List[VehicleRecord]):
         """儲存到資料庫"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        storage = SQLiteStorage(self.db_path)
+        try:
+            saved_count = storage.write_observations(vehicles)
 
-        saved_count = 0
-        for vehicle in vehicles:
+            # 欄式快取附加本輪資料；相似車輛索引只重建本輪有變動的車型 / 車款
+            # 觀測已提交，衍生快取失敗只記錄警告，之後讀取或下一輪寫入時會再同步
             try:
-                # 使用 VIN 或 unique_id 作為識別
-                vin = vehicle.get('vin') or vehicle.get('unique_id')
-
-                cursor.execute('''
-                    INSERT OR REPLACE INTO vehicle_prices
-                    (vin, model, year, trim, price, mileage, location,
-                     exterior_color, interior_color, autopilot_type,
-                     scrape_datetime, listing_url, raw_data)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    vin,
-                    vehicle.get('model'),
-                    vehicle.get('year'),
-                    vehicle.get('trim'),
-                    vehicle.get('price'),
-                    vehicle.get('mileage'),
-                    vehicle.get('location'),
-                    vehicle.get('exterior_color'),
-                    vehicle.get('interior_color'),
-                    vehicle.get('autopilot_type'),
-                    vehicle.get('scrape_datetime'),
-                    vehicle.get('listing_url'),
-                    vehicle.get('raw_data', '')
-                ))
-                saved_count += 1
+                storage.column_cache.sync()
             except Exception as e:
-                logger.error(f"儲存失敗: {e}")
-
-        conn.commit()
-        conn.close()
+                logger.warning(f"欄式快取同步失敗: {e}")
+            try:
+                ComparablesIndex(storage.conn).refresh()
+            except Exception as e:
+                logger.warning(f"相似車輛索引更新失敗: {e}")
+        finally:
+            storage.close()
 
         logger.info(f"成功儲存 {saved_count}/{len(vehicles)} 筆資料到資料庫")
 
@@ -0,0 +1,205 @@
+#!/home/cclin/.local/python311/bin/python3
+"""
+Tesla 車輛卡片原始文字儲存
+以內容雜湊為鍵、zlib（共用字典）壓縮，相同文字只存一份
+"""
+
+import hashlib
+import sqlite3
+import zlib
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# 共用壓縮字典：卡片文字中最常出現的片段（越常見的放越後面）
+RAW_DICT_VERSION = 1
+_RAW_ZDICTS = {
+    1: '\n'.join([
+        '台北', '新北', '桃園', '台中', '台南', '高雄', '新竹', '基隆',
+        '彰化', '嘉義', '屏東', '宜蘭', '花蓮', 'Taipei', 'Taichung', 'Kaohsiung',
+        '珍珠白', '純黑', '午夜銀', '深藍', '紅色',
+        'Pearl White', 'Solid Black', 'Midnight Silver', 'Deep Blue', 'Red',
+        '黑色內裝', '白色內裝', 'Enhanced Autopilot', 'Full Self-Driving',
+        '標準', '高性能', '長續航', 'Standard Range', 'Performance', 'Long Range',
+        'Dual Motor All-Wheel Drive', 'Rear-Wheel Drive', '全輪驅動', '後輪驅動',
+        'Model S', 'Model X', 'Model 3', 'Model Y',
+        '里程', '公里', ' km', '售價', '年', '元', 'TWD', 'NT$',
+    ]).encode('utf-8'),
+}
+
+
+class RawDataStore:
+    """以內容雜湊為鍵的壓縮原始文字儲存"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        """
+        初始化原始文字儲存
+
+        Args:
+            conn: 資料庫連線
+        """
+        self.conn = conn
+
+    @staticmethod
+    def content_hash(text: str) -> str:
+        """計算原始文字的內容雜湊"""
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+    @staticmethod
+    def compress(text: str, dict_version: int = RAW_DICT_VERSION) -> bytes:
+        """以共用字典壓縮文字"""
+        compressor = zlib.compressobj(level=9, zdict=_RAW_ZDICTS[dict_version])
+        return compressor.compress(text.encode('utf-8')) + compressor.flush()
+
+    @staticmethod
+    def decompress(data: bytes, dict_version: int) -> str:
+        """以對應版本的共用字典解壓縮"""
+        decompressor = zlib.decompressobj(zdict=_RAW_ZDICTS[dict_version])
+        return (decompressor.decompress(data) + decompressor.flush()).decode('utf-8')
+
+    def init_schema(self):
+        """建立 raw_texts 表格，並為 vehicle_prices 加上 raw_hash 欄位"""
+        cursor = self.conn.cursor()
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS raw_texts (
+                hash TEXT PRIMARY KEY,
+                dict_version INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                data BLOB NOT NULL
+            ) WITHOUT ROWID
+        ''')
+
+        columns = [row[1] for row in cursor.execute("PRAGMA table_info(vehicle_prices)")]
+        if columns and 'raw_hash' not in columns:
+            cursor.execute("ALTER TABLE vehicle_prices ADD COLUMN raw_hash TEXT")
+
+        self.register_sql_function()
+
+    def register_sql_function(self):
+        """註冊 SQL 函式 raw_text(raw_hash)，只有查詢真正選取時才解壓縮"""
+        self.conn.create_function('raw_text', 1, self.get, deterministic=True)
+
+    def put(self, text: Optional[str]) -> Optional[str]:
+        """
+        儲存原始文字（已存在則略過）
+
+        Args:
+            text: 原始卡片文字
+
+        Returns:
+            Optional[str]: 內容雜湊，文字為空時回傳 None
+        """
+        if not text:
+            return None
+
+        raw_hash = self.content_hash(text)
+        self.conn.execute('''
+            INSERT OR IGNORE INTO raw_texts (hash, dict_version, length, data)
+            VALUES (?, ?, ?, ?)
+        ''', (raw_hash, RAW_DICT_VERSION, len(text), self.compress(text)))
+        return raw_hash
+
+    def get(self, raw_hash: Optional[str]) -> Optional[str]:
+        """
+        依內容雜湊讀取並解壓縮原始文字
+
+        Args:
+            raw_hash: 內容雜湊
+
+        Returns:
+            Optional[str]: 原始文字，不存在時回傳 None
+        """
+        if not raw_hash:
+            return None
+
+        row = self.conn.execute(
+            "SELECT dict_version, data FROM raw_texts WHERE hash = ?", (raw_hash,)
+        ).fetchone()
+        if not row:
+            return None
+        return self.decompress(row[1], row[0])
+
+    def lazy(self, raw_hash: Optional[str]) -> 'LazyRawText':
+        """回傳延遲解壓縮的原始文字"""
+        return LazyRawText(self, raw_hash)
+
+    def delete_orphans(self) -> int:
+        """刪除已無任何 vehicle_prices 參照的原始文字"""
+        exists = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='raw_texts'"
+        ).fetchone()
+        if not exists:
+            return 0
+
+        cursor = self.conn.execute('''
+            DELETE FROM raw_texts
+            WHERE hash NOT IN (
+                SELECT raw_hash FROM vehicle_prices WHERE raw_hash IS NOT NULL
+            )
+        ''')
+        return cursor.rowcount
+
+    def migrate_inline_raw_data(self, batch_size: int = 5000) -> int:
+        """
+        將舊資料列中的 raw_data 文字搬移到 raw_texts
+
+        Args:
+            batch_size: 每批處理筆數
+
+        Returns:
+            int: 搬移的資料筆數
+        """
+        migrated = 0
+        last_id = 0
+
+        while True:
+            rows = self.conn.execute('''
+                SELECT id, raw_data FROM vehicle_prices
+                WHERE id > ? AND raw_data IS NOT NULL AND raw_data != ''
+                ORDER BY id
+                LIMIT ?
+            ''', (last_id, batch_size)).fetchall()
+            if not rows:
+                break
+
+            updates = [(self.put(raw_data), row_id) for row_id, raw_data in rows]
+            self.conn.executemany(
+                "UPDATE vehicle_prices SET raw_hash = ?, raw_data = NULL WHERE id = ?",
+                updates
+            )
+            self.conn.commit()
+
+            migrated += len(rows)
+            last_id = rows[-1][0]
+
+        if migrated:
+            logger.info(f"已將 {migrated} 筆 raw_data 搬移至壓縮儲存")
+        return migrated
+
+
+class LazyRawText:
+    """延遲解壓縮的原始文字，第一次轉成字串時才讀取"""
+
+    __slots__ = ('_store', '_hash', '_text')
+
+    def __init__(self, store: RawDataStore, raw_hash: Optional[str]):
+        self._store = store
+        self._hash = raw_hash
+        self._text = None
+
+    @property
+    def raw_hash(self) -> Optional[str]:
+        return self._hash
+
+    def __str__(self) -> str:
+        if self._text is None:
+            self._text = self._store.get(self._hash) or ''
+        return self._text
+
+    def __len__(self) -> int:
+        return len(str(self))
+
+    def __bool__(self) -> bool:
+        return self._hash is not None
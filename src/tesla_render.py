@@ -0,0 +1,150 @@
+#!/home/cclin/.local/python311/bin/python3
+"""
+Tesla 圖表批次繪製
+以 Agg 後端在程序池中平行繪製圖表，各子程序共用同一份預先計算的市場統計，不開啟任何視窗
+"""
+
+import os
+import json
+import time
+import hashlib
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import matplotlib
+
+from tesla_market_stats import MarketStats
+
+# 繪圖程式版本；圖表樣式變更時遞增，使所有快取失效
+RENDER_VERSION = 5
+
+MANIFEST_FILE = 'render_manifest.json'
+
+
+def _init_worker():
+    """子程序初始化：強制使用非互動的 Agg 後端"""
+    os.environ['MPLBACKEND'] = 'Agg'
+    matplotlib.use('Agg', force=True)
+
+    from tesla_visualizer import setup_plot_style
+    setup_plot_style()
+
+
+def _render_one(name: str, stats: MarketStats, path: str, dpi: int) -> Tuple[str, Optional[str], float]:
+    """
+    繪製並儲存單一圖表
+
+    Returns:
+        Tuple: (圖表名稱, 輸出路徑（無資料時為 None）, 繪製秒數)
+    """
+    from tesla_visualizer import CHART_DRAWERS, save_figure
+
+    start = time.perf_counter()
+    fig = CHART_DRAWERS[name](stats)
+    if fig is None:
+        return name, None, time.perf_counter() - start
+    save_figure(fig, path, dpi)
+    return name, path, time.perf_counter() - start
+
+
+def render_charts(stats: MarketStats, output_dir: str = '.', dpi: int = 300,
+                  fmt: str = 'png', workers: Optional[int] = None,
+                  names: Optional[List[str]] = None) -> List[Tuple[str, Optional[str], float]]:
+    """
+    平行繪製圖表
+
+    Args:
+        stats: 市場統計（會序列化傳給各子程序）
+        output_dir: 輸出目錄
+        dpi: 輸出解析度
+        fmt: 輸出格式（png / svg / pdf 等）
+        workers: 程序數（None 為圖表數與 CPU 數的較小值）
+        names: 只繪製指定圖表，None 表示全部
+
+    Returns:
+        List[Tuple]: 各圖表的 (名稱, 輸出路徑, 繪製秒數)，順序與 names 相同
+    """
+    from tesla_visualizer import CHART_DRAWERS, CHART_FILES
+
+    names = names or list(CHART_DRAWERS)
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {name: os.path.join(output_dir, f"{CHART_FILES[name]}.{fmt}") for name in names}
+
+    workers = workers or min(len(names), os.cpu_count() or 1)
+    if workers <= 1:
+        _init_worker()
+        return [_render_one(name, stats, paths[name], dpi) for name in names]
+
+    # spawn：子程序不繼承父程序已初始化的 GUI 後端
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker) as executor:
+        futures = [executor.submit(_render_one, name, stats, paths[name], dpi) for name in names]
+        return [future.result() for future in futures]
+
+
+class RenderCache:
+    """以圖表輸入資料指紋為鍵的輸出快取，並以 manifest 記錄每次執行重用 / 重繪的圖表"""
+
+    def __init__(self, output_dir: str = '.'):
+        """
+        初始化快取
+
+        Args:
+            output_dir: 圖表輸出目錄（manifest 存放於此）
+        """
+        self.path = os.path.join(output_dir, MANIFEST_FILE)
+        self.manifest = {'charts': {}, 'last_run': {}}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.manifest = json.load(f)
+            except (OSError, ValueError):
+                pass
+        self.manifest.setdefault('charts', {})
+
+    @staticmethod
+    def fingerprint(name: str, inputs: Dict) -> str:
+        """
+        計算圖表指紋
+
+        Args:
+            name: 圖表名稱
+            inputs: 圖表輸入（資料表指紋與繪圖參數）
+
+        Returns:
+            str: 指紋（十六進位）
+        """
+        payload = json.dumps({'chart': name, 'version': RENDER_VERSION, 'inputs': inputs},
+                             sort_keys=True, default=str)
+        return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+    def is_fresh(self, name: str, fingerprint: str, path: str) -> bool:
+        """指紋相同且輸出檔仍存在（或上次即無資料可繪）時可直接重用"""
+        entry = self.manifest['charts'].get(name)
+        if not entry or entry.get('fingerprint') != fingerprint:
+            return False
+        return entry.get('path') is None or (entry['path'] == path and os.path.exists(path))
+
+    def record(self, name: str, fingerprint: str, path: Optional[str], seconds: float):
+        """記錄重新繪製的圖表"""
+        self.manifest['charts'][name] = {
+            'fingerprint': fingerprint,
+            'path': path,
+            'rendered_at': datetime.now().isoformat(timespec='seconds'),
+            'seconds': round(seconds, 3),
+        }
+
+    def save(self, reused: List[str], rendered: List[str]):
+        """寫入 manifest（記錄本次重用與重繪的圖表）"""
+        self.manifest['last_run'] = {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'reused': reused,
+            'rendered': rendered,
+        }
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,208 @@
+#!/home/cclin/.local/python311/bin/python3
+"""
+Tesla 歷史原始文字重新解析
+修正解析規則後，依 id 分批讀出 vehicle_prices 參照的原始文字，在程序池中重新取出欄位並分批寫回；
+每批與水位在同一個交易提交，中斷後從水位繼續。只處理有保存原始文字的資料列
+"""
+
+import os
+import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from tesla_card_parser import PARSER_VERSION, extract_fields
+from tesla_raw_store import RawDataStore
+
+logger = logging.getLogger(__name__)
+
+# 水位名稱（存於 analysis_state）
+REPARSE_MARKER = 'reparse'
+
+# 重新解析後寫回的欄位（VIN 是車輛識別碼，不在此改寫）
+REPARSED_FIELDS = ['price', 'year', 'trim', 'mileage', 'location', 'exterior_color']
+
+# 一批資料列：(id, raw_hash, 日期, 目前欄位值)
+ChunkRow = Tuple[int, str, str, Tuple]
+
+
+def _parse_texts(texts: List[Tuple[str, int, bytes]]) -> Dict[str, Optional[Tuple]]:
+    """
+    子程序：解壓縮並重新解析一批不重複的原始文字
+
+    Args:
+        texts: (raw_hash, dict_version, 壓縮資料)
+
+    Returns:
+        Dict: raw_hash → REPARSED_FIELDS 欄位值（不是車輛卡片時為 None）
+    """
+    parsed = {}
+    for raw_hash, dict_version, data in texts:
+        fields = extract_fields(RawDataStore.decompress(data, dict_version))
+        parsed[raw_hash] = None if fields is None else tuple(fields[field] for field in REPARSED_FIELDS)
+    return parsed
+
+
+class Reparser:
+    """以程序池重新解析已保存的原始文字，並更新衍生資料"""
+
+    def __init__(self, storage, chunk_size: int = 20000, workers: Optional[int] = None,
+                 archive_dir: Optional[str] = 'tesla_archive'):
+        """
+        初始化重新解析
+
+        Args:
+            storage: SQLite 儲存實作
+            chunk_size: 每批資料列數（一批一個交易）
+            workers: 程序數（None 為 CPU 數，1 表示在本程序執行）
+            archive_dir: Parquet 封存目錄（受影響日期標記為需重新匯出；None 表示不處理）
+        """
+        self.storage = storage
+        self.conn = storage.conn
+        self.chunk_size = chunk_size
+        self.workers = workers or os.cpu_count() or 1
+        self.archive_dir = archive_dir
+        self.state = None
+
+    def _read_chunk(self, after_id: int, max_id: int) -> Tuple[List[ChunkRow], List[Tuple[str, int, bytes]]]:
+        """讀取下一批資料列與其中不重複的壓縮原始文字"""
+        rows, texts, seen = [], [], set()
+        for row in self.conn.execute(f'''
+            SELECT v.id, v.raw_hash, date(v.scrape_datetime), r.dict_version, r.data,
+                   {', '.join(f'v.{field}' for field in REPARSED_FIELDS)}
+            FROM vehicle_prices v JOIN raw_texts r ON r.hash = v.raw_hash
+            WHERE v.id > ? AND v.id <= ? AND v.raw_hash IS NOT NULL
+            ORDER BY v.id LIMIT ?
+        ''', (after_id, max_id, self.chunk_size)):
+            row_id, raw_hash, day, dict_version, data = row[:5]
+            rows.append((row_id, raw_hash, day, tuple(row[5:])))
+            if raw_hash not in seen:
+                seen.add(raw_hash)
+                texts.append((raw_hash, dict_version, data))
+        return rows, texts
+
+    def _apply(self, rows: List[ChunkRow], parsed: Dict[str, Optional[Tuple]], marker: Dict) -> int:
+        """
+        寫回一批結果並推進水位（set_marker 一併提交）
+
+        解析不到的欄位保留原值；沒有變動的資料列不寫入。
+
+        Returns:
+            int: 更新的資料列數
+        """
+        updates, dates = [], set(marker['dates'])
+        for row_id, raw_hash, day, current in rows:
+            values = parsed.get(raw_hash)
+            if values is None:
+                continue
+            merged = tuple(current[i] if value is None else value for i, value in enumerate(values))
+            if merged != current:
+                updates.append(merged + (row_id,))
+                dates.add(day)
+
+        self.conn.executemany(f'''
+            UPDATE vehicle_prices SET {', '.join(f'{field} = ?' for field in REPARSED_FIELDS)}
+            WHERE id = ?
+        ''', updates)
+
+        marker.update({
+            'last_id': rows[-1][0],
+            'scanned': marker['scanned'] + len(rows),
+            'updated': marker['updated'] + len(updates),
+            'dates': sorted(dates),
+        })
+        self.state.set_marker(REPARSE_MARKER, marker)
+        return len(updates)
+
+    def _load_marker(self, restart: bool) -> Dict:
+        """讀取水位；上次已完成、解析規則版本不同或要求重來時從頭開始"""
+        marker = self.state.get_marker(REPARSE_MARKER)
+        if restart or marker is None or marker['finished'] or marker['parser_version'] != PARSER_VERSION:
+            max_id = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM vehicle_prices").fetchone()[0]
+            marker = {
+                'parser_version': PARSER_VERSION, 'last_id': 0, 'max_id': max_id,
+                'scanned': 0, 'updated': 0, 'dates': [], 'finished': False,
+                'started_at': datetime.now().isoformat(timespec='seconds'),
+            }
+        elif marker['last_id']:
+            logger.info(f"從 id {marker['last_id']} 繼續重新解析（已處理 {marker['scanned']} 筆）")
+        return marker
+
+    def _parse_all(self, marker: Dict):
+        """依序讀取各批並送入程序池；結果依原順序寫回，程序池中最多保留 2 × 程序數批"""
+        if self.workers <= 1:
+            while True:
+                rows, texts = self._read_chunk(marker['last_id'], marker['max_id'])
+                if not rows:
+                    return
+                self._apply(rows, _parse_texts(texts), marker)
+
+        # spawn：子程序不繼承父程序的資料庫連線
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as executor:
+            pending = deque()
+            after_id, exhausted = marker['last_id'], False
+            while True:
+                while not exhausted and len(pending) < 2 * self.workers:
+                    rows, texts = self._read_chunk(after_id, marker['max_id'])
+                    if not rows:
+                        exhausted = True
+                        break
+                    after_id = rows[-1][0]
+                    pending.append((rows, executor.submit(_parse_texts, texts)))
+                if not pending:
+                    return
+                rows, future = pending.popleft()
+                self._apply(rows, future.result(), marker)
+
+    def _refresh_derived(self, dates: List[str]):
+        """
+        重建受影響日期的彙總與草圖、上架生命週期、最新價格索引與價格變動事件，
+        讓欄式快取、相似車輛索引與分析狀態失效，並標記 Parquet 封存需重新匯出
+
+        圖表快取不需另外處理：就地修改會遞增 table_versions，資料表指紋隨之改變。
+        """
+        from tesla_comparables import ComparablesIndex
+        from tesla_archive import mark_stale
+
+        self.storage.aggregates.rebuild(dates)
+        self.storage.sketches.rebuild(dates)
+        self.storage.listings.rebuild()
+        rebuilt_events = self.storage.events.rebuild(min(dates))
+        self.conn.commit()
+        logger.info(f"已重建 {min(dates)} 之後的 {rebuilt_events} 筆價格變動事件")
+
+        self.storage.column_cache.invalidate()
+        ComparablesIndex(self.conn).invalidate()
+        self.state.invalidate()
+        if self.archive_dir and mark_stale(self.archive_dir, 'vehicle_prices', dates):
+            logger.info(f"已標記 {len(dates)} 個日期的 Parquet 封存分區需重新匯出")
+
+    def run(self, restart: bool = False) -> Dict:
+        """
+        重新解析所有有原始文字的資料列（中斷後再次執行會從水位繼續）
+
+        Args:
+            restart: 捨棄未完成的水位，從頭開始
+
+        Returns:
+            Dict: 水位（scanned / updated / dates 等）
+        """
+        # 水位與其他增量工作一樣存於 analysis_state（子程序不需要載入分析模組）
+        from tesla_analysis_state import AnalysisState
+        self.state = AnalysisState(self.storage)
+        marker = self._load_marker(restart)
+        self.state.set_marker(REPARSE_MARKER, marker)
+
+        self._parse_all(marker)
+
+        if marker['updated']:
+            self._refresh_derived(marker['dates'])
+        marker['finished'] = True
+        marker['finished_at'] = datetime.now().isoformat(timespec='seconds')
+        self.state.set_marker(REPARSE_MARKER, marker)
+        logger.info(f"重新解析 {marker['scanned']} 筆，更新 {marker['updated']} 筆"
+                    f"（{len(marker['dates'])} 個日期）")
+        return marker
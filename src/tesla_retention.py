@@ -0,0 +1,246 @@
+#!/home/cclin/.local/python311/bin/python3
+"""
+Tesla 價格資料保留策略
+原始觀測保留固定天數，較舊資料彙整為每日 VIN / 車型資料表後刪除並回收空間
+"""
+
+import sqlite3
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from tesla_raw_store import RawDataStore
+
+logger = logging.getLogger(__name__)
+
+# 預設保留原始觀測的天數
+DEFAULT_KEEP_DAYS = 90
+
+# 每次增量回收的頁數（0 表示全部可回收頁）
+VACUUM_PAGES = 0
+
+# 將每日 VIN 彙整表還原成與 vehicle_prices 相容的欄位，供分析程式合併讀取
+ROLLUP_OBSERVATIONS_SQL = """
+    SELECT NULL AS id, vin, model, year, trim,
+           last_price AS price, last_mileage AS mileage, location,
+           exterior_color, NULL AS interior_color, NULL AS autopilot_type,
+           last_seen AS scrape_datetime, NULL AS listing_url,
+           NULL AS raw_data, NULL AS raw_hash
+    FROM vehicle_daily
+"""
+
+
+def init_rollup_schema(cursor: sqlite3.Cursor):
+    """建立每日彙整表格"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS vehicle_daily (
+            vin TEXT NOT NULL,
+            date DATE NOT NULL,
+            model TEXT,
+            year INTEGER,
+            trim TEXT,
+            location TEXT,
+            exterior_color TEXT,
+            min_price INTEGER,
+            max_price INTEGER,
+            last_price INTEGER,
+            min_mileage INTEGER,
+            max_mileage INTEGER,
+            last_mileage INTEGER,
+            last_seen DATETIME,
+            observations INTEGER NOT NULL,
+            PRIMARY KEY (vin, date)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS model_daily (
+            date DATE NOT NULL,
+            model TEXT NOT NULL,
+            observations INTEGER NOT NULL,
+            vehicles INTEGER NOT NULL,
+            price_sum INTEGER,
+            min_price INTEGER,
+            max_price INTEGER,
+            mileage_sum INTEGER,
+            mileage_count INTEGER,
+            PRIMARY KEY (date, model)
+        )
+    ''')
+
+
+def has_rollup_tier(conn: sqlite3.Connection) -> bool:
+    """資料庫是否已有每日彙整資料"""
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='vehicle_daily'"
+    ).fetchone()
+    if not row:
+        return False
+    return conn.execute("SELECT 1 FROM vehicle_daily LIMIT 1").fetchone() is not None
+
+
+class RetentionJob:
+    """原始資料保留、彙整與壓縮"""
+
+    def __init__(self, db_path: str = "tesla_prices.db", keep_days: int = DEFAULT_KEEP_DAYS):
+        """
+        初始化保留策略
+
+        Args:
+            db_path: 資料庫路徑
+            keep_days: 原始觀測保留天數
+        """
+        self.db_path = db_path
+        self.keep_days = keep_days
+
+    def cutoff_date(self, now: Optional[datetime] = None) -> str:
+        """計算截止日期（以整天為單位，早於此日期的資料會被彙整）"""
+        now = now or datetime.now()
+        return (now - timedelta(days=self.keep_days)).strftime('%Y-%m-%d')
+
+    def run(self, now: Optional[datetime] = None) -> dict:
+        """
+        執行保留策略
+
+        Args:
+            now: 基準時間（預設為現在）
+
+        Returns:
+            dict: 彙整與刪除的筆數
+        """
+        cutoff = self.cutoff_date(now)
+        conn = sqlite3.connect(self.db_path)
+
+        try:
+            cursor = conn.cursor()
+            init_rollup_schema(cursor)
+
+            old_rows = cursor.execute(
+                "SELECT COUNT(*) FROM vehicle_prices WHERE scrape_datetime < ?", (cutoff,)
+            ).fetchone()[0]
+
+            if not old_rows:
+                logger.info(f"沒有早於 {cutoff} 的原始資料需要彙整")
+                return {'cutoff': cutoff, 'rolled_up': 0, 'deleted': 0, 'raw_texts_deleted': 0}
+
+            # 彙整、刪除在同一個交易中完成，中斷時不會遺失資料
+            cursor.execute("BEGIN")
+            self._rollup_vehicles(cursor, cutoff)
+            self._rollup_models(cursor, cutoff)
+
+            cursor.execute("DELETE FROM vehicle_prices WHERE scrape_datetime < ?", (cutoff,))
+            deleted = cursor.rowcount
+            raw_deleted = RawDataStore(conn).delete_orphans()
+            conn.commit()
+
+            logger.info(f"已彙整並刪除 {deleted} 筆早於 {cutoff} 的原始資料")
+            self.incremental_vacuum(conn)
+            self.rebuild_analysis_state()
+
+            return {'cutoff': cutoff, 'rolled_up': old_rows, 'deleted': deleted,
+                    'raw_texts_deleted': raw_deleted}
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def rebuild_analysis_state(self):
+        """
+        已保存增量分析狀態時依彙整後的資料重建
+
+        彙整層只保留每日最後價格，增量累加過的原始價格總和無法再由資料重現；
+        重建後之後的增量結果與完整重新計算一致。
+        """
+        from tesla_storage import SQLiteStorage
+        from tesla_analysis_state import AnalysisState
+
+        storage = SQLiteStorage(self.db_path)
+        try:
+            if not storage.has_table('analysis_state'):
+                return
+            state = AnalysisState(storage)
+            if state.load():
+                state.rebuild()
+                logger.info("已依彙整後的資料重建增量分析狀態")
+        finally:
+            storage.close()
+
+    def _rollup_vehicles(self, cursor: sqlite3.Cursor, cutoff: str):
+        """彙整每日每 VIN 的價格與里程（與既有彙整合併）"""
+        cursor.execute('''
+            WITH old AS (
+                SELECT *, date(scrape_datetime) AS day,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY vin, date(scrape_datetime)
+                           ORDER BY scrape_datetime DESC, id DESC
+                       ) AS rn
+                FROM vehicle_prices
+                WHERE scrape_datetime < ? AND vin IS NOT NULL
+            ),
+            daily AS (
+                SELECT vin, day,
+                       MIN(price) AS min_price, MAX(price) AS max_price,
+                       MIN(mileage) AS min_mileage, MAX(mileage) AS max_mileage,
+                       MAX(scrape_datetime) AS last_seen, COUNT(*) AS observations
+                FROM old
+                GROUP BY vin, day
+            )
+            INSERT INTO vehicle_daily
+                (vin, date, model, year, trim, location, exterior_color,
+                 min_price, max_price, last_price, min_mileage, max_mileage,
+                 last_mileage, last_seen, observations)
+            SELECT d.vin, d.day, o.model, o.year, o.trim, o.location, o.exterior_color,
+                   d.min_price, d.max_price, o.price, d.min_mileage, d.max_mileage,
+                   o.mileage, d.last_seen, d.observations
+            FROM daily d
+            JOIN old o ON o.vin = d.vin AND o.day = d.day AND o.rn = 1
+            WHERE true
+            ON CONFLICT(vin, date) DO UPDATE SET
+                min_price = MIN(COALESCE(min_price, excluded.min_price), COALESCE(excluded.min_price, min_price)),
+                max_price = MAX(COALESCE(max_price, excluded.max_price), COALESCE(excluded.max_price, max_price)),
+                min_mileage = MIN(COALESCE(min_mileage, excluded.min_mileage), COALESCE(excluded.min_mileage, min_mileage)),
+                max_mileage = MAX(COALESCE(max_mileage, excluded.max_mileage), COALESCE(excluded.max_mileage, max_mileage)),
+                last_price = CASE WHEN excluded.last_seen >= last_seen THEN excluded.last_price ELSE last_price END,
+                last_mileage = CASE WHEN excluded.last_seen >= last_seen THEN excluded.last_mileage ELSE last_mileage END,
+                last_seen = MAX(last_seen, excluded.last_seen),
+                observations = observations + excluded.observations
+        ''', (cutoff,))
+
+    def _rollup_models(self, cursor: sqlite3.Cursor, cutoff: str):
+        """彙整每日每車型的統計（與既有彙整合併）"""
+        cursor.execute('''
+            INSERT INTO model_daily
+                (date, model, observations, vehicles, price_sum, min_price, max_price,
+                 mileage_sum, mileage_count)
+            SELECT date(scrape_datetime), COALESCE(model, 'UNKNOWN'),
+                   COUNT(*), COUNT(DISTINCT vin), SUM(price), MIN(price), MAX(price),
+                   SUM(mileage), COUNT(mileage)
+            FROM vehicle_prices
+            WHERE scrape_datetime < ?
+            GROUP BY date(scrape_datetime), COALESCE(model, 'UNKNOWN')
+            ON CONFLICT(date, model) DO UPDATE SET
+                observations = observations + excluded.observations,
+                vehicles = MAX(vehicles, excluded.vehicles),
+                price_sum = COALESCE(price_sum, 0) + COALESCE(excluded.price_sum, 0),
+                min_price = MIN(COALESCE(min_price, excluded.min_price), COALESCE(excluded.min_price, min_price)),
+                max_price = MAX(COALESCE(max_price, excluded.max_price), COALESCE(excluded.max_price, max_price)),
+                mileage_sum = COALESCE(mileage_sum, 0) + COALESCE(excluded.mileage_sum, 0),
+                mileage_count = mileage_count + excluded.mileage_count
+        ''', (cutoff,))
+
+    def incremental_vacuum(self, conn: sqlite3.Connection):
+        """增量回收空間；首次執行時將資料庫轉為 incremental auto_vacuum 模式"""
+        mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        if mode != 2:
+            # 切換模式需要一次完整 VACUUM，之後皆為增量回收
+            logger.info("切換資料庫為 incremental auto_vacuum 模式（執行一次完整 VACUUM）")
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            return
+
+        if VACUUM_PAGES:
+            conn.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES})")
+        else:
+            conn.execute("PRAGMA incremental_vacuum")
+        conn.commit()
@@ -0,0 +1,440 @@
+#!/home/cclin/.local/python311/bin/python3
+"""
+Tesla 價格分位數草圖
+寫入時為每日 × 車型維護可合併的 KLL 分位數草圖，任意日期區間的中位數 / P10 / P90 只需合併小草圖
+"""
+
+import math
+import struct
+import sqlite3
+import logging
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# 草圖大小參數：k=200 時分位數的排名誤差約 1%，每個草圖最多保存數百個價格
+DEFAULT_K = 200
+# 各層容量遞減比例
+_CAPACITY_RATIO = 2.0 / 3.0
+
+# 序列化格式版本
+_FORMAT_VERSION = 1
+_HEADER = struct.Struct('<BHBqqq')
+_LEVEL = struct.Struct('<IB')
+
+# 滾動分位數的預設視窗與分位點
+ROLLING_DAYS = 7
+BAND_QUANTILES = (0.1, 0.5, 0.9)
+
+
+def quantile_column(q: float) -> str:
+    """分位點的欄位名稱（0.1 → 'p10'）"""
+    return f"p{round(q * 100):d}"
+
+
+class KLLSketch:
+    """KLL 分位數草圖（層 h 的每個值代表 2^h 筆觀測；最小 / 最大值精確保存）"""
+
+    def __init__(self, k: int = DEFAULT_K):
+        """
+        初始化草圖
+
+        Args:
+            k: 最上層容量，越大越精確
+        """
+        self.k = k
+        self.levels: List[List[int]] = [[]]
+        # 各層壓縮時輪流保留奇數 / 偶數位置，結果可重現
+        self.parities: List[int] = [0]
+        self.n = 0
+        self.min: Optional[int] = None
+        self.max: Optional[int] = None
+        self._size = 0
+        self._max_size = self._capacity(0)
+
+    def _capacity(self, h: int) -> int:
+        """第 h 層容量（越低層越小）"""
+        return int(math.ceil(self.k * _CAPACITY_RATIO ** (len(self.levels) - h - 1))) + 1
+
+    def _grow(self):
+        """增加一層"""
+        self.levels.append([])
+        self.parities.append(0)
+        self._max_size = sum(self._capacity(h) for h in range(len(self.levels)))
+
+    def _compress(self):
+        """壓縮第一個超過容量的層：排序後每兩個值保留一個並升到上一層"""
+        while self._size >= self._max_size:
+            for h, level in enumerate(self.levels):
+                if len(level) < self._capacity(h):
+                    continue
+                if h + 1 >= len(self.levels):
+                    self._grow()
+                level.sort()
+                keep = level[-1:] if len(level) % 2 else []
+                body = level[:len(level) - len(keep)]
+                self.levels[h + 1].extend(body[self.parities[h]::2])
+                self.parities[h] ^= 1
+                self.levels[h] = keep
+                self._size = sum(len(values) for values in self.levels)
+                break
+
+    def update(self, values: Iterable[int]):
+        """
+        加入一批價格
+
+        Args:
+            values: 價格序列
+        """
+        values = [int(v) for v in values]
+        if not values:
+            return
+        self.levels[0].extend(values)
+        self.n += len(values)
+        low, high = min(values), max(values)
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+        self._size += len(values)
+        self._compress()
+
+    def merge(self, other: 'KLLSketch') -> 'KLLSketch':
+        """
+        合併另一個草圖（就地修改並回傳自身）
+
+        Args:
+            other: 另一個草圖
+        """
+        if not other.n:
+            return self
+        while len(self.levels) < len(other.levels):
+            self._grow()
+        for h, values in enumerate(other.levels):
+            self.levels[h].extend(values)
+        self.n += other.n
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self._size = sum(len(values) for values in self.levels)
+        self._compress()
+        return self
+
+    def quantiles(self, qs: Sequence[float]) -> List[Optional[float]]:
+        """
+        估計分位數
+
+        Args:
+            qs: 分位點（0 ~ 1）
+
+        Returns:
+            List[Optional[float]]: 各分位點的值；草圖為空時為 None
+        """
+        if not self.n:
+            return [None] * len(qs)
+
+        values = np.concatenate([np.asarray(level, dtype=np.int64) for level in self.levels])
+        weights = np.concatenate([np.full(len(level), 1 << h, dtype=np.int64)
+                                  for h, level in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+        values, cumulative = values[order], np.cumsum(weights[order])
+
+        result = []
+        for q in qs:
+            if q <= 0:
+                result.append(float(self.min))
+            elif q >= 1:
+                result.append(float(self.max))
+            else:
+                i = int(np.searchsorted(cumulative, q * cumulative[-1], side='left'))
+                result.append(float(values[min(i, len(values) - 1)]))
+        return result
+
+    def to_bytes(self) -> bytes:
+        """序列化（標頭 + 各層長度與輪替位元 + int64 值）"""
+        header = _HEADER.pack(_FORMAT_VERSION, self.k, len(self.levels), self.n,
+                              self.min if self.min is not None else 0,
+                              self.max if self.max is not None else 0)
+        levels = b''.join(_LEVEL.pack(len(values), parity)
+                          for values, parity in zip(self.levels, self.parities))
+        values = np.fromiter((v for level in self.levels for v in level), dtype='<i8',
+                             count=self._size)
+        return header + levels + values.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'KLLSketch':
+        """由 to_bytes 的結果還原"""
+        version, k, depth, n, low, high = _HEADER.unpack_from(data, 0)
+        if version != _FORMAT_VERSION:
+            raise ValueError(f"不支援的草圖格式版本: {version}")
+
+        sketch = cls(k)
+        offset = _HEADER.size
+        lengths = []
+        sketch.parities = []
+        for _ in range(depth):
+            length, parity = _LEVEL.unpack_from(data, offset)
+            offset += _LEVEL.size
+            lengths.append(length)
+            sketch.parities.append(parity)
+
+        values = np.frombuffer(data, dtype='<i8', offset=offset).tolist()
+        sketch.levels = []
+        for length in lengths:
+            sketch.levels.append(values[:length])
+            values = values[length:]
+
+        sketch.n = n
+        sketch.min, sketch.max = (low, high) if n else (None, None)
+        sketch._size = sum(lengths)
+        sketch._max_size = sum(sketch._capacity(h) for h in range(depth))
+        return sketch
+
+
+class SketchStore:
+    """每日 × 車型的價格分位數草圖（存於 price_sketches 表格）"""
+
+    def __init__(self, conn: sqlite3.Connection, k: int = DEFAULT_K):
+        """
+        初始化草圖表
+
+        Args:
+            conn: 資料庫連線
+            k: 新草圖的大小參數
+        """
+        self.conn = conn
+        self.k = k
+
+    def init_schema(self):
+        """建立草圖表格；既有資料庫第一次建立時由原始資料回填"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS price_sketches (
+                date DATE NOT NULL,
+                model TEXT NOT NULL,
+                observations INTEGER NOT NULL,
+                sketch BLOB NOT NULL,
+                PRIMARY KEY (date, model)
+            ) WITHOUT ROWID
+        ''')
+
+        has_sketches = cursor.execute("SELECT 1 FROM price_sketches LIMIT 1").fetchone()
+        has_raw = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='vehicle_prices'").fetchone()
+        if not has_sketches and has_raw:
+            if cursor.execute("SELECT 1 FROM vehicle_prices LIMIT 1").fetchone():
+                logger.info("回填價格分位數草圖...")
+                self.rebuild()
+
+    def _write(self, sketches: Dict[Tuple[str, str], KLLSketch]):
+        """寫入（覆蓋）草圖"""
+        self.conn.executemany('''
+            INSERT INTO price_sketches (date, model, observations, sketch) VALUES (?, ?, ?, ?)
+            ON CONFLICT(date, model) DO UPDATE SET
+                observations = excluded.observations, sketch = excluded.sketch
+        ''', [(date, model, sketch.n, sketch.to_bytes())
+              for (date, model), sketch in sketches.items()])
+
+    def add(self, rows: Iterable[Tuple]):
+        """
+        將新寫入的觀測加入草圖（同一批先依日期 × 車型分組，每組只讀寫一次）
+
+        Args:
+            rows: (scrape_datetime, model, price, mileage) 的序列，與彙總表相同
+        """
+        batch: Dict[Tuple[str, str], List[int]] = {}
+        for scrape_datetime, model, price, _ in rows:
+            if price is None or not scrape_datetime:
+                continue
+            batch.setdefault((str(scrape_datetime)[:10], model or 'UNKNOWN'), []).append(price)
+
+        if not batch:
+            return
+
+        sketches = {}
+        for (date, model), prices in batch.items():
+            row = self.conn.execute(
+                "SELECT sketch FROM price_sketches WHERE date = ? AND model = ?",
+                (date, model)).fetchone()
+            sketch = KLLSketch.from_bytes(row[0]) if row else KLLSketch(self.k)
+            sketch.update(prices)
+            sketches[(date, model)] = sketch
+        self._write(sketches)
+
+    def rebuild(self, dates: Optional[List[str]] = None):
+        """
+        由原始資料重建草圖（已被保留策略彙整的日期保留原有草圖）
+
+        Args:
+            dates: 只重建指定日期；None 表示重建原始資料涵蓋的所有日期
+        """
+        if dates is None:
+            row = self.conn.execute("SELECT MIN(date(scrape_datetime)) FROM vehicle_prices").fetchone()
+            if not row or row[0] is None:
+                return
+            where, params = "date(scrape_datetime) >= ?", [row[0]]
+            delete_where = "date >= ?"
+        else:
+            if not dates:
+                return
+            placeholders = ', '.join('?' * len(dates))
+            where, params = f"date(scrape_datetime) IN ({placeholders})", list(dates)
+            delete_where = f"date IN ({placeholders})"
+
+        self.conn.execute(f"DELETE FROM price_sketches WHERE {delete_where}", params)
+
+        cursor = self.conn.execute(f'''
+            SELECT date(scrape_datetime), COALESCE(model, 'UNKNOWN'), price
+            FROM vehicle_prices
+            WHERE price IS NOT NULL AND {where}
+            ORDER BY 1, 2
+        ''', params)
+
+        # 依 (日期, 車型) 排序後逐組建立，記憶體只保留一組的價格
+        sketches, key, prices = {}, None, []
+        for date, model, price in cursor:
+            if (date, model) != key:
+                if prices:
+                    sketches[key] = KLLSketch(self.k)
+                    sketches[key].update(prices)
+                if len(sketches) >= 1000:
+                    self._write(sketches)
+                    sketches = {}
+                key, prices = (date, model), []
+            prices.append(price)
+        if prices:
+            sketches[key] = KLLSketch(self.k)
+            sketches[key].update(prices)
+        self._write(sketches)
+
+    def check_consistency(self) -> List[Tuple]:
+        """
+        比對草圖的觀測數與原始資料（僅比對原始資料仍保留的日期）
+
+        Returns:
+            List[Tuple]: 不一致的 (date, model, 草圖筆數, 原始資料筆數)
+        """
+        row = self.conn.execute("SELECT MIN(date(scrape_datetime)) FROM vehicle_prices").fetchone()
+        if not row or row[0] is None:
+            return []
+
+        expected = dict(((date, model), n) for date, model, n in self.conn.execute('''
+            SELECT date(scrape_datetime), COALESCE(model, 'UNKNOWN'), COUNT(*)
+            FROM vehicle_prices WHERE price IS NOT NULL AND date(scrape_datetime) >= ?
+            GROUP BY 1, 2
+        ''', (row[0],)))
+        actual = dict(((date, model), n) for date, model, n in self.conn.execute(
+            "SELECT date, model, observations FROM price_sketches WHERE date >= ?", (row[0],)))
+
+        return [key + (actual.get(key, 0), expected.get(key, 0))
+                for key in sorted(set(expected) | set(actual))
+                if actual.get(key, 0) != expected.get(key, 0)]
+
+    def _iter_sketches(self, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                       models: Optional[List[str]] = None):
+        """依日期順序讀取 (date, model, 草圖)"""
+        conditions, params = [], []
+        if start_date:
+            conditions.append("date >= ?")
+            params.append(start_date)
+        if end_date:
+            conditions.append("date <= ?")
+            params.append(end_date)
+        if models:
+            conditions.append(f"model IN ({', '.join('?' * len(models))})")
+            params.extend(models)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        for date, model, blob in self.conn.execute(
+                f"SELECT date, model, sketch FROM price_sketches {where} ORDER BY date, model", params):
+            yield date, model, KLLSketch.from_bytes(blob)
+
+    def merged(self, start_date: Optional[str] = None, end_date: Optional[str] = None,
+               models: Optional[List[str]] = None) -> KLLSketch:
+        """
+        合併日期區間內的草圖
+
+        Args:
+            start_date: 起始日期（含）
+            end_date: 結束日期（含）
+            models: 只合併指定車型
+
+        Returns:
+            KLLSketch: 合併結果
+        """
+        result = KLLSketch(self.k)
+        for _, _, sketch in self._iter_sketches(start_date, end_date, models):
+            result.merge(sketch)
+        return result
+
+    def quantiles(self, qs: Sequence[float] = BAND_QUANTILES, start_date: Optional[str] = None,
+                  end_date: Optional[str] = None, models: Optional[List[str]] = None) -> Dict[float, Optional[float]]:
+        """
+        日期區間內的市場價格分位數
+
+        Returns:
+            Dict[float, Optional[float]]: 分位點 → 價格
+        """
+        return dict(zip(qs, self.merged(start_date, end_date, models).quantiles(qs)))
+
+    def quantiles_by_model(self, qs: Sequence[float] = BAND_QUANTILES,
+                           start_date: Optional[str] = None,
+                           end_date: Optional[str] = None) -> pd.DataFrame:
+        """
+        各車型的價格分位數
+
+        Returns:
+            pd.DataFrame: index 為車型，欄位為 count 與各分位點（p10 / p50 / ...）
+        """
+        per_model: Dict[str, KLLSketch] = {}
+        for _, model, sketch in self._iter_sketches(start_date, end_date):
+            per_model.setdefault(model, KLLSketch(self.k)).merge(sketch)
+
+        columns = ['count'] + [quantile_column(q) for q in qs]
+        rows = {model: [sketch.n] + sketch.quantiles(qs) for model, sketch in sorted(per_model.items())}
+        return pd.DataFrame.from_dict(rows, orient='index', columns=columns)
+
+    def rolling(self, window_days: int = ROLLING_DAYS, qs: Sequence[float] = BAND_QUANTILES,
+                start_date: Optional[str] = None, end_date: Optional[str] = None,
+                models: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        滾動視窗分位數（每個有資料的日期合併前 window_days 天的草圖）
+
+        Args:
+            window_days: 視窗天數（含當日）
+            qs: 分位點
+            start_date: 起始日期（含）
+            end_date: 結束日期（含）
+            models: 只計算指定車型
+
+        Returns:
+            pd.DataFrame: date 與各分位點欄位（p10 / p50 / p90）
+        """
+        columns = ['date'] + [quantile_column(q) for q in qs]
+        if start_date:
+            # 第一天的視窗也要包含之前的資料
+            lookback = (pd.Timestamp(start_date) - timedelta(days=window_days - 1)).strftime('%Y-%m-%d')
+        else:
+            lookback = None
+
+        # 先將同一天各車型合併，每個日期只剩一個草圖
+        daily: Dict[str, KLLSketch] = {}
+        for date, _, sketch in self._iter_sketches(lookback, end_date, models):
+            daily.setdefault(date, KLLSketch(self.k)).merge(sketch)
+        if not daily:
+            return pd.DataFrame(columns=columns)
+
+        dates = sorted(daily)
+        timestamps = pd.to_datetime(dates)
+        rows = []
+        first = 0
+        for i, (date, timestamp) in enumerate(zip(dates, timestamps)):
+            while (timestamp - timestamps[first]).days >= window_days:
+                first += 1
+            if start_date and date < start_date:
+                continue
+            window = KLLSketch(self.k)
+            for j in range(first, i + 1):
+                window.merge(daily[dates[j]])
+            rows.append([timestamp] + window.quantiles(qs))
+        return pd.DataFrame(rows, columns=columns)
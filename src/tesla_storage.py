@@ -0,0 +1,986 @@
+#!/home/cclin/.local/python311/bin/python3
+"""
+Tesla 價格資料儲存層
+統一的寫入 / 讀取 / 彙總介面：SQLite 為預設實作，DuckDB 為內嵌分析用實作
+"""
+
+import abc
+import json
+import sqlite3
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import pandas as pd
+from pandas.api.types import union_categoricals, is_numeric_dtype
+
+from tesla_raw_store import RawDataStore
+from tesla_aggregates import AggregateStore, price_band_sql
+from tesla_events import PriceEventDetector
+from tesla_sketches import SketchStore
+from tesla_listings import ListingTracker
+from tesla_watchlist import Watchlist
+from tesla_column_cache import ColumnCache, cache_dir_for
+from tesla_vehicle_record import VehicleRecord
+from tesla_fingerprint import FingerprintMap
+from tesla_retention import has_rollup_tier, ROLLUP_OBSERVATIONS_SQL
+
+# 嘗試導入 duckdb
+try:
+    import duckdb
+    HAS_DUCKDB = True
+except ImportError:
+    HAS_DUCKDB = False
+
+logger = logging.getLogger(__name__)
+
+# 寫入 vehicle_prices 的欄位順序
+OBSERVATION_COLUMNS = [
+    'vin', 'model', 'year', 'trim', 'price', 'mileage', 'location',
+    'exterior_color', 'interior_color', 'autopilot_type',
+    'scrape_datetime', 'listing_url'
+]
+
+# 圖表與報表實際使用的欄位（不含 raw_data / listing_url 等大型文字欄位）
+ANALYSIS_COLUMNS = [
+    'vin', 'model', 'year', 'trim', 'price', 'mileage', 'location',
+    'exterior_color', 'scrape_datetime'
+]
+
+# 就地修改會改變分析結果的欄位（UPDATE 這些欄位或刪除資料列時遞增 table_versions；
+# sweep_id、raw_hash 等簿記欄位不影響快取）
+VERSIONED_COLUMNS = {
+    'vehicle_prices': OBSERVATION_COLUMNS,
+    'price_trends': ['vin', 'model', 'price', 'price_change', 'change_percentage', 'date_recorded'],
+}
+
+# 載入後轉為類別型態的欄位
+CATEGORICAL_COLUMNS = ['model', 'location', 'exterior_color', 'trim']
+
+# 載入後轉為精簡整數型態的欄位（含缺值時使用可為空的整數型態）
+INTEGER_DTYPES = {'price': 'int32', 'mileage': 'int32', 'year': 'int16'}
+
+# 分析查詢（{day} 由各實作替換為取日期的運算式）
+QUERIES = {
+    'vehicles': """
+        SELECT * FROM vehicle_prices
+        ORDER BY scrape_datetime DESC
+    """,
+    'trends': """
+        SELECT * FROM price_trends
+        ORDER BY date_recorded DESC
+    """,
+    'daily_counts': """
+        SELECT {day} AS date, COUNT(*) AS count
+        FROM vehicle_prices
+        GROUP BY 1 ORDER BY 1
+    """,
+    'model_stats': """
+        SELECT model, COUNT(*) AS count, AVG(price) AS price_mean,
+               MIN(price) AS price_min, MAX(price) AS price_max,
+               AVG(mileage) AS mileage_mean
+        FROM vehicle_prices
+        GROUP BY model ORDER BY model
+    """,
+    'price_bands': f"""
+        SELECT {price_band_sql()} AS band, COUNT(*) AS count
+        FROM vehicle_prices
+        WHERE price IS NOT NULL
+        GROUP BY 1 ORDER BY 1
+    """,
+    'color_counts': """
+        SELECT exterior_color, COUNT(*) AS count
+        FROM vehicle_prices
+        WHERE exterior_color IS NOT NULL
+        GROUP BY 1 ORDER BY 2 DESC
+        LIMIT 8
+    """,
+    'year_counts': """
+        SELECT year, COUNT(*) AS count
+        FROM vehicle_prices
+        WHERE year IS NOT NULL
+        GROUP BY 1 ORDER BY 1
+    """,
+    'price_mileage': """
+        SELECT model, price, mileage
+        FROM vehicle_prices
+        WHERE price IS NOT NULL
+    """,
+    'daily_model_avg': """
+        SELECT date_recorded, model, AVG(price) AS price
+        FROM price_trends
+        GROUP BY 1, 2 ORDER BY 1, 2
+    """,
+    'trend_heatmap': """
+        SELECT model, date_recorded, AVG(change_percentage) AS change_percentage
+        FROM price_trends
+        GROUP BY 1, 2 ORDER BY 1, 2
+    """,
+}
+
+# 價格變動熱力圖最多欄數；超過時依序改以每週、每月分組
+HEATMAP_MAX_COLUMNS = 60
+
+
+def compact_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """將觀測資料轉為類別 / 精簡整數 / datetime 型態以降低記憶體用量"""
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype('category')
+
+    for column, dtype in INTEGER_DTYPES.items():
+        if column in df.columns:
+            if df[column].isna().any():
+                dtype = dtype.capitalize()
+            df[column] = df[column].astype(dtype)
+
+    if 'scrape_datetime' in df.columns:
+        if is_numeric_dtype(df['scrape_datetime']):
+            df['scrape_datetime'] = pd.to_datetime(df['scrape_datetime'], unit='s')
+        else:
+            df['scrape_datetime'] = pd.to_datetime(df['scrape_datetime'])
+    return df
+
+
+def concat_compact(chunks: List[pd.DataFrame]) -> pd.DataFrame:
+    """合併多個精簡型態的分塊，類別欄位先統一類別集合以免退回 object 型態"""
+    if not chunks:
+        return pd.DataFrame()
+    if len(chunks) == 1:
+        return chunks[0]
+
+    for column in CATEGORICAL_COLUMNS:
+        if column in chunks[0].columns:
+            categories = union_categoricals([chunk[column] for chunk in chunks]).categories
+            for chunk in chunks:
+                chunk[column] = chunk[column].cat.set_categories(categories)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def _window_clause(date_column: str, start_date: Optional[str], end_date: Optional[str],
+                   models: Optional[List[str]]) -> Tuple[str, list]:
+    """產生日期區間（含結束日）與車型條件"""
+    conditions, params = [], []
+    if start_date:
+        conditions.append(f"{date_column} >= ?")
+        params.append(str(pd.Timestamp(start_date).date()))
+    if end_date:
+        conditions.append(f"{date_column} < ?")
+        params.append(str((pd.Timestamp(end_date) + timedelta(days=1)).date()))
+    if models:
+        conditions.append(f"model IN ({', '.join('?' * len(models))})")
+        params.extend(models)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+    return where, params
+
+
+def heatmap_bucket(first: pd.Timestamp, last: pd.Timestamp,
+                   max_columns: int = HEATMAP_MAX_COLUMNS) -> Tuple[str, pd.Timestamp]:
+    """
+    選擇熱力圖的時間分組，使欄數不超過 max_columns
+
+    Args:
+        first: 資料最早日期
+        last: 資料最晚日期
+        max_columns: 最多欄數
+
+    Returns:
+        Tuple: (分組 'day' / 'week' / 'month', 實際起始日期（按月仍過多時往後截斷）)
+    """
+    first, last = pd.Timestamp(first).normalize(), pd.Timestamp(last).normalize()
+    days = (last - first).days + 1
+    if days <= max_columns:
+        return 'day', first
+
+    week_start = first - timedelta(days=first.weekday())
+    if ((last - week_start).days // 7) + 1 <= max_columns:
+        return 'week', first
+
+    months = (last.year - first.year) * 12 + last.month - first.month + 1
+    if months > max_columns:
+        first = (last.to_period('M') - (max_columns - 1)).start_time
+    return 'month', first
+
+
+def observation_row(vehicle: Union[Dict, VehicleRecord], vehicle_id: Optional[str] = None) -> Tuple:
+    """
+    將車輛資料轉為 vehicle_prices 欄位值
+
+    Args:
+        vehicle: 車輛資料
+        vehicle_id: 寫入 vin 欄位的識別碼（FingerprintMap.resolve 的結果；未指定時為 VIN，缺少時以 unique_id 代替）
+
+    Returns:
+        Tuple: 欄位值
+    """
+    if isinstance(vehicle, VehicleRecord):
+        row = vehicle.to_db_row(OBSERVATION_COLUMNS)
+    else:
+        row = tuple(vehicle.get(column) for column in OBSERVATION_COLUMNS)
+    if vehicle_id is None:
+        vehicle_id = vehicle.get('vin') or vehicle.get('unique_id')
+    return (vehicle_id,) + row[1:]
+
+
+class StorageBackend(abc.ABC):
+    """儲存層介面（子類別需實作所有抽象方法）"""
+
+    # 取日期的 SQL 運算式
+    day_expression = 'date(scrape_datetime)'
+    # 熱力圖時間分組運算式（週以星期一為起始）
+    bucket_expressions = {
+        'day': "date({column})",
+        'week': "date({column}, 'weekday 0', '-6 days')",
+        'month': "strftime('%Y-%m-01', {column})",
+    }
+
+    # 載入 scrape_datetime 的 SQL 運算式（SQLite 直接轉為 epoch 秒數，省去字串解析）
+    datetime_expression = "CAST(strftime('%s', scrape_datetime) AS INTEGER)"
+
+    @abc.abstractmethod
+    def init_schema(self):
+        """建立表格"""
+
+    @abc.abstractmethod
+    def write_observations(self, vehicles: List[Union[Dict, VehicleRecord]]) -> int:
+        """
+        寫入一批車輛觀測
+
+        Args:
+            vehicles: 車輛資料
+
+        Returns:
+            int: 實際寫入的筆數
+        """
+
+    @abc.abstractmethod
+    def write_trends(self, rows: Iterable[Tuple]) -> int:
+        """寫入價格趨勢 (vin, model, price, price_change, change_percentage, date_recorded)"""
+
+    @abc.abstractmethod
+    def read_frame(self, sql: str, params: Tuple = ()) -> pd.DataFrame:
+        """執行查詢並回傳 DataFrame"""
+
+    @abc.abstractmethod
+    def iter_frames(self, sql: str, params: Tuple = (), chunksize: int = 100000) -> Iterator[pd.DataFrame]:
+        """分塊執行查詢"""
+
+    @abc.abstractmethod
+    def has_table(self, name: str) -> bool:
+        """表格是否存在"""
+
+    @abc.abstractmethod
+    def table_columns(self, name: str) -> List[str]:
+        """表格的欄位名稱"""
+
+    def observation_sources(self) -> List[str]:
+        """觀測資料來源（表格或子查詢）"""
+        return ['vehicle_prices']
+
+    @abc.abstractmethod
+    def close(self):
+        """關閉連線"""
+
+    def _observation_query(self, columns: Optional[List[str]], start_date: Optional[str],
+                           end_date: Optional[str], models: Optional[List[str]]) -> Tuple[str, list]:
+        """產生投影與篩選條件下推後的觀測查詢"""
+        available = set(self.table_columns('vehicle_prices'))
+        columns = [c for c in (columns or ANALYSIS_COLUMNS) if c in available]
+
+        select = ', '.join(
+            f"{self.datetime_expression} AS scrape_datetime" if c == 'scrape_datetime' else c
+            for c in columns
+        )
+        where, params = _window_clause('scrape_datetime', start_date, end_date, models)
+
+        sources = self.observation_sources()
+        sql = ' UNION ALL '.join(f"SELECT {select} FROM {source}{where}" for source in sources)
+        if 'scrape_datetime' in columns:
+            sql += " ORDER BY scrape_datetime DESC"
+        return sql, params * len(sources)
+
+    def iter_observations(self, columns: Optional[List[str]] = None,
+                          start_date: Optional[str] = None, end_date: Optional[str] = None,
+                          models: Optional[List[str]] = None,
+                          chunksize: int = 100000) -> Iterator[pd.DataFrame]:
+        """
+        分塊讀取觀測資料（每塊皆已轉為精簡型態）
+
+        Args:
+            columns: 需要的欄位，None 使用 ANALYSIS_COLUMNS
+            start_date: 起始日期（含）
+            end_date: 結束日期（含）
+            models: 只讀取指定車型
+            chunksize: 每塊筆數
+        """
+        sql, params = self._observation_query(columns, start_date, end_date, models)
+        for chunk in self.iter_frames(sql, tuple(params), chunksize):
+            yield compact_frame(chunk)
+
+    def read_observations(self, columns: Optional[List[str]] = None,
+                          start_date: Optional[str] = None, end_date: Optional[str] = None,
+                          models: Optional[List[str]] = None,
+                          chunksize: Optional[int] = None) -> pd.DataFrame:
+        """
+        讀取觀測資料（欄位投影、日期 / 車型條件皆在 SQL 端執行）
+
+        Args:
+            columns: 需要的欄位，None 使用 ANALYSIS_COLUMNS
+            start_date: 起始日期（含）
+            end_date: 結束日期（含）
+            models: 只讀取指定車型
+            chunksize: 指定時分塊讀取並逐塊轉型，降低峰值記憶體
+
+        Returns:
+            pd.DataFrame: 觀測資料
+        """
+        if chunksize:
+            return concat_compact(list(self.iter_observations(
+                columns, start_date, end_date, models, chunksize)))
+
+        sql, params = self._observation_query(columns, start_date, end_date, models)
+        return compact_frame(self.read_frame(sql, tuple(params)))
+
+    def read_trends(self, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                    models: Optional[List[str]] = None) -> pd.DataFrame:
+        """讀取價格趨勢（日期 / 車型條件在 SQL 端執行）"""
+        where, params = _window_clause('date_recorded', start_date, end_date, models)
+        df = self.read_frame(f"SELECT * FROM price_trends{where} ORDER BY date_recorded DESC",
+                             tuple(params))
+        if 'model' in df.columns:
+            df['model'] = df['model'].astype('category')
+        df['date_recorded'] = pd.to_datetime(df['date_recorded'])
+        return df
+
+    def read_trend_heatmap(self, window_days: Optional[int] = None,
+                           max_columns: int = HEATMAP_MAX_COLUMNS,
+                           models: Optional[List[str]] = None) -> Tuple[pd.DataFrame, str]:
+        """
+        在 SQL 端彙總價格變動熱力圖（車型 × 時間分組的平均變動百分比）
+
+        Args:
+            window_days: 只取最近 N 天，None 表示全部歷史
+            max_columns: 最多欄數，超過時改以每週或每月分組
+            models: 只讀取指定車型
+
+        Returns:
+            Tuple: (model / bucket / change_percentage 的 DataFrame, 分組名稱)
+        """
+        empty = pd.DataFrame(columns=['model', 'bucket', 'change_percentage'])
+        if not self.has_table('price_trends'):
+            return empty, 'day'
+
+        bounds = self.read_frame(
+            "SELECT MIN(date_recorded) AS first, MAX(date_recorded) AS last FROM price_trends").iloc[0]
+        if pd.isna(bounds['last']):
+            return empty, 'day'
+
+        first, last = pd.Timestamp(bounds['first']), pd.Timestamp(bounds['last'])
+        if window_days:
+            first = max(first, last - timedelta(days=window_days - 1))
+        bucket, first = heatmap_bucket(first, last, max_columns)
+
+        where, params = _window_clause('date_recorded', first, None, models)
+        expression = self.bucket_expressions[bucket].format(column='date_recorded')
+        df = self.read_frame(f'''
+            SELECT model, {expression} AS bucket, AVG(change_percentage) AS change_percentage
+            FROM price_trends{where}
+            GROUP BY 1, 2 ORDER BY 1, 2
+        ''', tuple(params))
+        df['bucket'] = pd.to_datetime(df['bucket'])
+        return df, bucket
+
+    def run_query(self, name: str, params: Tuple = ()) -> pd.DataFrame:
+        """
+        執行具名分析查詢
+
+        Args:
+            name: QUERIES 中的查詢名稱
+            params: 查詢參數
+
+        Returns:
+            pd.DataFrame: 查詢結果
+        """
+        return self.read_frame(QUERIES[name].format(day=self.day_expression), params)
+
+    def count_observations(self) -> int:
+        """觀測資料筆數"""
+        if not self.has_table('vehicle_prices'):
+            return 0
+        return int(self.read_frame("SELECT COUNT(*) AS n FROM vehicle_prices")['n'].iloc[0])
+
+    def table_fingerprint(self, table: str) -> List:
+        """
+        表格內容指紋（筆數、最大 id、最新時間）；任何寫入或刪除都會改變
+
+        Args:
+            table: 'vehicle_prices' 或 'price_trends'
+
+        Returns:
+            List: [筆數, 最大 id, 最新時間]；表格不存在時為空列表
+        """
+        if not self.has_table(table):
+            return []
+        date_column = 'date_recorded' if table == 'price_trends' else 'scrape_datetime'
+        row = self.read_frame(
+            f"SELECT COUNT(*) AS n, MAX(id) AS max_id, MAX({date_column}) AS latest FROM {table}"
+        ).iloc[0]
+        return [int(row['n']), None if pd.isna(row['max_id']) else int(row['max_id']),
+                None if pd.isna(row['latest']) else str(row['latest'])]
+
+
+class SQLiteStorage(StorageBackend):
+    """SQLite 儲存（預設）"""
+
+    def __init__(self, db_path: str = "tesla_prices.db"):
+        """
+        初始化 SQLite 儲存
+
+        Args:
+            db_path: 資料庫路徑
+        """
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.raw_store = RawDataStore(self.conn)
+        self.aggregates = AggregateStore(self.conn)
+        self.sketches = SketchStore(self.conn)
+        self.events = PriceEventDetector(self.conn)
+        self.listings = ListingTracker(self.conn)
+        self.watchlist = Watchlist(self.conn)
+        self.fingerprints = FingerprintMap(self.conn)
+        self.column_cache = ColumnCache(self.conn, cache_dir_for(db_path))
+        self._column_cache_synced = False
+
+    def init_schema(self):
+        """建立表格、原始文字儲存、彙總表、分位數草圖、價格變動事件、上架生命週期、追蹤清單與車輛指紋表"""
+        cursor = self.conn.cursor()
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS vehicle_prices (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                vin TEXT,
+                model TEXT,
+                year INTEGER,
+                trim TEXT,
+                price INTEGER,
+                mileage INTEGER,
+                location TEXT,
+                exterior_color TEXT,
+                interior_color TEXT,
+                autopilot_type TEXT,
+                scrape_datetime DATETIME,
+                listing_url TEXT,
+                raw_data TEXT,
+                raw_hash TEXT,
+                UNIQUE(vin, scrape_datetime)
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS price_trends (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                vin TEXT,
+                model TEXT,
+                price INTEGER,
+                price_change INTEGER,
+                change_percentage REAL,
+                date_recorded DATE,
+                UNIQUE(vin, date_recorded)
+            )
+        ''')
+
+        # 依時間 / 車型 + 時間查詢的索引（查詢 API 的最新在架車輛與日期範圍）
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_vehicle_prices_time "
+                       "ON vehicle_prices(scrape_datetime)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_vehicle_prices_model_time "
+                       "ON vehicle_prices(model, scrape_datetime)")
+
+        # 每筆觀測所屬的爬取輪次（舊資料庫補欄位）
+        if 'sweep_id' not in self.table_columns('vehicle_prices'):
+            cursor.execute("ALTER TABLE vehicle_prices ADD COLUMN sweep_id INTEGER")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_vehicle_prices_sweep "
+                       "ON vehicle_prices(sweep_id)")
+
+        # 原始文字改存於壓縮表格，並搬移舊資料
+        self.raw_store.init_schema()
+        self.conn.commit()
+        self.raw_store.migrate_inline_raw_data()
+
+        # 報表用彙總表（每日 × 車型 × 價格區間）
+        self.aggregates.init_schema()
+        self.conn.commit()
+
+        # 每日 × 車型的價格分位數草圖
+        self.sketches.init_schema()
+        self.conn.commit()
+
+        # 價格變動事件與每個 VIN 的最新價格索引
+        self.events.init_schema()
+        self.conn.commit()
+
+        # 上架生命週期（每輛車的首次 / 最後出現與售出）
+        self.listings.init_schema()
+        self.conn.commit()
+
+        # 追蹤規則與通知紀錄
+        self.watchlist.init_schema()
+        self.conn.commit()
+
+        # 沒有 VIN 的車輛指紋 → VIN 對應
+        self.fingerprints.init_schema()
+        self.conn.commit()
+
+        # 資料表變更計數（快取以此判斷就地修改）
+        self._init_table_versions(cursor)
+        self.conn.commit()
+
+    def _init_table_versions(self, cursor: sqlite3.Cursor):
+        """
+        建立資料表變更計數與觸發程序
+
+        新增資料列已反映在筆數與最大 id；就地 UPDATE 資料欄位或 DELETE 時由觸發程序遞增計數，
+        重新解析、保留策略等任何寫入路徑都不需要另外記得更新。
+        """
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS table_versions (
+                name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        ''')
+        for table, columns in VERSIONED_COLUMNS.items():
+            cursor.execute("INSERT OR IGNORE INTO table_versions (name, version) VALUES (?, 0)", (table,))
+            bump = f"UPDATE table_versions SET version = version + 1 WHERE name = '{table}';"
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_version_update
+                AFTER UPDATE OF {', '.join(columns)} ON {table}
+                BEGIN {bump} END
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_version_delete
+                AFTER DELETE ON {table}
+                BEGIN {bump} END
+            ''')
+
+    def table_version(self, table: str) -> int:
+        """資料表就地修改 / 刪除的次數（沒有計數時為 0）"""
+        if not self.has_table('table_versions'):
+            return 0
+        row = self.conn.execute("SELECT version FROM table_versions WHERE name = ?", (table,)).fetchone()
+        return row[0] if row else 0
+
+    def write_observations(self, vehicles: List[Union[Dict, VehicleRecord]]) -> int:
+        """
+        寫入一輪爬取的車輛觀測，並同步更新原始文字儲存、彙總表、分位數草圖、價格變動事件、上架生命週期與追蹤清單
+
+        每次呼叫視為一輪完整爬取：本輪涵蓋的車型中未再出現的在架車輛會被標為已售出。
+        沒有 VIN 的車輛以指紋（已知對應時為 VIN）寫入；本輪新學到的指紋 → VIN 對應會合併上架生命週期。
+        """
+        cursor = self.conn.cursor()
+
+        sweep_id = None
+        if vehicles:
+            started_at = min((str(v.get('scrape_datetime')) for v in vehicles if v.get('scrape_datetime')),
+                             default=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+            sweep_id = self.listings.begin_sweep(started_at)
+
+        saved_count = 0
+        inserted = []
+        seen = {}
+        for vehicle in vehicles:
+            try:
+                row = observation_row(vehicle, self.fingerprints.resolve(vehicle))
+                if row[0] and vehicle.get('scrape_datetime'):
+                    seen[row[0]] = (vehicle.get('model') or 'UNKNOWN', vehicle.get('trim'),
+                                    vehicle.get('year'), vehicle.get('price'),
+                                    str(vehicle.get('scrape_datetime')))
+
+                # 原始文字以內容雜湊存放，資料列只保留參照
+                raw_hash = self.raw_store.put(vehicle.get('raw_data'))
+
+                cursor.execute(f'''
+                    INSERT OR IGNORE INTO vehicle_prices
+                    ({', '.join(OBSERVATION_COLUMNS)}, raw_hash, sweep_id)
+                    VALUES ({', '.join('?' * (len(OBSERVATION_COLUMNS) + 2))})
+                ''', row + (raw_hash, sweep_id))
+
+                # 同一秒重複出現的同一輛車只保留第一筆，彙總也只計入實際寫入的資料
+                if cursor.rowcount == 1:
+                    saved_count += 1
+                    inserted.append((vehicle.get('scrape_datetime'), vehicle.get('model'),
+                                     vehicle.get('price'), vehicle.get('mileage')))
+                    self.events.observe(row[0], vehicle.get('model'),
+                                        vehicle.get('price'), vehicle.get('scrape_datetime'))
+                    self.watchlist.observe(row[0], vehicle.get('model'), vehicle.get('trim'),
+                                           vehicle.get('price'), vehicle.get('mileage'),
+                                           vehicle.get('scrape_datetime'))
+            except Exception as e:
+                logger.error(f"儲存失敗: {e}")
+
+        self.aggregates.add(inserted)
+        self.sketches.add(inserted)
+        events = self.events.flush()
+        matches = self.watchlist.flush()
+        linked = self.fingerprints.take_linked()
+        if sweep_id is not None:
+            for fingerprint, vin in linked:
+                self.listings.merge_alias(fingerprint, vin)
+            self.listings.end_sweep(sweep_id, seen)
+        self.conn.commit()
+        self.events.publish(events)
+        self.watchlist.publish(matches)
+        self._column_cache_synced = False
+        return saved_count
+
+    def _use_column_cache(self, columns: Optional[List[str]]) -> bool:
+        """需要的欄位都在欄式快取時，同步快取（每個連線只在寫入後重新同步）"""
+        if self.column_cache.cache_dir is None or not self.column_cache.covers(columns):
+            return False
+        if not self._column_cache_synced:
+            try:
+                self.column_cache.sync()
+            except Exception as e:
+                logger.warning(f"欄式快取無法使用，改讀資料庫: {e}")
+                return False
+            self._column_cache_synced = True
+        return True
+
+    def read_observations(self, columns: Optional[List[str]] = None,
+                          start_date: Optional[str] = None, end_date: Optional[str] = None,
+                          models: Optional[List[str]] = None,
+                          chunksize: Optional[int] = None) -> pd.DataFrame:
+        """讀取觀測資料（欄位都在欄式快取時由 mmap 建立，不經過 SQL 與時間解析）"""
+        if self._use_column_cache(columns):
+            return self.column_cache.frame(columns or ANALYSIS_COLUMNS, start_date, end_date, models)
+        return super().read_observations(columns, start_date, end_date, models, chunksize)
+
+    def iter_observations(self, columns: Optional[List[str]] = None,
+                          start_date: Optional[str] = None, end_date: Optional[str] = None,
+                          models: Optional[List[str]] = None,
+                          chunksize: int = 100000) -> Iterator[pd.DataFrame]:
+        """分塊讀取觀測資料（沒有篩選條件時直接切分欄式快取，順序不保證）"""
+        if not any([start_date, end_date, models]) and self._use_column_cache(columns):
+            return self.column_cache.iter_frames(columns or ANALYSIS_COLUMNS, chunksize)
+        return super().iter_observations(columns, start_date, end_date, models, chunksize)
+
+    def write_trends(self, rows: Iterable[Tuple]) -> int:
+        """寫入價格趨勢"""
+        cursor = self.conn.executemany('''
+            INSERT OR IGNORE INTO price_trends
+            (vin, model, price, price_change, change_percentage, date_recorded)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', list(rows))
+        self.conn.commit()
+        return cursor.rowcount
+
+    def read_frame(self, sql: str, params: Tuple = ()) -> pd.DataFrame:
+        """執行查詢並回傳 DataFrame"""
+        return pd.read_sql_query(sql, self.conn, params=params)
+
+    def iter_frames(self, sql: str, params: Tuple = (), chunksize: int = 100000) -> Iterator[pd.DataFrame]:
+        """分塊執行查詢"""
+        return pd.read_sql_query(sql, self.conn, params=params, chunksize=chunksize)
+
+    def has_table(self, name: str) -> bool:
+        """表格是否存在"""
+        return self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)
+        ).fetchone() is not None
+
+    def table_columns(self, name: str) -> List[str]:
+        """表格的欄位名稱"""
+        return [row[1] for row in self.conn.execute(f"PRAGMA table_info({name})")]
+
+    def observation_sources(self) -> List[str]:
+        """原始觀測，加上保留策略彙整後的每日資料"""
+        sources = ['vehicle_prices']
+        if has_rollup_tier(self.conn):
+            sources.append(f"({ROLLUP_OBSERVATIONS_SQL})")
+        return sources
+
+    def table_fingerprint(self, table: str) -> List:
+        """表格內容指紋；另外包含就地修改的變更計數，vehicle_prices 再加上彙整層的筆數"""
+        fingerprint = super().table_fingerprint(table)
+        if not fingerprint:
+            return fingerprint
+        fingerprint.append(self.table_version(table))
+        if table == 'vehicle_prices' and has_rollup_tier(self.conn):
+            fingerprint.append(self.conn.execute("SELECT COUNT(*) FROM vehicle_daily").fetchone()[0])
+        return fingerprint
+
+    def close(self):
+        """關閉連線"""
+        self.conn.close()
+
+
+class DuckDBStorage(StorageBackend):
+    """DuckDB 內嵌欄式儲存（分析用）"""
+
+    day_expression = 'CAST(scrape_datetime AS DATE)'
+    bucket_expressions = {
+        'day': "CAST({column} AS DATE)",
+        'week': "CAST(date_trunc('week', {column}) AS DATE)",
+        'month': "CAST(date_trunc('month', {column}) AS DATE)",
+    }
+    datetime_expression = 'scrape_datetime'
+
+    def __init__(self, db_path: str = "tesla_prices.duckdb"):
+        """
+        初始化 DuckDB 儲存
+
+        Args:
+            db_path: DuckDB 檔案路徑（':memory:' 表示記憶體）
+        """
+        if not HAS_DUCKDB:
+            raise ImportError("DuckDB 儲存需要 duckdb: pip install duckdb")
+
+        self.db_path = db_path
+        self.conn = duckdb.connect(db_path)
+
+    def init_schema(self):
+        """建立表格（分析用副本，不保存原始文字）"""
+        self.conn.execute("CREATE SEQUENCE IF NOT EXISTS vehicle_prices_id")
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS vehicle_prices (
+                id BIGINT DEFAULT nextval('vehicle_prices_id'),
+                vin VARCHAR,
+                model VARCHAR,
+                year INTEGER,
+                trim VARCHAR,
+                price BIGINT,
+                mileage INTEGER,
+                location VARCHAR,
+                exterior_color VARCHAR,
+                interior_color VARCHAR,
+                autopilot_type VARCHAR,
+                scrape_datetime TIMESTAMP,
+                listing_url VARCHAR,
+                raw_hash VARCHAR
+            )
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS price_trends (
+                id BIGINT,
+                vin VARCHAR,
+                model VARCHAR,
+                price BIGINT,
+                price_change BIGINT,
+                change_percentage DOUBLE,
+                date_recorded DATE
+            )
+        ''')
+        # 保留策略的每日彙整（與 SQLite 相同欄位，整表同步）
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS vehicle_daily (
+                vin VARCHAR,
+                date DATE,
+                model VARCHAR,
+                year INTEGER,
+                trim VARCHAR,
+                location VARCHAR,
+                exterior_color VARCHAR,
+                min_price BIGINT,
+                max_price BIGINT,
+                last_price BIGINT,
+                min_mileage INTEGER,
+                max_mileage INTEGER,
+                last_mileage INTEGER,
+                last_seen TIMESTAMP,
+                observations INTEGER
+            )
+        ''')
+        # 各表格上次同步時 SQLite 端的狀態（JSON）
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS sync_state (
+                name VARCHAR PRIMARY KEY,
+                state VARCHAR
+            )
+        ''')
+
+    def write_observations(self, vehicles: List[Union[Dict, VehicleRecord]]) -> int:
+        """寫入車輛觀測（與 SQLite 的 UNIQUE(vin, scrape_datetime) 相同，已存在的觀測略過）"""
+        rows = [observation_row(vehicle) for vehicle in vehicles]
+        if not rows:
+            return 0
+        columns = ', '.join(OBSERVATION_COLUMNS)
+        self.conn.execute(f"CREATE OR REPLACE TEMP TABLE _incoming AS "
+                          f"SELECT {columns} FROM vehicle_prices LIMIT 0")
+        try:
+            self.conn.executemany(f"INSERT INTO _incoming VALUES ({', '.join('?' * len(OBSERVATION_COLUMNS))})",
+                                  rows)
+            # VIN 為 NULL 的觀測不受唯一限制（與 SQLite 相同）
+            return self.conn.execute(f'''
+                INSERT INTO vehicle_prices ({columns})
+                SELECT {columns} FROM (
+                    SELECT *, ROW_NUMBER() OVER (PARTITION BY vin, scrape_datetime) AS rn FROM _incoming
+                ) i
+                WHERE (i.rn = 1 OR i.vin IS NULL)
+                  AND NOT EXISTS (SELECT 1 FROM vehicle_prices v
+                                  WHERE v.vin = i.vin AND v.scrape_datetime = i.scrape_datetime)
+            ''').fetchone()[0]
+        finally:
+            self.conn.execute("DROP TABLE IF EXISTS _incoming")
+
+    def write_trends(self, rows: Iterable[Tuple]) -> int:
+        """寫入價格趨勢"""
+        rows = list(rows)
+        if rows:
+            self.conn.executemany('''
+                INSERT INTO price_trends
+                (vin, model, price, price_change, change_percentage, date_recorded)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', rows)
+        return len(rows)
+
+    def write_frame(self, table: str, df: pd.DataFrame):
+        """以 DataFrame 大量寫入（欄位名稱需與表格一致）"""
+        self.conn.register('_incoming', df)
+        try:
+            self.conn.execute(
+                f"INSERT INTO {table} ({', '.join(df.columns)}) SELECT * FROM _incoming")
+        finally:
+            self.conn.unregister('_incoming')
+
+    def sync_from_sqlite(self, sqlite_path: str = "tesla_prices.db", chunksize: int = 200000) -> int:
+        """
+        從 SQLite 同步資料
+
+        只有新增資料列時依 id 水位附加；SQLite 端有刪除（保留策略）、就地修改（重新解析，
+        由 table_versions 得知）或最小 id 改變時，整表重新複製。每日彙整表變動時整表重新複製。
+
+        Args:
+            sqlite_path: SQLite 資料庫路徑
+            chunksize: 每批讀取筆數
+
+        Returns:
+            int: 同步（附加或重新複製）的 vehicle_prices 筆數
+        """
+        source = sqlite3.connect(sqlite_path)
+        synced = 0
+        try:
+            for table in ('vehicle_prices', 'price_trends', 'vehicle_daily'):
+                copied = self._sync_table(source, table, chunksize)
+                if table == 'vehicle_prices':
+                    synced = copied
+        finally:
+            source.close()
+
+        logger.info(f"已同步 {synced} 筆觀測至 DuckDB")
+        return synced
+
+    @staticmethod
+    def _source_state(source: sqlite3.Connection, table: str) -> Optional[Dict]:
+        """SQLite 端表格目前的狀態（表格不存在時為 None）"""
+        tables = {row[0] for row in source.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if table not in tables:
+            return None
+        if table == 'vehicle_daily':
+            count, latest = source.execute("SELECT COUNT(*), MAX(last_seen) FROM vehicle_daily").fetchone()
+            return {'rows': count, 'latest': latest}
+        count, min_id, max_id = source.execute(f"SELECT COUNT(*), MIN(id), MAX(id) FROM {table}").fetchone()
+        version = 0
+        if 'table_versions' in tables:
+            row = source.execute("SELECT version FROM table_versions WHERE name = ?", (table,)).fetchone()
+            version = row[0] if row else 0
+        return {'rows': count, 'min_id': min_id, 'max_id': max_id or 0, 'version': version}
+
+    def _sync_table(self, source: sqlite3.Connection, table: str, chunksize: int) -> int:
+        """同步一個表格；回傳附加或重新複製的筆數"""
+        state = self._source_state(source, table)
+        if state is None:
+            return 0
+        row = self.conn.execute("SELECT state FROM sync_state WHERE name = ?", [table]).fetchone()
+        previous = json.loads(row[0]) if row else None
+        if previous == state:
+            return 0
+
+        columns = [row[0] for row in self.conn.execute(f"DESCRIBE {table}").fetchall()]
+        source_columns = [row[1] for row in source.execute(f"PRAGMA table_info({table})")]
+        columns = [c for c in columns if c in source_columns]
+
+        if table == 'vehicle_daily':
+            appendable = False
+        elif previous is None:
+            # 舊版只以 id 水位同步、沒有記錄狀態的副本：筆數與 id 範圍一致時視為可附加
+            count, min_id = self.conn.execute(f"SELECT COUNT(*), MIN(id) FROM {table}").fetchone()
+            previous = {'rows': count, 'min_id': min_id,
+                        'max_id': self.conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0],
+                        'version': state['version']}
+            appendable = count == 0 or min_id == state['min_id']
+        else:
+            appendable = previous['version'] == state['version'] and previous['min_id'] == state['min_id']
+
+        if appendable:
+            new_rows = source.execute(f"SELECT COUNT(*) FROM {table} WHERE id > ? AND id <= ?",
+                                      (previous['max_id'], state['max_id'])).fetchone()[0]
+            appendable = previous['rows'] + new_rows == state['rows']
+
+        if appendable:
+            query = f"SELECT {', '.join(columns)} FROM {table} WHERE id > ? AND id <= ? ORDER BY id"
+            params = (previous['max_id'], state['max_id'])
+        else:
+            logger.info(f"{table}: 無法依 id 水位附加，重新複製整個表格")
+            self.conn.execute(f"DELETE FROM {table}")
+            order = 'date, vin' if table == 'vehicle_daily' else 'id'
+            query = f"SELECT {', '.join(columns)} FROM {table} ORDER BY {order}"
+            params = ()
+
+        copied = 0
+        for chunk in pd.read_sql_query(query, source, params=params, chunksize=chunksize):
+            self.write_frame(table, chunk)
+            copied += len(chunk)
+        self.conn.execute("INSERT OR REPLACE INTO sync_state VALUES (?, ?)", [table, json.dumps(state)])
+        return copied
+
+    def observation_sources(self) -> List[str]:
+        """原始觀測，加上同步過來的每日彙整資料"""
+        sources = ['vehicle_prices']
+        if self.has_table('vehicle_daily') and \
+                self.conn.execute("SELECT 1 FROM vehicle_daily LIMIT 1").fetchone():
+            sources.append(f"({ROLLUP_OBSERVATIONS_SQL})")
+        return sources
+
+    def read_frame(self, sql: str, params: Tuple = ()) -> pd.DataFrame:
+        """執行查詢並回傳 DataFrame"""
+        return self.conn.execute(sql, list(params)).df()
+
+    def iter_frames(self, sql: str, params: Tuple = (), chunksize: int = 100000) -> Iterator[pd.DataFrame]:
+        """分塊執行查詢（DuckDB 以 2048 筆為一個向量）"""
+        cursor = self.conn.execute(sql, list(params))
+        vectors = max(1, chunksize // 2048)
+        while True:
+            chunk = cursor.fetch_df_chunk(vectors)
+            if chunk.empty:
+                break
+            yield chunk
+
+    def has_table(self, name: str) -> bool:
+        """表格是否存在"""
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?", [name]
+        ).fetchone()[0] > 0
+
+    def table_columns(self, name: str) -> List[str]:
+        """表格的欄位名稱"""
+        return [row[0] for row in self.conn.execute(f"DESCRIBE {name}").fetchall()]
+
+    def close(self):
+        """關閉連線"""
+        self.conn.close()
+
+
+def open_storage(backend: str = 'sqlite', db_path: Optional[str] = None) -> StorageBackend:
+    """
+    依名稱建立儲存實作
+
+    Args:
+        backend: 'sqlite' 或 'duckdb'
+        db_path: 資料庫路徑，None 使用各實作預設值
+
+    Returns:
+        StorageBackend: 儲存實作
+    """
+    if backend == 'duckdb':
+        return DuckDBStorage(db_path or "tesla_prices.duckdb")
+    if backend == 'sqlite':
+        return SQLiteStorage(db_path or "tesla_prices.db")
+    raise ValueError(f"不支援的儲存類型: {backend}")
@@ -0,0 +1,97 @@
+#!/home/cclin/.local/python311/bin/python3
+"""
+Tesla 車輛紀錄
+以 __slots__ 保存爬取到的車輛，類別欄位字串共用（intern），同一輪所有紀錄共用同一個時間字串，
+可直接轉為資料庫資料列與 JSON
+"""
+
+import sys
+import json
+from typing import Iterable, Optional, Tuple
+
+# 欄位順序（與 vehicle_prices 的寫入欄位相同，另加 unique_id（車輛指紋）、頁面 data-id 與 raw_data）
+RECORD_FIELDS = (
+    'vin', 'model', 'year', 'trim', 'price', 'mileage', 'location',
+    'exterior_color', 'interior_color', 'autopilot_type', 'scrape_datetime', 'listing_url',
+    'unique_id', 'data_id', 'raw_data',
+)
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    """共用字串物件（車型 / 車款 / 地點 / 顏色等值域很小的欄位；None 保持 None）"""
+    return None if value is None else sys.intern(str(value))
+
+
+class VehicleRecord:
+    """一輛車的一次觀測"""
+
+    __slots__ = RECORD_FIELDS
+
+    def __init__(self, model: str, scrape_datetime: str, vin: Optional[str] = None,
+                 unique_id: Optional[str] = None, year: Optional[int] = None,
+                 trim: Optional[str] = None, price: Optional[int] = None,
+                 mileage: Optional[int] = None, location: Optional[str] = None,
+                 exterior_color: Optional[str] = None, interior_color: Optional[str] = None,
+                 autopilot_type: Optional[str] = None, listing_url: Optional[str] = None,
+                 data_id: Optional[str] = None, raw_data: Optional[str] = None):
+        """
+        建立紀錄
+
+        Args:
+            model: 車型
+            scrape_datetime: 本輪爬取時間（同一輪的紀錄傳入同一個字串物件）
+            unique_id: 車輛指紋（tesla_fingerprint.vehicle_fingerprint）
+            data_id: 頁面元素的 data-id 屬性
+            其餘欄位同 vehicle_prices；raw_data 只在需要保留原始文字時傳入
+        """
+        self.vin = vin
+        self.unique_id = unique_id
+        self.model = _intern(model)
+        self.year = year
+        self.trim = _intern(trim)
+        self.price = price
+        self.mileage = mileage
+        self.location = _intern(location)
+        self.exterior_color = _intern(exterior_color)
+        self.interior_color = _intern(interior_color)
+        self.autopilot_type = _intern(autopilot_type)
+        self.scrape_datetime = scrape_datetime
+        self.listing_url = listing_url
+        self.data_id = data_id
+        self.raw_data = raw_data
+
+    def __repr__(self) -> str:
+        return f"VehicleRecord({self.key!r}, {self.model!r}, price={self.price!r})"
+
+    @property
+    def key(self) -> Optional[str]:
+        """去重用的識別碼（VIN，沒有時為車輛指紋）"""
+        return self.vin or self.unique_id
+
+    def get(self, name: str, default=None):
+        """與 dict 相同的讀取介面（寫入層同時接受 dict 與紀錄）"""
+        value = getattr(self, name, None) if name in RECORD_FIELDS else None
+        return default if value is None else value
+
+    def to_db_row(self, columns: Iterable[str]) -> Tuple:
+        """
+        依欄位順序轉為資料列（VIN 缺少時以 unique_id 代替）
+
+        Args:
+            columns: 欄位名稱（例如 OBSERVATION_COLUMNS）
+
+        Returns:
+            Tuple: 欄位值
+        """
+        return tuple(self.key if column == 'vin' else getattr(self, column) for column in columns)
+
+    def to_json(self) -> str:
+        """轉為 JSON 物件字串（省略空值）"""
+        return '{' + ', '.join(f'"{field}": {json.dumps(value, ensure_ascii=False)}'
+                               for field in RECORD_FIELDS
+                               for value in (getattr(self, field),) if value is not None) + '}'
+
+
+def records_to_json(records: Iterable[VehicleRecord]) -> str:
+    """多筆紀錄轉為 JSON 陣列字串"""
+    return '[\n' + ',\n'.join(record.to_json() for record in records) + '\n]'
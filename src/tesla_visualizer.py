@@ -4,333 +4,600 @@ Tesla 認證中古車價格趨勢視覺化分析
 提供互動式圖表和深入的價格分析
 """
 
-import sqlite3
+import os
+import time
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
+from typing import Dict, List, Optional
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
+from matplotlib.colors import LogNorm
 from matplotlib.font_manager import FontProperties
 import seaborn as sns
 import warnings
+
+from tesla_market_stats import (MarketStats, compute_market_stats, compute_trend_stats,
+                                points_by_model, apply_sketch_quantiles, SCATTER_POINT_LIMIT)
+from tesla_storage import (open_storage, compact_frame, SQLiteStorage, ANALYSIS_COLUMNS,
+                           HEATMAP_MAX_COLUMNS)
+from tesla_analysis_state import AnalysisState, stats_from_state
+from tesla_depreciation import DepreciationModel
 warnings.filterwarnings('ignore')
 
-# 設定中文字體
-plt.rcParams['font.sans-serif'] = ['Microsoft JhengHei', 'Arial Unicode MS', 'sans-serif']
-plt.rcParams['axes.unicode_minus'] = False
+
+# 輸出檔名（不含副檔名）
+CHART_FILES = {
+    'price_distribution': 'tesla_price_distribution',
+    'price_trends': 'tesla_price_trends',
+    'market_insights': 'tesla_market_insights',
+}
+
+# 熱力圖格數超過此值時不標註數值
+HEATMAP_ANNOTATION_LIMIT = 120
+
+# 熱力圖時間分組的標題說明
+HEATMAP_BUCKET_TITLES = {'day': '每日', 'week': '每週', 'month': '每月'}
+
+# 各圖表依賴的資料表（用於計算快取指紋）
+CHART_INPUTS = {
+    'price_distribution': ['vehicle_prices'],
+    'price_trends': ['price_trends', 'vehicle_prices'],
+    'market_insights': ['vehicle_prices'],
+}
+
+
+def setup_plot_style():
+    """設定Seaborn樣式（繪圖子程序也需各自設定一次）"""
+    sns.set_style("whitegrid")
+    sns.set_palette("husl")
+    # 設定中文字體
+    plt.rcParams['font.sans-serif'] = ['Microsoft JhengHei', 'Arial Unicode MS', 'sans-serif']
+    plt.rcParams['axes.unicode_minus'] = False
+
+
+def save_figure(fig, path: str, dpi: int = 300):
+    """
+    儲存圖表並釋放記憶體
+
+    Args:
+        fig: matplotlib Figure
+        path: 輸出路徑（副檔名決定格式）
+        dpi: 輸出解析度
+    """
+    fig.savefig(path, dpi=dpi, bbox_inches='tight')
+    plt.close(fig)
+
+
+def draw_price_distribution(stats: MarketStats):
+    """
+    繪製價格分布圖
+
+    Args:
+        stats: 市場統計
+
+    Returns:
+        Figure: 圖表
+    """
+    fig, axes = plt.subplots(2, 2, figsize=(15, 10))
+    fig.suptitle('Tesla 認證中古車價格分布分析', fontsize=16, fontweight='bold')
+
+    # 1. 整體價格分布直方圖（以預先計算的分組數量繪製）
+    ax1 = axes[0, 0]
+    hist_counts, hist_edges = stats.price_histogram
+    ax1.hist(hist_edges[:-1], bins=hist_edges, weights=hist_counts,
+             edgecolor='black', alpha=0.7)
+    ax1.set_xlabel('價格 (萬元 NTD)')
+    ax1.set_ylabel('車輛數量')
+    ax1.set_title('整體價格分布')
+    ax1.grid(True, alpha=0.3)
+
+    # 添加統計資訊
+    mean_price = stats.overall['price_mean'] / 10000
+    median_price = stats.overall['price_median'] / 10000
+    ax1.axvline(mean_price, color='red', linestyle='--', label=f'平均: {mean_price:.1f}萬')
+    ax1.axvline(median_price, color='green', linestyle='--', label=f'中位數: {median_price:.1f}萬')
+    if stats.overall.get('price_p10') is not None:
+        p10, p90 = stats.overall['price_p10'] / 10000, stats.overall['price_p90'] / 10000
+        ax1.axvspan(p10, p90, color='green', alpha=0.08, label=f'P10-P90: {p10:.1f}-{p90:.1f}萬')
+    ax1.legend()
+
+    # 2. 各車型價格箱型圖
+    ax2 = axes[0, 1]
+    models = [box_stat['label'] for box_stat in stats.box_stats]
+    box = ax2.bxp(stats.box_stats, patch_artist=True)
+
+    # 設定箱型圖顏色
+    colors = plt.cm.Set3(np.linspace(0, 1, len(models)))
+    for patch, color in zip(box['boxes'], colors):
+        patch.set_facecolor(color)
+
+    ax2.set_xlabel('車型')
+    ax2.set_ylabel('價格 (萬元 NTD)')
+    ax2.set_title('各車型價格分布')
+    ax2.grid(True, alpha=0.3)
+
+    # 3. 價格與里程關係散點圖（資料量大時改為 2-D 密度圖）
+    ax3 = axes[1, 0]
+    max_mileage = None
+    if stats.scatter_density is not None:
+        counts, x_edges, y_edges = stats.scatter_density
+        mesh = ax3.pcolormesh(x_edges, y_edges, np.ma.masked_equal(counts.T, 0),
+                              cmap='viridis', norm=LogNorm())
+        fig.colorbar(mesh, ax=ax3, label='車輛數量')
+        max_mileage = x_edges[-1] * 1000
+    elif stats.points_by_model:
+        max_mileage = 0
+        for model, (mileage, prices) in stats.points_by_model.items():
+            ax3.scatter(mileage / 1000, prices / 10000,
+                      label=model, alpha=0.6, s=50)
+            if np.isfinite(mileage).any():
+                max_mileage = max(max_mileage, np.nanmax(mileage))
+        ax3.legend()
+
+    if max_mileage is not None:
+        ax3.set_xlabel('里程數 (千公里)')
+        ax3.set_ylabel('價格 (萬元 NTD)')
+        ax3.set_title('價格與里程關係')
+        ax3.grid(True, alpha=0.3)
+
+        # 各車型折舊曲線（平均車齡下），沒有時使用整體趨勢線
+        if stats.depreciation_curves:
+            for model, (x_curve, y_curve) in stats.depreciation_curves.items():
+                ax3.plot(x_curve, y_curve, "--", linewidth=2, label=f'{model} 折舊')
+            ax3.legend(fontsize=8)
+        elif stats.trend_coefficients is not None:
+            p = np.poly1d(stats.trend_coefficients)
+            x_trend = np.linspace(0, max_mileage / 1000, 100)
+            ax3.plot(x_trend, p(x_trend), "r--", alpha=0.5, label='趨勢線')
+
+    # 4. 各車型庫存數量圓餅圖
+    ax4 = axes[1, 1]
+    model_counts = stats.per_model['count'].sort_values(ascending=False)
+    model_counts = model_counts[model_counts > 0]
+    wedges, texts, autotexts = ax4.pie(model_counts.values,
+                                       labels=model_counts.index,
+                                       autopct='%1.1f%%',
+                                       startangle=90)
+
+    # 改善圓餅圖文字
+    for autotext in autotexts:
+        autotext.set_color('white')
+        autotext.set_fontweight('bold')
+
+    ax4.set_title('各車型庫存比例')
+
+    fig.tight_layout()
+    return fig
+
+
+def draw_price_trends(stats: MarketStats):
+    """
+    繪製價格趨勢圖
+
+    Args:
+        stats: 市場統計（需先以 compute_trend_stats 加入趨勢資料）
+
+    Returns:
+        Figure: 圖表；無趨勢資料時為 None
+    """
+    if stats.trend_daily_avg.empty:
+        return None
+
+    fig, axes = plt.subplots(2, 1, figsize=(15, 10))
+    fig.suptitle('Tesla 認證中古車價格趨勢分析', fontsize=16, fontweight='bold')
+
+    # 1. 平均價格趨勢
+    ax1 = axes[0]
+
+    # 按日期和車型分組的平均價格
+    daily_avg = stats.trend_daily_avg
+
+    # 降採樣後點數多，不再逐點標記
+    marker = None if stats.trend_downsampled else 'o'
+    for model in daily_avg['model'].unique():
+        model_data = daily_avg[daily_avg['model'] == model]
+        ax1.plot(model_data['date_recorded'],
+                model_data['price'] / 10000,
+                marker=marker, label=model, linewidth=2)
+
+    # 全市場滾動中位數與 P10-P90 區間（由分位數草圖合併，只取趨勢圖的日期範圍）
+    band = stats.price_quantile_band
+    if not band.empty:
+        first, last = daily_avg['date_recorded'].min(), daily_avg['date_recorded'].max()
+        band = band[(band['date'] >= first) & (band['date'] <= last)]
+    if not band.empty:
+        ax1.fill_between(band['date'], band['p10'] / 10000, band['p90'] / 10000,
+                         color='gray', alpha=0.15, label='市場 P10-P90')
+        ax1.plot(band['date'], band['p50'] / 10000, color='black', linestyle=':',
+                 linewidth=1.5, label='市場滾動中位數')
+
+    ax1.set_xlabel('日期')
+    ax1.set_ylabel('平均價格 (萬元 NTD)')
+    ax1.set_title('各車型平均價格趨勢')
+    ax1.legend(loc='best')
+    ax1.grid(True, alpha=0.3)
+
+    # 格式化x軸日期（期間長時每週一個刻度過密，改由 matplotlib 自動決定）
+    ax1.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
+    span = daily_avg['date_recorded'].max() - daily_avg['date_recorded'].min()
+    if stats.trend_downsampled or span.days > 120:
+        ax1.xaxis.set_major_locator(mdates.AutoDateLocator())
+    else:
+        ax1.xaxis.set_major_locator(mdates.DayLocator(interval=7))
+    plt.setp(ax1.xaxis.get_majorticklabels(), rotation=45)
+
+    # 2. 價格變動熱力圖
+    ax2 = axes[1]
+
+    pivot_data = stats.trend_heatmap
+
+    if not pivot_data.empty:
+        # 格數多時數值標註不可讀且佔大部分繪圖時間
+        sns.heatmap(pivot_data,
+                   annot=pivot_data.size <= HEATMAP_ANNOTATION_LIMIT,
+                   fmt='.1f',
+                   cmap='RdYlGn_r',
+                   center=0,
+                   ax=ax2,
+                   cbar_kws={'label': '價格變動百分比 (%)'}
+                   )
+
+        ax2.set_title(f'價格變動熱力圖（{HEATMAP_BUCKET_TITLES[stats.trend_heatmap_bucket]}平均）')
+        ax2.set_xlabel('日期')
+        ax2.set_ylabel('車型')
+        plt.setp(ax2.xaxis.get_majorticklabels(), rotation=45)
+
+    fig.tight_layout()
+    return fig
+
+
+def draw_market_insights(stats: MarketStats):
+    """
+    繪製市場洞察圖表
+
+    Args:
+        stats: 市場統計
+
+    Returns:
+        Figure: 圖表
+    """
+    fig, axes = plt.subplots(2, 2, figsize=(15, 10))
+    fig.suptitle('Tesla 認證中古車市場洞察', fontsize=16, fontweight='bold')
+
+    # 1. 新車輛上架趨勢
+    ax1 = axes[0, 0]
+
+    # 每天新增車輛數
+    daily_new = stats.daily_counts
+
+    ax1.plot(daily_new.index, daily_new.values,
+            marker='o', linewidth=2, color='steelblue')
+    ax1.fill_between(daily_new.index, daily_new.values,
+                    alpha=0.3, color='steelblue')
+    ax1.set_xlabel('日期')
+    ax1.set_ylabel('新增車輛數')
+    ax1.set_title('每日新增車輛趨勢')
+    ax1.grid(True, alpha=0.3)
+    plt.setp(ax1.xaxis.get_majorticklabels(), rotation=45)
+
+    # 2. 價格區間分布
+    ax2 = axes[0, 1]
+
+    range_counts = stats.per_band.values.tolist()
+    range_labels = stats.per_band.index.tolist()
+
+    bars = ax2.bar(range_labels, range_counts, color='coral')
+    ax2.set_xlabel('價格區間')
+    ax2.set_ylabel('車輛數量')
+    ax2.set_title('價格區間分布')
+
+    # 添加數值標籤
+    for bar, count in zip(bars, range_counts):
+        height = bar.get_height()
+        ax2.text(bar.get_x() + bar.get_width()/2., height,
+                f'{count}',
+                ha='center', va='bottom')
+
+    plt.setp(ax2.xaxis.get_majorticklabels(), rotation=45)
+
+    # 3. 顏色偏好分析
+    ax3 = axes[1, 0]
+
+    if not stats.per_color.empty:
+        color_counts = stats.per_color
+
+        colors_map = {
+            'Pearl White': '#F8F8FF',
+            'Solid Black': '#000000',
+            'Midnight Silver': '#696969',
+            'Deep Blue': '#00008B',
+            'Red': '#DC143C',
+            'Gray': '#808080',
+            'Blue': '#4169E1',
+            'White': '#FFFFFF'
+        }
+
+        bar_colors = [colors_map.get(c, '#CCCCCC') for c in color_counts.index]
+
+        bars = ax3.barh(range(len(color_counts)), color_counts.values)
+
+        for bar, color in zip(bars, bar_colors):
+            bar.set_color(color)
+            bar.set_edgecolor('black')
+
+        ax3.set_yticks(range(len(color_counts)))
+        ax3.set_yticklabels(color_counts.index)
+        ax3.set_xlabel('數量')
+        ax3.set_title('外觀顏色偏好')
+        ax3.invert_yaxis()
+
+    # 4. 年份分布
+    ax4 = axes[1, 1]
+
+    if not stats.per_year.empty:
+        year_counts = stats.per_year
+
+        ax4.bar(year_counts.index, year_counts.values,
+               color='teal', edgecolor='black')
+        ax4.set_xlabel('年份')
+        ax4.set_ylabel('車輛數量')
+        ax4.set_title('車輛年份分布')
+        ax4.grid(True, alpha=0.3, axis='y')
+
+        # 添加數值標籤
+        for x, y in zip(year_counts.index, year_counts.values):
+            ax4.text(x, y, str(y), ha='center', va='bottom')
+
+    fig.tight_layout()
+    return fig
+
+
+# 圖表名稱 → 繪圖函式（只依賴 MarketStats，可在子程序中執行）
+CHART_DRAWERS = {
+    'price_distribution': draw_price_distribution,
+    'price_trends': draw_price_trends,
+    'market_insights': draw_market_insights,
+}
+
 
 class TeslaPriceVisualizer:
     """Tesla價格視覺化分析工具"""
 
-    def __init__(self, db_path: str = "tesla_prices.db"):
+    def __init__(self, db_path: Optional[str] = None, archive_dir: str = "tesla_archive",
+                 backend: str = 'sqlite', output_dir: str = '.', output_dpi: int = 300,
+                 output_format: str = 'png', interactive: bool = True,
+                 heatmap_window_days: Optional[int] = None,
+                 heatmap_max_columns: int = HEATMAP_MAX_COLUMNS):
         """
         初始化視覺化工具
 
         Args:
-            db_path: 資料庫路徑
+            db_path: 資料庫路徑（None 使用儲存實作的預設值）
+            archive_dir: Parquet 封存目錄（load_data 使用 source='archive' 時）
+            backend: 儲存實作，'sqlite' 或 'duckdb'
+            output_dir: 圖表輸出目錄
+            output_dpi: 圖表輸出解析度
+            output_format: 圖表輸出格式（png / svg / pdf 等；'html' 輸出單一互動儀表板，不使用 matplotlib 繪圖）
+            interactive: 是否以 plt.show() 顯示圖表
+            heatmap_window_days: 價格變動熱力圖只取最近 N 天（None 為全部歷史）
+            heatmap_max_columns: 熱力圖最多欄數，超過時改以每週 / 每月分組
         """
-        self.db_path = db_path
-        self.conn = sqlite3.connect(db_path)
-
-        # 設定Seaborn樣式
-        sns.set_style("whitegrid")
-        sns.set_palette("husl")
-
-    def load_data(self) -> tuple:
-        """載入資料"""
-        # 載入車輛資料
-        query_vehicles = """
-            SELECT * FROM vehicle_prices
-            ORDER BY scrape_datetime DESC
+        self.storage = open_storage(backend, db_path)
+        self.db_path = self.storage.db_path
+        self.archive_dir = archive_dir
+        self.conn = self.storage.conn
+
+        # 彙總表：載入完整 SQLite 資料時，統計數字直接由彙總表讀取
+        self.aggregates = getattr(self.storage, 'aggregates', None)
+        self.use_aggregates = False
+
+        # 增量分析狀態（SQLite）：每次分析只納入新增的資料
+        self.analysis_state = AnalysisState(self.storage) \
+            if isinstance(self.storage, SQLiteStorage) else None
+
+        # 各車型 / 車款折舊模型（係數依資料指紋快取）
+        self.depreciation = DepreciationModel(self.storage)
+
+        self.output_dir = output_dir
+        self.output_dpi = output_dpi
+        self.output_format = output_format
+        self.interactive = interactive
+        self.heatmap_window_days = heatmap_window_days
+        self.heatmap_max_columns = heatmap_max_columns
+        os.makedirs(output_dir, exist_ok=True)
+
+        setup_plot_style()
+
+    def load_data(self, source: str = 'db',
+                  columns: Optional[List[str]] = None,
+                  start_date: Optional[str] = None,
+                  end_date: Optional[str] = None,
+                  models: Optional[List[str]] = None,
+                  chunksize: Optional[int] = None) -> tuple:
         """
-        df_vehicles = pd.read_sql_query(query_vehicles, self.conn)
+        載入資料（只讀取需要的欄位與時間區間，並轉為精簡型態）
 
-        # 載入價格趨勢
-        query_trends = """
-            SELECT * FROM price_trends
-            ORDER BY date_recorded DESC
+        Args:
+            source: 資料來源，'db'（儲存實作）或 'archive'（Parquet 封存）
+            columns: vehicle_prices 需要的欄位，None 表示圖表使用的欄位
+            start_date: 起始日期（含）
+            end_date: 結束日期（含）
+            models: 只載入指定車型
+            chunksize: 指定時分塊讀取，降低峰值記憶體
         """
-        df_trends = pd.read_sql_query(query_trends, self.conn)
-
-        # 轉換日期格式
-        if not df_vehicles.empty:
-            df_vehicles['scrape_datetime'] = pd.to_datetime(df_vehicles['scrape_datetime'])
-        if not df_trends.empty:
-            df_trends['date_recorded'] = pd.to_datetime(df_trends['date_recorded'])
+        if source == 'archive':
+            from tesla_archive import load_archive
+
+            df_vehicles = load_archive(self.archive_dir, 'vehicle_prices',
+                                       columns=columns or ANALYSIS_COLUMNS,
+                                       start_date=start_date, end_date=end_date, models=models)
+            df_trends = load_archive(self.archive_dir, 'price_trends',
+                                     start_date=start_date, end_date=end_date, models=models)
+            df_vehicles = compact_frame(df_vehicles)
+            if not df_vehicles.empty and 'scrape_datetime' in df_vehicles.columns:
+                df_vehicles = df_vehicles.sort_values('scrape_datetime', ascending=False)
+            if not df_trends.empty:
+                df_trends['date_recorded'] = pd.to_datetime(df_trends['date_recorded'])
+                df_trends = df_trends.sort_values('date_recorded', ascending=False)
+        else:
+            # 欄位投影與篩選條件皆下推至 SQL
+            df_vehicles = self.storage.read_observations(columns, start_date, end_date,
+                                                         models, chunksize)
+            df_trends = self.storage.read_trends(start_date, end_date, models)
+
+        filtered = any([start_date, end_date, models])
+        self.use_aggregates = (source == 'db' and not filtered and self.aggregates is not None
+                               and not self.aggregates.is_empty())
 
         return df_vehicles, df_trends
 
-    def plot_price_distribution(self, df_vehicles: pd.DataFrame):
+    def load_incremental(self, full_rebuild: bool = False) -> tuple:
         """
-        繪製價格分布圖
+        更新增量分析狀態並由狀態建立統計（只讀取上次分析後新增的資料）
 
         Args:
-            df_vehicles: 車輛資料DataFrame
+            full_rebuild: 捨棄狀態從頭重新計算
+
+        Returns:
+            tuple: (MarketStats, 近30天價格趨勢DataFrame)
         """
-        fig, axes = plt.subplots(2, 2, figsize=(15, 10))
-        fig.suptitle('Tesla 認證中古車價格分布分析', fontsize=16, fontweight='bold')
-
-        # 1. 整體價格分布直方圖
-        ax1 = axes[0, 0]
-        ax1.hist(df_vehicles['price'] / 10000, bins=30, edgecolor='black', alpha=0.7)
-        ax1.set_xlabel('價格 (萬元 NTD)')
-        ax1.set_ylabel('車輛數量')
-        ax1.set_title('整體價格分布')
-        ax1.grid(True, alpha=0.3)
-
-        # 添加統計資訊
-        mean_price = df_vehicles['price'].mean() / 10000
-        median_price = df_vehicles['price'].median() / 10000
-        ax1.axvline(mean_price, color='red', linestyle='--', label=f'平均: {mean_price:.1f}萬')
-        ax1.axvline(median_price, color='green', linestyle='--', label=f'中位數: {median_price:.1f}萬')
-        ax1.legend()
-
-        # 2. 各車型價格箱型圖
-        ax2 = axes[0, 1]
-        models = df_vehicles['model'].unique()
-        price_by_model = [df_vehicles[df_vehicles['model'] == model]['price'] / 10000 for model in models]
-        box = ax2.boxplot(price_by_model, labels=models, patch_artist=True)
-
-        # 設定箱型圖顏色
-        colors = plt.cm.Set3(np.linspace(0, 1, len(models)))
-        for patch, color in zip(box['boxes'], colors):
-            patch.set_facecolor(color)
-
-        ax2.set_xlabel('車型')
-        ax2.set_ylabel('價格 (萬元 NTD)')
-        ax2.set_title('各車型價格分布')
-        ax2.grid(True, alpha=0.3)
-
-        # 3. 價格與里程關係散點圖
-        ax3 = axes[1, 0]
-        if 'mileage' in df_vehicles.columns:
-            for model in models:
-                model_data = df_vehicles[df_vehicles['model'] == model]
-                ax3.scatter(model_data['mileage'] / 1000,
-                          model_data['price'] / 10000,
-                          label=model, alpha=0.6, s=50)
-
-            ax3.set_xlabel('里程數 (千公里)')
-            ax3.set_ylabel('價格 (萬元 NTD)')
-            ax3.set_title('價格與里程關係')
-            ax3.legend()
-            ax3.grid(True, alpha=0.3)
-
-            # 添加趨勢線
-            if len(df_vehicles) > 10:
-                z = np.polyfit(df_vehicles['mileage'].fillna(0) / 1000,
-                             df_vehicles['price'] / 10000, 1)
-                p = np.poly1d(z)
-                x_trend = np.linspace(0, df_vehicles['mileage'].max() / 1000, 100)
-                ax3.plot(x_trend, p(x_trend), "r--", alpha=0.5, label='趨勢線')
-
-        # 4. 各車型庫存數量圓餅圖
-        ax4 = axes[1, 1]
-        model_counts = df_vehicles['model'].value_counts()
-        wedges, texts, autotexts = ax4.pie(model_counts.values,
-                                           labels=model_counts.index,
-                                           autopct='%1.1f%%',
-                                           startangle=90)
-
-        # 改善圓餅圖文字
-        for autotext in autotexts:
-            autotext.set_color('white')
-            autotext.set_fontweight('bold')
-
-        ax4.set_title('各車型庫存比例')
-
-        plt.tight_layout()
-        plt.savefig('tesla_price_distribution.png', dpi=300, bbox_inches='tight')
-        plt.show()
-
-    def plot_price_trends(self, df_trends: pd.DataFrame):
+        vehicles, trends = self.analysis_state.update(full_rebuild)
+        print(f"  納入 {vehicles} 筆新觀測、{trends} 筆新趨勢")
+
+        stats = stats_from_state(self.analysis_state,
+                                 heatmap_window_days=self.heatmap_window_days,
+                                 heatmap_max_columns=self.heatmap_max_columns)
+        # 中位數 / 四分位數 / P10 / P90 改由每日分位數草圖合併（比 1 萬元分組精確）
+        self.storage.sketches.init_schema()
+        self.storage.conn.commit()
+        apply_sketch_quantiles(stats, self.storage.sketches)
+
+        # 資料量小時仍讀取各點繪製散點圖（只需三個欄位）
+        if 0 < stats.overall['count'] <= SCATTER_POINT_LIMIT:
+            df_points = self.storage.read_observations(['model', 'price', 'mileage'])
+            stats.points_by_model = points_by_model(df_points[df_points['price'].notna()])
+            stats.scatter_density = None
+
+        # 摘要報告只需要近30天的趨勢
+        latest = self.storage.read_frame("SELECT MAX(date_recorded) AS latest FROM price_trends")
+        latest = latest['latest'].iloc[0]
+        if latest is None or pd.isna(latest):
+            df_trends = pd.DataFrame()
+        else:
+            start = (pd.Timestamp(latest) - timedelta(days=30)).strftime('%Y-%m-%d')
+            df_trends = self.storage.read_trends(start_date=start)
+        return stats, df_trends
+
+    def load_stats(self, full_rebuild: bool = False) -> Optional[tuple]:
         """
-        繪製價格趨勢圖
+        載入圖表與摘要報告共用的資料與統計（有增量分析狀態時由狀態建立）
 
         Args:
-            df_trends: 價格趨勢DataFrame
-        """
-        if df_trends.empty:
-            print("無價格趨勢資料")
-            return
+            full_rebuild: 捨棄增量分析狀態從頭重新計算
 
-        fig, axes = plt.subplots(2, 1, figsize=(15, 10))
-        fig.suptitle('Tesla 認證中古車價格趨勢分析', fontsize=16, fontweight='bold')
-
-        # 1. 平均價格趨勢
-        ax1 = axes[0]
-
-        # 按日期和車型分組計算平均價格
-        daily_avg = df_trends.groupby(['date_recorded', 'model'])['price'].mean().reset_index()
+        Returns:
+            Optional[tuple]: (車輛DataFrame, 價格趨勢DataFrame, MarketStats)；無資料時為 None
+        """
+        if self.analysis_state is not None:
+            print("更新分析狀態...")
+            stats, df_trends = self.load_incremental(full_rebuild)
+            df_vehicles = pd.DataFrame()
 
-        for model in daily_avg['model'].unique():
-            model_data = daily_avg[daily_avg['model'] == model]
-            ax1.plot(model_data['date_recorded'],
-                    model_data['price'] / 10000,
-                    marker='o', label=model, linewidth=2)
+            if not stats.overall['count']:
+                print("無車輛資料可供分析")
+                return None
+            return df_vehicles, df_trends, stats
 
-        ax1.set_xlabel('日期')
-        ax1.set_ylabel('平均價格 (萬元 NTD)')
-        ax1.set_title('各車型平均價格趨勢')
-        ax1.legend(loc='best')
-        ax1.grid(True, alpha=0.3)
+        print("載入資料...")
+        df_vehicles, df_trends = self.load_data()
 
-        # 格式化x軸日期
-        ax1.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
-        ax1.xaxis.set_major_locator(mdates.DayLocator(interval=7))
-        plt.setp(ax1.xaxis.get_majorticklabels(), rotation=45)
-
-        # 2. 價格變動熱力圖
-        ax2 = axes[1]
-
-        # 準備熱力圖資料
-        pivot_data = df_trends.pivot_table(
-            values='change_percentage',
-            index='model',
-            columns=df_trends['date_recorded'].dt.date,
-            aggfunc='mean'
-        )
-
-        if not pivot_data.empty:
-            sns.heatmap(pivot_data,
-                       annot=True,
-                       fmt='.1f',
-                       cmap='RdYlGn_r',
-                       center=0,
-                       ax=ax2,
-                       cbar_kws={'label': '價格變動百分比 (%)'}
-                       )
-
-            ax2.set_title('價格變動熱力圖')
-            ax2.set_xlabel('日期')
-            ax2.set_ylabel('車型')
-            plt.setp(ax2.xaxis.get_majorticklabels(), rotation=45)
-
-        plt.tight_layout()
-        plt.savefig('tesla_price_trends.png', dpi=300, bbox_inches='tight')
-        plt.show()
-
-    def plot_market_insights(self, df_vehicles: pd.DataFrame):
+        if df_vehicles.empty:
+            print("無車輛資料可供分析")
+            return None
+
+        # 所有圖表與報表共用同一份統計
+        stats = self.compute_stats(df_vehicles)
+        # 熱力圖在 SQL 端彙總，只讀回有上限的 車型 × 時間分組
+        heatmap = self.storage.read_trend_heatmap(self.heatmap_window_days,
+                                                  self.heatmap_max_columns)
+        compute_trend_stats(stats, df_trends, heatmap=heatmap)
+        return df_vehicles, df_trends, stats
+
+    def compute_stats(self, df_vehicles: pd.DataFrame) -> MarketStats:
+        """計算所有圖表與報表共用的市場統計"""
+        return compute_market_stats(df_vehicles, self.aggregates if self.use_aggregates else None)
+
+    def _output_figure(self, fig, name: str):
+        """儲存圖表並回傳輸出路徑；互動模式才顯示視窗"""
+        path = self.chart_path(name)
+        if self.interactive:
+            fig.savefig(path, dpi=self.output_dpi, bbox_inches='tight')
+            plt.show()
+        else:
+            save_figure(fig, path, self.output_dpi)
+        return path
+
+    def plot_price_distribution(self, df_vehicles: pd.DataFrame, stats: Optional[MarketStats] = None):
         """
-        繪製市場洞察圖表
+        繪製價格分布圖
 
         Args:
             df_vehicles: 車輛資料DataFrame
+            stats: 預先計算的市場統計（None 時由 df_vehicles 計算）
         """
-        fig, axes = plt.subplots(2, 2, figsize=(15, 10))
-        fig.suptitle('Tesla 認證中古車市場洞察', fontsize=16, fontweight='bold')
-
-        # 1. 新車輛上架趨勢
-        ax1 = axes[0, 0]
-
-        # 計算每天新增車輛數
-        df_vehicles['date'] = df_vehicles['scrape_datetime'].dt.date
-        daily_new = df_vehicles.groupby('date').size().reset_index(name='count')
-
-        ax1.plot(daily_new['date'], daily_new['count'],
-                marker='o', linewidth=2, color='steelblue')
-        ax1.fill_between(daily_new['date'], daily_new['count'],
-                        alpha=0.3, color='steelblue')
-        ax1.set_xlabel('日期')
-        ax1.set_ylabel('新增車輛數')
-        ax1.set_title('每日新增車輛趨勢')
-        ax1.grid(True, alpha=0.3)
-        plt.setp(ax1.xaxis.get_majorticklabels(), rotation=45)
-
-        # 2. 價格區間分布
-        ax2 = axes[0, 1]
-
-        price_ranges = [
-            (0, 150, '150萬以下'),
-            (150, 200, '150-200萬'),
-            (200, 250, '200-250萬'),
-            (250, 300, '250-300萬'),
-            (300, float('inf'), '300萬以上')
-        ]
-
-        range_counts = []
-        range_labels = []
-
-        for low, high, label in price_ranges:
-            count = len(df_vehicles[(df_vehicles['price'] >= low*10000) &
-                                   (df_vehicles['price'] < high*10000)])
-            range_counts.append(count)
-            range_labels.append(label)
-
-        bars = ax2.bar(range_labels, range_counts, color='coral')
-        ax2.set_xlabel('價格區間')
-        ax2.set_ylabel('車輛數量')
-        ax2.set_title('價格區間分布')
-
-        # 添加數值標籤
-        for bar, count in zip(bars, range_counts):
-            height = bar.get_height()
-            ax2.text(bar.get_x() + bar.get_width()/2., height,
-                    f'{count}',
-                    ha='center', va='bottom')
-
-        plt.setp(ax2.xaxis.get_majorticklabels(), rotation=45)
-
-        # 3. 顏色偏好分析
-        ax3 = axes[1, 0]
-
-        if 'exterior_color' in df_vehicles.columns:
-            color_counts = df_vehicles['exterior_color'].value_counts().head(8)
-
-            colors_map = {
-                'Pearl White': '#F8F8FF',
-                'Solid Black': '#000000',
-                'Midnight Silver': '#696969',
-                'Deep Blue': '#00008B',
-                'Red': '#DC143C',
-                'Gray': '#808080',
-                'Blue': '#4169E1',
-                'White': '#FFFFFF'
-            }
-
-            bar_colors = [colors_map.get(c, '#CCCCCC') for c in color_counts.index]
+        if stats is None:
+            stats = self.compute_stats(df_vehicles)
 
-            bars = ax3.barh(range(len(color_counts)), color_counts.values)
+        return self._output_figure(draw_price_distribution(stats), 'price_distribution')
 
-            for bar, color in zip(bars, bar_colors):
-                bar.set_color(color)
-                bar.set_edgecolor('black')
+    def plot_price_trends(self, df_trends: pd.DataFrame, stats: Optional[MarketStats] = None):
+        """
+        繪製價格趨勢圖
 
-            ax3.set_yticks(range(len(color_counts)))
-            ax3.set_yticklabels(color_counts.index)
-            ax3.set_xlabel('數量')
-            ax3.set_title('外觀顏色偏好')
-            ax3.invert_yaxis()
+        Args:
+            df_trends: 價格趨勢DataFrame
+            stats: 已加入趨勢資料的市場統計（None 時由 df_trends 計算）
+        """
+        if stats is None or stats.trend_daily_avg.empty:
+            stats = compute_trend_stats(stats or MarketStats(), df_trends,
+                                        window_days=self.heatmap_window_days,
+                                        max_columns=self.heatmap_max_columns)
 
-        # 4. 年份分布
-        ax4 = axes[1, 1]
+        fig = draw_price_trends(stats)
+        if fig is None:
+            print("無價格趨勢資料")
+            return None
 
-        if 'year' in df_vehicles.columns:
-            year_counts = df_vehicles['year'].value_counts().sort_index()
+        return self._output_figure(fig, 'price_trends')
 
-            ax4.bar(year_counts.index, year_counts.values,
-                   color='teal', edgecolor='black')
-            ax4.set_xlabel('年份')
-            ax4.set_ylabel('車輛數量')
-            ax4.set_title('車輛年份分布')
-            ax4.grid(True, alpha=0.3, axis='y')
+    def plot_market_insights(self, df_vehicles: pd.DataFrame, stats: Optional[MarketStats] = None):
+        """
+        繪製市場洞察圖表
 
-            # 添加數值標籤
-            for x, y in zip(year_counts.index, year_counts.values):
-                ax4.text(x, y, str(y), ha='center', va='bottom')
+        Args:
+            df_vehicles: 車輛資料DataFrame
+            stats: 預先計算的市場統計（None 時由 df_vehicles 計算）
+        """
+        if stats is None:
+            stats = self.compute_stats(df_vehicles)
 
-        plt.tight_layout()
-        plt.savefig('tesla_market_insights.png', dpi=300, bbox_inches='tight')
-        plt.show()
+        return self._output_figure(draw_market_insights(stats), 'market_insights')
 
-    def generate_summary_report(self, df_vehicles: pd.DataFrame, df_trends: pd.DataFrame):
+    def generate_summary_report(self, df_vehicles: pd.DataFrame, df_trends: pd.DataFrame,
+                                stats: Optional[MarketStats] = None):
         """
         生成摘要報告
 
         Args:
             df_vehicles: 車輛資料DataFrame
             df_trends: 價格趨勢DataFrame
+            stats: 預先計算的市場統計（None 時由 df_vehicles 計算）
         """
+        if stats is None:
+            stats = self.compute_stats(df_vehicles)
+        overall = stats.overall
+
         print("\n" + "="*80)
         print("Tesla 認證中古車市場分析報告摘要")
         print("="*80)
@@ -339,29 +606,32 @@ class TeslaPriceVisualizer:
 
         # 基本統計
         print("\n【基本統計資訊】")
-        print(f"總記錄數: {len(df_vehicles):,} 筆")
-        print(f"唯一車輛數: {df_vehicles['vin'].nunique():,} 輛")
-        print(f"資料時間範圍: {df_vehicles['scrape_datetime'].min()} 至 {df_vehicles['scrape_datetime'].max()}")
+        print(f"總記錄數: {overall['count']:,} 筆")
+        print(f"唯一車輛數: {overall['unique_vins']:,} 輛")
+        print(f"資料時間範圍: {overall['first_seen']} 至 {overall['last_seen']}")
 
         # 價格統計
         print("\n【價格統計】")
-        print(f"平均價格: NT${df_vehicles['price'].mean():,.0f}")
-        print(f"中位數價格: NT${df_vehicles['price'].median():,.0f}")
-        print(f"最低價格: NT${df_vehicles['price'].min():,.0f}")
-        print(f"最高價格: NT${df_vehicles['price'].max():,.0f}")
-        print(f"價格標準差: NT${df_vehicles['price'].std():,.0f}")
+        print(f"平均價格: NT${overall['price_mean']:,.0f}")
+        print(f"中位數價格: NT${overall['price_median']:,.0f}")
+        if overall.get('price_p10') is not None:
+            print(f"P10 / P90 價格: NT${overall['price_p10']:,.0f} / NT${overall['price_p90']:,.0f}")
+        print(f"最低價格: NT${overall['price_min']:,.0f}")
+        print(f"最高價格: NT${overall['price_max']:,.0f}")
+        print(f"價格標準差: NT${overall['price_std'] or 0:,.0f}")
 
         # 各車型統計
         print("\n【各車型詳細統計】")
-        for model in df_vehicles['model'].unique():
-            model_data = df_vehicles[df_vehicles['model'] == model]
+        for model, model_stats in stats.per_model.iterrows():
             print(f"\n{model}:")
-            print(f"  數量: {len(model_data)} 筆記錄")
-            print(f"  平均價格: NT${model_data['price'].mean():,.0f}")
-            print(f"  價格範圍: NT${model_data['price'].min():,.0f} - NT${model_data['price'].max():,.0f}")
+            print(f"  數量: {model_stats['count']:.0f} 筆記錄")
+            print(f"  平均價格: NT${model_stats['price_mean']:,.0f}")
+            if not pd.isna(model_stats['price_median']):
+                print(f"  中位數價格: NT${model_stats['price_median']:,.0f}")
+            print(f"  價格範圍: NT${model_stats['price_min']:,.0f} - NT${model_stats['price_max']:,.0f}")
 
-            if 'mileage' in model_data.columns:
-                print(f"  平均里程: {model_data['mileage'].mean():,.0f} km")
+            if not pd.isna(model_stats['mileage_mean']):
+                print(f"  平均里程: {model_stats['mileage_mean']:,.0f} km")
 
         # 價格趨勢分析
         if not df_trends.empty:
@@ -382,31 +652,134 @@ class TeslaPriceVisualizer:
 
         print("\n" + "="*80)
 
-    def run_analysis(self):
-        """執行完整分析"""
-        print("載入資料...")
-        df_vehicles, df_trends = self.load_data()
+    def chart_path(self, name: str) -> str:
+        """圖表輸出路徑"""
+        if name == 'dashboard':
+            from tesla_dashboard import DASHBOARD_FILE
+            return os.path.join(self.output_dir, f"{DASHBOARD_FILE}.html")
+        return os.path.join(self.output_dir, f"{CHART_FILES[name]}.{self.output_format}")
 
-        if df_vehicles.empty:
-            print("無車輛資料可供分析")
+    def chart_fingerprints(self) -> Dict[str, str]:
+        """
+        計算各圖表的輸入指紋（資料表的筆數 / 最大 id / 最新時間 / 變更計數，加上輸出參數）
+
+        Returns:
+            Dict[str, str]: 圖表名稱 → 指紋；html 格式時只有 'dashboard' 一項
+        """
+        from tesla_render import RenderCache
+
+        tables = {table: self.storage.table_fingerprint(table)
+                  for table in {t for inputs in CHART_INPUTS.values() for t in inputs}}
+        params = {'dpi': self.output_dpi, 'format': self.output_format,
+                  'heatmap_window_days': self.heatmap_window_days,
+                  'heatmap_max_columns': self.heatmap_max_columns}
+        if self.output_format == 'html':
+            from tesla_dashboard import DASHBOARD_VERSION
+            return {'dashboard': RenderCache.fingerprint('dashboard', {
+                'tables': tables, 'params': params, 'dashboard_version': DASHBOARD_VERSION,
+            })}
+        return {
+            name: RenderCache.fingerprint(name, {
+                'tables': {table: tables[table] for table in CHART_INPUTS[name]},
+                'params': params,
+            })
+            for name in CHART_DRAWERS
+        }
+
+    def run_analysis(self, batch: bool = False, workers: Optional[int] = None,
+                     use_cache: Optional[bool] = None, full_rebuild: bool = False):
+        """
+        執行完整分析
+
+        Args:
+            batch: 批次模式，於程序池中以 Agg 後端平行繪製所有圖表（不呼叫 show）
+            workers: 批次模式的程序數（None 為圖表數與 CPU 數的較小值）
+            use_cache: 只重繪輸入資料有變動的圖表（None 表示非互動模式時啟用）
+            full_rebuild: 捨棄增量分析狀態從頭重新計算（同時忽略圖表快取）
+        """
+        from tesla_render import RenderCache
+
+        if use_cache is None:
+            use_cache = not self.interactive and not full_rebuild
+
+        cache = RenderCache(self.output_dir)
+        fingerprints = self.chart_fingerprints()
+        names = list(fingerprints)
+        if use_cache:
+            reused = [name for name in names
+                      if cache.is_fresh(name, fingerprints[name], self.chart_path(name))]
+            names = [name for name in names if name not in reused]
+        else:
+            reused = []
+
+        for name in reused:
+            print(f"  {name}: 資料未變更，重用 {cache.manifest['charts'][name]['path']}")
+
+        if not names:
+            cache.save(reused, [])
+            print("\n資料自上次分析後沒有變更，略過繪圖。")
+            # 摘要報告仍由增量分析狀態產生（沒有新資料時不需讀取觀測）
+            loaded = self.load_stats(full_rebuild)
+            if loaded is not None:
+                self.generate_summary_report(*loaded)
+            return
+
+        loaded = self.load_stats(full_rebuild)
+        if loaded is None:
             return
+        df_vehicles, df_trends, stats = loaded
+
+        # 折舊曲線取代整體趨勢線
+        stats.depreciation_curves = self.depreciation.curves() \
+            if not self.depreciation.fit().empty else {}
 
         print("生成分析圖表...")
 
-        # 生成各種圖表
-        self.plot_price_distribution(df_vehicles)
-        self.plot_price_trends(df_trends)
-        self.plot_market_insights(df_vehicles)
+        if self.output_format == 'html':
+            from tesla_dashboard import write_dashboard
+
+            # 統計已預先彙總，儀表板只序列化為 JSON，由瀏覽器繪製
+            start = time.perf_counter()
+            path = write_dashboard(stats, self.chart_path('dashboard'))
+            results = [('dashboard', path, time.perf_counter() - start)]
+        elif batch:
+            from tesla_render import render_charts
+
+            start = time.perf_counter()
+            results = render_charts(stats, self.output_dir, self.output_dpi,
+                                    self.output_format, workers, names)
+        else:
+            # 生成各種圖表
+            plots = {
+                'price_distribution': lambda: self.plot_price_distribution(df_vehicles, stats),
+                'price_trends': lambda: self.plot_price_trends(df_trends, stats),
+                'market_insights': lambda: self.plot_market_insights(df_vehicles, stats),
+            }
+            start = time.perf_counter()
+            results = []
+            for name in names:
+                chart_start = time.perf_counter()
+                path = plots[name]()
+                results.append((name, path, time.perf_counter() - chart_start))
+
+        for name, path, seconds in results:
+            if path is None:
+                print(f"  {name}: 無資料，略過")
+            else:
+                print(f"  {name}: {seconds:.2f} 秒 -> {path}")
+            cache.record(name, fingerprints[name], path, seconds)
+        print(f"  總繪圖時間: {time.perf_counter() - start:.2f} 秒")
+        cache.save(reused, [name for name, _, _ in results])
 
         # 生成摘要報告
-        self.generate_summary_report(df_vehicles, df_trends)
+        self.generate_summary_report(df_vehicles, df_trends, stats)
 
         print("\n分析完成！圖表已儲存。")
 
     def __del__(self):
         """關閉資料庫連線"""
-        if hasattr(self, 'conn'):
-            self.conn.close()
+        if hasattr(self, 'storage'):
+            self.storage.close()
 
 def main():
     """主程式"""
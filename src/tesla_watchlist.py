@@ -0,0 +1,240 @@
+#!/home/cclin/.local/python311/bin/python3
+"""
+Tesla 追蹤清單
+已存搜尋條件（車型 / 車款 / 價格 / 里程）存於 watch_rules 表格，寫入觀測時比對並寫入本機通知匣（JSON Lines）
+"""
+
+import json
+import bisect
+import sqlite3
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 預設通知匣
+OUTBOX_FILE = 'tesla_watchlist_outbox.jsonl'
+
+# 規則欄位
+RULE_FIELDS = ['id', 'name', 'model', 'trim', 'min_price', 'max_price', 'max_mileage', 'created_at']
+
+# 通知欄位（watch_matches 表格與 JSON 共用）
+MATCH_FIELDS = ['rule_id', 'rule_name', 'vin', 'model', 'trim', 'price', 'mileage',
+                'seen_at', 'matched_at']
+
+
+def normalize_key(value: Optional[str]) -> Optional[str]:
+    """車型 / 車款比對用的正規化（忽略大小寫與空白，'Model Y' 與 'MODELY' 相同）"""
+    if value is None:
+        return None
+    key = ''.join(str(value).split()).upper()
+    return key or None
+
+
+class RuleIndex:
+    """
+    依 (車型, 車款) 分組的規則索引，未指定的車型 / 車款以 None 作為萬用鍵
+
+    每組依價格上限排序，一筆觀測只需查 4 個分組，並以二分搜尋略過價格上限低於售價的規則
+    """
+
+    def __init__(self, rules: List[Dict]):
+        """
+        編譯規則
+
+        Args:
+            rules: watch_rules 資料列
+        """
+        groups: Dict[Tuple, List[Tuple[float, Dict]]] = {}
+        for rule in rules:
+            key = (normalize_key(rule['model']), normalize_key(rule['trim']))
+            upper = rule['max_price'] if rule['max_price'] is not None else float('inf')
+            groups.setdefault(key, []).append((upper, rule))
+
+        self._groups = {}
+        for key, entries in groups.items():
+            entries.sort(key=lambda entry: entry[0])
+            self._groups[key] = ([upper for upper, _ in entries], [rule for _, rule in entries])
+        self.size = len(rules)
+
+    def match(self, model: Optional[str], trim: Optional[str], price: Optional[int],
+              mileage: Optional[int]) -> List[Dict]:
+        """
+        找出符合一筆觀測的規則
+
+        Args:
+            model: 車型
+            trim: 車款
+            price: 價格
+            mileage: 里程
+
+        Returns:
+            List[Dict]: 符合的規則
+        """
+        if price is None:
+            return []
+        model, trim = normalize_key(model), normalize_key(trim)
+        matched = []
+        for key in {(model, trim), (model, None), (None, trim), (None, None)}:
+            group = self._groups.get(key)
+            if group is None:
+                continue
+            uppers, rules = group
+            for rule in rules[bisect.bisect_left(uppers, price):]:
+                if rule['min_price'] is not None and price < rule['min_price']:
+                    continue
+                if rule['max_mileage'] is not None and (mileage is None or mileage > rule['max_mileage']):
+                    continue
+                matched.append(rule)
+        return matched
+
+
+class Watchlist:
+    """追蹤規則、比對與去重後的通知匣"""
+
+    def __init__(self, conn: sqlite3.Connection, outbox_path: Optional[str] = OUTBOX_FILE):
+        """
+        初始化追蹤清單
+
+        Args:
+            conn: 資料庫連線
+            outbox_path: JSON Lines 通知匣（None 表示只寫入資料表）
+        """
+        self.conn = conn
+        self.outbox_path = outbox_path
+        self._index: Optional[RuleIndex] = None
+        self._pending: List[Dict] = []
+
+    def init_schema(self):
+        """建立規則與通知紀錄表格"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS watch_rules (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                model TEXT,
+                trim TEXT,
+                min_price INTEGER,
+                max_price INTEGER,
+                max_mileage INTEGER,
+                created_at DATETIME
+            )
+        ''')
+        # 同一規則、同一輛車、同一價格只通知一次（降價後會再通知）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS watch_matches (
+                rule_id INTEGER NOT NULL,
+                rule_name TEXT,
+                vin TEXT NOT NULL,
+                model TEXT,
+                trim TEXT,
+                price INTEGER NOT NULL,
+                mileage INTEGER,
+                seen_at DATETIME,
+                matched_at DATETIME,
+                PRIMARY KEY (rule_id, vin, price)
+            ) WITHOUT ROWID
+        ''')
+
+    def add_rule(self, name: str, model: Optional[str] = None, trim: Optional[str] = None,
+                 min_price: Optional[int] = None, max_price: Optional[int] = None,
+                 max_mileage: Optional[int] = None) -> int:
+        """
+        新增追蹤規則（未指定的條件不限制）
+
+        Returns:
+            int: 規則 id
+        """
+        rule_id = self.conn.execute('''
+            INSERT INTO watch_rules (name, model, trim, min_price, max_price, max_mileage, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (name, model, trim, min_price, max_price, max_mileage,
+              datetime.now().isoformat(sep=' ', timespec='seconds'))).lastrowid
+        self.conn.commit()
+        self._index = None
+        return rule_id
+
+    def remove_rule(self, rule_id: int) -> bool:
+        """刪除追蹤規則與其通知紀錄"""
+        removed = self.conn.execute("DELETE FROM watch_rules WHERE id = ?", (rule_id,)).rowcount
+        self.conn.execute("DELETE FROM watch_matches WHERE rule_id = ?", (rule_id,))
+        self.conn.commit()
+        self._index = None
+        return removed > 0
+
+    def rules(self) -> List[Dict]:
+        """所有追蹤規則"""
+        rows = self.conn.execute(f"SELECT {', '.join(RULE_FIELDS)} FROM watch_rules ORDER BY id").fetchall()
+        return [dict(zip(RULE_FIELDS, row)) for row in rows]
+
+    def _load_index(self) -> RuleIndex:
+        """第一次使用時編譯規則索引"""
+        if self._index is None:
+            self._index = RuleIndex(self.rules())
+        return self._index
+
+    def observe(self, vin: Optional[str], model: Optional[str], trim: Optional[str],
+                price: Optional[int], mileage: Optional[int], seen_at) -> int:
+        """
+        比對一筆新觀測
+
+        Args:
+            vin: 車輛識別碼
+            model: 車型
+            trim: 車款
+            price: 價格
+            mileage: 里程
+            seen_at: 觀測時間
+
+        Returns:
+            int: 符合的規則數
+        """
+        index = self._load_index()
+        if not vin or not index.size:
+            return 0
+
+        rules = index.match(model, trim, price, mileage)
+        matched_at = datetime.now().isoformat(sep=' ', timespec='seconds')
+        for rule in rules:
+            self._pending.append({
+                'rule_id': rule['id'], 'rule_name': rule['name'], 'vin': vin,
+                'model': model, 'trim': trim, 'price': price, 'mileage': mileage,
+                'seen_at': None if seen_at is None else str(seen_at), 'matched_at': matched_at,
+            })
+        return len(rules)
+
+    def flush(self) -> List[Dict]:
+        """
+        將本批符合項目寫入通知紀錄（與觀測同一個交易，由呼叫端 commit），已通知過的略過
+
+        Returns:
+            List[Dict]: 首次出現的符合項目，commit 後以 publish() 寫入通知匣
+        """
+        pending, self._pending = self._pending, []
+        fresh = []
+        for match in pending:
+            cursor = self.conn.execute(f'''
+                INSERT OR IGNORE INTO watch_matches ({', '.join(MATCH_FIELDS)})
+                VALUES ({', '.join('?' * len(MATCH_FIELDS))})
+            ''', tuple(match[field] for field in MATCH_FIELDS))
+            if cursor.rowcount == 1:
+                fresh.append(match)
+        return fresh
+
+    def publish(self, matches: List[Dict]):
+        """將已提交的通知附加到通知匣"""
+        if not matches or not self.outbox_path:
+            return
+        with open(self.outbox_path, 'a', encoding='utf-8') as f:
+            for match in matches:
+                f.write(json.dumps(match, ensure_ascii=False) + '\n')
+        logger.info(f"追蹤清單有 {len(matches)} 筆新符合車輛")
+
+    def recent(self, limit: int = 20) -> List[Dict]:
+        """最近的符合項目（新到舊）"""
+        rows = self.conn.execute(f'''
+            SELECT {', '.join(MATCH_FIELDS)} FROM watch_matches
+            ORDER BY matched_at DESC, seen_at DESC LIMIT ?
+        ''', (limit,)).fetchall()
+        return [dict(zip(MATCH_FIELDS, row)) for row in rows]
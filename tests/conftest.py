@@ -0,0 +1,61 @@
+"""
+測試共用設定：src/ 加入匯入路徑，並提供以暫存資料庫建立的儲存層
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from tesla_storage import SQLiteStorage  # noqa: E402
+
+MODELS = ['MODEL3', 'MODELY', 'MODELS', 'MODELX']
+COLORS = ['珍珠白', '純黑', '午夜銀', '深藍', '紅色']
+
+
+def make_sweep(day: datetime, sweep: int, vehicles: int = 50):
+    """
+    一輪爬取的車輛資料（同一批 VIN 每輪價格與里程略有變動）
+
+    Args:
+        day: 日期
+        sweep: 當日第幾輪
+        vehicles: 車輛數
+
+    Returns:
+        List[Dict]: write_observations 的輸入
+    """
+    seen_at = (day + timedelta(hours=8 + sweep * 6)).strftime('%Y-%m-%d %H:%M:%S')
+    offset = day.toordinal() * 2 + sweep
+    return [{
+        'vin': f'5YJTEST{i:010d}',
+        'model': MODELS[i % len(MODELS)],
+        'year': 2018 + i % 7,
+        'trim': 'Long Range' if i % 2 else 'Performance',
+        'price': 1000000 + i * 15000 - (offset % 5) * 3000,
+        'mileage': 10000 + i * 700 + offset,
+        'location': '台北',
+        'exterior_color': COLORS[i % len(COLORS)],
+        'scrape_datetime': seen_at,
+    } for i in range(vehicles)]
+
+
+def open_storage(db_path) -> SQLiteStorage:
+    """建立 SQLite 儲存（事件與通知匣只寫入資料表）"""
+    storage = SQLiteStorage(str(db_path))
+    storage.events.events_path = None
+    storage.watchlist.outbox_path = None
+    storage.init_schema()
+    return storage
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    """暫存目錄中的 SQLite 儲存"""
+    monkeypatch.chdir(tmp_path)
+    storage = open_storage(tmp_path / 'tesla_prices.db')
+    yield storage
+    storage.close()
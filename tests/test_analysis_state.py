@@ -0,0 +1,63 @@
+"""
+增量分析狀態：逐輪增量累加與完整重新計算的結果一致（含保留策略彙整後）
+"""
+
+from datetime import datetime, timedelta
+
+from conftest import make_sweep
+from tesla_analysis_state import AnalysisState, stats_from_state
+from tesla_retention import RetentionJob
+
+START = datetime(2026, 1, 1)
+
+
+def write_days(storage, first_day: int, days: int):
+    """每天寫入兩輪爬取"""
+    for day in range(first_day, first_day + days):
+        for sweep in range(2):
+            storage.write_observations(make_sweep(START + timedelta(days=day), sweep))
+
+
+def assert_matches_rebuild(storage):
+    """增量狀態與完整重新計算逐項一致"""
+    incremental = AnalysisState(storage)
+    incremental.update()
+    assert incremental.verify() == []
+
+    rebuilt = AnalysisState(storage)
+    rebuilt.rebuild()
+    assert incremental.state['overall'] == rebuilt.state['overall']
+    assert stats_from_state(incremental).overall == stats_from_state(rebuilt).overall
+    return incremental
+
+
+def test_incremental_matches_full_rebuild(storage):
+    write_days(storage, 0, 3)
+    AnalysisState(storage).update()
+
+    # 每輪寫入後增量累加
+    for day in range(3, 6):
+        write_days(storage, day, 1)
+        state = assert_matches_rebuild(storage)
+
+    assert state.state['overall'][0] == 6 * 2 * 50
+
+
+def test_incremental_matches_full_rebuild_after_retention(storage):
+    write_days(storage, 0, 10)
+    state = AnalysisState(storage)
+    state.update()
+    assert state.state['overall'][0] == 1000
+
+    # 前 5 天彙整為每日每 VIN 一列
+    storage.conn.commit()
+    result = RetentionJob(storage.db_path, keep_days=5).run(now=START + timedelta(days=10))
+    assert result['deleted'] == 500
+
+    state = assert_matches_rebuild(storage)
+    assert state.state['overall'][0] == 1000
+
+    # 彙整之後繼續增量寫入
+    write_days(storage, 10, 2)
+    state = assert_matches_rebuild(storage)
+    assert state.state['overall'][0] == 1200
@@ -0,0 +1,206 @@
+"""
+查詢 API：以暫存資料庫在自動選擇的連接埠啟動服務，檢查各端點的 JSON、ETag / 304 與新一輪爬取後的快取失效
+"""
+
+import json
+import threading
+import http.client
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import make_sweep
+from tesla_api import PriceApiServer, PriceQueryService
+from tesla_retention import RetentionJob
+
+DAY = datetime(2026, 2, 1)
+VIN = '5YJTEST0000000003'
+
+
+@contextmanager
+def serve(db_path):
+    """在自動選擇的連接埠啟動服務；回傳 GET 函式"""
+    server = PriceApiServer(PriceQueryService(db_path), port=0)
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+
+    def get(path, headers=None, method='GET'):
+        """送出請求，回傳 (狀態碼, 標頭, 內容)"""
+        conn = http.client.HTTPConnection(host, port, timeout=10)
+        try:
+            conn.request(method, path, headers=headers or {})
+            response = conn.getresponse()
+            return response.status, dict(response.getheaders()), response.read()
+        finally:
+            conn.close()
+
+    try:
+        yield get
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+@pytest.fixture
+def api(storage):
+    """寫入兩輪爬取後啟動服務；回傳 (GET 函式, 儲存層)"""
+    for sweep in range(2):
+        storage.write_observations(make_sweep(DAY, sweep, vehicles=20))
+    with serve(storage.db_path) as get:
+        yield get, storage
+
+
+def get_json(get, path):
+    status, headers, body = get(path)
+    assert status == 200
+    assert headers['Content-Type'].startswith('application/json')
+    return json.loads(body)
+
+
+def test_health(api):
+    get, _ = api
+    payload = get_json(get, '/health')
+    assert payload['status'] == 'ok'
+    assert payload['latest_observation'] == '2026-02-01 14:00:00'
+
+
+def test_vin_history(api):
+    get, _ = api
+    payload = get_json(get, f'/vins/{VIN}/history')
+    assert payload['vin'] == VIN
+    assert [row['scrape_datetime'] for row in payload['observations']] == \
+        ['2026-02-01 08:00:00', '2026-02-01 14:00:00']
+    assert payload['trends'] == []
+    # 兩輪價格不同，第二輪產生一筆價格變動事件
+    assert len(payload['events']) == 1
+    event = payload['events'][0]
+    assert event['new_price'] - event['old_price'] == event['price_change']
+
+
+def test_inventory(api):
+    get, _ = api
+    summary = get_json(get, '/inventory')
+    assert summary['date'] == '2026-02-01'
+    assert {row['model']: row['count'] for row in summary['models']} == \
+        {'MODEL3': 5, 'MODELS': 5, 'MODELX': 5, 'MODELY': 5}
+
+    listing = get_json(get, '/inventory/MODELY')
+    assert listing['model'] == 'MODELY'
+    assert listing['count'] == 5
+    prices = [vehicle['price'] for vehicle in listing['vehicles']]
+    assert prices == sorted(prices)
+    # 同一天出現兩次的車輛只取最後一筆
+    assert {vehicle['scrape_datetime'] for vehicle in listing['vehicles']} == {'2026-02-01 14:00:00'}
+
+
+def test_daily(api):
+    get, _ = api
+    rows = get_json(get, '/daily?start=2026-02-01&end=2026-02-01')['days']
+    assert sorted(row['model'] for row in rows) == ['MODEL3', 'MODELS', 'MODELX', 'MODELY']
+    assert sum(row['observations'] for row in rows) == 40
+
+    overall = get_json(get, '/daily?by_model=0&model=MODEL3')['days']
+    assert overall == [{**overall[0], 'date': '2026-02-01', 'observations': 10}]
+
+
+def test_quantiles(api):
+    get, _ = api
+    payload = get_json(get, '/quantiles?q=0.1,0.5,0.9&model=MODELX')
+    assert payload['observations'] == 10
+    values = list(payload['quantiles'].values())
+    assert len(values) == 3 and values == sorted(values)
+
+
+def test_events(api):
+    get, _ = api
+    events = get_json(get, '/events')['events']
+    assert len(events) == 20
+    assert len(get_json(get, '/events?limit=3')['events']) == 3
+    types = {event['event_type'] for event in events}
+    for event_type in types:
+        filtered = get_json(get, f'/events?type={event_type}')['events']
+        assert filtered and all(event['event_type'] == event_type for event in filtered)
+
+
+def test_events_limit_is_clamped(api):
+    get, _ = api
+    # 負數在 SQLite 中代表不限筆數
+    assert len(get_json(get, '/events?limit=-1')['events']) == 1
+    assert len(get_json(get, '/events?limit=0')['events']) == 1
+    assert get('/events?limit=abc')[0] == 400
+
+
+def test_vin_history_after_retention(storage):
+    old_day = DAY - timedelta(days=200)
+    for sweep in range(3):
+        storage.write_observations(make_sweep(old_day, sweep, vehicles=20))
+    storage.write_observations(make_sweep(DAY, 0, vehicles=20))
+    RetentionJob(storage.db_path, keep_days=30).run(DAY + timedelta(days=1))
+
+    with serve(storage.db_path) as get:
+        payload = get_json(get, f'/vins/{VIN}/history')
+        # 彙整過的日期只剩每日最後一筆
+        assert [(row['scrape_datetime'], row['rolled_up']) for row in payload['observations']] == [
+            ((old_day + timedelta(hours=20)).strftime('%Y-%m-%d %H:%M:%S'), 1),
+            ('2026-02-01 08:00:00', 0),
+        ]
+        assert payload['observations'][0]['price'] == make_sweep(old_day, 2, vehicles=20)[3]['price']
+
+        # 只剩彙整資料的車輛仍可查詢
+        storage.write_observations(make_sweep(DAY + timedelta(days=1), 0, vehicles=5))
+        RetentionJob(storage.db_path, keep_days=0).run(DAY + timedelta(days=1))
+        assert get('/vins/5YJTEST0000000010/history')[0] == 200
+        assert get('/vins/NOSUCHVIN/history')[0] == 404
+
+
+def test_errors(api):
+    get, _ = api
+    assert get('/vins/NOSUCHVIN/history')[0] == 404
+    assert get('/nowhere')[0] == 404
+    status, headers, body = get('/quantiles?q=2')
+    assert status == 400
+    assert 'error' in json.loads(body)
+    assert 'ETag' not in headers
+
+
+def test_etag_and_not_modified(api):
+    get, _ = api
+    status, headers, body = get('/inventory')
+    etag = headers['ETag']
+
+    # 參數順序不同的相同查詢共用快取與 ETag
+    assert get('/daily?start=2026-02-01&model=MODELY')[1]['ETag'] == \
+        get('/daily?model=MODELY&start=2026-02-01')[1]['ETag']
+
+    status, headers, body = get('/inventory', {'If-None-Match': etag})
+    assert status == 304
+    assert headers['ETag'] == etag
+    assert body == b''
+
+    assert get('/inventory', {'If-None-Match': '"other", ' + etag})[0] == 304
+    assert get('/inventory', {'If-None-Match': '"other"'})[0] == 200
+
+    status, headers, body = get('/inventory', method='HEAD')
+    assert status == 200 and body == b''
+    assert headers['ETag'] == etag
+
+
+def test_cache_invalidated_by_new_sweep(api):
+    get, storage = api
+    _, headers, _ = get('/inventory')
+    etag = headers['ETag']
+    before = get_json(get, f'/vins/{VIN}/history')
+
+    # 另一個連線寫入新一天的爬取後，快取的回應不再使用
+    storage.write_observations(make_sweep(datetime(2026, 2, 2), 0, vehicles=20))
+
+    status, headers, body = get('/inventory', {'If-None-Match': etag})
+    assert status == 200
+    assert headers['ETag'] != etag
+    assert json.loads(body)['date'] == '2026-02-02'
+
+    after = get_json(get, f'/vins/{VIN}/history')
+    assert len(after['observations']) == len(before['observations']) + 1
@@ -0,0 +1,73 @@
+"""
+欄式快取：附加、保留策略、invalidate() 與就地修改之後，讀出的觀測與直接查詢資料庫一致
+"""
+
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from conftest import make_sweep, open_storage
+from tesla_retention import RetentionJob
+from tesla_storage import StorageBackend
+
+START = datetime(2026, 1, 1)
+COLUMNS = ['vin', 'model', 'price', 'mileage', 'year', 'scrape_datetime']
+
+
+def normalized(df: pd.DataFrame) -> pd.DataFrame:
+    """忽略列順序與欄位型別（快取以類別 / int64 時間儲存）"""
+    df = df[COLUMNS].astype({'vin': str, 'model': str, 'scrape_datetime': 'datetime64[ns]'})
+    return df.sort_values(COLUMNS).reset_index(drop=True).astype(object)
+
+
+def assert_matches_database(db_path):
+    """以新連線讀取（如另一個行程）：快取與 SQL 查詢結果相同"""
+    storage = open_storage(db_path)
+    try:
+        cached = storage.read_observations(COLUMNS)
+        assert storage._column_cache_synced
+        plain = StorageBackend.read_observations(storage, COLUMNS)
+        assert len(cached) == len(plain)
+        pd.testing.assert_frame_equal(normalized(cached), normalized(plain))
+    finally:
+        storage.close()
+
+
+def test_cache_follows_appends(storage):
+    storage.write_observations(make_sweep(START, 0))
+    assert_matches_database(storage.db_path)
+
+    storage.write_observations(make_sweep(START, 1))
+    storage.write_observations(make_sweep(START + timedelta(days=1), 0))
+    assert_matches_database(storage.db_path)
+    # 同一個連線寫入後也重新同步
+    assert len(storage.read_observations(COLUMNS)) == 150
+
+
+def test_cache_follows_retention(storage):
+    for day in range(5):
+        storage.write_observations(make_sweep(START + timedelta(days=day * 10), 0))
+    assert_matches_database(storage.db_path)
+
+    RetentionJob(storage.db_path, keep_days=15).run(START + timedelta(days=41))
+    assert_matches_database(storage.db_path)
+
+
+def test_cache_rebuilt_after_invalidate(storage):
+    storage.write_observations(make_sweep(START, 0))
+    assert_matches_database(storage.db_path)
+
+    storage.column_cache.invalidate()
+    storage.write_observations(make_sweep(START, 1))
+    assert_matches_database(storage.db_path)
+
+
+def test_cache_follows_in_place_update(storage):
+    storage.write_observations(make_sweep(START, 0))
+    storage.write_observations(make_sweep(START, 1))
+    assert_matches_database(storage.db_path)
+
+    # 重新解析之類的就地修改：筆數與 id 範圍都不變
+    storage.conn.execute("UPDATE vehicle_prices SET price = price - 10000 WHERE id % 4 = 0")
+    storage.conn.commit()
+    assert_matches_database(storage.db_path)
@@ -0,0 +1,30 @@
+"""
+相似車輛：原始觀測被保留策略彙整後，分組與以 VIN 查詢都改讀每日彙整的里程與顏色
+"""
+
+from datetime import datetime, timedelta
+
+from conftest import make_sweep
+from tesla_comparables import ComparablesIndex
+from tesla_retention import RetentionJob
+
+DAY = datetime(2026, 1, 1)
+VIN = '5YJTEST0000000005'
+
+
+def test_query_vin_after_retention(storage):
+    sweep = make_sweep(DAY, 0, vehicles=20)
+    storage.write_observations(sweep)
+    index = ComparablesIndex(storage.conn, cache_path=None)
+    before = index.query_vin(VIN, k=3)
+
+    RetentionJob(storage.db_path, keep_days=30).run(DAY + timedelta(days=60))
+    assert storage.conn.execute("SELECT COUNT(*) FROM vehicle_prices").fetchone()[0] == 0
+
+    index = ComparablesIndex(storage.conn, cache_path=None)
+    after = index.query_vin(VIN, k=3)
+    assert after is not None
+    assert after['vehicle'] == before['vehicle']
+    assert after['vehicle']['mileage'] == sweep[5]['mileage']
+    assert after['vehicle']['colour'] == sweep[5]['exterior_color']
+    assert [item['vin'] for item in after['comparables']] == [item['vin'] for item in before['comparables']]
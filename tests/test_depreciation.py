@@ -0,0 +1,48 @@
+"""
+折舊模型：堆疊正規方程的分組最小平方解與逐組 numpy.linalg.lstsq 相同
+"""
+
+import numpy as np
+
+from tesla_depreciation import fit_grouped
+
+# RIDGE 項造成的偏差約 1e-5（價格以萬元計，遠小於 1 元）
+TOLERANCE = 1e-4
+
+
+def test_fit_grouped_matches_lstsq():
+    rng = np.random.default_rng(7)
+    sizes = [500, 40, 3, 1200, 25]
+    codes = np.repeat(np.arange(len(sizes)), sizes)
+    mileage = rng.uniform(0, 15, len(codes))
+    age = rng.integers(0, 8, len(codes)).astype(np.float64)
+    X = np.column_stack([np.ones(len(codes)), mileage, age])
+    truth = rng.normal([150, -3, -8], [30, 1, 2], (len(sizes), 3))
+    y = np.einsum('nk,nk->n', X, truth[codes]) + rng.normal(0, 5, len(codes))
+
+    coefficients, counts, rmse = fit_grouped(X, y, codes, len(sizes))
+    assert counts.tolist() == sizes
+    for group in range(len(sizes)):
+        rows = codes == group
+        expected, *_ = np.linalg.lstsq(X[rows], y[rows], rcond=None)
+        np.testing.assert_allclose(coefficients[group], expected, rtol=TOLERANCE, atol=TOLERANCE)
+        residuals = y[rows] - X[rows] @ expected
+        np.testing.assert_allclose(rmse[group], np.sqrt(np.mean(residuals ** 2)),
+                                   rtol=TOLERANCE, atol=TOLERANCE)
+
+
+def test_fit_grouped_degenerate_and_empty_groups():
+    # 單一年份（車齡欄為常數）時矩陣奇異：預測值仍與 lstsq 的最小範數解相同
+    rng = np.random.default_rng(3)
+    n = 60
+    X = np.column_stack([np.ones(n), rng.uniform(0, 10, n), np.full(n, 2.0)])
+    y = 120 - 4 * X[:, 1] + rng.normal(0, 2, n)
+    codes = np.zeros(n, dtype=np.int64)
+
+    coefficients, counts, rmse = fit_grouped(X, y, codes, 2)
+    expected, *_ = np.linalg.lstsq(X, y, rcond=None)
+    np.testing.assert_allclose(X @ coefficients[0], X @ expected, rtol=TOLERANCE)
+    assert np.all(np.isfinite(coefficients))
+    # 沒有資料的分組
+    assert counts.tolist() == [n, 0]
+    assert rmse[1] == 0
@@ -0,0 +1,50 @@
+"""
+上架生命週期：每輪爬取結束時新上架、售出、重新上架的判斷，以及本輪未涵蓋的車型不受影響
+"""
+
+from datetime import datetime, timedelta
+
+from conftest import make_sweep
+
+DAY = datetime(2026, 1, 1)
+
+
+def listing(storage, vin):
+    """(狀態, 重新上架次數, 售出時間, 售價, 在架天數)"""
+    return storage.conn.execute('''
+        SELECT status, relists, sold_at, sale_price, days_on_market FROM listings WHERE vin = ?
+    ''', (vin,)).fetchone()
+
+
+def last_sweep(storage):
+    """最後一輪的 (new_listings, relisted, delisted)"""
+    return storage.conn.execute('''
+        SELECT new_listings, relisted, delisted FROM sweeps ORDER BY id DESC LIMIT 1
+    ''').fetchone()
+
+
+def test_listing_lifecycle(storage):
+    first = make_sweep(DAY, 0, vehicles=8)
+    storage.write_observations(first)
+    assert last_sweep(storage) == (8, 0, 0)
+    assert {row[0] for row in storage.conn.execute("SELECT status FROM listings")} == {'active'}
+
+    # 第 0 輛（MODEL3）未再出現：車型有涵蓋，視為售出；MODELX 整個車型缺席，不受影響
+    second = [vehicle for i, vehicle in enumerate(make_sweep(DAY + timedelta(days=3), 0, vehicles=8))
+              if i != 0 and vehicle['model'] != 'MODELX']
+    storage.write_observations(second)
+    assert last_sweep(storage) == (0, 0, 1)
+    status, relists, sold_at, sale_price, days_on_market = listing(storage, first[0]['vin'])
+    assert (status, relists, sale_price, days_on_market) == ('sold', 0, first[0]['price'], 0)
+    assert sold_at == second[0]['scrape_datetime']
+    for vehicle in first:
+        if vehicle['model'] == 'MODELX':
+            assert listing(storage, vehicle['vin']) == ('active', 0, None, None, None)
+
+    # 售出的車輛再次出現：重新上架，售出資訊清除
+    third = make_sweep(DAY + timedelta(days=5), 0, vehicles=8)
+    storage.write_observations(third)
+    assert last_sweep(storage) == (0, 1, 0)
+    assert listing(storage, first[0]['vin']) == ('active', 1, None, None, None)
+    assert storage.conn.execute("SELECT last_seen, sightings FROM listings WHERE vin = ?",
+                                (first[0]['vin'],)).fetchone() == (third[0]['scrape_datetime'], 2)
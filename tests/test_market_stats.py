@@ -0,0 +1,54 @@
+"""
+市場統計：只由彙總表建立的統計與載入原始資料的統計欄位一致；LTTB 降採樣的輸出格式
+"""
+
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import make_sweep
+from tesla_market_stats import compute_market_stats, lttb, stats_from_aggregates
+
+
+def test_aggregate_only_overall_has_same_keys(storage):
+    storage.write_observations(make_sweep(datetime(2026, 1, 1), 0))
+    full = compute_market_stats(storage.read_observations(), storage.aggregates)
+    aggregated = stats_from_aggregates(storage.aggregates)
+    assert set(aggregated.overall) == set(full.overall)
+    assert aggregated.overall['price_median'] is None
+
+    with_sketches = stats_from_aggregates(storage.aggregates, storage.sketches)
+    assert with_sketches.overall['count'] == full.overall['count'] == 50
+    # 草圖中位數在 KLL 的排名誤差內
+    prices = pd.Series([vehicle['price'] for vehicle in make_sweep(datetime(2026, 1, 1), 0)])
+    assert prices.quantile(0.45) <= with_sketches.overall['price_median'] <= prices.quantile(0.55)
+
+    # 沒有原始資料時退回彙總表，欄位仍然相同
+    fallback = compute_market_stats(pd.DataFrame(), storage.aggregates)
+    assert set(fallback.overall) == set(aggregated.overall)
+
+
+@pytest.mark.parametrize('n, threshold', [(5000, 3), (5000, 10), (5000, 500), (5000, 4999), (7, 5)])
+def test_lttb_indices(n, threshold):
+    rng = np.random.default_rng(n + threshold)
+    x = np.sort(rng.uniform(0, 1000, n))
+    y = np.cumsum(rng.normal(0, 1, n))
+    spike = n // 3
+    y[spike] += 1000
+
+    indices = lttb(x, y, threshold)
+    assert len(indices) == threshold
+    assert indices[0] == 0 and indices[-1] == n - 1
+    assert np.all(np.diff(indices) > 0)
+    # 明顯的峰值一定保留
+    if threshold > 3:
+        assert spike in indices
+
+
+def test_lttb_returns_all_points_when_not_needed():
+    x = np.arange(10.0)
+    assert lttb(x, x, 10).tolist() == list(range(10))
+    assert lttb(x, x, 50).tolist() == list(range(10))
+    assert lttb(x, x, 2).tolist() == list(range(10))
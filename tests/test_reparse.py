@@ -0,0 +1,106 @@
+"""
+重新解析：寫回修正後的欄位後，衍生資料（最新價格索引、價格變動事件、Parquet 封存）與以正確規則寫入的資料一致
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import make_sweep, open_storage
+from tesla_card_parser import extract_fields
+from tesla_events import EVENT_FIELDS
+from tesla_reparse import Reparser
+
+START = datetime(2026, 3, 1)
+DAYS = 4
+VEHICLES = 30
+
+# 比較事件時忽略偵測時間
+COMPARED_EVENT_FIELDS = [field for field in EVENT_FIELDS if field != 'detected_at']
+
+
+def card_text(i: int, day: int) -> str:
+    """第 i 輛車在第 day 天的卡片文字（價格每天調整）"""
+    price = 1500000 + i * 20000 - (day * (i % 3)) * 10000
+    return (f"2022 Model Y Long Range NT$ {price:,} {8000 + i * 500 + day * 50:,} km "
+            f"台北 珍珠白 5YJTEST{i:010d}")
+
+
+def write_days(storage, misparsed: bool):
+    """
+    以卡片文字寫入每天一輪爬取
+
+    Args:
+        storage: SQLite 儲存
+        misparsed: 模擬舊版解析錯誤（部分車輛第 1 天之後的價格少算 10 萬）
+    """
+    for day in range(DAYS):
+        seen_at = (START + timedelta(days=day, hours=9)).strftime('%Y-%m-%d %H:%M:%S')
+        vehicles = []
+        for i in range(VEHICLES):
+            text = card_text(i, day)
+            vehicle = dict(extract_fields(text), model='MODELY', scrape_datetime=seen_at, raw_data=text)
+            if misparsed and day >= 1 and i % 4 == 0:
+                vehicle['price'] -= 100000
+            vehicles.append(vehicle)
+        storage.write_observations(vehicles)
+
+
+def snapshot(storage):
+    """觀測、最新價格索引與事件"""
+    conn = storage.conn
+    return {
+        'prices': conn.execute("SELECT vin, scrape_datetime, price FROM vehicle_prices "
+                               "ORDER BY vin, scrape_datetime").fetchall(),
+        'last_price': conn.execute("SELECT vin, price, seen_at FROM vin_last_price ORDER BY vin").fetchall(),
+        'events': conn.execute(f"SELECT {', '.join(COMPARED_EVENT_FIELDS)} FROM events "
+                               "ORDER BY vin, seen_at").fetchall(),
+    }
+
+
+def test_reparse_rebuilds_events_and_last_prices(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    expected = open_storage(tmp_path / 'expected.db')
+    write_days(expected, misparsed=False)
+
+    storage = open_storage(tmp_path / 'tesla_prices.db')
+    write_days(storage, misparsed=True)
+    assert snapshot(storage)['events'] != snapshot(expected)['events']
+
+    result = Reparser(storage, chunk_size=25, workers=1, archive_dir=None).run()
+    assert result['updated'] == (DAYS - 1) * len(range(0, VEHICLES, 4))
+    assert snapshot(storage) == snapshot(expected)
+
+    expected.close()
+    storage.close()
+
+
+def test_reparse_marks_archive_for_reexport(tmp_path, monkeypatch):
+    pytest.importorskip('pyarrow')
+    from tesla_archive import ParquetArchiveExporter, load_archive
+
+    monkeypatch.chdir(tmp_path)
+    storage = open_storage(tmp_path / 'tesla_prices.db')
+    write_days(storage, misparsed=True)
+    exporter = ParquetArchiveExporter(str(tmp_path / 'tesla_prices.db'), str(tmp_path / 'archive'))
+    exporter.export()
+
+    Reparser(storage, workers=1, archive_dir=str(tmp_path / 'archive')).run()
+    exported = exporter.export()
+    assert exported['vehicle_prices'] == 0
+
+    archived = load_archive(str(tmp_path / 'archive'), 'vehicle_prices', columns=['id', 'price'])
+    current = storage.read_frame("SELECT id, price FROM vehicle_prices")
+    assert sorted(map(tuple, archived[['id', 'price']].values.tolist())) == \
+        sorted(map(tuple, current[['id', 'price']].values.tolist()))
+    storage.close()
+
+
+def test_rebuilt_index_uses_latest_observation_time(storage):
+    # 較晚寫入（id 較大）的補寫舊資料不是最新價格
+    storage.write_observations(make_sweep(START + timedelta(days=1), 0, vehicles=5))
+    storage.write_observations(make_sweep(START, 0, vehicles=5))
+    storage.events.rebuild(START.strftime('%Y-%m-%d'))
+    latest = make_sweep(START + timedelta(days=1), 0, vehicles=5)
+    assert storage.conn.execute("SELECT vin, price, seen_at FROM vin_last_price ORDER BY vin").fetchall() == \
+        [(vehicle['vin'], vehicle['price'], vehicle['scrape_datetime']) for vehicle in latest]
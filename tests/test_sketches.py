@@ -0,0 +1,75 @@
+"""
+KLL 分位數草圖：估計值的排名誤差在 k=200 的標稱範圍內，分段建立再合併與一次加入所有值一致
+"""
+
+import numpy as np
+import pytest
+
+from tesla_sketches import KLLSketch
+
+QS = (0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99)
+# k=200 的標稱排名誤差（DEFAULT_K 的說明）
+RANK_ERROR = 0.01
+
+
+def prices(n: int, seed: int) -> np.ndarray:
+    """近似中古車價格分布的整數序列（含重複值）"""
+    rng = np.random.default_rng(seed)
+    return (rng.lognormal(np.log(1500000), 0.35, n) // 1000 * 1000).astype(np.int64)
+
+
+def rank_error(values: np.ndarray, estimate: float, q: float) -> float:
+    """估計值在實際資料中的排名與目標分位點的差距（重複值取最接近的排名）"""
+    ordered = np.sort(values)
+    low = np.searchsorted(ordered, estimate, side='left') / len(ordered)
+    high = np.searchsorted(ordered, estimate, side='right') / len(ordered)
+    return 0.0 if low <= q <= high else min(abs(low - q), abs(high - q))
+
+
+@pytest.mark.parametrize('n', [1000, 100000])
+def test_quantiles_within_rank_error(n):
+    values = prices(n, seed=n)
+    sketch = KLLSketch()
+    for chunk in np.array_split(values, 37):
+        sketch.update(chunk)
+
+    assert sketch.n == n
+    assert (sketch.min, sketch.max) == (values.min(), values.max())
+    estimates = sketch.quantiles(QS)
+    exact = np.quantile(values, QS)
+    for q, estimate, expected in zip(QS, estimates, exact):
+        assert rank_error(values, estimate, q) <= RANK_ERROR, (q, estimate, expected)
+    assert estimates == sorted(estimates)
+    assert sketch.quantiles((0, 1)) == [values.min(), values.max()]
+
+
+def test_merge_matches_single_sketch():
+    parts = [prices(n, seed=i) for i, n in enumerate([5000, 120, 30000, 1, 8000])]
+    values = np.concatenate(parts)
+
+    single = KLLSketch()
+    single.update(values)
+    merged = KLLSketch()
+    for part in parts:
+        partial = KLLSketch()
+        partial.update(part)
+        merged.merge(KLLSketch.from_bytes(partial.to_bytes()))
+
+    assert (merged.n, merged.min, merged.max) == (single.n, single.min, single.max)
+    for q, a, b in zip(QS, merged.quantiles(QS), single.quantiles(QS)):
+        assert rank_error(values, a, q) <= RANK_ERROR
+        assert rank_error(values, b, q) <= RANK_ERROR
+
+    # 未壓縮的小草圖合併後與一次加入完全相同
+    small = [prices(30, seed=10), prices(40, seed=11)]
+    single = KLLSketch()
+    single.update(np.concatenate(small))
+    merged = KLLSketch()
+    for part in small:
+        partial = KLLSketch()
+        partial.update(part)
+        merged.merge(partial)
+    assert merged.quantiles(QS) == single.quantiles(QS)
+
+    # 合併空草圖不改變結果
+    assert merged.merge(KLLSketch()).quantiles(QS) == single.quantiles(QS)
@@ -0,0 +1,99 @@
+"""
+SQLite 儲存：資料表指紋需反映就地修改（圖表與分析快取以此判斷是否失效）
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import make_sweep
+from tesla_retention import RetentionJob
+from tesla_storage import StorageBackend
+
+
+def test_fingerprint_changes_on_in_place_update(storage):
+    storage.write_observations(make_sweep(datetime(2026, 1, 1), 0))
+    before = storage.table_fingerprint('vehicle_prices')
+
+    # 簿記欄位不影響分析結果
+    storage.conn.execute("UPDATE vehicle_prices SET sweep_id = sweep_id")
+    storage.conn.commit()
+    assert storage.table_fingerprint('vehicle_prices') == before
+
+    # 重新解析之類的就地修改：筆數、最大 id 與最新時間都不變
+    storage.conn.execute("UPDATE vehicle_prices SET price = price - 10000 WHERE id = 1")
+    storage.conn.commit()
+    after = storage.table_fingerprint('vehicle_prices')
+    assert after != before
+    assert after[:3] == before[:3]
+
+
+def test_fingerprint_changes_on_delete(storage):
+    storage.write_observations(make_sweep(datetime(2026, 1, 1), 0))
+    storage.write_observations(make_sweep(datetime(2026, 1, 1), 1))
+    before = storage.table_fingerprint('vehicle_prices')
+
+    # 保留策略之類的刪除
+    storage.conn.execute("DELETE FROM vehicle_prices WHERE id = 1")
+    storage.conn.commit()
+    assert storage.table_fingerprint('vehicle_prices') != before
+
+
+def observations(storage):
+    """可跨實作比較的觀測（以 SQL 讀取含彙整層的所有來源，依 VIN / 價格 / 里程排序）"""
+    df = StorageBackend.read_observations(storage, ['vin', 'model', 'price', 'mileage'])
+    return sorted(df.astype(object).itertuples(index=False, name=None))
+
+
+def test_duckdb_sync_follows_retention_and_updates(storage, tmp_path):
+    pytest.importorskip('duckdb')
+    from tesla_storage import DuckDBStorage
+
+    for day in range(3):
+        storage.write_observations(make_sweep(datetime(2026, 1, 1) + timedelta(days=day * 40), 0))
+    duck = DuckDBStorage(str(tmp_path / 'tesla_prices.duckdb'))
+    duck.init_schema()
+    assert duck.sync_from_sqlite(storage.db_path) == 150
+    assert duck.sync_from_sqlite(storage.db_path) == 0
+    assert observations(duck) == observations(storage)
+
+    # 只有新增：依水位附加
+    storage.write_observations(make_sweep(datetime(2026, 4, 1), 0))
+    assert duck.sync_from_sqlite(storage.db_path) == 50
+    assert observations(duck) == observations(storage)
+
+    # 保留策略刪除並彙整：彙整層一併同步
+    RetentionJob(storage.db_path, keep_days=30).run(datetime(2026, 4, 2))
+    duck.sync_from_sqlite(storage.db_path)
+    assert duck.read_frame("SELECT COUNT(*) AS n FROM vehicle_prices")['n'][0] == 100
+    assert observations(duck) == observations(storage)
+
+    # 重新解析之類的就地修改：整表重新複製
+    storage.conn.execute("UPDATE vehicle_prices SET price = price + 1000 WHERE id % 3 = 0")
+    storage.conn.commit()
+    duck.sync_from_sqlite(storage.db_path)
+    assert observations(duck) == observations(storage)
+    duck.close()
+
+
+def test_duckdb_write_skips_existing_observations(tmp_path):
+    pytest.importorskip('duckdb')
+    from tesla_storage import DuckDBStorage
+
+    duck = DuckDBStorage(str(tmp_path / 'tesla_prices.duckdb'))
+    duck.init_schema()
+    sweep = make_sweep(datetime(2026, 1, 1), 0, vehicles=10)
+    unknown = [dict(vehicle, vin=None) for vehicle in sweep[:2]]
+    assert duck.write_observations(sweep + sweep[:3] + unknown) == 12
+    assert duck.write_observations(sweep + unknown) == 2
+    duck.close()
+
+
+def test_backend_requires_all_methods():
+    # 缺少實作的子類別在建立時就失敗，而不是呼叫到一半才發現
+    class Partial(StorageBackend):
+        def init_schema(self):
+            pass
+
+    with pytest.raises(TypeError):
+        Partial()